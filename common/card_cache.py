@@ -0,0 +1,124 @@
+"""Content-addressed cache for LLM-generated cards.
+
+Entries are keyed by (chunk hash, enrich model, prompt version) so a rebuild
+only pays for chunks whose code, model or prompt actually changed. Shared by
+indexer/build_cards.py and server/cards_builder.py.
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import hashlib
+from typing import Any, Dict, Optional, Iterable
+
+
+def prompt_version(prompt: str) -> str:
+    """Short stable fingerprint of a prompt template."""
+    return hashlib.md5((prompt or "").encode("utf-8")).hexdigest()[:10]
+
+
+def enrich_model() -> str:
+    """Model generate_text() will use by default (mirrors server.env_model)."""
+    return os.getenv("GEN_MODEL", os.getenv("ENRICH_MODEL", "gpt-4o-mini")) or "gpt-4o-mini"
+
+
+def chunk_hash(chunk: Dict[str, Any]) -> str:
+    """Return the chunk's content hash (as computed by index_repo), or derive it."""
+    h = chunk.get("hash")
+    if h:
+        return str(h)
+    return hashlib.md5((chunk.get("code") or "").encode()).hexdigest()
+
+
+def usage_tokens(meta: Any, prompt: str = "", output: str = "") -> int:
+    """Best-effort token count for a generate_text() result.
+
+    Uses the provider-reported usage when present, otherwise ~4 chars/token.
+    """
+    try:
+        usage = getattr(meta, "usage", None)
+        if usage is None and isinstance(meta, dict):
+            usage = meta.get("usage")
+        if usage is not None:
+            total = getattr(usage, "total_tokens", None)
+            if total is None and isinstance(usage, dict):
+                total = usage.get("total_tokens")
+            if total:
+                return int(total)
+        if isinstance(meta, dict):
+            # Ollama reports eval counts
+            n = int(meta.get("prompt_eval_count") or 0) + int(meta.get("eval_count") or 0)
+            if n:
+                return n
+    except Exception:
+        pass
+    return (len(prompt or "") + len(output or "")) // 4
+
+
+class CardCache:
+    def __init__(self, outdir: str, model: str, prompt_ver: str, filename: str = "card_cache.jsonl"):
+        os.makedirs(outdir, exist_ok=True)
+        self.path = os.path.join(outdir, filename)
+        self.model = str(model or "")
+        self.prompt_ver = str(prompt_ver or "")
+        self.cache: Dict[str, Dict[str, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+        self.spent_tokens = 0
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        o = json.loads(line)
+                        self.cache[o["key"]] = o
+                    except Exception:
+                        pass
+
+    def _key(self, h: str) -> str:
+        return f"{h}:{self.model}:{self.prompt_ver}"
+
+    def get(self, h: str) -> Optional[Dict[str, Any]]:
+        o = self.cache.get(self._key(h))
+        if o is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.saved_tokens += int(o.get("tokens") or 0)
+        return dict(o.get("card") or {})
+
+    def put(self, h: str, card: Dict[str, Any], tokens: int = 0) -> None:
+        self.spent_tokens += int(tokens or 0)
+        self.cache[self._key(h)] = {
+            "key": self._key(h),
+            "hash": h,
+            "model": self.model,
+            "prompt": self.prompt_ver,
+            "tokens": int(tokens or 0),
+            "card": card,
+        }
+
+    def save(self) -> None:
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for o in self.cache.values():
+                f.write(json.dumps(o, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.path)
+
+    def prune(self, valid_hashes: Iterable[str]) -> int:
+        """Drop entries for chunks that no longer exist (any model/prompt)."""
+        valid = set(valid_hashes)
+        before = len(self.cache)
+        self.cache = {k: o for k, o in self.cache.items() if o.get("hash") in valid}
+        return before - len(self.cache)
+
+    def stats(self) -> Dict[str, Any]:
+        looked_up = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / looked_up, 4) if looked_up else 0.0,
+            "saved_tokens": self.saved_tokens,
+            "spent_tokens": self.spent_tokens,
+        }
@@ -149,3 +149,25 @@ def choose_repo_from_query(query: str, default: Optional[str] = None) -> str:
         return best
     return (default or get_default_repo())
 
+
+
+def rank_repos_for_query(query: str, default: Optional[str] = None) -> List[str]:
+    """All configured repos ordered by keyword hits (the default repo wins ties).
+
+    Used by federated search to pick candidate repos; an explicit `repo:` prefix
+    puts that repo first.
+    """
+    q = (query or "").lower().strip()
+    names = list_repos()
+    dflt = (default or get_default_repo() or "").lower()
+    pinned = None
+    if ":" in q:
+        cand = q.split(":", 1)[0].strip()
+        if cand in [r.lower() for r in names]:
+            pinned = cand
+    scored = []
+    for pos, name in enumerate(names):
+        hits = sum(1 for kw in get_repo_keywords(name) if kw and kw in q)
+        scored.append((name.lower() != pinned, -hits, name.lower() != dflt, pos, name))
+    scored.sort()
+    return [s[-1] for s in scored]
@@ -0,0 +1,302 @@
+"""Concurrent, rate-limited embedding requests for the indexer.
+
+embed_texts() and friends used to send one fixed-size batch at a time, so
+throughput was batch size / round trip. EmbeddingExecutor instead:
+
+  - packs texts into batches by token count (up to EMBED_BATCH_TOKENS and
+    EMBED_BATCH_ITEMS), so short chunks travel in big requests and long ones
+    never exceed the provider's per-request limit
+  - keeps EMBED_CONCURRENCY batches in flight on the shared provider clients
+  - waits on a per-provider limiter (requests/min + tokens/min buckets, shared
+    by every executor in the process) before each request
+  - retries 429 / 5xx / connection errors with exponential backoff + jitter,
+    honouring Retry-After; a 429 pauses the whole provider, not just one worker
+  - hands each finished batch to on_batch(indices, vectors) in the calling
+    thread, so callers can persist it (embedding cache) or stream it (Qdrant
+    uploader) while the remaining batches are still in flight
+
+Env:
+  EMBED_CONCURRENCY        batches in flight              (default 8)
+  EMBED_BATCH_TOKENS       max tokens per request         (default 64000)
+  EMBED_BATCH_ITEMS        max texts per request          (default 512)
+  EMBED_MAX_RETRIES        attempts per batch             (default 6)
+  <PROVIDER>_EMBED_RPM     e.g. OPENAI_EMBED_RPM          (default openai 3000, voyage 2000)
+  <PROVIDER>_EMBED_TPM     e.g. VOYAGE_EMBED_TPM          (default openai 1000000, voyage 3000000)
+"""
+
+from __future__ import annotations
+
+import os
+import time
+import random
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# (requests/min, tokens/min) when no <PROVIDER>_EMBED_RPM/TPM override is set
+DEFAULT_LIMITS: Dict[str, Tuple[float, float]] = {
+    "openai": (3000.0, 1_000_000.0),
+    "voyage": (2000.0, 3_000_000.0),
+}
+OPENAI_MAX_INPUT_TOKENS = 8000
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.getenv(name, str(default)) or default))
+    except Exception:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)) or default)
+    except Exception:
+        return default
+
+
+class RateLimiter:
+    """Blocking requests/min + tokens/min token buckets."""
+
+    def __init__(self, rpm: float, tpm: float, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.rpm = max(1.0, float(rpm))
+        self.tpm = max(1.0, float(tpm))
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        now = clock()
+        self._req = self.rpm
+        self._tok = self.tpm
+        self._updated = now
+        self._paused_until = now
+
+    def _refill(self, now: float) -> None:
+        dt = max(0.0, now - self._updated)
+        self._updated = now
+        self._req = min(self.rpm, self._req + dt * self.rpm / 60.0)
+        self._tok = min(self.tpm, self._tok + dt * self.tpm / 60.0)
+
+    def acquire(self, tokens: int = 0) -> float:
+        """Block until one request carrying `tokens` may be sent; returns seconds waited."""
+        tokens = min(float(tokens), self.tpm)  # a single oversize batch must still pass eventually
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._refill(now)
+                delay = self._paused_until - now
+                if delay <= 0:
+                    need_req = (1.0 - self._req) * 60.0 / self.rpm
+                    need_tok = (tokens - self._tok) * 60.0 / self.tpm
+                    delay = max(need_req, need_tok)
+                    if delay <= 0:
+                        self._req -= 1.0
+                        self._tok -= tokens
+                        return waited
+            self._sleep(delay)
+            waited += delay
+
+    def pause(self, seconds: float) -> None:
+        """Hold every caller back for `seconds` (after a 429)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, self._clock() + max(0.0, seconds))
+
+
+_limiters_lock = threading.Lock()
+_limiters: Dict[str, RateLimiter] = {}
+
+
+def limiter_for(provider: str) -> RateLimiter:
+    """Process-wide limiter for a provider (env limits are read on first use)."""
+    key = (provider or "default").lower()
+    with _limiters_lock:
+        lim = _limiters.get(key)
+        if lim is None:
+            rpm, tpm = DEFAULT_LIMITS.get(key, (3000.0, 1_000_000.0))
+            lim = RateLimiter(_env_float(f"{key.upper()}_EMBED_RPM", rpm), _env_float(f"{key.upper()}_EMBED_TPM", tpm))
+            _limiters[key] = lim
+        return lim
+
+
+def reset_limiters() -> None:
+    with _limiters_lock:
+        _limiters.clear()
+
+
+# ---- token counting / batching ----
+_enc = None
+
+
+def _encoding():
+    global _enc
+    if _enc is None:
+        import tiktoken
+        _enc = tiktoken.get_encoding("cl100k_base")
+    return _enc
+
+
+def clip_for_openai(texts: Sequence[str], max_tokens: int = OPENAI_MAX_INPUT_TOKENS) -> Tuple[List[str], List[int]]:
+    """Clip each text to the embedding input limit; returns (texts, token counts).
+
+    Each text is tokenised once (batched across threads by tiktoken); the count
+    drives batch packing and the tokens/min budget.
+    """
+    enc = _encoding()
+    toks = enc.encode_ordinary_batch(list(texts))
+    out, counts = [], []
+    for t, tk in zip(texts, toks):
+        if len(tk) > max_tokens:
+            tk = tk[:max_tokens]
+            t = enc.decode(tk)
+        out.append(t)
+        counts.append(len(tk))
+    return out, counts
+
+
+def estimate_tokens(texts: Sequence[str]) -> List[int]:
+    """Cheap count for providers without a local tokenizer (~3 chars per code token)."""
+    return [max(1, len(t) // 3) for t in texts]
+
+
+def token_batches(counts: Sequence[int], max_tokens: int, max_items: int) -> List[List[int]]:
+    """Greedy, order-preserving packing of text indices into batches."""
+    batches: List[List[int]] = []
+    cur: List[int] = []
+    cur_tok = 0
+    for i, n in enumerate(counts):
+        if cur and (cur_tok + n > max_tokens or len(cur) >= max_items):
+            batches.append(cur)
+            cur, cur_tok = [], 0
+        cur.append(i)
+        cur_tok += n
+    if cur:
+        batches.append(cur)
+    return batches
+
+
+# ---- retries ----
+def _status(e: BaseException) -> Optional[int]:
+    for attr in ("status_code", "http_status", "status"):
+        v = getattr(e, attr, None)
+        if isinstance(v, int):
+            return v
+    resp = getattr(e, "response", None)
+    v = getattr(resp, "status_code", None)
+    return v if isinstance(v, int) else None
+
+
+def _retry_after(e: BaseException) -> Optional[float]:
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    try:
+        v = headers.get("retry-after") if headers is not None else None
+        return float(v) if v is not None else None
+    except Exception:
+        return None
+
+
+def is_rate_limited(e: BaseException) -> bool:
+    return _status(e) == 429 or "RateLimit" in type(e).__name__
+
+
+def is_retryable(e: BaseException) -> bool:
+    if is_rate_limited(e):
+        return True
+    st = _status(e)
+    if st is not None:
+        return st >= 500 or st in (408, 409)
+    name = type(e).__name__
+    return isinstance(e, (ConnectionError, TimeoutError)) or any(
+        s in name for s in ("Timeout", "Connection", "ServiceUnavailable", "ServerError"))
+
+
+class EmbeddingExecutor:
+    """Embed many texts with N concurrent, token-packed, rate-limited requests.
+
+    embed_batch(texts) -> list of vectors is the provider call for one request.
+    """
+
+    def __init__(self, embed_batch: Callable[[List[str]], List[List[float]]], provider: str = "openai",
+                 concurrency: Optional[int] = None, max_batch_tokens: Optional[int] = None,
+                 max_batch_items: Optional[int] = None, max_retries: Optional[int] = None,
+                 limiter: Optional[RateLimiter] = None, sleep: Callable[[float], None] = time.sleep):
+        self.embed_batch = embed_batch
+        self.provider = provider
+        self.concurrency = concurrency or _env_int("EMBED_CONCURRENCY", 8)
+        self.max_batch_tokens = max_batch_tokens or _env_int("EMBED_BATCH_TOKENS", 64000)
+        self.max_batch_items = max_batch_items or _env_int("EMBED_BATCH_ITEMS", 512)
+        self.max_retries = max_retries or _env_int("EMBED_MAX_RETRIES", 6)
+        self.limiter = limiter or limiter_for(provider)
+        self._sleep = sleep
+        self.stats: Dict[str, Any] = {"batches": 0, "texts": 0, "tokens": 0, "retries": 0, "rate_limited": 0, "seconds": 0.0}
+        self._stats_lock = threading.Lock()
+
+    def _bump(self, **kw) -> None:
+        with self._stats_lock:
+            for k, v in kw.items():
+                self.stats[k] += v
+
+    def _call(self, texts: List[str], tokens: int) -> List[List[float]]:
+        delay = 1.0
+        for attempt in range(1, self.max_retries + 1):
+            self.limiter.acquire(tokens)
+            try:
+                vecs = self.embed_batch(texts)
+                if len(vecs) != len(texts):
+                    raise ValueError(f"{self.provider} returned {len(vecs)} embeddings for {len(texts)} inputs")
+                return vecs
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                wait_s = _retry_after(e) or delay * (0.5 + random.random())
+                if is_rate_limited(e):
+                    self._bump(rate_limited=1)
+                    self.limiter.pause(wait_s)
+                else:
+                    self._sleep(wait_s)
+                self._bump(retries=1)
+                delay = min(delay * 2, 60.0)
+        raise RuntimeError("unreachable")
+
+    def map(self, texts: Sequence[str], token_counts: Optional[Sequence[int]] = None,
+            on_batch: Optional[Callable[[List[int], List[List[float]]], None]] = None) -> List[List[float]]:
+        """Embeddings for `texts` in input order; on_batch sees each batch as it completes."""
+        t0 = time.perf_counter()
+        counts = list(token_counts) if token_counts is not None else estimate_tokens(texts)
+        out: List[Any] = [None] * len(texts)
+        batches = token_batches(counts, self.max_batch_tokens, self.max_batch_items)
+        pending: Dict[Any, List[int]] = {}
+        it = iter(batches)
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=f"embed-{self.provider}") as ex:
+            def _submit() -> bool:
+                idx = next(it, None)
+                if idx is None:
+                    return False
+                tok = sum(counts[i] for i in idx)
+                pending[ex.submit(self._call, [texts[i] for i in idx], tok)] = idx
+                return True
+
+            # Only `concurrency` batches are submitted at a time so a failure stops
+            # the run quickly and results never pile up far ahead of on_batch.
+            for _ in range(self.concurrency):
+                if not _submit():
+                    break
+            try:
+                while pending:
+                    done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        idx = pending.pop(fut)
+                        vecs = fut.result()
+                        for i, v in zip(idx, vecs):
+                            out[i] = v
+                        self._bump(batches=1, texts=len(idx), tokens=sum(counts[i] for i in idx))
+                        if on_batch is not None:
+                            on_batch(idx, vecs)
+                        _submit()
+            except BaseException:
+                for fut in pending:
+                    fut.cancel()
+                raise
+            finally:
+                self._bump(seconds=time.perf_counter() - t0)
+        return out
@@ -0,0 +1,258 @@
+"""Versioned (blue/green) index generations for a repo's out dir.
+
+Layout under out/<repo>/generations/:
+  CURRENT              name of the live generation (swapped atomically)
+  gen-<ts>-<rand>/     chunks.jsonl, bm25_index/, vectors/ and manifest.json
+
+The indexer builds a complete generation next to the live one, points a fresh
+versioned Qdrant collection (<alias>__<gen>) at it, then publish() flips the
+Qdrant alias and CURRENT. Searches resolve every artifact of one generation
+through generation_dir() and query the collection recorded in its manifest, so
+BM25, dense and chunk metadata always come from the same index run; nothing a
+running search reads is rewritten in place.
+
+The manifest's "dense" key (qdrant | local | none) says which dense index the
+generation has; searches of a "none" generation skip dense retrieval.
+
+The previous KEEP generations (and their collections) are kept, so rollback()
+is just another pointer flip. prune() without a Qdrant client keeps a
+generation whose collection it can't drop, so the collection is never leaked.
+
+Incremental runs (indexer/incremental.py) write a new generation too but add
+their points to the live collection, so several generations may name the same
+collection; it is dropped with the last of them. Point ids are keyed by chunk
+content, so those upserts never overwrite a point an older generation lists
+(bm25_index/bm25_point_ids.json); prune() deletes a doomed generation's points
+once no kept generation lists them. Repos indexed before generations existed
+have no CURRENT file and keep working from the flat out/<repo>/ layout.
+
+CLI:
+  python -m common.index_generations --repo agro list
+  python -m common.index_generations --repo agro rollback [--to gen-...]
+
+Env:
+  INDEX_KEEP_GENERATIONS   generations kept for rollback, incl. the live one (default 3)
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import time
+import uuid
+import shutil
+from typing import Any, Dict, List, Optional, Set
+
+GENERATIONS_DIRNAME = "generations"
+MANIFEST = "manifest.json"
+
+
+def _keep() -> int:
+    try:
+        return max(1, int(os.getenv("INDEX_KEEP_GENERATIONS", "3") or 3))
+    except Exception:
+        return 3
+
+
+def _gens_dir(base: str) -> str:
+    return os.path.join(base, GENERATIONS_DIRNAME)
+
+
+def current_generation(base: str) -> Optional[str]:
+    """Name of the live generation, or None for the legacy flat layout."""
+    try:
+        with open(os.path.join(_gens_dir(base), "CURRENT"), "r", encoding="utf-8") as f:
+            gen = f.read().strip()
+    except Exception:
+        return None
+    if gen and os.path.isdir(os.path.join(_gens_dir(base), gen)):
+        return gen
+    return None
+
+
+def generation_dir(base: str, gen: Optional[str] = None) -> str:
+    """Directory holding chunks.jsonl / bm25_index / vectors for a generation (default: live)."""
+    gen = gen if gen is not None else current_generation(base)
+    return os.path.join(_gens_dir(base), gen) if gen else base
+
+
+def read_manifest(base: str, gen: Optional[str] = None) -> Dict[str, Any]:
+    gen = gen if gen is not None else current_generation(base)
+    if not gen:
+        return {}
+    try:
+        with open(os.path.join(_gens_dir(base), gen, MANIFEST), "r", encoding="utf-8") as f:
+            m = json.load(f)
+        return m if isinstance(m, dict) else {}
+    except Exception:
+        return {}
+
+
+def collection_name(alias: str, gen: str) -> str:
+    return f"{alias}__{gen}"
+
+
+def generation_name() -> str:
+    """gen-<UTC timestamp with microseconds>-<rand>: names sort chronologically."""
+    now = time.time()
+    return f"gen-{time.strftime('%Y%m%d%H%M%S', time.gmtime(now))}{int(now * 1e6) % 1000000:06d}-{uuid.uuid4().hex[:6]}"
+
+
+def new_generation(base: str) -> str:
+    """Create an empty generation directory (not live until publish())."""
+    # list/prune/rollback rely on names sorting chronologically
+    gen = generation_name()
+    os.makedirs(os.path.join(_gens_dir(base), gen), exist_ok=True)
+    return gen
+
+
+def _write_json(path: str, obj: Dict[str, Any]) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp, path)
+
+
+def _set_current(base: str, gen: str) -> None:
+    d = _gens_dir(base)
+    tmp = os.path.join(d, "CURRENT.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(gen)
+    os.replace(tmp, os.path.join(d, "CURRENT"))
+
+
+def publish(base: str, gen: str, manifest: Optional[Dict[str, Any]] = None, qdrant=None,
+            keep: Optional[int] = None) -> Dict[str, Any]:
+    """Make `gen` live: flip the Qdrant alias (if the manifest names a collection), then CURRENT.
+
+    Old generations beyond `keep` are deleted together with their collections.
+    """
+    m = dict(manifest or {})
+    m.setdefault("generation", gen)
+    m.setdefault("created", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))
+    m["previous"] = current_generation(base)
+    _write_json(os.path.join(_gens_dir(base), gen, MANIFEST), m)
+    if qdrant is not None and m.get("collection") and m.get("alias"):
+        from common.qdrant_utils import swap_alias
+        swap_alias(qdrant, m["alias"], m["collection"])
+    _set_current(base, gen)
+    prune(base, keep=keep, qdrant=qdrant)
+    return m
+
+
+def list_generations(base: str) -> List[Dict[str, Any]]:
+    """Newest-first generations with their manifests."""
+    d = _gens_dir(base)
+    if not os.path.isdir(d):
+        return []
+    live = current_generation(base)
+    out = []
+    for g in sorted((n for n in os.listdir(d) if n.startswith("gen-")), reverse=True):
+        m = read_manifest(base, g)
+        m["generation"] = g
+        m["live"] = g == live
+        out.append(m)
+    return out
+
+
+def _point_ids(base: str, gen: str) -> Set[str]:
+    """Qdrant point ids a generation's BM25 rows map to (empty when it has none)."""
+    path = os.path.join(_gens_dir(base), gen, "bm25_index", "bm25_point_ids.json")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            m = json.load(f)
+        return {str(v) for v in m.values()} if isinstance(m, dict) else set()
+    except Exception:
+        return set()
+
+
+def _delete_points(qdrant, collection: str, ids: Set[str]) -> None:
+    from qdrant_client import models
+    ids = sorted(ids)
+    for i in range(0, len(ids), 1000):
+        qdrant.delete(collection, points_selector=models.PointIdsList(points=ids[i:i + 1000]), wait=True)
+
+
+def prune(base: str, keep: Optional[int] = None, qdrant=None) -> List[str]:
+    keep = _keep() if keep is None else max(1, keep)
+    live = current_generation(base)
+    gens = [g["generation"] for g in list_generations(base)]
+    # Keep the newest `keep` plus the live one (which may be older after a rollback)
+    doomed = [g for g in gens[keep:] if g != live]
+    # Incremental generations share their base generation's collection
+    kept = {g: read_manifest(base, g).get("collection") for g in gens if g not in doomed}
+    in_use = set(kept.values())
+    listed: Dict[str, Set[str]] = {}  # shared collection -> point ids kept generations list
+    pruned = []
+    for g in doomed:
+        coll = read_manifest(base, g).get("collection")
+        if coll and coll not in in_use:
+            if qdrant is None:
+                # Keep the manifest naming the collection until a prune with a client can drop both
+                continue
+            try:
+                qdrant.delete_collection(coll)
+            except Exception:
+                continue
+        elif coll:
+            # Points of chunks an incremental run replaced: no kept generation lists them
+            if coll not in listed:
+                listed[coll] = set().union(*(_point_ids(base, k) for k, c in kept.items() if c == coll))
+            stale = _point_ids(base, g) - listed[coll]
+            if stale:
+                if qdrant is None:
+                    continue
+                try:
+                    _delete_points(qdrant, coll, stale)
+                except Exception:
+                    continue
+        shutil.rmtree(os.path.join(_gens_dir(base), g), ignore_errors=True)
+        pruned.append(g)
+    return pruned
+
+
+def rollback(base: str, to: Optional[str] = None, qdrant=None) -> Dict[str, Any]:
+    """Point CURRENT (and the Qdrant alias) back at `to`, default the live one's predecessor."""
+    live = current_generation(base)
+    if to is None:
+        to = read_manifest(base, live).get("previous") if live else None
+        if not to:
+            older = [g["generation"] for g in list_generations(base) if g["generation"] < (live or "")]
+            to = older[0] if older else None
+    if not to or not os.path.isdir(os.path.join(_gens_dir(base), to)):
+        raise ValueError(f"no generation to roll back to (live: {live}, requested: {to})")
+    m = read_manifest(base, to)
+    if qdrant is not None and m.get("collection") and m.get("alias"):
+        from common.qdrant_utils import swap_alias
+        swap_alias(qdrant, m["alias"], m["collection"])
+    _set_current(base, to)
+    return {"from": live, "to": to, "collection": m.get("collection")}
+
+
+def main() -> int:
+    import argparse
+    from common.config_loader import out_dir
+    ap = argparse.ArgumentParser(description="List or roll back index generations")
+    ap.add_argument("--repo", default=os.getenv("REPO", "project"))
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list")
+    rb = sub.add_parser("rollback")
+    rb.add_argument("--to", default=None, help="generation name (default: previous)")
+    rb.add_argument("--no-qdrant", action="store_true", help="only flip CURRENT, leave the alias alone")
+    args = ap.parse_args()
+    base = out_dir(args.repo)
+    if args.cmd == "list":
+        for g in list_generations(base):
+            flag = "*" if g.get("live") else " "
+            print(f"{flag} {g['generation']}  chunks={g.get('chunk_count', '?')}  collection={g.get('collection') or '-'}")
+        return 0
+    q = None
+    if not args.no_qdrant:
+        from qdrant_client import QdrantClient
+        q = QdrantClient(url=os.getenv("QDRANT_URL", "http://127.0.0.1:6333"))
+    print(json.dumps(rollback(base, args.to, qdrant=q), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,77 @@
+"""Per-repo index metadata (<out>/<repo>/last_index.json).
+
+Writers (the indexer, incremental runs, card builders) merge what they just
+produced into last_index.json together with the on-disk sizes of the live
+artifacts, so readers (server/index_stats.py, incremental indexing) never have
+to count lines or walk index directories.
+"""
+
+from __future__ import annotations
+
+import os
+import json
+from pathlib import Path
+from typing import Any, Dict
+
+META_FILENAME = "last_index.json"
+
+
+def read_json(path: Path, default: Any) -> Any:
+    if path.exists():
+        try:
+            return json.loads(path.read_text())
+        except Exception:
+            return default
+    return default
+
+
+def gen_dir(repo_dir: Path) -> Path:
+    """Live index generation dir (chunks.jsonl, bm25_index) or the repo dir itself."""
+    try:
+        from common.index_generations import generation_dir
+        return Path(generation_dir(str(repo_dir)))
+    except Exception:
+        return repo_dir
+
+
+def dir_size(p: Path) -> int:
+    total = 0
+    for root, _dirs, files in os.walk(p):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def read_index_meta(repo_dir: str) -> Dict[str, Any]:
+    """Contents of <repo_dir>/last_index.json ({} when missing or unreadable)."""
+    meta = read_json(Path(repo_dir) / META_FILENAME, {})
+    return meta if isinstance(meta, dict) else {}
+
+
+def record_index_meta(repo_dir: str, **fields: Any) -> Dict[str, Any]:
+    """Merge fields into <repo_dir>/last_index.json and refresh stored sizes/counts.
+
+    Called by the indexer (and cards builders) after they write artifacts so that
+    get_index_stats() never has to count lines or walk index directories.
+    """
+    rd = Path(repo_dir)
+    path = rd / META_FILENAME
+    meta = read_index_meta(repo_dir)
+    meta.update({k: v for k, v in fields.items() if v is not None})
+    sizes: Dict[str, int] = {}
+    gd = gen_dir(rd)
+    chunks = gd / "chunks.jsonl"
+    if chunks.exists():
+        sizes["chunks"] = chunks.stat().st_size
+    if (gd / "bm25_index").exists():
+        sizes["bm25"] = dir_size(gd / "bm25_index")
+    if (rd / "cards.jsonl").exists():
+        sizes["cards"] = (rd / "cards.jsonl").stat().st_size
+    meta["sizes"] = sizes
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(meta, indent=2))
+    os.replace(tmp, path)
+    return meta
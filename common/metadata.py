@@ -1,6 +1,40 @@
 from __future__ import annotations
 
-from typing import Dict, Any
+import os
+import json
+from typing import Dict, Any, Optional
+
+METADATA_PROMPT = (
+    "Analyze this code and return a JSON object with: "
+    "symbols (array of function/class/component names), "
+    "purpose (one sentence description), "
+    "keywords (array of technical terms). "
+    "Be concise. Return ONLY valid JSON.\n\n"
+)
+
+
+def metadata_input(code: str) -> str:
+    """Build the LLM input for a chunk (shared by enrich() and batch mode)."""
+    return METADATA_PROMPT + (code or "")[:1000]
+
+
+def parse_metadata(text: str, file_path: str, lang: str) -> Optional[Dict[str, Any]]:
+    """Parse an LLM metadata response; returns None when it is not valid JSON."""
+    if not text:
+        return None
+    try:
+        result = json.loads(text)
+    except (json.JSONDecodeError, ValueError):
+        return None
+    if not isinstance(result, dict):
+        return None
+    return {
+        "summary": (result.get("purpose") or "")[:240],
+        "keywords": (result.get("keywords") or [])[:10],
+        "symbols": (result.get("symbols") or [])[:10],
+        "file_path": file_path,
+        "lang": lang,
+    }
 
 
 def enrich(file_path: str, lang: str, code: str) -> Dict[str, Any]:
@@ -14,7 +48,6 @@ def enrich(file_path: str, lang: str, code: str) -> Dict[str, Any]:
         lang: Language/extension (e.g., 'py', 'ts', 'js')
         code: Source code content
     """
-    import json
     import re
 
     # Try LLM enrichment if enabled
@@ -25,14 +58,7 @@ def enrich(file_path: str, lang: str, code: str) -> Dict[str, Any]:
         if len(code or "") < 50 or os.getenv('ENRICH_DISABLED') == '1':
             raise ValueError("Skip LLM enrichment")
 
-        prompt = (
-            "Analyze this code and return a JSON object with: "
-            "symbols (array of function/class/component names), "
-            "purpose (one sentence description), "
-            "keywords (array of technical terms). "
-            "Be concise. Return ONLY valid JSON.\n\n"
-        )
-        user_input = prompt + (code or "")[:1000]
+        user_input = metadata_input(code)
 
         text, _ = generate_text(
             user_input=user_input,
@@ -41,18 +67,9 @@ def enrich(file_path: str, lang: str, code: str) -> Dict[str, Any]:
             response_format={"type": "json_object"}
         )
 
-        if text:
-            try:
-                result = json.loads(text)
-                return {
-                    "summary": result.get("purpose", "")[:240],
-                    "keywords": result.get("keywords", [])[:10],
-                    "symbols": result.get("symbols", [])[:10],
-                    "file_path": file_path,
-                    "lang": lang,
-                }
-            except (json.JSONDecodeError, ValueError):
-                pass
+        meta = parse_metadata(text, file_path, lang)
+        if meta is not None:
+            return meta
     except Exception:
         pass
 
@@ -0,0 +1,188 @@
+"""Process-wide registry of provider clients with persistent connection pools.
+
+Every embedding, rerank and generation call goes through these instead of
+building a fresh SDK client (and TLS session) per request:
+
+  http_client()       shared httpx.Client (HTTP/2 when `h2` is installed, keep-alive pool)
+  openai_client()     OpenAI SDK client on the shared httpx pool
+  cohere_client()     Cohere SDK client on the shared httpx pool
+  voyage_client()     Voyage SDK client (own session; cached so it is reused)
+  request(...)        requests.Session with keep-alive + connect retries, for plain
+                      HTTP providers (Ollama); still goes through the API interceptor
+
+Clients are cached per API key, so rotating a key from the GUI takes effect on
+the next call. reset() drops everything (tests, config reloads).
+
+Env:
+  PROVIDER_HTTP2            1|0      (default 1; needs the `h2` package)
+  PROVIDER_CONNECT_TIMEOUT  seconds  (default 5)
+  PROVIDER_TIMEOUT          seconds  (default 60, read/write; Cohere/Voyage and plain HTTP calls)
+  PROVIDER_READ_TIMEOUT     seconds  (default 600, the SDK's own default; OpenAI calls, which
+                                      include long non-streaming generations and batch uploads)
+  PROVIDER_MAX_RETRIES      retries  (default 2)
+  PROVIDER_POOL_SIZE        conns    (default 20 per host)
+  PROVIDER_KEEPALIVE_S      seconds  (default 60)
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from typing import Any, Dict, Optional
+
+_lock = threading.RLock()  # factories nest (openai_client -> http_client)
+_clients: Dict[str, Any] = {}
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)) or default)
+    except Exception:
+        return default
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)) or default)
+    except Exception:
+        return default
+
+
+def timeout_s() -> float:
+    return _env_float("PROVIDER_TIMEOUT", 60.0)
+
+
+def read_timeout_s() -> float:
+    return _env_float("PROVIDER_READ_TIMEOUT", 600.0)
+
+
+def _sdk_timeout():
+    import httpx
+    return httpx.Timeout(read_timeout_s(), connect=_env_float("PROVIDER_CONNECT_TIMEOUT", 5.0))
+
+
+def max_retries() -> int:
+    return max(0, _env_int("PROVIDER_MAX_RETRIES", 2))
+
+
+def _http2_enabled() -> bool:
+    if str(os.getenv("PROVIDER_HTTP2", "1")).strip().lower() not in {"1", "true", "on"}:
+        return False
+    try:
+        import h2  # noqa: F401  # type: ignore
+        return True
+    except Exception:
+        return False
+
+
+def _cached(key: str, factory):
+    c = _clients.get(key)
+    if c is not None:
+        return c
+    with _lock:
+        c = _clients.get(key)
+        if c is None:
+            c = factory()
+            _clients[key] = c
+        return c
+
+
+def http_client():
+    """Shared httpx.Client used by the SDK clients below."""
+    def make():
+        import httpx
+        pool = max(1, _env_int("PROVIDER_POOL_SIZE", 20))
+        return httpx.Client(
+            http2=_http2_enabled(),
+            # SDK clients pass their own per-request timeout; this only covers bare calls
+            timeout=_sdk_timeout(),
+            limits=httpx.Limits(
+                max_connections=pool * 4,
+                max_keepalive_connections=pool,
+                keepalive_expiry=_env_float("PROVIDER_KEEPALIVE_S", 60.0),
+            ),
+        )
+    return _cached("httpx", make)
+
+
+def openai_client(api_key: Optional[str] = None):
+    key = api_key if api_key is not None else os.getenv("OPENAI_API_KEY")
+
+    def make():
+        from openai import OpenAI
+        kwargs: Dict[str, Any] = {"http_client": http_client(), "max_retries": max_retries(), "timeout": _sdk_timeout()}
+        if key:
+            kwargs["api_key"] = key
+        return OpenAI(**kwargs)
+    return _cached(f"openai:{key or ''}", make)
+
+
+def cohere_client(api_key: Optional[str] = None):
+    key = api_key if api_key is not None else os.getenv("COHERE_API_KEY")
+    if not key:
+        raise RuntimeError("COHERE_API_KEY not set")
+
+    def make():
+        import cohere
+        try:
+            return cohere.Client(api_key=key, httpx_client=http_client(), timeout=timeout_s())
+        except TypeError:
+            # Older SDKs manage their own session
+            return cohere.Client(api_key=key)
+    return _cached(f"cohere:{key}", make)
+
+
+def voyage_client(api_key: Optional[str] = None):
+    key = api_key if api_key is not None else os.getenv("VOYAGE_API_KEY")
+
+    def make():
+        import voyageai
+        try:
+            return voyageai.Client(api_key=key, max_retries=max_retries(), timeout=timeout_s())
+        except TypeError:
+            return voyageai.Client(api_key=key)
+    return _cached(f"voyage:{key or ''}", make)
+
+
+def requests_session():
+    """Keep-alive requests.Session; retries only connection failures (safe for POST)."""
+    def make():
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        pool = max(1, _env_int("PROVIDER_POOL_SIZE", 20))
+        n = max_retries()
+        retry = Retry(total=n, connect=n, read=0, status=0, other=0, backoff_factor=0.2, raise_on_status=False)
+        s = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool, pool_maxsize=pool, max_retries=retry)
+        s.mount("http://", adapter)
+        s.mount("https://", adapter)
+        return s
+    return _cached("requests", make)
+
+
+def request(method: str, url: str, **kwargs):
+    """requests-style call on the pooled session, tracked like module-level requests calls."""
+    kwargs.setdefault("timeout", timeout_s())
+    session = requests_session()
+    try:
+        from server.api_interceptor import track_request
+    except Exception:
+        return session.request(method, url, **kwargs)
+    return track_request(method, url, lambda u, **kw: session.request(method, u, **kw), **kwargs)
+
+
+def reset() -> None:
+    """Close and forget all cached clients."""
+    with _lock:
+        items = list(_clients.values())
+        _clients.clear()
+    for c in items:
+        try:
+            c.close()
+        except Exception:
+            pass
+
+
+def stats() -> Dict[str, Any]:
+    return {"clients": sorted(k.split(":", 1)[0] for k in _clients), "http2": _http2_enabled()}
@@ -0,0 +1,208 @@
+"""Qdrant collection and query tuning shared by the indexer and hybrid search.
+
+By default a collection holds plain float32 vectors in RAM, which for 3072-dim
+text-embedding-3-large is ~12 KB per chunk. The indexer can instead keep the
+originals on disk and search a quantized copy in RAM (int8: 4x smaller, binary:
+32x smaller), rescoring the oversampled candidates with the originals so
+recall stays close to exact. scripts/benchmark_qdrant_config.py measures
+memory, p95 latency and recall for each setting.
+
+Index time (read by collection_kwargs() when a collection is created):
+  QDRANT_QUANTIZATION     none|int8|binary                    (default none)
+  QDRANT_QUANT_ALWAYS_RAM keep quantized vectors in RAM 1|0   (default 1)
+  QDRANT_ON_DISK          original vectors on disk (mmap) 1|0 (default 0)
+  QDRANT_HNSW_M           HNSW edges per node                 (default: server, 16)
+  QDRANT_HNSW_EF_CONSTRUCT HNSW build beam width              (default: server, 100)
+  QDRANT_HNSW_ON_DISK     HNSW graph on disk 1|0              (default 0)
+  QDRANT_PAYLOAD_INDEXES  keyword payload indexes             (default repo,layer,language)
+  DENSE_COARSE_DIM        Matryoshka coarse vector size, 0 = off (default 0)
+
+Query time (search_params()):
+  QDRANT_HNSW_EF          search beam width                   (default: server, = limit)
+  QDRANT_OVERSAMPLING     candidates per result before rescoring (default 2.0)
+  QDRANT_RESCORE          rescore with original vectors 1|0   (default 1)
+  QDRANT_EXACT            brute-force search 1|0              (default 0)
+  DENSE_RESCORE_K         coarse candidates rescored at full dim (default 256)
+
+Two-stage (Matryoshka) dense retrieval: text-embedding-3-large, mxbai and
+voyage-code-3 are trained so that a prefix of the vector, re-normalised, is
+itself a good embedding. With DENSE_COARSE_DIM=256 each point also stores that
+prefix as the named vector "dense_coarse", which carries the HNSW graph and
+stays in RAM; the full "dense" vector gets no graph and lives on disk. Queries
+prefetch DENSE_RESCORE_K candidates from the coarse graph and rescore them
+exactly with the full vector. The generation manifest records coarse_dim, so
+search picks the mode per collection.
+"""
+
+from __future__ import annotations
+
+import os
+import math
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from qdrant_client import models
+
+QUANTIZATION_MODES = ("none", "int8", "binary")
+DENSE_VECTOR = "dense"
+COARSE_VECTOR = "dense_coarse"
+# Embedding types whose vectors may be truncated (bge-small, the local model, may not)
+MATRYOSHKA_EMBEDDINGS = {"openai", "mxbai", "voyage"}
+
+
+def _flag(name: str, default: str = "0") -> bool:
+    return str(os.getenv(name, default) or default).strip().lower() in {"1", "true", "on", "yes"}
+
+
+def _opt_int(name: str) -> Optional[int]:
+    try:
+        v = (os.getenv(name) or "").strip()
+        return int(v) if v else None
+    except Exception:
+        return None
+
+
+def _opt_float(name: str) -> Optional[float]:
+    try:
+        v = (os.getenv(name) or "").strip()
+        return float(v) if v else None
+    except Exception:
+        return None
+
+
+def index_settings() -> Dict[str, Any]:
+    """Index-time settings from the environment (also recorded in the generation manifest)."""
+    quant = (os.getenv("QDRANT_QUANTIZATION", "none") or "none").strip().lower()
+    if quant in ("scalar", "int8", "uint8"):
+        quant = "int8"
+    if quant not in QUANTIZATION_MODES:
+        quant = "none"
+    fields = os.getenv("QDRANT_PAYLOAD_INDEXES", "repo,layer,language")
+    return {
+        "quantization": quant,
+        "quant_always_ram": _flag("QDRANT_QUANT_ALWAYS_RAM", "1"),
+        "on_disk": _flag("QDRANT_ON_DISK"),
+        "hnsw_m": _opt_int("QDRANT_HNSW_M"),
+        "hnsw_ef_construct": _opt_int("QDRANT_HNSW_EF_CONSTRUCT"),
+        "hnsw_on_disk": _flag("QDRANT_HNSW_ON_DISK"),
+        "payload_indexes": [f.strip() for f in (fields or "").split(",") if f.strip()],
+        "coarse_dim": _opt_int("DENSE_COARSE_DIM") or 0,
+    }
+
+
+def quantization_config(settings: Dict[str, Any]):
+    mode = settings.get("quantization", "none")
+    always_ram = bool(settings.get("quant_always_ram", True))
+    if mode == "int8":
+        return models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(
+            type=models.ScalarType.INT8, quantile=0.99, always_ram=always_ram))
+    if mode == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=always_ram))
+    return None
+
+
+def vector_params(size: int, settings: Optional[Dict[str, Any]] = None) -> models.VectorParams:
+    s = index_settings() if settings is None else settings
+    return models.VectorParams(size=int(size), distance=models.Distance.COSINE,
+                               on_disk=True if s.get("on_disk") else None)
+
+
+def coarse_dim(full_dim: int, settings: Optional[Dict[str, Any]] = None) -> int:
+    """Size of the coarse Matryoshka vector for a collection of `full_dim` vectors (0 = single stage)."""
+    s = index_settings() if settings is None else settings
+    cd = int(s.get("coarse_dim") or 0)
+    return cd if 0 < cd < int(full_dim) else 0
+
+
+def vectors_config(full_dim: int, settings: Optional[Dict[str, Any]] = None) -> Dict[str, models.VectorParams]:
+    """Named vectors for a collection: "dense", plus "dense_coarse" in two-stage mode."""
+    s = index_settings() if settings is None else settings
+    cd = coarse_dim(full_dim, s)
+    if not cd:
+        return {DENSE_VECTOR: vector_params(full_dim, s)}
+    return {
+        # Only read to rescore prefetched candidates: no graph, memory-mapped
+        DENSE_VECTOR: models.VectorParams(size=int(full_dim), distance=models.Distance.COSINE, on_disk=True,
+                                          hnsw_config=models.HnswConfigDiff(m=0)),
+        COARSE_VECTOR: vector_params(cd, {**s, "on_disk": False}),
+    }
+
+
+def truncate(vec: Sequence[float], dim: int) -> List[float]:
+    """First `dim` components, re-normalised (Matryoshka prefix)."""
+    w = [float(x) for x in vec[:dim]]
+    n = math.sqrt(sum(x * x for x in w)) or 1.0
+    return [x / n for x in w]
+
+
+def point_vectors(vec: Sequence[float], cd: int) -> Dict[str, List[float]]:
+    out = {DENSE_VECTOR: list(vec)}
+    if cd:
+        out[COARSE_VECTOR] = truncate(vec, cd)
+    return out
+
+
+def collection_kwargs(settings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """hnsw_config / quantization_config for create_collection (empty when untuned)."""
+    s = index_settings() if settings is None else settings
+    out: Dict[str, Any] = {}
+    if s.get("hnsw_m") is not None or s.get("hnsw_ef_construct") is not None or s.get("hnsw_on_disk"):
+        out["hnsw_config"] = models.HnswConfigDiff(m=s.get("hnsw_m"), ef_construct=s.get("hnsw_ef_construct"),
+                                                   on_disk=True if s.get("hnsw_on_disk") else None)
+    qc = quantization_config(s)
+    if qc is not None:
+        out["quantization_config"] = qc
+    return out
+
+
+def create_payload_indexes(client, collection: str, fields: Optional[Iterable[str]] = None) -> List[str]:
+    """Keyword indexes for filtered search (best-effort; returns the fields indexed)."""
+    fields = index_settings()["payload_indexes"] if fields is None else list(fields)
+    done = []
+    for f in fields:
+        try:
+            client.create_payload_index(collection_name=collection, field_name=f,
+                                        field_schema=models.PayloadSchemaType.KEYWORD)
+            done.append(f)
+        except Exception:
+            pass
+    return done
+
+
+def search_params(hnsw_ef: Optional[int] = None, oversampling: Optional[float] = None,
+                  rescore: Optional[bool] = None, exact: Optional[bool] = None) -> models.SearchParams:
+    """Query-side knobs (explicit args win over env).
+
+    Quantization parameters are ignored by Qdrant for unquantized collections,
+    so they are always sent; rescoring is what keeps recall up when they apply.
+    """
+    hnsw_ef = hnsw_ef if hnsw_ef is not None else _opt_int("QDRANT_HNSW_EF")
+    oversampling = oversampling if oversampling is not None else (_opt_float("QDRANT_OVERSAMPLING") or 2.0)
+    rescore = rescore if rescore is not None else _flag("QDRANT_RESCORE", "1")
+    exact = exact if exact is not None else _flag("QDRANT_EXACT")
+    return models.SearchParams(
+        hnsw_ef=hnsw_ef,
+        exact=exact or None,
+        quantization=models.QuantizationSearchParams(rescore=rescore, oversampling=oversampling),
+    )
+
+
+def dense_query(vector: Sequence[float], limit: int, cd: int = 0, rescore_k: Optional[int] = None,
+                params: Optional[models.SearchParams] = None) -> Dict[str, Any]:
+    """query_points() kwargs for a dense search: single-stage, or coarse prefetch + full rescoring."""
+    params = params if params is not None else search_params()
+    if not cd:
+        return {"query": list(vector), "using": DENSE_VECTOR, "limit": limit, "search_params": params}
+    k = rescore_k if rescore_k is not None else (_opt_int("DENSE_RESCORE_K") or 256)
+    return {
+        "prefetch": models.Prefetch(query=truncate(vector, cd), using=COARSE_VECTOR,
+                                    limit=max(int(k), int(limit)), params=params),
+        "query": list(vector),
+        "using": DENSE_VECTOR,
+        "limit": limit,
+    }
+
+
+def describe(settings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Compact, JSON-safe view of the index settings for manifests and logs."""
+    s = index_settings() if settings is None else settings
+    return {k: v for k, v in s.items() if v not in (None, False, [])}
@@ -1,11 +1,13 @@
 from __future__ import annotations
 
-"""Qdrant recreate fallback wrappers to avoid hard failures on 404/exists."""
+"""Qdrant recreate fallback wrappers to avoid hard failures on 404/exists,
+plus alias helpers for blue/green collection swaps (common/index_generations.py)."""
 
-def recreate_collection(client, collection_name: str, vectors_config):
+def recreate_collection(client, collection_name: str, vectors_config, **kwargs):
     """
     Recreate a Qdrant collection with proper error handling.
     Handles both old (flat) and new (nested) vector config formats.
+    Extra kwargs (hnsw_config, quantization_config, ...) go to create_collection.
     """
     try:
         # Check if collection exists first
@@ -19,7 +21,8 @@ def recreate_collection(client, collection_name: str, vectors_config):
         # Create with proper config
         return client.create_collection(
             collection_name=collection_name,
-            vectors_config=vectors_config
+            vectors_config=vectors_config,
+            **kwargs
         )
     except Exception as e:
         print(f"Error creating collection '{collection_name}': {e}")
@@ -27,9 +30,45 @@ def recreate_collection(client, collection_name: str, vectors_config):
         try:
             return client.recreate_collection(
                 collection_name=collection_name,
-                vectors_config=vectors_config
+                vectors_config=vectors_config,
+                **kwargs
             )
         except Exception as e2:
             print(f"Recreate also failed: {e2}")
             raise
 
+
+
+def alias_target(client, alias: str):
+    """Collection an alias points at, or None."""
+    try:
+        for a in client.get_aliases().aliases:
+            if a.alias_name == alias:
+                return a.collection_name
+    except Exception:
+        pass
+    return None
+
+
+def swap_alias(client, alias: str, collection_name: str) -> None:
+    """Atomically (re)point `alias` at `collection_name`.
+
+    Delete + create go in one update_collection_aliases call, so searches on the
+    alias never see a missing collection. A plain collection still occupying the
+    alias name (indexed before aliases were used) is dropped first; that one
+    migration is the only moment the name is briefly unavailable.
+    """
+    from qdrant_client import models
+    ops = []
+    if alias_target(client, alias) is not None:
+        ops.append(models.DeleteAliasOperation(delete_alias=models.DeleteAlias(alias_name=alias)))
+    else:
+        try:
+            names = {c.name for c in client.get_collections().collections}
+        except Exception:
+            names = set()
+        if alias in names:
+            print(f"Migrating collection '{alias}' to an alias (dropping the unversioned collection)...")
+            client.delete_collection(alias)
+    ops.append(models.CreateAliasOperation(create_alias=models.CreateAlias(collection_name=collection_name, alias_name=alias)))
+    client.update_collection_aliases(change_aliases_operations=ops)
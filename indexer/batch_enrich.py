@@ -0,0 +1,492 @@
+"""Offline (Batch API) enrichment for cards and chunk metadata.
+
+Full rebuilds with ENRICH enabled issue one synchronous Responses call per
+chunk. This module packs the chunks that are not already in the card /
+metadata cache into batch request files, submits them through a pluggable
+backend, polls, and merges the results back into cards.jsonl, cards.txt and
+the cards BM25 index. For --kind metadata results only go to the metadata
+cache: published index generations are never rewritten, and the next index
+run (ENRICH_CODE_CHUNKS=true) puts the summaries into chunks.jsonl, BM25 and
+the embeddings together.
+
+Usage:
+  python -m indexer.batch_enrich run --repo agro --kind cards            # submit, wait, merge
+  python -m indexer.batch_enrich submit --repo agro --kind cards
+  python -m indexer.batch_enrich status --repo agro --kind cards
+  python -m indexer.batch_enrich collect --repo agro --kind cards --wait
+  BATCH_BACKEND=local python -m indexer.batch_enrich run --repo agro     # offline stand-in
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import argparse
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, List, Optional
+
+from common.config_loader import out_dir
+from common.index_generations import generation_dir
+from common.card_cache import CardCache, chunk_hash, enrich_model, prompt_version, usage_tokens
+from common.metadata import METADATA_PROMPT, metadata_input, parse_metadata
+
+KINDS = ("cards", "metadata")
+BATCH_ENDPOINT = "/v1/responses"
+MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "50000") or "50000")
+POLL_SEC = float(os.getenv("BATCH_POLL_SEC", "30") or "30")
+COMPLETION_WINDOW = os.getenv("BATCH_COMPLETION_WINDOW", "24h") or "24h"
+_DONE = {"completed", "failed", "expired", "cancelled"}
+_FAILED = _DONE - {"completed"}
+
+
+# ---------------- Backends ----------------
+
+class BatchBackend(ABC):
+    """Minimal batch job interface: upload a request JSONL, poll, download output JSONL."""
+
+    name = "base"
+
+    @abstractmethod
+    def submit(self, requests_path: str) -> str:
+        ...
+
+    @abstractmethod
+    def status(self, batch_id: str) -> str:
+        ...
+
+    @abstractmethod
+    def fetch(self, batch_id: str, dest_path: str) -> bool:
+        """Write the output JSONL to dest_path; returns False if there is none."""
+        ...
+
+
+class OpenAIBatchBackend(BatchBackend):
+    name = "openai"
+
+    def __init__(self) -> None:
+        from server.env_model import client
+        self.client = client()
+
+    def submit(self, requests_path: str) -> str:
+        with open(requests_path, "rb") as f:
+            up = self.client.files.create(file=f, purpose="batch")
+        b = self.client.batches.create(
+            input_file_id=up.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=COMPLETION_WINDOW,
+            metadata={"source": "agro-batch-enrich"},
+        )
+        return str(b.id)
+
+    def status(self, batch_id: str) -> str:
+        return str(self.client.batches.retrieve(batch_id).status)
+
+    def fetch(self, batch_id: str, dest_path: str) -> bool:
+        b = self.client.batches.retrieve(batch_id)
+        file_id = getattr(b, "output_file_id", None)
+        if not file_id:
+            return False
+        content = self.client.files.content(file_id)
+        data = content.read() if hasattr(content, "read") else getattr(content, "content", b"")
+        with open(dest_path, "wb") as f:
+            f.write(data if isinstance(data, bytes) else str(data).encode("utf-8"))
+        return True
+
+
+def _heuristic_json(body: Dict[str, Any]) -> str:
+    """Deterministic stand-in for a model response (local backend)."""
+    text = str(body.get("input") or "")
+    syms = [m[1] for m in re.findall(r"\b(class|def|function|interface|type)\s+([A-Za-z_][A-Za-z0-9_]*)", text)][:5]
+    routes = re.findall(r"['\"](/[^'\"\s]*)['\"]", text)[:5]
+    purpose = f"Defines {', '.join(syms[:3])}" if syms else "Code chunk"
+    return json.dumps({"symbols": syms, "purpose": purpose, "routes": routes, "keywords": syms})
+
+
+class LocalBatchBackend(BatchBackend):
+    """File-based stand-in for the Batch API (tests, air-gapped runs).
+
+    Jobs live under <root>/<batch_id>/; a job stays in_progress until the first
+    status() poll, which answers every request with `responder(body) -> str`.
+    """
+
+    name = "local"
+
+    def __init__(self, root: str, responder=None) -> None:
+        self.root = root
+        self.responder = responder or _heuristic_json
+        os.makedirs(root, exist_ok=True)
+
+    def _dir(self, batch_id: str) -> str:
+        return os.path.join(self.root, batch_id)
+
+    def submit(self, requests_path: str) -> str:
+        batch_id = f"local_{uuid.uuid4().hex[:12]}"
+        d = self._dir(batch_id)
+        os.makedirs(d, exist_ok=True)
+        shutil.copyfile(requests_path, os.path.join(d, "input.jsonl"))
+        with open(os.path.join(d, "status"), "w") as f:
+            f.write("in_progress")
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        d = self._dir(batch_id)
+        try:
+            with open(os.path.join(d, "status")) as f:
+                st = f.read().strip()
+        except FileNotFoundError:
+            return "failed"
+        if st != "in_progress":
+            return st
+        with open(os.path.join(d, "input.jsonl"), encoding="utf-8") as fin, \
+             open(os.path.join(d, "output.jsonl"), "w", encoding="utf-8") as fout:
+            for line in fin:
+                if not line.strip():
+                    continue
+                req = json.loads(line)
+                body = req.get("body") or {}
+                text = self.responder(body)
+                out = {
+                    "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                    "custom_id": req.get("custom_id"),
+                    "response": {
+                        "status_code": 200,
+                        "body": {
+                            "model": body.get("model"),
+                            "output": [{"type": "message", "content": [{"type": "output_text", "text": text}]}],
+                            "usage": {"total_tokens": (len(str(body.get("input") or "")) + len(text)) // 4},
+                        },
+                    },
+                    "error": None,
+                }
+                fout.write(json.dumps(out, ensure_ascii=False) + "\n")
+        with open(os.path.join(d, "status"), "w") as f:
+            f.write("completed")
+        return "completed"
+
+    def fetch(self, batch_id: str, dest_path: str) -> bool:
+        src = os.path.join(self._dir(batch_id), "output.jsonl")
+        if not os.path.exists(src):
+            return False
+        shutil.copyfile(src, dest_path)
+        return True
+
+
+def get_backend(name: Optional[str], repo: str) -> BatchBackend:
+    name = (name or os.getenv("BATCH_BACKEND", "openai") or "openai").lower()
+    if name == "local":
+        return LocalBatchBackend(os.path.join(_batch_dir(repo), "local"))
+    if name == "openai":
+        return OpenAIBatchBackend()
+    raise ValueError(f"Unknown batch backend: {name}")
+
+
+# ---------------- Job state ----------------
+
+def _batch_dir(repo: str) -> str:
+    d = os.path.join(out_dir(repo), "batch")
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+def _state_path(repo: str, kind: str) -> str:
+    return os.path.join(_batch_dir(repo), f"{kind}.json")
+
+
+def load_state(repo: str, kind: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(_state_path(repo, kind), encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def _save_state(repo: str, kind: str, state: Dict[str, Any]) -> None:
+    p = _state_path(repo, kind)
+    tmp = p + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, p)
+
+
+def _iter_chunks(repo: str) -> Iterator[Dict[str, Any]]:
+    with open(os.path.join(generation_dir(out_dir(repo)), "chunks.jsonl"), encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _cache_for(repo: str, kind: str, model: str) -> CardCache:
+    if kind == "cards":
+        from indexer.build_cards import PROMPT, domain_context
+        return CardCache(out_dir(repo), model, prompt_version(PROMPT + domain_context(repo)))
+    return CardCache(out_dir(repo), model, prompt_version(METADATA_PROMPT), filename="metadata_cache.jsonl")
+
+
+def _request_input(repo: str, kind: str, chunk: Dict[str, Any]) -> str:
+    code = chunk.get("code") or ""
+    if kind == "cards":
+        from indexer.build_cards import PROMPT, domain_context
+        return PROMPT + domain_context(repo) + code[:2000]
+    return metadata_input(code)
+
+
+# ---------------- Submit / collect ----------------
+
+def build_requests(repo: str, kind: str, model: str) -> List[str]:
+    """Write request JSONL file(s) for chunks missing from the cache; returns their paths."""
+    cache = _cache_for(repo, kind, model)
+    try:
+        temp = float(os.getenv("GEN_TEMPERATURE", "0.0") or 0.0)
+    except Exception:
+        temp = 0.0
+    paths: List[str] = []
+    f = None
+    n_in_file = 0
+    seen = set()
+    try:
+        for ch in _iter_chunks(repo):
+            h = chunk_hash(ch)
+            if h in seen or cache.get(h) is not None:
+                continue
+            seen.add(h)
+            if f is None or n_in_file >= MAX_REQUESTS:
+                if f is not None:
+                    f.close()
+                p = os.path.join(_batch_dir(repo), f"{kind}_requests_{len(paths):03d}.jsonl")
+                paths.append(p)
+                f = open(p, "w", encoding="utf-8")
+                n_in_file = 0
+            req = {
+                "custom_id": h,
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": {
+                    "model": model,
+                    "input": _request_input(repo, kind, ch),
+                    "temperature": temp,
+                    "text": {"format": {"type": "json_object"}},
+                },
+            }
+            f.write(json.dumps(req, ensure_ascii=False) + "\n")
+            n_in_file += 1
+    finally:
+        if f is not None:
+            f.close()
+    return paths
+
+
+def submit(repo: str, kind: str = "cards", backend: Optional[BatchBackend] = None) -> Dict[str, Any]:
+    if kind not in KINDS:
+        raise ValueError(f"kind must be one of {KINDS}")
+    backend = backend or get_backend(None, repo)
+    model = enrich_model()
+    state: Dict[str, Any] = {
+        "repo": repo,
+        "kind": kind,
+        "backend": backend.name,
+        "model": model,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "batches": [],
+        "status": "submitted",
+    }
+    for p in build_requests(repo, kind, model):
+        n = sum(1 for _ in open(p, encoding="utf-8"))
+        bid = backend.submit(p)
+        state["batches"].append({"id": bid, "input": os.path.basename(p), "requests": n, "status": "validating"})
+        print(f"Submitted {n} {kind} requests as batch {bid} ({backend.name})")
+    if not state["batches"]:
+        state["status"] = "cached"
+        print(f"All {kind} for {repo} are cached; nothing to submit")
+    _save_state(repo, kind, state)
+    return state
+
+
+def poll(repo: str, kind: str = "cards", backend: Optional[BatchBackend] = None) -> Dict[str, Any]:
+    state = load_state(repo, kind)
+    if not state:
+        raise RuntimeError(f"No batch job for repo={repo} kind={kind}; run submit first")
+    backend = backend or get_backend(state.get("backend"), repo)
+    for b in state.get("batches", []):
+        if b.get("status") not in _DONE:
+            try:
+                b["status"] = backend.status(b["id"])
+            except Exception as e:
+                b["error"] = str(e)
+    if state.get("batches") and all(b.get("status") in _DONE for b in state["batches"]):
+        if state.get("status") == "submitted":
+            # Only fully completed jobs are merged; failed/expired/cancelled ones need a resubmit
+            failed = [b["id"] for b in state["batches"] if b.get("status") in _FAILED]
+            state["status"] = "failed" if failed else "ready"
+            if failed:
+                state["failed_batches"] = failed
+    _save_state(repo, kind, state)
+    return state
+
+
+def _output_text(body: Dict[str, Any]) -> str:
+    if isinstance(body.get("output_text"), str) and body["output_text"]:
+        return body["output_text"]
+    for item in body.get("output") or []:
+        for c in (item or {}).get("content") or []:
+            if isinstance(c, dict) and c.get("text"):
+                return c["text"]
+    try:
+        return body["choices"][0]["message"]["content"] or ""
+    except Exception:
+        return ""
+
+
+def _parse_card(content: str) -> Optional[Dict[str, Any]]:
+    content = (content or "").strip()
+    try:
+        card = json.loads(content)
+    except Exception:
+        start, end = content.find("{"), content.rfind("}")
+        if start == -1 or end <= start:
+            return None
+        try:
+            card = json.loads(content[start:end + 1])
+        except Exception:
+            return None
+    return card if isinstance(card, dict) else None
+
+
+def _read_results(repo: str, kind: str, state: Dict[str, Any], backend: BatchBackend) -> Dict[str, Dict[str, Any]]:
+    """custom_id -> response body for all successful requests."""
+    results: Dict[str, Dict[str, Any]] = {}
+    for b in state.get("batches", []):
+        dest = os.path.join(_batch_dir(repo), f"{kind}_output_{b['id']}.jsonl")
+        if not os.path.exists(dest) and not backend.fetch(b["id"], dest):
+            continue
+        with open(dest, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    o = json.loads(line)
+                except Exception:
+                    continue
+                resp = o.get("response") or {}
+                if o.get("error") or int(resp.get("status_code") or 0) != 200:
+                    continue
+                results[str(o.get("custom_id"))] = resp.get("body") or {}
+    return results
+
+
+def _merge_cards(repo: str, cache: CardCache) -> Dict[str, int]:
+    from indexer.build_cards import card_text, build_cards_bm25
+    base = out_dir(repo)
+    cards_path = os.path.join(base, "cards.jsonl")
+    txt_path = os.path.join(base, "cards.txt")
+    # Chunks without a cached result keep the card they already have (matched by hash, else by
+    # chunk id; such a card keeps its old hash so `build_cards --incremental` still refreshes it)
+    existing: Dict[str, Dict[str, Any]] = {}
+    try:
+        with open(cards_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    c = json.loads(line)
+                    existing[str(c.get("id"))] = c
+                    if c.get("hash"):
+                        existing[str(c["hash"])] = c
+                except Exception:
+                    continue
+    except FileNotFoundError:
+        pass
+    written = missing = 0
+    with open(cards_path + ".tmp", "w", encoding="utf-8") as out_json, open(txt_path + ".tmp", "w", encoding="utf-8") as out_txt:
+        for ch in _iter_chunks(repo):
+            fp = ch.get("file_path", "")
+            h = chunk_hash(ch)
+            card = cache.get(h)
+            if card is None:
+                old = existing.get(h) or existing.get(str(ch.get("id")))
+                if old is None:
+                    missing += 1
+                    old = {"symbols": [], "purpose": "", "routes": [], "hash": h}
+                card, h = dict(old), old.get("hash")
+            card["file_path"] = fp
+            card["id"] = ch.get("id")
+            card["hash"] = h
+            out_json.write(json.dumps(card, ensure_ascii=False) + "\n")
+            out_txt.write(card_text(card, fp) + "\n")
+            written += 1
+    os.replace(cards_path + ".tmp", cards_path)
+    os.replace(txt_path + ".tmp", txt_path)
+    try:
+        build_cards_bm25(base)
+    except Exception as e:
+        print("BM25 build failed:", e)
+    return {"cards_written": written, "cards_missing": missing}
+
+
+def _merge_metadata(repo: str, cache: CardCache) -> Dict[str, int]:
+    """Count the live chunks the metadata cache now covers; the next index run applies them."""
+    cached = sum(1 for ch in _iter_chunks(repo) if cache.get(chunk_hash(ch)) is not None)
+    return {"chunks_cached": cached}
+
+
+def collect(repo: str, kind: str = "cards", wait: bool = False, backend: Optional[BatchBackend] = None) -> Dict[str, Any]:
+    """Merge finished batch results into the repo's cards/metadata; optionally poll until done."""
+    state = poll(repo, kind, backend)
+    backend = backend or get_backend(state.get("backend"), repo)
+    while wait and state.get("status") == "submitted":
+        time.sleep(POLL_SEC)
+        state = poll(repo, kind, backend)
+    if state.get("status") == "submitted":
+        return state
+    if state.get("status") == "failed":
+        print(f"Batch job for {repo} ({kind}) did not complete: {', '.join(state.get('failed_batches') or [])}; "
+              f"nothing merged, run submit again")
+        return state
+
+    model = state.get("model") or enrich_model()
+    cache = _cache_for(repo, kind, model)
+    for h, body in _read_results(repo, kind, state, backend).items():
+        content = _output_text(body)
+        if kind == "cards":
+            parsed = _parse_card(content)
+        else:
+            parsed = parse_metadata(content, "", "")
+        if parsed is not None:
+            cache.put(h, parsed, usage_tokens(body, "", content))
+    cache.save()
+    cache.hits = cache.misses = cache.saved_tokens = 0  # report merge-time lookups only
+    summary = _merge_cards(repo, cache) if kind == "cards" else _merge_metadata(repo, cache)
+    summary["spent_tokens"] = cache.spent_tokens
+    state["status"] = "merged"
+    state["merged_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    state["result"] = summary
+    _save_state(repo, kind, state)
+    print(f"Merged {kind} for {repo}: {summary}")
+    if kind == "metadata":
+        print("Re-index with ENRICH_CODE_CHUNKS=true to apply the cached metadata.")
+    return state
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Batch-API enrichment for cards and chunk metadata")
+    ap.add_argument("cmd", choices=["submit", "status", "collect", "run"])
+    ap.add_argument("--repo", default=os.getenv("REPO", "agro"))
+    ap.add_argument("--kind", choices=KINDS, default="cards")
+    ap.add_argument("--backend", choices=["openai", "local"], default=None)
+    ap.add_argument("--wait", action="store_true", help="collect: poll until the batch finishes")
+    args = ap.parse_args()
+
+    repo = args.repo.strip()
+    if args.cmd == "status":
+        print(json.dumps(poll(repo, args.kind), indent=2))
+        return
+    backend = get_backend(args.backend, repo) if args.backend else None
+    if args.cmd in ("submit", "run"):
+        submit(repo, args.kind, backend)
+    if args.cmd in ("collect", "run"):
+        state = collect(repo, args.kind, wait=args.wait or args.cmd == "run", backend=backend)
+        if state.get("status") == "failed":
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,19 @@
 import os
+import sys
 import json
 from typing import Dict, Iterator
 from dotenv import load_dotenv
-from server.env_model import generate_text
 from common.config_loader import out_dir
+from common.index_generations import generation_dir
+from common.card_cache import CardCache, chunk_hash, enrich_model, prompt_version, usage_tokens
+from retrieval import cards_index
+from retrieval.cards_index import card_text
 
 load_dotenv()
 REPO = os.getenv('REPO','project').strip()
 MAX_CHUNKS = int(os.getenv('CARDS_MAX') or '0')
 BASE = out_dir(REPO)
-CHUNKS = os.path.join(BASE, 'chunks.jsonl')
+CHUNKS = os.path.join(generation_dir(BASE), 'chunks.jsonl')
 CARDS = os.path.join(BASE, 'cards.jsonl')
 CARDS_TXT = os.path.join(BASE, 'cards.txt')
 INDEX_DIR = os.path.join(BASE, 'bm25_cards')
@@ -41,70 +45,104 @@ def iter_chunks() -> Iterator[Dict]:
             o = json.loads(line)
             yield o
 
+def domain_context(repo: str) -> str:
+    if repo == '':
+        return "\nDOMAIN CONTEXT: This is  - a smart home automation platform. Focus on:\n- Plugin architecture (device plugins, automation plugins)\n- Camera/streaming functionality (RTSP, ONVIF, FFmpeg)\n- HomeKit integration and device bridging\n- Motion detection and AI analysis\n- Webhook notifications and automation rules\n- Device management and discovery\n\n"
+    if repo == 'agro':
+        return "\nDOMAIN CONTEXT: This is AGRO - a RAG (Retrieval Augmented Generation) system. Focus on:\n- Vector search and embedding models\n- Hybrid retrieval (BM25 + dense vectors)\n- Code chunking and semantic analysis\n- MCP (Model Context Protocol) integration\n- Evaluation and performance optimization\n- Multi-repository routing and indexing\n\n"
+    return ""
+
+def build_cards_bm25(base: str = BASE) -> int:
+    """Publish a fresh cards BM25 generation from cards.txt; returns the doc count."""
+    return cards_index.rebuild(base)
+
+def make_card(ch: Dict, cache: CardCache, generate_text, domain_context_str: str) -> Dict:
+    code = ch.get('code','')
+    fp = ch.get('file_path','')
+    h = chunk_hash(ch)
+    card = cache.get(h)
+    if card is None:
+        snippet = code[:2000]
+        msg = PROMPT + domain_context_str + snippet
+        try:
+            text, meta = generate_text(user_input=msg, system_instructions=None, reasoning_effort=None, response_format={"type": "json_object"})
+            content = (text or '').strip()
+            card = json.loads(content) if content else {"symbols": [], "purpose": "", "routes": []}
+            if content:
+                cache.put(h, dict(card), usage_tokens(meta, msg, content))
+        except Exception:
+            card = {"symbols": [], "purpose": "", "routes": []}
+    card['file_path'] = fp
+    card['id'] = ch.get('id')
+    card['hash'] = h
+    return card
+
 def main() -> None:
+    from server.env_model import generate_text
     os.makedirs(BASE, exist_ok=True)
     
     # Add domain context based on repo
-    domain_context = ""
-    if REPO == '':
-        domain_context = "\nDOMAIN CONTEXT: This is  - a smart home automation platform. Focus on:\n- Plugin architecture (device plugins, automation plugins)\n- Camera/streaming functionality (RTSP, ONVIF, FFmpeg)\n- HomeKit integration and device bridging\n- Motion detection and AI analysis\n- Webhook notifications and automation rules\n- Device management and discovery\n\n"
-    elif REPO == 'agro':
-        domain_context = "\nDOMAIN CONTEXT: This is AGRO - a RAG (Retrieval Augmented Generation) system. Focus on:\n- Vector search and embedding models\n- Hybrid retrieval (BM25 + dense vectors)\n- Code chunking and semantic analysis\n- MCP (Model Context Protocol) integration\n- Evaluation and performance optimization\n- Multi-repository routing and indexing\n\n"
+    domain_context_str = domain_context(REPO)
     
+    cache = CardCache(BASE, enrich_model(), prompt_version(PROMPT + domain_context_str))
+    seen_hashes = set()
     n = 0
     with open(CARDS, 'w', encoding='utf-8') as out_json, open(CARDS_TXT, 'w', encoding='utf-8') as out_txt:
         for ch in iter_chunks():
-            code = ch.get('code','')
-            fp = ch.get('file_path','')
-            snippet = code[:2000]
-            msg = PROMPT + domain_context + snippet
-            try:
-                text, _ = generate_text(user_input=msg, system_instructions=None, reasoning_effort=None, response_format={"type": "json_object"})
-                content = (text or '').strip()
-                card: Dict = json.loads(content) if content else {"symbols": [], "purpose": "", "routes": []}
-            except Exception:
-                card = {"symbols": [], "purpose": "", "routes": []}
-            card['file_path'] = fp
-            card['id'] = ch.get('id')
+            seen_hashes.add(chunk_hash(ch))
+            card = make_card(ch, cache, generate_text, domain_context_str)
             out_json.write(json.dumps(card, ensure_ascii=False) + '\n')
-            # Create rich text representation for BM25 indexing
-            text_parts = [
-                ' '.join(card.get('symbols', [])),
-                card.get('purpose', ''),
-                card.get('technical_details', ''),
-                ' '.join(card.get('domain_concepts', [])),
-                ' '.join(card.get('routes', [])),
-                ' '.join(card.get('dependencies', [])),
-                ' '.join(card.get('patterns', [])),
-                fp
-            ]
-            text_out = ' '.join(filter(None, text_parts))
-            out_txt.write(text_out.replace('\n',' ') + '\n')
+            out_txt.write(card_text(card, card['file_path']) + '\n')
             n += 1
             if MAX_CHUNKS and n >= MAX_CHUNKS:
                 break
+    if not MAX_CHUNKS:
+        cache.prune(seen_hashes)
+    cache.save()
+    st = cache.stats()
+    print(f"Card cache: {st['hits']} hits / {st['misses']} misses ({st['hit_ratio']*100:.1f}%), saved ~{st['saved_tokens']} tokens")
     try:
-        import bm25s  # type: ignore
-        from bm25s.tokenization import Tokenizer  # type: ignore
-        from Stemmer import Stemmer  # type: ignore
-        stemmer = Stemmer('english')
-        tok = Tokenizer(stemmer=stemmer, stopwords='en')
-        with open(CARDS_TXT,'r',encoding='utf-8') as f:
-            docs = [line.strip() for line in f if line.strip()]
-        tokens = tok.tokenize(docs)
-        retriever = bm25s.BM25(method='lucene', k1=1.2, b=0.65)
-        retriever.index(tokens)
-        try:
-            retriever.vocab_dict = {str(k): v for k, v in retriever.vocab_dict.items()}
-        except Exception:
-            pass
-        os.makedirs(INDEX_DIR, exist_ok=True)
-        retriever.save(INDEX_DIR, corpus=docs)
-        tok.save_vocab(save_dir=INDEX_DIR)
-        tok.save_stopwords(save_dir=INDEX_DIR)
-        print(f"Built cards BM25 index with {len(docs)} docs at {INDEX_DIR}")
+        ndocs = build_cards_bm25()
+        print(f"Built cards BM25 index with {ndocs} docs at {INDEX_DIR}")
     except Exception as e:
         print('BM25 build failed:', e)
 
+def main_incremental() -> None:
+    """Regenerate cards only for chunks that are new or whose code changed, drop cards
+    for removed chunks, and publish a new cards BM25 generation."""
+    from server.env_model import generate_text
+    existing = {}
+    if os.path.exists(CARDS):
+        with open(CARDS, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    c = json.loads(line)
+                    existing[str(c.get('id'))] = c.get('hash')
+                except Exception:
+                    continue
+    if not existing or cards_index.current_generation(BASE) is None:
+        main()
+        return
+    domain_context_str = domain_context(REPO)
+    cache = CardCache(BASE, enrich_model(), prompt_version(PROMPT + domain_context_str))
+    live = set()
+    upserts = []
+    for ch in iter_chunks():
+        cid = str(ch.get('id'))
+        live.add(cid)
+        if cid in existing and existing[cid] == chunk_hash(ch):
+            continue
+        upserts.append(make_card(ch, cache, generate_text, domain_context_str))
+    removed = [cid for cid in existing if cid not in live]
+    if not upserts and not removed:
+        print('Cards up to date')
+        return
+    cache.save()
+    res = cards_index.apply_changes(BASE, upserts, removed)
+    print(f"Cards updated: +{res['added']} ~{res['replaced']} -{len(removed)} -> generation {res['generation']}")
+
 if __name__ == '__main__':
-    main()
+    if '--incremental' in sys.argv[1:]:
+        main_incremental()
+    else:
+        main()
@@ -0,0 +1,161 @@
+"""Per-file facts computed once while a file is read for indexing.
+
+Every chunk of a file shares its layer, origin (first-party vs vendored),
+license header, language and size; the indexer used to recompute them per
+chunk, re-opening the file for each one to look for a license header.
+describe_file() reads the file once and returns its text plus a FileMeta
+record whose chunk_fields() are copied onto each chunk.
+
+The records are written to file_meta.jsonl in the index generation (one line
+per file, including files skipped by the size heuristics), together with the
+ids of the chunks each file produced, so an incremental run can tell which
+files changed (size, mtime, sha1) and which chunks to replace.
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import hashlib
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+# Heuristics for files that are not worth chunking
+MAX_FILE_CHARS = 2_000_000
+MAX_AVG_LINE = 2500
+HEADER_LINES = 12
+
+VENDOR_MARKERS = (
+    "/vendor/","/third_party/","/external/","/deps/","/node_modules/",
+    "/Pods/","/Godeps/","/.bundle/","/bundle/"
+)
+LICENSE_MARKERS = (
+    ("apache license", "apache"),
+    ("mit license", "mit"),
+    ("bsd license", "bsd"),
+    ("mozilla public license", "mpl"),
+)
+
+
+@dataclass
+class FileMeta:
+    path: str
+    language: Optional[str] = None
+    layer: str = "server"
+    origin: str = "first_party"
+    license: Optional[str] = None
+    size: int = 0            # bytes on disk
+    mtime: float = 0.0
+    lines: int = 0
+    avg_line: float = 0.0
+    sha1: Optional[str] = None
+    skipped: Optional[str] = None   # why the file was not chunked
+    chunk_ids: List[str] = field(default_factory=list)
+
+    def chunk_fields(self) -> Dict[str, str]:
+        """File-level fields stored on every chunk of this file."""
+        out = {"layer": self.layer, "origin": self.origin}
+        if self.license:
+            out["license"] = self.license
+        return out
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False)
+
+
+def detect_layer(fp: str) -> str:
+    """Repo-aware layer tagging for AGRO.
+
+    Maps files to one of the engine's actual layers:
+      gui, server, retrieval, indexer, eval, scripts, common, infra
+    Defaults to 'server' when no match.
+    """
+    f = (fp or '').lower()
+    if '/gui/' in f or '/public/' in f:
+        return 'gui'
+    if '/server/' in f:
+        return 'server'
+    if '/retrieval/' in f:
+        return 'retrieval'
+    if '/indexer/' in f:
+        return 'indexer'
+    if '/eval/' in f or '/tests/' in f:
+        return 'eval'
+    if '/scripts/' in f:
+        return 'scripts'
+    if '/common/' in f:
+        return 'common'
+    if '/infra/' in f:
+        return 'infra'
+    return 'server'
+
+
+def license_header(head: str) -> Optional[str]:
+    """Short license name if `head` (the first lines of a file) carries a known license header."""
+    low = (head or '').lower()
+    for marker, name in LICENSE_MARKERS:
+        if marker in low:
+            return name
+    return None
+
+
+def detect_origin(fp: str, head: Optional[str] = None) -> str:
+    """'vendor' for vendored paths or files with a license header, else 'first_party'.
+
+    Pass `head` when the file is already in memory; otherwise its first lines are read.
+    """
+    low = (fp or '').lower()
+    for m in VENDOR_MARKERS:
+        if m in low:
+            return 'vendor'
+    if head is None:
+        try:
+            with open(fp, 'r', encoding='utf-8', errors='ignore') as f:
+                head = ''.join(line for _, line in zip(range(HEADER_LINES), f))
+        except Exception:
+            head = ''
+    return 'vendor' if license_header(head) else 'first_party'
+
+
+def describe_file(fp: str, language: Optional[str] = None) -> Tuple[Optional[str], FileMeta]:
+    """Read `fp` once: (text, meta), or (None, meta with `skipped` set)."""
+    meta = FileMeta(path=fp, language=language, layer=detect_layer(fp))
+    try:
+        st = os.stat(fp)
+        meta.size, meta.mtime = st.st_size, st.st_mtime
+        with open(fp, 'r', encoding='utf-8', errors='ignore') as f:
+            text = f.read()
+    except Exception:
+        meta.skipped = 'unreadable'
+        return None, meta
+    if len(text) > MAX_FILE_CHARS:
+        meta.skipped = 'too_large'
+        return None, meta
+    lines = text.splitlines()
+    meta.lines = len(lines)
+    if lines:
+        meta.avg_line = round(sum(len(x) for x in lines) / len(lines), 1)
+        if meta.avg_line > MAX_AVG_LINE:
+            meta.skipped = 'minified'
+            return None, meta
+    meta.sha1 = hashlib.sha1(text.encode('utf-8', errors='ignore')).hexdigest()
+    head = '\n'.join(lines[:HEADER_LINES])
+    meta.license = license_header(head)
+    meta.origin = detect_origin(fp, head)
+    return text, meta
+
+
+def load_table(path: str) -> Dict[str, FileMeta]:
+    """file_meta.jsonl -> {path: FileMeta} (empty when missing; bad lines are skipped)."""
+    out: Dict[str, FileMeta] = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    o = json.loads(line)
+                    out[o['path']] = FileMeta(**o)
+                except Exception:
+                    pass
+    except FileNotFoundError:
+        pass
+    return out
@@ -0,0 +1,74 @@
+"""Which files changed in a repo root since it was last indexed.
+
+Every index run records, per root in BASES, the HEAD commit it indexed and the
+paths that were dirty in the work tree at that moment (modified, staged or
+untracked files are indexed as they are on disk, not as committed). The next
+incremental run re-chunks exactly:
+
+  git diff <recorded commit> HEAD        files committed since
+  + paths dirty now                      uncommitted edits
+  + paths dirty last time                edits that were since reverted/committed
+
+All paths are returned relative to the root (git runs with --relative from the
+root, so a root that is a subdirectory of a larger work tree only sees its own
+files). Any git failure yields None and the caller falls back to a full index.
+"""
+
+from __future__ import annotations
+
+import os
+import subprocess
+from typing import Dict, List, Optional, Sequence
+
+
+def _git(root: str, *args: str, timeout: float = 120.0) -> Optional[bytes]:
+    try:
+        r = subprocess.run(["git", "-C", root, *args], capture_output=True, timeout=timeout)
+    except Exception:
+        return None
+    return r.stdout if r.returncode == 0 else None
+
+
+def _paths(out: Optional[bytes]) -> Optional[List[str]]:
+    if out is None:
+        return None
+    return [p for p in out.decode("utf-8", errors="surrogateescape").split("\0") if p]
+
+
+def head_commit(root: str) -> Optional[str]:
+    out = _git(root, "rev-parse", "--verify", "HEAD")
+    return out.decode().strip() if out else None
+
+
+def dirty_paths(root: str) -> Optional[List[str]]:
+    """Tracked files differing from HEAD plus untracked, non-ignored files (relative to `root`)."""
+    tracked = _paths(_git(root, "diff", "--name-only", "-z", "--no-renames", "--relative", "HEAD"))
+    untracked = _paths(_git(root, "ls-files", "-z", "--others", "--exclude-standard"))
+    if tracked is None or untracked is None:
+        return None
+    return sorted(set(tracked) | set(untracked))
+
+
+def snapshot(roots: Sequence[str]) -> Dict[str, Dict]:
+    """{root: {"commit": sha, "dirty": [...]}} for the roots that are git work trees."""
+    out: Dict[str, Dict] = {}
+    for root in roots:
+        if not os.path.isdir(root):
+            continue
+        sha = head_commit(root)
+        dirty = dirty_paths(root) if sha else None
+        if sha and dirty is not None:
+            out[root] = {"commit": sha, "dirty": dirty}
+    return out
+
+
+def changed_paths(root: str, since: Dict) -> Optional[List[str]]:
+    """Paths under `root` that may differ from the index built at `since` (a snapshot() entry)."""
+    base = (since or {}).get("commit")
+    if not base or head_commit(root) is None:
+        return None
+    committed = _paths(_git(root, "diff", "--name-only", "-z", "--no-renames", "--relative", base, "HEAD"))
+    dirty = dirty_paths(root)
+    if committed is None or dirty is None:
+        return None
+    return sorted(set(committed) | set(dirty) | set(since.get("dirty") or []))
@@ -0,0 +1,339 @@
+"""Commit-driven incremental re-indexing.
+
+A full index run (indexer/index_repo.py) records, per repo root, the commit it
+indexed and the paths that were dirty at the time (last_index.json and the
+generation manifest, key "git"). This job diffs that against the work tree now
+(indexer/git_state.py), re-chunks only the touched files and publishes a new
+generation:
+
+  chunks / BM25   unchanged chunks are copied from the live generation and the
+                  touched files re-chunked; BM25 is rebuilt from that corpus
+                  (IDF is corpus-wide, and tokenizing is cheap next to embedding)
+  Qdrant          only the new chunks are embedded and upserted into the live
+                  collection under content-keyed ids, so no point a retained
+                  generation lists is overwritten; points of chunks that
+                  disappeared are deleted by index_generations.prune() once no
+                  kept generation lists them; the embedding cache is looked
+                  up through its hash index, reading only the vectors it hits
+  local vectors   rows of unchanged chunks are reused, new ones embedded
+  cards           `indexer.build_cards --incremental` when cards exist
+
+It falls back to a full index whenever the diff can't be trusted: no live
+generation or recorded commit, a commit git no longer knows (rebased away), a
+changed .gitignore / exclude_globs.txt, a different embedding type or dense
+mode, or more touched files than INDEX_INCREMENTAL_MAX_FILES. Runs for one repo
+are serialized with a lock file in its out dir.
+
+  INDEX_INCREMENTAL_MAX_FILES  touched files above which a full run is used (default 2000)
+  INDEX_INCREMENTAL_CARDS      refresh cards of changed chunks 1|0          (default 1)
+
+CLI (the git hooks installed by the server run this in the background):
+  REPO=agro python -m indexer.incremental             # incremental, full run as fallback
+  REPO=agro python -m indexer.incremental --dry-run   # print the plan only
+  REPO=agro python -m indexer.incremental --no-full   # exit 2 instead of a full run
+  REPO=agro python -m indexer.incremental --live-mode # dense mode/embedding type of the live generation
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+from common import index_generations
+from common.index_meta import read_index_meta, read_json
+from indexer import discovery, git_state
+from indexer import index_repo as ir
+from indexer.file_meta import load_table
+from retrieval import local_vectors
+
+ROOT = Path(__file__).resolve().parents[1]
+# Touching these changes which files are indexed at all
+RULE_FILES = {".gitignore", "exclude_globs.txt"}
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)) or default)
+    except Exception:
+        return default
+
+
+def _dense_mode(manifest: Dict[str, Any], gen_dir: str) -> str:
+    if manifest.get("dense"):
+        return manifest["dense"]
+    if manifest.get("collection"):
+        return "qdrant"
+    if os.path.exists(os.path.join(gen_dir, local_vectors.VECTORS_DIRNAME, "meta.json")):
+        return "local"
+    return "none"
+
+
+def _wanted_dense_mode() -> str:
+    if (os.getenv("SKIP_DENSE", "0") or "0").strip() == "1":
+        return "none"
+    return "local" if local_vectors.enabled() else "qdrant"
+
+
+def live_mode_env() -> Dict[str, str]:
+    """SKIP_DENSE / VECTOR_BACKEND / EMBEDDING_TYPE matching how the live generation was indexed.
+
+    Git hooks run with whatever env the shell has; following the live generation
+    keeps them incremental instead of re-indexing with another dense mode.
+    """
+    live = index_generations.current_generation(ir.OUTDIR)
+    if not live:
+        return {}
+    m = index_generations.read_manifest(ir.OUTDIR, live)
+    mode = _dense_mode(m, index_generations.generation_dir(ir.OUTDIR, live))
+    env = {"SKIP_DENSE": "1" if mode == "none" else "0"}
+    if mode != "none" and local_vectors.enabled() != (mode == "local"):
+        env["VECTOR_BACKEND"] = "local" if mode == "local" else "qdrant"
+    if m.get("embedding_type"):
+        env["EMBEDDING_TYPE"] = str(m["embedding_type"])
+    return env
+
+
+def _recorded_git(live: str, manifest: Dict[str, Any]) -> Dict[str, Any]:
+    """Commits the live generation was built from (last_index.json, else its manifest)."""
+    meta = read_index_meta(ir.OUTDIR)
+    # last_index.json describes the last *published* run; after a rollback trust the manifest
+    if meta.get("generation") == live and meta.get("git"):
+        return meta["git"]
+    return manifest.get("git") or {}
+
+
+def plan() -> Dict[str, Any]:
+    """{"full": reason} or {"live", "manifest", "mode", "git", "changed": {path: root}}."""
+    live = index_generations.current_generation(ir.OUTDIR)
+    if not live:
+        return {"full": "no live index generation"}
+    m = index_generations.read_manifest(ir.OUTDIR, live)
+    mode = _dense_mode(m, index_generations.generation_dir(ir.OUTDIR, live))
+    if mode != _wanted_dense_mode():
+        return {"full": f"dense mode changed ({mode} -> {_wanted_dense_mode()})"}
+    et = (os.getenv("EMBEDDING_TYPE", "openai") or "openai").lower()
+    if mode != "none" and m.get("embedding_type") != et:
+        return {"full": f"embedding type changed ({m.get('embedding_type')} -> {et})"}
+    if mode != "none" and et == "openai" and not ir.OPENAI_API_KEY:
+        return {"full": "OPENAI_API_KEY not set"}
+    recorded = _recorded_git(live, m)
+    # Taken before the diff: anything edited from here on shows up as dirty next time
+    now = git_state.snapshot(ir.BASES)
+    changed: Dict[str, str] = {}
+    for root in ir.BASES:
+        if root not in recorded or root not in now:
+            return {"full": f"no indexed commit recorded for {root}"}
+        rels = git_state.changed_paths(root, recorded[root])
+        if rels is None:
+            return {"full": f"cannot diff {root} from {str(recorded[root].get('commit'))[:12]}"}
+        base = root.rstrip(os.sep) or os.sep
+        for rel in rels:
+            if os.path.basename(rel) in RULE_FILES:
+                return {"full": f"exclude rules changed ({rel})"}
+            changed[os.path.join(base, rel)] = base
+    limit = _env_int("INDEX_INCREMENTAL_MAX_FILES", 2000)
+    if len(changed) > limit:
+        return {"full": f"{len(changed)} files changed (INDEX_INCREMENTAL_MAX_FILES={limit})"}
+    return {"live": live, "manifest": m, "mode": mode, "git": now, "changed": changed}
+
+
+def _await_points(q, collection: str, ids: List[str], timeout: float = 120.0) -> None:
+    """Wait until wait=False upserts of `ids` are visible (the collection count includes old points)."""
+    deadline = time.monotonic() + timeout
+    pending = list(ids)
+    while pending:
+        found = set()
+        for i in range(0, len(pending), 1000):
+            pts = q.retrieve(collection, ids=pending[i:i + 1000], with_payload=False, with_vectors=False)
+            found.update(str(p.id) for p in pts)
+        pending = [p for p in pending if p not in found]
+        if pending and time.monotonic() >= deadline:
+            raise RuntimeError(f"{len(pending)} upserted points not visible in {collection}")
+        if pending:
+            time.sleep(0.2)
+
+
+def _same_file(path: str, fm) -> bool:
+    """True when `path` is still exactly what the live generation indexed (size and mtime)."""
+    if fm is None or fm.skipped:
+        return False
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return st.st_size == fm.size and st.st_mtime == fm.mtime
+
+
+def _refresh_cards() -> None:
+    if (os.getenv("INDEX_INCREMENTAL_CARDS", "1") or "1").strip() != "1":
+        return
+    if not os.path.exists(os.path.join(ir.OUTDIR, "cards.jsonl")):
+        return
+    try:
+        r = subprocess.run([sys.executable, "-m", "indexer.build_cards", "--incremental"],
+                           env={**os.environ, "REPO": ir.REPO}, cwd=str(ROOT),
+                           capture_output=True, text=True, timeout=3600)
+        print((r.stdout or r.stderr or "").strip()[-500:])
+    except Exception as e:
+        print(f"Cards refresh failed ({e}).")
+
+
+def apply(p: Dict[str, Any]) -> Dict[str, Any]:
+    """Build and publish the incremental generation described by plan()."""
+    t0 = time.perf_counter()
+    live, m, mode, changed = p["live"], p["manifest"], p["mode"], p["changed"]
+    old_dir = index_generations.generation_dir(ir.OUTDIR, live)
+    matcher = discovery.ExcludeMatcher(discovery.exclude_patterns(ir.BASES))
+
+    old_files = load_table(os.path.join(old_dir, "file_meta.jsonl"))
+    # Files that stay dirty are listed by every run; skip them until they are touched again
+    changed = {path: root for path, root in changed.items() if not _same_file(path, old_files.get(path))}
+    relevant = [path for path, root in changed.items() if path in old_files or (
+        ir.lang_from_path(path) and os.path.isfile(path) and ir._path_allowed(path)
+        and discovery.included(root, path, matcher))]
+    if not relevant:
+        # Nothing indexable changed (docs, ignored files...): just move the recorded commits
+        ir.record_index_meta(ir.OUTDIR, git=p["git"])
+        return {"generation": live, "from": live, "files": 0, "added": 0, "removed": 0,
+                "chunks": m.get("chunk_count"), "seconds": round(time.perf_counter() - t0, 2)}
+
+    GEN = index_generations.new_generation(ir.OUTDIR)
+    GEN_DIR = index_generations.generation_dir(ir.OUTDIR, GEN)
+    BM25_DIR = os.path.join(GEN_DIR, "bm25_index")
+    try:
+        writer = ir._GenerationWriter(GEN_DIR)
+        seen, removed, new_chunks = set(), set(), []
+        # Point ids of the copied chunks, as the live generation recorded them
+        old_pids = read_json(Path(old_dir) / "bm25_index" / "bm25_point_ids.json", {}) if mode == "qdrant" else {}
+        pids: List[str] = []
+        try:
+            for row, c in enumerate(ir._iter_jsonl(os.path.join(old_dir, "chunks.jsonl"))):
+                if c.get("file_path") in changed:
+                    removed.add(str(c["id"]))
+                    continue
+                seen.add(c.get("hash"))
+                writer.write(c)
+                if mode == "qdrant":
+                    pids.append(old_pids.get(str(row)) or ir._point_id(c))
+            for path, fm in old_files.items():
+                if path not in changed:
+                    writer.write_file(fm)
+            enricher = ir._Enricher.from_env()
+            for path in sorted(relevant):
+                lang = ir.lang_from_path(path)
+                if not lang or not os.path.isfile(path) or not ir._path_allowed(path):
+                    continue
+                if not discovery.included(changed[path], path, matcher):
+                    continue
+                new_chunks.extend(ir._file_chunks(path, lang, seen, enricher, writer))
+        finally:
+            writer.close()
+        ir._build_bm25(BM25_DIR, os.path.join(GEN_DIR, ir._GenerationWriter.CORPUS_SPILL), writer.n_chunks)
+        stale = sorted(removed - {str(c["id"]) for c in new_chunks})
+
+        manifest = {k: v for k, v in m.items() if k not in ("generation", "created", "previous")}
+        manifest.update({
+            "chunk_count": writer.n_chunks, "file_count": writer.n_files, "git": p["git"],
+            "incremental": {"from": live, "files": len(changed), "added": len(new_chunks), "removed": len(stale)},
+        })
+
+        q = None
+        embs = None
+        et = manifest.get("embedding_type") or "local"
+        stream = None
+        if mode == "qdrant":
+            stream = ir._QdrantStream(ir.QDRANT_URL, m["collection"], existing=True,
+                                      coarse_dim=int(m.get("coarse_dim") or 0))
+        if mode != "none" and new_chunks:
+            client = ir.openai_client(ir.OPENAI_API_KEY) if ir.OPENAI_API_KEY else None
+            dense = ir._DenseStage(et, client, os.path.join(GEN_DIR, "embeddings.f32"), stream)
+            window, _ = ir._memory_plan(int(m.get("embedding_dim") or ir._embed_dim_hint(et)))
+            dense.run(ir._windows(new_chunks, window))
+            if dense.error is not None:
+                raise dense.error
+            embs = dense.finish()
+            if embs is None or int(embs.shape[1]) != int(m.get("embedding_dim") or embs.shape[1]):
+                raise RuntimeError(f"embedding dim {None if embs is None else embs.shape[1]} != index dim {m.get('embedding_dim')}")
+        if mode == "qdrant":
+            if new_chunks:
+                stream.finish()
+                q = stream.q
+                _await_points(q, m["collection"], [ir._point_id(c) for c in new_chunks])
+            else:
+                q = ir.QdrantClient(url=ir.QDRANT_URL)
+            ir._write_json_map(os.path.join(BM25_DIR, "bm25_point_ids.json"),
+                               pids + [ir._point_id(c) for c in new_chunks])
+        elif mode == "local":
+            old = local_vectors.LocalVectorIndex(os.path.join(old_dir, local_vectors.VECTORS_DIRNAME))
+            old_rows = {cid: i for i, cid in enumerate(old.ids)}
+            new_rows = {str(c["id"]): i for i, c in enumerate(new_chunks)}
+            ids = list(ir._chunk_ids(BM25_DIR))
+            vecs = np.empty((len(ids), old.dim), dtype=np.float32)
+            for j, cid in enumerate(ids):
+                vecs[j] = embs[new_rows[cid]] if cid in new_rows else old.vectors[old_rows[cid]]
+            local_vectors.build(os.path.join(GEN_DIR, local_vectors.VECTORS_DIRNAME), ids, vecs,
+                                meta={"repo": ir.REPO, "embedding_type": et})
+        del embs
+        if os.path.exists(os.path.join(GEN_DIR, "embeddings.f32")):
+            os.unlink(os.path.join(GEN_DIR, "embeddings.f32"))
+    except BaseException:
+        # Never published: the live generation is untouched (upserted points are new,
+        # content-keyed ids that searches of it filter out)
+        shutil.rmtree(GEN_DIR, ignore_errors=True)
+        raise
+
+    # Stale points stay in the collection for rollback; prune() deletes them
+    ir._publish_generation(GEN, manifest, q)
+    _refresh_cards()
+    return {"generation": GEN, "from": live, "files": len(changed), "added": len(new_chunks),
+            "removed": len(stale), "chunks": writer.n_chunks, "seconds": round(time.perf_counter() - t0, 2)}
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Re-index only the files changed since the last indexed commit")
+    ap.add_argument("--dry-run", action="store_true", help="print what would be re-indexed and exit")
+    ap.add_argument("--no-full", action="store_true", help="exit with status 2 instead of running a full index")
+    ap.add_argument("--live-mode", action="store_true",
+                    help="use the live generation's dense mode and embedding type (git hooks)")
+    args = ap.parse_args(argv)
+    with ir._index_lock(ir.OUTDIR):
+        if args.live_mode:
+            os.environ.update(live_mode_env())
+        p = plan()
+        if args.dry_run:
+            out = {"full": p["full"]} if "full" in p else {"from": p["live"], "files": sorted(p["changed"])}
+            print(json.dumps(out, indent=2))
+            return 0
+        if "full" not in p:
+            if not p["changed"]:
+                print(f"Index is up to date (generation {p['live']}).")
+                return 0
+            try:
+                res = apply(p)
+                if res["generation"] == res["from"]:
+                    print(f"No indexed files changed; recorded the new commit (generation {res['from']}).")
+                    return 0
+                print(f"Incremental update: {res['files']} files, +{res['added']} chunks, -{res['removed']} stale "
+                      f"-> generation {res['generation']} ({res['seconds']}s).")
+                return 0
+            except Exception as e:
+                p = {"full": f"incremental update failed ({e})"}
+        if args.no_full:
+            print(f"Full index needed: {p['full']}")
+            return 2
+        print(f"Running a full index: {p['full']}")
+        ir.main()
+        return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,11 +1,17 @@
 import os
 import json
 import hashlib
-from typing import List, Dict
+import functools
+import contextlib
+import queue
+import threading
+from typing import Callable, List, Dict, Optional, Tuple
 from pathlib import Path
+import numpy as np
 from dotenv import load_dotenv, find_dotenv
 from common.config_loader import get_repo_paths, out_dir
 from common.paths import data_dir
+from common.index_meta import record_index_meta
 from retrieval.ast_chunker import lang_from_path, collect_files, chunk_code
 import bm25s  # type: ignore
 from bm25s.tokenization import Tokenizer  # type: ignore
@@ -13,42 +19,25 @@ from Stemmer import Stemmer  # type: ignore
 from qdrant_client import QdrantClient, models
 import uuid
 from openai import OpenAI
+from common.provider_clients import openai_client
 from retrieval.embed_cache import EmbeddingCache
+from retrieval import local_vectors
+from common import index_generations, qdrant_config
+from indexer.qdrant_uploader import QdrantUploader
+from indexer.discovery import ExcludeMatcher, exclude_patterns
+from indexer import git_state
+from indexer.file_meta import FileMeta, describe_file, detect_layer, detect_origin  # noqa: F401 (re-exported)
+from common.embedding_executor import EmbeddingExecutor, clip_for_openai, estimate_tokens
 import tiktoken
-# Lazy import heavy models only when needed (avoid memory spikes on BM25-only runs)
+# Lazy import heavy models only when needed (avoid memory spikes on BM25-only runs);
+# cached because the streaming pipeline embeds one window at a time
+@functools.lru_cache(maxsize=2)
 def _load_st_model(model_name: str):
     from sentence_transformers import SentenceTransformer  # type: ignore
     return SentenceTransformer(model_name)
-import fnmatch
-import pathlib
 import common.qdrant_utils as qdrant_recreate_fallback  # make recreate_collection 404-safe
 from datetime import datetime
 
-# --- global safe filters (avoid indexing junk) ---
-from common.filtering import _prune_dirs_in_place, _should_index_file, PRUNE_DIRS
-
-# Patch os.walk to prune noisy dirs and skip junk file types
-_os_walk = os.walk
-def _filtered_os_walk(top, *args, **kwargs):
-    for root, dirs, files in _os_walk(top, *args, **kwargs):
-        _prune_dirs_in_place(dirs)
-        files[:] = [f for f in files if _should_index_file(f)]
-        yield root, dirs, files
-os.walk = _filtered_os_walk  # type: ignore
-
-# Patch Path.rglob as well (if code uses it)
-_Path_rglob = Path.rglob
-def _filtered_rglob(self, pattern):
-    for p in _Path_rglob(self, pattern):
-        # skip if any pruned dir appears in the path
-        if any(part in PRUNE_DIRS for part in p.parts):
-            continue
-        if not _should_index_file(p.name):
-            continue
-        yield p
-Path.rglob = _filtered_rglob  # type: ignore
-# --- end filters ---
-
 
 # Load local env and also repo-root .env if present (no hard-coded paths)
 try:
@@ -87,111 +76,43 @@ SOURCE_EXTS = {
     ".sql", ".yml", ".yaml", ".toml", ".ini", ".json", ".txt", ".sh", ".bash"
     # Note: .md excluded per user requirement - filtering.py blocks it
 }
-EXCLUDE_GLOBS_FILE = str((data_dir() / "exclude_globs.txt").resolve())
-
-def _load_exclude_globs() -> list[str]:
-    p = pathlib.Path(EXCLUDE_GLOBS_FILE)
-    if not p.exists():
-        return []
-    return [ln.strip() for ln in p.read_text().splitlines() if ln.strip() and not ln.startswith("#")]
-
-_EXCLUDE_GLOBS = _load_exclude_globs()
+_EXCLUDES = ExcludeMatcher(exclude_patterns(BASES))
 
-def should_index_file(path: str) -> bool:
-    p = pathlib.Path(path)
+def _path_allowed(path: str) -> bool:
     # 1) fast deny: extension must look like source
-    if p.suffix.lower() not in SOURCE_EXTS:
-        return False
-    # 2) glob excludes (vendor, caches, images, minified, etc.)
-    as_posix = p.as_posix()
-    for pat in _EXCLUDE_GLOBS:
-        if fnmatch.fnmatch(as_posix, pat):
-            return False
-    # 3) quick heuristic to skip huge/minified one-liners
-    try:
-        text = p.read_text(errors="ignore")
-        if len(text) > 2_000_000:  # ~2MB
-            return False
-        lines = text.splitlines()
-        if lines:
-            avg = sum(len(x) for x in lines) / max(1, len(lines))
-            if avg > 2500:
-                return False
-    except Exception:
+    if os.path.splitext(path)[1].lower() not in SOURCE_EXTS:
         return False
-    return True
-
-
-"""Repo-aware layer tagging for AGRO.
-
-Maps files to one of the engine's actual layers:
-  gui, server, retrieval, indexer, eval, scripts, common, infra
-Defaults to 'server' when no match.
-"""
-def detect_layer(fp: str) -> str:
-    f = (fp or '').lower()
-    if '/gui/' in f or '/public/' in f:
-        return 'gui'
-    if '/server/' in f:
-        return 'server'
-    if '/retrieval/' in f:
-        return 'retrieval'
-    if '/indexer/' in f:
-        return 'indexer'
-    if '/eval/' in f or '/tests/' in f:
-        return 'eval'
-    if '/scripts/' in f:
-        return 'scripts'
-    if '/common/' in f:
-        return 'common'
-    if '/infra/' in f:
-        return 'infra'
-    return 'server'
-
-VENDOR_MARKERS = (
-    "/vendor/","/third_party/","/external/","/deps/","/node_modules/",
-    "/Pods/","/Godeps/","/.bundle/","/bundle/"
-)
-def detect_origin(fp: str) -> str:
-    low = (fp or '').lower()
-    for m in VENDOR_MARKERS:
-        if m in low:
-            return 'vendor'
-    try:
-        with open(fp, 'r', encoding='utf-8', errors='ignore') as f:
-            head = ''.join([next(f) for _ in range(12)])
-        if any(k in head.lower() for k in (
-            'apache license','mit license','bsd license','mozilla public license'
-        )):
-            return 'vendor'
-    except Exception:
-        pass
-    return 'first_party'
+    # 2) glob excludes (vendor, caches, images, minified, etc.), compiled once
+    return not _EXCLUDES.match(Path(path).as_posix())
+
+def should_index_file(path: str) -> bool:
+    # 3) quick heuristic to skip huge/minified one-liners (see indexer/file_meta.py)
+    return _path_allowed(path) and describe_file(path)[0] is not None
+
+
 os.makedirs(OUTDIR, exist_ok=True)
 
-def _clip_for_openai(text: str, enc, max_tokens: int = 8000) -> str:
-    toks = enc.encode(text)
-    if len(toks) <= max_tokens:
-        return text
-    return enc.decode(toks[:max_tokens])
+# on_batch(indices, vectors): called as each embedding batch completes
+OnBatch = Callable[[List[int], List[List[float]]], None]
 
-def embed_texts(client: OpenAI, texts: List[str], batch: int = 64) -> List[List[float]]:
-    embs = []
-    enc = tiktoken.get_encoding('cl100k_base')
-    for i in range(0, len(texts), batch):
-        sub = [_clip_for_openai(t, enc) for t in texts[i:i+batch]]
-        r = client.embeddings.create(model='text-embedding-3-large', input=sub)
-        for d in r.data:
-            embs.append(d.embedding)
-    return embs
+def embed_texts(client: OpenAI, texts: List[str], batch: Optional[int] = None,
+                on_batch: Optional[OnBatch] = None) -> List[List[float]]:
+    clipped, counts = clip_for_openai(texts)
+    ex = EmbeddingExecutor(
+        lambda sub: [d.embedding for d in client.embeddings.create(model='text-embedding-3-large', input=sub).data],
+        provider='openai', max_batch_items=batch)
+    return ex.map(clipped, counts, on_batch=on_batch)
 
-def embed_texts_local(texts: List[str], model_name: str = 'BAAI/bge-small-en-v1.5', batch: int = 128) -> List[List[float]]:
+def embed_texts_local(texts: List[str], model_name: str = 'BAAI/bge-small-en-v1.5', batch: int = 128,
+                      on_batch: Optional[OnBatch] = None) -> List[List[float]]:
     model = _load_st_model(model_name)
     out = []
     for i in range(0, len(texts), batch):
         sub = texts[i:i+batch]
-        v = model.encode(sub, normalize_embeddings=True, show_progress_bar=False)
-        out.extend(v.tolist())
+        v = model.encode(sub, normalize_embeddings=True, show_progress_bar=False).tolist()
+        out.extend(v)
+        if on_batch is not None:
+            on_batch(list(range(i, i + len(sub))), v)
     return out
 
 def _renorm_truncate(vecs: List[List[float]], dim: int) -> List[List[float]]:
@@ -203,226 +124,615 @@ def _renorm_truncate(vecs: List[List[float]], dim: int) -> List[List[float]]:
         out.append([x / n for x in w])
     return out
 
-def embed_texts_mxbai(texts: List[str], dim: int = 512, batch: int = 128) -> List[List[float]]:
+def embed_texts_mxbai(texts: List[str], dim: int = 512, batch: int = 128,
+                      on_batch: Optional[OnBatch] = None) -> List[List[float]]:
     model = _load_st_model('mixedbread-ai/mxbai-embed-large-v1')
     out: List[List[float]] = []
     for i in range(0, len(texts), batch):
         sub = texts[i:i+batch]
-        v = model.encode(sub, normalize_embeddings=True, show_progress_bar=False)
-        out.extend(v.tolist())
-    return _renorm_truncate(out, dim)
-
-def embed_texts_voyage(texts: List[str], batch: int = 128, output_dimension: int = 512) -> List[List[float]]:
-    import voyageai  # type: ignore
-    client = voyageai.Client(api_key=os.getenv('VOYAGE_API_KEY'))
-    out: List[List[float]] = []
-    for i in range(0, len(texts), batch):
-        sub = texts[i:i+batch]
-        r = client.embed(sub, model='voyage-code-3', input_type='document', output_dimension=output_dimension)
-        out.extend(r.embeddings)
+        v = _renorm_truncate(model.encode(sub, normalize_embeddings=True, show_progress_bar=False).tolist(), dim)
+        out.extend(v)
+        if on_batch is not None:
+            on_batch(list(range(i, i + len(sub))), v)
     return out
 
-def main() -> None:
-    files = collect_files(BASES)
-    print(f'Discovered {len(files)} source files.')
-    all_chunks: List[Dict] = []
-    for fp in files:
-        if not should_index_file(fp):
-            continue
-        lang = lang_from_path(fp)
-        if not lang:
-            continue
-        try:
-            with open(fp, 'r', encoding='utf-8', errors='ignore') as f:
-                src = f.read()
-        except Exception:
-            continue
-        ch = chunk_code(src, fp, lang, target=900)
-        all_chunks.extend(ch)
+def embed_texts_voyage(texts: List[str], batch: Optional[int] = None, output_dimension: int = 512,
+                       on_batch: Optional[OnBatch] = None) -> List[List[float]]:
+    from common.provider_clients import voyage_client
+    client = voyage_client()
+    ex = EmbeddingExecutor(
+        lambda sub: client.embed(sub, model='voyage-code-3', input_type='document', output_dimension=output_dimension).embeddings,
+        provider='voyage', max_batch_items=batch)
+    return ex.map(texts, estimate_tokens(texts), on_batch=on_batch)
 
-    seen, chunks = set(), []
-    for c in all_chunks:
-        c['repo'] = REPO
-        try:
-            c['layer'] = detect_layer(c.get('file_path',''))
-        except Exception:
-            c['layer'] = 'server'
-        try:
-            c['origin'] = detect_origin(c.get('file_path',''))
-        except Exception:
-            c['origin'] = 'first_party'
-        h = hashlib.md5(c['code'].encode()).hexdigest()
-        if h in seen:
-            continue
-        seen.add(h)
-        c['hash'] = h
-        chunks.append(c)
-    print(f'Prepared {len(chunks)} chunks.')
-
-    ENRICH = (os.getenv('ENRICH_CODE_CHUNKS', 'false') or 'false').lower() == 'true'
-    enrich = None  # type: ignore[assignment]
-    if ENRICH:
+def _point_id(c: Dict) -> str:
+    # Keyed by content as well: an incremental run upserting a changed chunk adds
+    # a point rather than overwriting one an older generation still lists
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, f"{c['id']}:{c.get('hash') or ''}"))
+
+def _slim_payload(c: Dict) -> Dict:
+    slim_payload = {
+        'id': c.get('id'),
+        'file_path': c.get('file_path'),
+        'start_line': c.get('start_line'),
+        'end_line': c.get('end_line'),
+        'layer': c.get('layer'),
+        'repo': c.get('repo'),
+        'origin': c.get('origin'),
+        'hash': c.get('hash'),
+        'language': c.get('language')
+    }
+    return {k: v for k, v in slim_payload.items() if v is not None}
+
+class _QdrantStream:
+    """Uploads embedded batches while the remaining batches are still embedding.
+
+    The collection is created on the first batch (which fixes the vector size).
+    A Qdrant failure only stops the stream; finish() reports it, so embedding
+    and the embedding cache are unaffected. With DENSE_COARSE_DIM set and a
+    Matryoshka-trained model, points also carry the truncated coarse vector.
+    """
+
+    def __init__(self, url: str, collection: str, matryoshka: bool = True, queue_size: Optional[int] = None,
+                 existing: bool = False, coarse_dim: int = 0):
+        self.url = url
+        self.collection = collection
+        self.queue_size = queue_size
+        # existing=True adds points to a live collection (incremental runs) instead of creating one
+        self.existing = existing
+        self.settings = qdrant_config.index_settings()
+        if not matryoshka:
+            self.settings['coarse_dim'] = 0
+        self.coarse_dim = coarse_dim
+        self.q = None
+        self.up: Optional[QdrantUploader] = None
+        self.error: Optional[BaseException] = None
+
+    def add(self, chunks: List[Dict], vecs) -> None:
+        if self.error is not None or not chunks:
+            return
         try:
-            from common.metadata import enrich  # type: ignore
-        except Exception:
-            pass
-        if enrich is not None:
-            for c in chunks:
-                try:
-                    meta = enrich(c.get('file_path',''), c.get('language',''), c.get('code',''))
-                    c['summary'] = meta.get('summary','')
-                    c['keywords'] = meta.get('keywords', [])
-                except Exception:
-                    c['summary'] = ''
-                    c['keywords'] = []
-
-    corpus: List[str] = []
-    for c in chunks:
-        pre = []
-        if c.get('name'):
-            pre += [c['name']]*2
-        if c.get('imports'):
-            pre += [i[0] or i[1] for i in c['imports'] if isinstance(i, (list, tuple))]
-        body = c['code']
-        corpus.append((' '.join(pre)+'\n'+body).strip())
+            vecs = np.asarray(vecs, dtype=np.float32)
+            if self.up is None and self.existing:
+                if self.q is None:
+                    self.q = QdrantClient(url=self.url)
+                self.up = QdrantUploader(self.q, self.collection, queue_size=self.queue_size)
+            if self.up is None:
+                if self.q is None:
+                    self.q = QdrantClient(url=self.url)
+                # Quantization / on-disk / HNSW settings come from QDRANT_* env (common/qdrant_config.py)
+                qdrant_recreate_fallback.recreate_collection(
+                    self.q,
+                    collection_name=self.collection,
+                    vectors_config=qdrant_config.vectors_config(vecs.shape[1], self.settings),
+                    **qdrant_config.collection_kwargs(self.settings)
+                )
+                self.coarse_dim = qdrant_config.coarse_dim(vecs.shape[1], self.settings)
+                # Payload indexes before the bulk upload, so they are built incrementally
+                qdrant_config.create_payload_indexes(self.q, self.collection, self.settings['payload_indexes'])
+                self.up = QdrantUploader(self.q, self.collection, queue_size=self.queue_size)
+            for c, v in zip(chunks, vecs):
+                self.up.add(_point_id(c), qdrant_config.point_vectors(v.tolist(), self.coarse_dim), _slim_payload(c))
+        except Exception as e:
+            self.error = e
+
+    def discard(self) -> None:
+        """Drop what was streamed (a fallback model is re-embedding everything)."""
+        if self.up is not None:
+            self.up.abort()
+        self.up = None
+        self.error = None
+        # The fallback (bge-small) is not Matryoshka-trained: single-stage collection
+        self.settings['coarse_dim'] = 0
+
+    def finish(self):
+        """Drain the upload workers and verify the point count."""
+        if self.up is None and self.error is None:
+            self.error = RuntimeError('no embeddings were produced')
+        if self.error is not None:
+            if self.up is not None:
+                self.up.abort(self.error)
+            raise self.error
+        st = self.up.close()
+        if not self.existing:
+            self.up.verify()
+        return st
+
+
+def _memory_plan(dim: int) -> Tuple[int, int]:
+    """(chunks per embedding window, upload batches queued) under INDEX_MEMORY_MB.
+
+    Rough per-item costs: a chunk dict + text (~16 KB), its float32 vector and,
+    while it waits in the upload queue, the same vector as Python floats. The
+    per-corpus hash sets (~150 bytes a chunk) are not part of the budget.
+    """
+    try:
+        budget = max(64, int(os.getenv('INDEX_MEMORY_MB', '2048') or 2048)) * 2**20
+    except Exception:
+        budget = 2048 * 2**20
+    per_chunk = 16 * 1024 + dim * 4 + dim * 32
+    window = max(64, min(8192, int(budget * 0.5 / per_chunk)))
+    try:
+        upload_batch = max(1, int(os.getenv('QDRANT_UPLOAD_BATCH', '256') or 256))
+    except Exception:
+        upload_batch = 256
+    batches = max(1, min(64, int(budget * 0.3 / (upload_batch * (dim * 32 + 1024)))))
+    return window, batches
+
+
+def _embed_dim_hint(et: str) -> int:
+    try:
+        if et == 'voyage':
+            return int(os.getenv('VOYAGE_EMBED_DIM', '512'))
+        if et == 'mxbai':
+            return int(os.getenv('EMBEDDING_DIM', '512'))
+    except Exception:
+        pass
+    return 384 if et == 'local' else 3072
+
+
+def _embed_text(c: Dict) -> str:
+    if c.get('summary') or c.get('keywords'):
+        kw = ' '.join(c.get('keywords', []))
+        return f"{c.get('file_path','') }\n{c.get('summary','')}\n{kw}\n{c.get('code','')}"
+    return c['code']
+
+
+def _bm25_text(c: Dict) -> str:
+    pre = []
+    if c.get('name'):
+        pre += [c['name']]*2
+    if c.get('imports'):
+        pre += [i[0] or i[1] for i in c['imports'] if isinstance(i, (list, tuple))]
+    body = c['code']
+    return (' '.join(pre)+'\n'+body).strip()
+
+
+def _iter_jsonl(path: str):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _windows(items, size: int):
+    win = []
+    for it in items:
+        win.append(it)
+        if len(win) >= size:
+            yield win
+            win = []
+    if win:
+        yield win
+
+
+def _write_json_map(path: str, values) -> None:
+    """{"0": v0, "1": v1, ...} written incrementally (same JSON as json.dump of the dict)."""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('{')
+        for i, v in enumerate(values):
+            f.write((', ' if i else '') + json.dumps(str(i)) + ': ' + json.dumps(v))
+        f.write('}')
+
+
+def _chunk_ids(bm25_dir: str):
+    with open(os.path.join(bm25_dir, 'chunk_ids.txt'), 'r', encoding='utf-8') as f:
+        for line in f:
+            yield line.rstrip('\n')
+
+
+def _build_bm25(bm25_dir: str, corpus_spill: str, n_chunks: int) -> None:
+    """BM25 index (and bm25_map.json) from a jsonl spill of documents; the spill is removed."""
+    def _corpus():
+        with open(corpus_spill, 'r', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
 
     stemmer = Stemmer('english')
     tokenizer = Tokenizer(stemmer=stemmer, stopwords='en')
-    corpus_tokens = tokenizer.tokenize(corpus)
+    corpus_tokens = tokenizer.tokenize(_corpus(), length=n_chunks)
     retriever = bm25s.BM25(method='lucene', k1=1.2, b=0.65)
     retriever.index(corpus_tokens)
-    os.makedirs(os.path.join(OUTDIR, 'bm25_index'), exist_ok=True)
+    del corpus_tokens
     try:
         retriever.vocab_dict = {str(k): v for k, v in retriever.vocab_dict.items()}
     except Exception:
         pass
-    retriever.save(os.path.join(OUTDIR, 'bm25_index'), corpus=corpus)
-    tokenizer.save_vocab(save_dir=os.path.join(OUTDIR, 'bm25_index'))
-    tokenizer.save_stopwords(save_dir=os.path.join(OUTDIR, 'bm25_index'))
-    with open(os.path.join(OUTDIR, 'bm25_index', 'corpus.txt'), 'w', encoding='utf-8') as f:
-        for doc in corpus:
-            f.write(doc.replace('\n','\\n')+'\n')
-    chunk_ids = [str(c['id']) for c in chunks]
-    with open(os.path.join(OUTDIR, 'bm25_index', 'chunk_ids.txt'), 'w', encoding='utf-8') as f:
-        for cid in chunk_ids:
-            f.write(cid+'\n')
-    import json as _json
-    _json.dump({str(i): cid for i, cid in enumerate(chunk_ids)}, open(os.path.join(OUTDIR,'bm25_index','bm25_map.json'),'w'))
-    with open(os.path.join(OUTDIR,'chunks.jsonl'),'w',encoding='utf-8') as f:
-        for c in chunks:
-            f.write(json.dumps(c, ensure_ascii=False)+'\n')
-    print('BM25 index saved.')
+    retriever.save(bm25_dir, corpus=_corpus())
+    tokenizer.save_vocab(save_dir=bm25_dir)
+    tokenizer.save_stopwords(save_dir=bm25_dir)
+    del retriever
+    os.unlink(corpus_spill)
+    _write_json_map(os.path.join(bm25_dir, 'bm25_map.json'), _chunk_ids(bm25_dir))
 
+
+def _reachable_qdrant():
+    """Qdrant client if the server answers, else None."""
     try:
-        meta = {
-            'repo': REPO,
-            'timestamp': datetime.utcnow().isoformat() + 'Z',
-            'chunks_path': os.path.join(OUTDIR, 'chunks.jsonl'),
-            'bm25_index_dir': os.path.join(OUTDIR, 'bm25_index'),
-            'chunk_count': len(chunks),
-            'collection_name': COLLECTION,
-        }
-        with open(os.path.join(OUTDIR, 'last_index.json'), 'w', encoding='utf-8') as mf:
-            json.dump(meta, mf, indent=2)
+        q = QdrantClient(url=QDRANT_URL)
+        q.get_collections()
+        return q
+    except Exception:
+        return None
+
+
+def _publish_generation(gen: str, manifest: Dict, q=None) -> None:
+    """Make `gen` live and record it (and the indexed git commits) in last_index.json.
+
+    Without a client of its own (BM25-only or local-vector runs) Qdrant is still
+    contacted when reachable, so pruning drops old generations' collections too.
+    """
+    gen_dir = index_generations.generation_dir(OUTDIR, gen)
+    # Searches skip dense retrieval for "none" instead of querying the alias,
+    # which still points at an older generation's collection
+    manifest.setdefault('dense', 'qdrant' if manifest.get('collection') else 'none')
+    index_generations.publish(OUTDIR, gen, manifest, qdrant=q if q is not None else _reachable_qdrant())
+    print(f"Published generation {gen} (collection: {manifest.get('collection') or '-'}).")
+    try:
+        ts = datetime.utcnow().isoformat() + 'Z'
+        record_index_meta(
+            OUTDIR,
+            repo=REPO,
+            timestamp=ts,
+            bm25_updated=ts,
+            chunks_path=os.path.join(gen_dir, 'chunks.jsonl'),
+            bm25_index_dir=os.path.join(gen_dir, 'bm25_index'),
+            chunk_count=manifest.get('chunk_count'),
+            collection_name=COLLECTION,
+            generation=gen,
+            git=manifest.get('git'),
+            **({'dense_updated': ts, 'embedding_type': manifest.get('embedding_type'),
+                'embedding_dim': manifest.get('embedding_dim')} if manifest.get('embedding_dim') else {}),
+        )
     except Exception:
         pass
 
-    if (os.getenv('SKIP_DENSE','0') or '0').strip() == '1':
-        print('Skipping dense embeddings and Qdrant upsert (SKIP_DENSE=1).')
-        return
 
-    client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
-    texts = []
-    for c in chunks:
-        if c.get('summary') or c.get('keywords'):
-            kw = ' '.join(c.get('keywords', []))
-            texts.append(f"{c.get('file_path','') }\n{c.get('summary','')}\n{kw}\n{c.get('code','')}")
-        else:
-            texts.append(c['code'])
-    embs: List[List[float]] = []
-    et = (os.getenv('EMBEDDING_TYPE','openai') or 'openai').lower()
-    if et == 'voyage':
+class _Enricher:
+    """Optional per-chunk summary/keywords (ENRICH_CODE_CHUNKS=true), reusing batch_enrich results."""
+
+    def __init__(self, enrich=None, cache=None):
+        self.enrich = enrich
+        self.cache = cache
+
+    @classmethod
+    def from_env(cls) -> '_Enricher':
+        if (os.getenv('ENRICH_CODE_CHUNKS', 'false') or 'false').lower() != 'true':
+            return cls()
         try:
-            embs = embed_texts_voyage(texts, batch=64, output_dimension=int(os.getenv('VOYAGE_EMBED_DIM','512')))
-        except Exception as e:
-            print(f"Voyage embedding failed ({e}); falling back to local embeddings.")
-            embs = []
-        if not embs:
-            embs = embed_texts_local(texts)
-    elif et == 'mxbai':
+            from common.metadata import enrich  # type: ignore
+        except Exception:
+            return cls()
+        # Reuse results merged by `indexer.batch_enrich --kind metadata` (same model + prompt)
         try:
-            dim = int(os.getenv('EMBEDDING_DIM', '512'))
-            embs = embed_texts_mxbai(texts, dim=dim)
-        except Exception as e:
-            print(f"MXBAI embedding failed ({e}); falling back to local embeddings.")
-            embs = embed_texts_local(texts)
-    elif et == 'local':
-        embs = embed_texts_local(texts)
-    else:
-        if client is not None:
+            from common.card_cache import CardCache, enrich_model, prompt_version
+            from common.metadata import METADATA_PROMPT
+            meta_cache = CardCache(OUTDIR, enrich_model(), prompt_version(METADATA_PROMPT), filename='metadata_cache.jsonl')
+        except Exception:
+            meta_cache = None
+        return cls(enrich, meta_cache)
+
+    def __call__(self, c: Dict) -> None:
+        if self.enrich is None:
+            return
+        try:
+            meta = self.cache.get(c['hash']) if self.cache is not None else None
+            if meta is None:
+                meta = self.enrich(c.get('file_path',''), c.get('language',''), c.get('code',''))
+            c['summary'] = meta.get('summary','')
+            c['keywords'] = meta.get('keywords', [])
+        except Exception:
+            c['summary'] = ''
+            c['keywords'] = []
+
+    def report(self) -> None:
+        if self.cache is not None and self.cache.hits:
+            print(f'Metadata cache: {self.cache.hits} hits / {self.cache.misses} misses')
+
+
+class _GenerationWriter:
+    """Appends chunks to a generation's chunks.jsonl, BM25 corpus files and file_meta.jsonl."""
+
+    CORPUS_SPILL = 'corpus.spill.jsonl'
+
+    def __init__(self, gen_dir: str):
+        bm25_dir = os.path.join(gen_dir, 'bm25_index')
+        os.makedirs(bm25_dir, exist_ok=True)
+        self.chunks_path = os.path.join(gen_dir, 'chunks.jsonl')
+        self._chunks = open(self.chunks_path, 'w', encoding='utf-8')
+        self._spill = open(os.path.join(gen_dir, self.CORPUS_SPILL), 'w', encoding='utf-8')
+        self._corpus = open(os.path.join(bm25_dir, 'corpus.txt'), 'w', encoding='utf-8')
+        self._ids = open(os.path.join(bm25_dir, 'chunk_ids.txt'), 'w', encoding='utf-8')
+        self._meta = open(os.path.join(gen_dir, 'file_meta.jsonl'), 'w', encoding='utf-8')
+        self.n_chunks = self.n_files = 0
+
+    def write(self, c: Dict) -> None:
+        doc = _bm25_text(c)
+        self._chunks.write(json.dumps(c, ensure_ascii=False)+'\n')
+        self._spill.write(json.dumps(doc, ensure_ascii=False)+'\n')
+        self._corpus.write(doc.replace('\n','\\n')+'\n')
+        self._ids.write(str(c['id'])+'\n')
+        self.n_chunks += 1
+
+    def write_file(self, fmeta: FileMeta) -> None:
+        self._meta.write(fmeta.to_json()+'\n')
+        if fmeta.skipped is None:
+            self.n_files += 1
+
+    def close(self) -> None:
+        for f in (self._chunks, self._spill, self._corpus, self._ids, self._meta):
+            f.close()
+
+
+def _file_chunks(fp: str, lang: str, seen: set, enricher: _Enricher, writer: _GenerationWriter):
+    """Chunk one file, dedupe against `seen`, write and yield the new chunks."""
+    # One read per file; layer/origin/license are shared by all its chunks
+    src, fmeta = describe_file(fp, lang)
+    if src is not None:
+        file_fields = fmeta.chunk_fields()
+        for c in chunk_code(src, fp, lang, target=900):
+            h = hashlib.md5(c['code'].encode()).hexdigest()
+            if h in seen:
+                continue
+            seen.add(h)
+            c['repo'] = REPO
+            c.update(file_fields)
+            c['hash'] = h
+            enricher(c)
+            writer.write(c)
+            fmeta.chunk_ids.append(str(c['id']))
+            yield c
+    writer.write_file(fmeta)
+
+
+class _DenseStage:
+    """Embeds chunks window by window into a float32 spill file and the Qdrant stream.
+
+    Only one window of texts/vectors is held at a time; rows in the spill file
+    follow chunks.jsonl order, so the local vector index can memory-map it.
+    """
+
+    def __init__(self, et: str, client, spill_path: str, stream: Optional[_QdrantStream]):
+        self.et = et
+        self.client = client
+        self.spill_path = spill_path
+        self.stream = stream
+        self.cache = EmbeddingCache(OUTDIR) if et == 'openai' and client is not None else None
+        self.mode = et if (et != 'openai' or client is not None) else 'local'
+        self.rows = 0
+        self.dim = 0
+        self.error: Optional[BaseException] = None
+        self._spill = open(spill_path, 'wb')
+
+    def reset(self, mode: str) -> None:
+        """Start over with another model (fallback): empty the spill and the stream."""
+        if self.stream is not None:
+            self.stream.discard()
+        self._spill.close()
+        self._spill = open(self.spill_path, 'wb')
+        self.mode = mode
+        self.rows = self.dim = 0
+        self.error = None
+
+    def _embed(self, win: List[Dict]):
+        texts = [_embed_text(c) for c in win]
+        on_batch = (lambda idx, vecs: self.stream.add([win[i] for i in idx], vecs)) if self.stream is not None else None
+        if self.mode == 'voyage':
+            return embed_texts_voyage(texts, output_dimension=int(os.getenv('VOYAGE_EMBED_DIM','512')), on_batch=on_batch)
+        if self.mode == 'mxbai':
+            return embed_texts_mxbai(texts, dim=int(os.getenv('EMBEDDING_DIM', '512')), on_batch=on_batch)
+        if self.mode == 'openai':
+            return self.cache.embed_texts(self.client, texts, [c['hash'] for c in win],
+                                          model='text-embedding-3-large', on_batch=on_batch)
+        return embed_texts_local(texts, on_batch=on_batch)
+
+    def run(self, windows) -> None:
+        """Embed every window; on failure record the error and keep draining `windows`."""
+        for win in windows:
+            if self.error is not None:
+                continue  # drain so the producer never blocks
             try:
-                cache = EmbeddingCache(OUTDIR)
-                hashes = [c['hash'] for c in chunks]
-                embs = cache.embed_texts(client, texts, hashes, model='text-embedding-3-large', batch=64)
-                pruned = cache.prune(set(hashes))
+                arr = np.asarray(self._embed(win), dtype=np.float32)
+                if arr.ndim != 2 or len(arr) != len(win):
+                    raise ValueError(f'expected {len(win)} embeddings, got shape {arr.shape}')
+                self.dim = arr.shape[1]
+                self._spill.write(arr.tobytes())
+                self.rows += len(arr)
+            except Exception as e:
+                self.error = e
+
+    def finish(self, valid_hashes: Optional[set] = None):
+        """Close the spill; memory-map it as (rows, dim). valid_hashes prunes the embedding cache."""
+        self._spill.close()
+        if self.cache is not None and self.mode == 'openai':
+            if valid_hashes is not None:
+                pruned = self.cache.prune(valid_hashes)
                 if pruned > 0:
                     print(f'Pruned {pruned} orphaned embeddings from cache.')
-                cache.save()
-            except Exception as e:
-                print(f'Embedding via OpenAI failed ({e}); falling back to local embeddings.')
-        if not embs:
-            embs = embed_texts_local(texts)
-    point_ids: List[str] = []
+            self.cache.save()
+        if not self.rows:
+            return None
+        return np.memmap(self.spill_path, dtype=np.float32, mode='r', shape=(self.rows, self.dim))
+
+
+_LOCKS_HELD = threading.local()
+
+
+@contextlib.contextmanager
+def _index_lock(outdir: str):
+    """One index run per repo at a time (hooks may fire while a run is in progress).
+
+    Re-entrant per thread, so an incremental run falling back to main() keeps its lock.
+    """
+    held = getattr(_LOCKS_HELD, 'dirs', None)
+    if held is None:
+        held = _LOCKS_HELD.dirs = set()
+    key = os.path.abspath(outdir)
+    if key in held:
+        yield
+        return
     try:
-        q = QdrantClient(url=QDRANT_URL)
-        qdrant_recreate_fallback.recreate_collection(
-            q,
-            collection_name=COLLECTION,
-            vectors_config={'dense': models.VectorParams(size=len(embs[0]), distance=models.Distance.COSINE)}
-        )
-        points = []
-        for c, v in zip(chunks, embs):
-            cid = str(c['id'])
-            pid = str(uuid.uuid5(uuid.NAMESPACE_DNS, cid))
-            slim_payload = {
-                'id': c.get('id'),
-                'file_path': c.get('file_path'),
-                'start_line': c.get('start_line'),
-                'end_line': c.get('end_line'),
-                'layer': c.get('layer'),
-                'repo': c.get('repo'),
-                'origin': c.get('origin'),
-                'hash': c.get('hash'),
-                'language': c.get('language')
-            }
-            slim_payload = {k: v for k, v in slim_payload.items() if v is not None}
-            points.append(models.PointStruct(id=pid, vector={'dense': v}, payload=slim_payload))
-            point_ids.append(pid)
-            if len(points) == 64:
-                q.upsert(COLLECTION, points=points)
-                points = []
-        if points:
-            q.upsert(COLLECTION, points=points)
-        import json as _json
-        _json.dump({str(i): pid for i, pid in enumerate(point_ids)}, open(os.path.join(OUTDIR,'bm25_index','bm25_point_ids.json'),'w'))
-        print(f'Indexed {len(chunks)} chunks to Qdrant (embeddings: {len(embs[0])} dims).')
+        import fcntl
+    except ImportError:  # non-POSIX: no locking
+        yield
+        return
+    os.makedirs(outdir, exist_ok=True)
+    with open(os.path.join(outdir, '.index.lock'), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        held.add(key)
         try:
-            meta = {
-                'repo': REPO,
-                'timestamp': datetime.utcnow().isoformat() + 'Z',
-                'chunks_path': os.path.join(OUTDIR, 'chunks.jsonl'),
-                'bm25_index_dir': os.path.join(OUTDIR, 'bm25_index'),
-                'chunk_count': len(chunks),
-                'collection_name': COLLECTION,
-                'embedding_type': (os.getenv('EMBEDDING_TYPE','openai') or 'openai').lower(),
-                'embedding_dim': len(embs[0]) if embs and embs[0] else None,
-            }
-            with open(os.path.join(OUTDIR, 'last_index.json'), 'w', encoding='utf-8') as mf:
-                json.dump(meta, mf, indent=2)
-        except Exception:
-            pass
+            yield
+        finally:
+            held.discard(key)
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def main() -> None:
+    """Streaming pipeline: discover -> chunk -> dedupe -> write -> embed -> upsert.
+
+    Chunks are written to chunks.jsonl (and the BM25 corpus spill) as they are
+    produced and handed over a bounded queue to the embedding stage, which runs
+    concurrently and streams vectors to Qdrant. No chunk text or vector is kept
+    for the whole corpus: what stays resident per chunk is its hash (the dedupe
+    set and the embedding cache's hash -> row index, whose vectors are read from
+    a memory map), and the BM25 build at the end reads the spill file.
+    INDEX_MEMORY_MB (default 2048) bounds the chunks and vectors in flight.
+    Runs for one repo (full or incremental) are serialized by .index.lock.
+    """
+    with _index_lock(OUTDIR):
+        _index()
+
+
+def _index() -> None:
+    # Commits (and dirty paths) being indexed; the next incremental run diffs from here
+    git = git_state.snapshot(BASES)
+    files = collect_files(BASES)
+    print(f'Discovered {len(files)} source files.')
+
+    # Everything a search reads goes into a new generation; it only becomes
+    # visible when publish() flips CURRENT (and the Qdrant alias) at the end.
+    GEN = index_generations.new_generation(OUTDIR)
+    GEN_DIR = index_generations.generation_dir(OUTDIR, GEN)
+    BM25_DIR = os.path.join(GEN_DIR, 'bm25_index')
+    os.makedirs(BM25_DIR, exist_ok=True)
+    corpus_spill = os.path.join(GEN_DIR, _GenerationWriter.CORPUS_SPILL)
+    manifest = {'repo': REPO, 'chunk_count': 0, 'alias': COLLECTION, 'collection': None, 'git': git}
+
+    enricher = _Enricher.from_env()
+
+    # ---- dense stage (consumer thread) ----
+    skip_dense = (os.getenv('SKIP_DENSE','0') or '0').strip() == '1'
+    et = (os.getenv('EMBEDDING_TYPE','openai') or 'openai').lower()
+    window, upload_batches = _memory_plan(_embed_dim_hint(et))
+    # Versioned collection; the COLLECTION alias moves to it on publish
+    GEN_COLLECTION = index_generations.collection_name(COLLECTION, GEN)
+    dense = stream = None
+    chunk_q: 'queue.Queue' = queue.Queue(maxsize=window)
+    dense_thread = None
+    if not skip_dense:
+        client = openai_client(OPENAI_API_KEY) if OPENAI_API_KEY else None
+        # Batches go to Qdrant as soon as they are embedded (not in local-vector mode)
+        stream = None if local_vectors.enabled() else _QdrantStream(
+            QDRANT_URL, GEN_COLLECTION, matryoshka=et in qdrant_config.MATRYOSHKA_EMBEDDINGS,
+            queue_size=upload_batches)
+        dense = _DenseStage(et, client, os.path.join(GEN_DIR, 'embeddings.f32'), stream)
+
+        def _from_queue():
+            while True:
+                c = chunk_q.get()
+                if c is None:
+                    return
+                yield c
+
+        dense_thread = threading.Thread(target=lambda: dense.run(_windows(_from_queue(), window)),
+                                        name='index-embed', daemon=True)
+        dense_thread.start()
+
+    # ---- discover -> chunk -> dedupe -> write (producer) ----
+    seen = set()
+    writer = _GenerationWriter(GEN_DIR)
+    try:
+        for fp in files:
+            if not _path_allowed(fp):
+                continue
+            lang = lang_from_path(fp)
+            if not lang:
+                continue
+            for c in _file_chunks(fp, lang, seen, enricher, writer):
+                if dense_thread is not None:
+                    chunk_q.put(c)  # blocks while the embedding stage is a window behind
+    finally:
+        writer.close()
+        if dense_thread is not None:
+            chunk_q.put(None)
+    n_chunks, n_files = writer.n_chunks, writer.n_files
+    print(f'Prepared {n_chunks} chunks from {n_files} files.')
+    enricher.report()
+    manifest['chunk_count'] = n_chunks
+    manifest['file_count'] = n_files
+
+    # ---- BM25 from the spill file (overlaps with the tail of the dense stage) ----
+    _build_bm25(BM25_DIR, corpus_spill, n_chunks)
+    print(f'BM25 index saved (generation {GEN}).')
+
+    if dense is None:
+        print('Skipping dense embeddings and Qdrant upsert (SKIP_DENSE=1).')
+        _publish_generation(GEN, manifest)
+        return
+
+    dense_thread.join()
+    if dense.error is not None and dense.mode != 'local':
+        names = {'voyage': 'Voyage', 'mxbai': 'MXBAI', 'openai': 'OpenAI'}
+        print(f"Embedding via {names.get(dense.mode, dense.mode)} failed ({dense.error}); falling back to local embeddings.")
+        dense.reset('local')
+        dense.run(_windows(_iter_jsonl(writer.chunks_path), window))
+    if dense.error is not None:
+        raise dense.error
+    embs = dense.finish(seen)
+    if embs is not None:
+        manifest.update({'embedding_type': et, 'embedding_dim': int(embs.shape[1])})
+    if stream is None:
+        # Single-node mode: memory-mapped index next to the BM25 index, no Qdrant
+        if embs is not None:
+            manifest['dense'] = 'local'
+            vdir = os.path.join(GEN_DIR, local_vectors.VECTORS_DIRNAME)
+            info = local_vectors.build(vdir, list(_chunk_ids(BM25_DIR)), embs, meta={'repo': REPO, 'embedding_type': et})
+            print(f"Wrote local vector index ({info['kind']}, {info['count']} x {info['dim']}) to {vdir}.")
+        del embs
+        os.unlink(dense.spill_path)
+        _publish_generation(GEN, manifest)
+        return
+    del embs
+    os.unlink(dense.spill_path)
+
+    q = None
+    try:
+        # Most points are already uploaded; drain the queue and confirm the count
+        # before the alias may point at this collection.
+        st = stream.finish()
+        q = stream.q
+        print(f'Uploaded {st.points} points in {st.batches} batches ({st.seconds:.1f}s, '
+              f'{st.points_per_second:.0f} pts/s, {stream.up.workers} workers, {st.retries} retries).')
+        _write_json_map(os.path.join(BM25_DIR, 'bm25_point_ids.json'),
+                        (_point_id(c) for c in _iter_jsonl(writer.chunks_path)))
+        print(f'Indexed {n_chunks} chunks to Qdrant collection {GEN_COLLECTION} (embeddings: {manifest.get("embedding_dim")} dims).')
+        manifest['collection'] = GEN_COLLECTION
+        manifest['qdrant'] = qdrant_config.describe(stream.settings)
+        manifest['coarse_dim'] = stream.coarse_dim
     except Exception as e:
         print(f"Qdrant unavailable or failed to index ({e}); continuing with BM25-only index. Dense retrieval will be disabled.")
+        manifest.pop('embedding_dim', None)
+        q = stream.q
+        if q is not None:
+            try:
+                q.delete_collection(GEN_COLLECTION)
+            except Exception:
+                pass
+    try:
+        _publish_generation(GEN, manifest, q if manifest.get('collection') else None)
+    except Exception as e:
+        # Alias flip failed: leave the previous generation live
+        print(f"Failed to publish generation {GEN} ({e}); previous generation stays live.")
 
 if __name__ == '__main__':
     main()
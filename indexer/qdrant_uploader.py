@@ -0,0 +1,206 @@
+"""Pipelined Qdrant upserts for the indexer.
+
+The producer (index_repo) adds points as embeddings become available; they are
+cut into batches and handed to a bounded queue drained by several upload
+threads. Each upload is sent with wait=False, so a worker only pays for the
+request round trip, not for Qdrant applying the batch, and the producer only
+blocks when every worker is busy and the queue is full (back-pressure keeps
+memory bounded). close() drains the pipeline and verify() waits until the
+collection reports the expected number of points before anything is published.
+
+Env:
+  QDRANT_UPLOAD_BATCH           points per upsert request        (default 256)
+  QDRANT_UPLOAD_WORKERS         concurrent upload threads        (default 4)
+  QDRANT_UPLOAD_QUEUE           batches buffered ahead of workers (default 2*workers)
+  QDRANT_UPLOAD_RETRIES         attempts per batch               (default 3)
+  QDRANT_UPLOAD_VERIFY_TIMEOUT  seconds to wait for the final count (default 120)
+"""
+
+from __future__ import annotations
+
+import os
+import time
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from qdrant_client import models
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.getenv(name, str(default)) or default))
+    except Exception:
+        return default
+
+
+@dataclass
+class UploadStats:
+    points: int = 0
+    batches: int = 0
+    retries: int = 0
+    seconds: float = 0.0
+
+    @property
+    def points_per_second(self) -> float:
+        return self.points / self.seconds if self.seconds > 0 else 0.0
+
+
+_STOP = object()
+
+
+class QdrantUploader:
+    """Bounded producer/consumer uploader; use as a context manager or call close()."""
+
+    def __init__(self, client, collection: str, vector_name: str = "dense",
+                 batch_size: Optional[int] = None, workers: Optional[int] = None,
+                 queue_size: Optional[int] = None, retries: Optional[int] = None):
+        self.client = client
+        self.collection = collection
+        self.vector_name = vector_name
+        self.batch_size = batch_size or _env_int("QDRANT_UPLOAD_BATCH", 256)
+        self.workers = workers or _env_int("QDRANT_UPLOAD_WORKERS", 4)
+        if type(getattr(client, "_client", None)).__name__ == "QdrantLocal":
+            self.workers = 1  # the in-process client (":memory:"/path) is not thread-safe
+        self.retries = retries or _env_int("QDRANT_UPLOAD_RETRIES", 3)
+        self._q: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size or _env_int("QDRANT_UPLOAD_QUEUE", 2 * self.workers))
+        self._pending: List[models.PointStruct] = []
+        self._ids: set = set()
+        self._lock = threading.Lock()
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        self.stats = UploadStats()
+        self._t0 = time.perf_counter()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"qdrant-upload-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    # ---- producer side ----
+    def add(self, point_id: str, vector: Sequence[float], payload: Optional[Dict[str, Any]] = None) -> None:
+        self._raise_if_failed()
+        if self._closed:
+            raise RuntimeError("uploader is closed")
+        vec = vector if isinstance(vector, dict) else {self.vector_name: list(vector)}
+        self._pending.append(models.PointStruct(id=point_id, vector=vec, payload=payload or {}))
+        self._ids.add(point_id)
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+
+    def add_many(self, points: Iterable[Tuple[str, Sequence[float], Optional[Dict[str, Any]]]]) -> None:
+        for pid, vec, payload in points:
+            self.add(pid, vec, payload)
+
+    @property
+    def expected(self) -> int:
+        """Distinct point ids added so far (re-added ids overwrite, so this is the final count)."""
+        return len(self._ids)
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        # Blocks while all workers are busy and the queue is full; re-check for a
+        # dead pipeline periodically so a failed upload cannot hang the producer.
+        while True:
+            self._raise_if_failed()
+            try:
+                self._q.put(batch, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def _raise_if_failed(self) -> None:
+        if self._error is not None:
+            raise RuntimeError(f"Qdrant upload to {self.collection} failed: {self._error}") from self._error
+
+    # ---- consumer side ----
+    def _upsert(self, batch: List[models.PointStruct]) -> None:
+        delay = 0.5
+        for attempt in range(1, self.retries + 1):
+            try:
+                self.client.upsert(self.collection, points=batch, wait=False)
+                return
+            except Exception:
+                if attempt >= self.retries:
+                    raise
+                with self._lock:
+                    self.stats.retries += 1
+                time.sleep(delay)
+                delay *= 2
+
+    def _worker(self) -> None:
+        while True:
+            item = self._q.get()
+            try:
+                if item is _STOP:
+                    return
+                if self._error is not None:
+                    continue  # drain so the producer never blocks on a dead pipeline
+                self._upsert(item)
+                with self._lock:
+                    self.stats.points += len(item)
+                    self.stats.batches += 1
+            except Exception as e:
+                with self._lock:
+                    if self._error is None:
+                        self._error = e
+            finally:
+                self._q.task_done()
+
+    # ---- completion ----
+    def close(self) -> UploadStats:
+        """Send the last partial batch, wait for every worker, raise if any batch failed."""
+        if not self._closed:
+            try:
+                if self._error is None:
+                    self._flush()
+            finally:
+                self._closed = True
+                for _ in self._threads:
+                    self._q.put(_STOP)
+                for t in self._threads:
+                    t.join()
+                self.stats.seconds = time.perf_counter() - self._t0
+        self._raise_if_failed()
+        return self.stats
+
+    def verify(self, expected: Optional[int] = None, timeout: Optional[float] = None) -> int:
+        """Wait until the collection holds `expected` points (wait=False upserts apply asynchronously)."""
+        expected = self.expected if expected is None else expected
+        if timeout is None:
+            try:
+                timeout = float(os.getenv("QDRANT_UPLOAD_VERIFY_TIMEOUT", "120") or 120)
+            except Exception:
+                timeout = 120.0
+        deadline = time.monotonic() + timeout
+        delay = 0.1
+        while True:
+            n = int(self.client.count(self.collection, exact=True).count)
+            if n == expected:
+                return n
+            if n > expected or time.monotonic() >= deadline:
+                raise RuntimeError(f"Qdrant collection {self.collection} has {n} points, expected {expected}")
+            time.sleep(delay)
+            delay = min(delay * 2, 2.0)
+
+    def abort(self, reason: Optional[BaseException] = None) -> None:
+        """Stop the workers and drop whatever is still queued (no error raised)."""
+        self._error = self._error or reason or RuntimeError("upload aborted")
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __enter__(self) -> "QdrantUploader":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+            return
+        # Producer failed: stop the workers without masking the original error
+        self.abort(exc)
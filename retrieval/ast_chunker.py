@@ -108,33 +108,9 @@ def greedy_fallback(src:str, fpath:str, lang:str, target:int)->List[Dict]:
         } for i,s in enumerate(rejoined)]
 
 def collect_files(roots:List[str])->List[str]:
-    import fnmatch
-    out=[]
-    skip_dirs = {".git","node_modules",".venv","venv","dist","build","__pycache__",".next",".turbo",".parcel-cache",".pytest_cache","vendor","third_party",".bundle","Pods"}
-    exclude_patterns = []
-    for root in roots:
-        parent_dir = os.path.dirname(root) if os.path.isfile(root) else root
-        exclude_file = os.path.join(parent_dir, 'data', 'exclude_globs.txt')
-        if os.path.exists(exclude_file):
-            try:
-                with open(exclude_file, 'r') as f:
-                    patterns = [line.strip() for line in f if line.strip() and not line.startswith('#')]
-                    exclude_patterns.extend(patterns)
-            except Exception:
-                pass
-    for root in roots:
-        for dp, dns, fns in os.walk(root):
-            dns[:] = [d for d in dns if d not in skip_dirs and not d.startswith('.venv') and not d.startswith('venv')]
-            for fn in fns:
-                p = os.path.join(dp, fn)
-                skip = False
-                for pattern in exclude_patterns:
-                    if fnmatch.fnmatch(p, pattern) or fnmatch.fnmatch(os.path.relpath(p, root), pattern):
-                        skip = True
-                        break
-                if not skip and lang_from_path(p):
-                    out.append(p)
-    return out
+    # Compiled excludes, pruned os.scandir walk, .gitignore (see indexer/discovery.py)
+    from indexer.discovery import discover
+    return discover(roots)
 
 def _guess_name(lang:str, text:str)->Optional[str]:
     if lang=="python":
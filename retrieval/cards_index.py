@@ -0,0 +1,245 @@
+"""Generational BM25 index over semantic cards.
+
+Layout under out/<repo>/bm25_cards/:
+  CURRENT              name of the live generation (swapped atomically)
+  gen-<utc-ts>-<rand>/    bm25s index + chunk_ids.json (doc index -> chunk id) + docs.txt
+                          + cards.jsonl (snapshot of the cards the index was built from)
+
+Writers build a complete new generation next to the live one and flip CURRENT
+with os.replace(), so running searches keep using the generation they loaded
+and pick up the new one on their next lookup. Each generation reads its own
+cards.jsonl snapshot, so its index and card rows always match even while
+out/<repo>/cards.jsonl is being rewritten. Older layouts (bm25s files directly in
+bm25_cards/, or generations without a snapshot) read out/<repo>/cards.jsonl.
+
+bm25s has no in-place append, so apply_changes() re-indexes the merged card
+texts; that is cheap next to regenerating cards, which only happens for the
+changed chunks.
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import time
+import shutil
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from common.config_loader import out_dir
+from common.index_generations import generation_name
+
+CARDS_DIRNAME = "bm25_cards"
+KEEP_GENERATIONS = int(os.getenv("CARDS_KEEP_GENERATIONS", "2") or "2")
+
+_lock = threading.Lock()
+_loaded: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+
+
+def card_text(card: Dict[str, Any], fp: str) -> str:
+    """Rich single-line text representation of a card for BM25 indexing."""
+    text_parts = [
+        ' '.join(card.get('symbols', [])),
+        card.get('purpose', ''),
+        card.get('technical_details', ''),
+        ' '.join(card.get('domain_concepts', [])),
+        ' '.join(card.get('routes', [])),
+        ' '.join(card.get('dependencies', [])),
+        ' '.join(card.get('patterns', [])),
+        fp
+    ]
+    return ' '.join(filter(None, text_parts)).replace('\n', ' ')
+
+
+def _cards_dir(base: str) -> str:
+    return os.path.join(base, CARDS_DIRNAME)
+
+
+def current_generation(base: str) -> Optional[str]:
+    """Name of the live generation, '' for a legacy flat index, None if there is no index."""
+    d = _cards_dir(base)
+    try:
+        with open(os.path.join(d, "CURRENT"), "r", encoding="utf-8") as f:
+            gen = f.read().strip()
+        if gen and os.path.isdir(os.path.join(d, gen)):
+            return gen
+    except FileNotFoundError:
+        pass
+    except Exception:
+        return None
+    if os.path.exists(os.path.join(d, "params.index.json")):
+        return ""
+    return None
+
+
+def _read_cards(base: str) -> List[Dict[str, Any]]:
+    cards: List[Dict[str, Any]] = []
+    p = os.path.join(base, "cards.jsonl")
+    if os.path.exists(p):
+        with open(p, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    cards.append(json.loads(line))
+                except Exception:
+                    continue
+    return cards
+
+
+def _build_bm25(docs: List[str], dest: str) -> None:
+    import bm25s  # type: ignore
+    from bm25s.tokenization import Tokenizer  # type: ignore
+    from Stemmer import Stemmer  # type: ignore
+    tok = Tokenizer(stemmer=Stemmer("english"), stopwords="en")
+    tokens = tok.tokenize(docs)
+    retriever = bm25s.BM25(method="lucene", k1=1.2, b=0.65)
+    retriever.index(tokens)
+    try:
+        retriever.vocab_dict = {str(k): v for k, v in retriever.vocab_dict.items()}
+    except Exception:
+        pass
+    retriever.save(dest, corpus=docs)
+    tok.save_vocab(save_dir=dest)
+    tok.save_stopwords(save_dir=dest)
+
+
+def publish(base: str, docs: List[str], chunk_ids: List[str], keep: Optional[int] = None,
+            cards: Optional[List[Dict[str, Any]]] = None) -> str:
+    """Build a new generation from aligned (docs, chunk_ids) and make it live.
+
+    `cards` are snapshotted into the generation (default: a copy of <base>/cards.jsonl).
+    """
+    if len(docs) != len(chunk_ids):
+        raise ValueError("docs and chunk_ids must be aligned")
+    d = _cards_dir(base)
+    os.makedirs(d, exist_ok=True)
+    gen = generation_name()
+    gdir = os.path.join(d, gen)
+    tmp_dir = gdir + ".building"
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        _build_bm25(docs, tmp_dir)
+        with open(os.path.join(tmp_dir, "chunk_ids.json"), "w", encoding="utf-8") as f:
+            json.dump(chunk_ids, f)
+        with open(os.path.join(tmp_dir, "docs.txt"), "w", encoding="utf-8") as f:
+            for doc in docs:
+                f.write(doc + "\n")
+        snap = os.path.join(tmp_dir, "cards.jsonl")
+        if cards is not None:
+            with open(snap, "w", encoding="utf-8") as f:
+                for c in cards:
+                    f.write(json.dumps(c, ensure_ascii=False) + "\n")
+        elif os.path.exists(os.path.join(base, "cards.jsonl")):
+            shutil.copyfile(os.path.join(base, "cards.jsonl"), snap)
+        os.replace(tmp_dir, gdir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    cur_tmp = os.path.join(d, "CURRENT.tmp")
+    with open(cur_tmp, "w", encoding="utf-8") as f:
+        f.write(gen)
+    os.replace(cur_tmp, os.path.join(d, "CURRENT"))
+    _prune(d, gen, KEEP_GENERATIONS if keep is None else keep)
+    try:
+        from common.index_meta import record_index_meta
+        record_index_meta(base, cards_updated=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), cards_generation=gen, card_count=len(docs))
+    except Exception:
+        pass
+    return gen
+
+
+def _prune(d: str, live: str, keep: int) -> None:
+    gens = sorted(n for n in os.listdir(d) if n.startswith("gen-") and not n.endswith(".building"))
+    old = [g for g in gens if g != live][: max(0, len(gens) - max(1, keep))]
+    for g in old:
+        shutil.rmtree(os.path.join(d, g), ignore_errors=True)
+
+
+def rebuild(base: str) -> int:
+    """Publish a generation from cards.txt / cards.jsonl (full rebuild); returns doc count."""
+    cards = _read_cards(base)
+    with open(os.path.join(base, "cards.txt"), "r", encoding="utf-8") as f:
+        lines = [ln.strip() for ln in f]
+    docs: List[str] = []
+    ids: List[str] = []
+    for card, doc in zip(cards, lines):
+        cid = str(card.get("id") or "")
+        if cid and doc:
+            docs.append(doc)
+            ids.append(cid)
+    publish(base, docs, ids, cards=cards)
+    return len(docs)
+
+
+def apply_changes(base: str, upserts: Iterable[Dict[str, Any]] = (), removes: Iterable[str] = ()) -> Dict[str, Any]:
+    """Add/replace cards (matched by chunk id) and drop removed chunk ids.
+
+    Rewrites cards.jsonl / cards.txt atomically and publishes a new generation.
+    """
+    new_cards = {str(c.get("id")): c for c in upserts if c.get("id")}
+    drop = {str(x) for x in removes}
+    merged: List[Dict[str, Any]] = []
+    replaced = 0
+    for card in _read_cards(base):
+        cid = str(card.get("id") or "")
+        if cid in drop:
+            continue
+        if cid in new_cards:
+            card = new_cards.pop(cid)
+            replaced += 1
+        merged.append(card)
+    added = len(new_cards)
+    merged.extend(new_cards.values())
+
+    docs = [card_text(c, c.get("file_path", "")) for c in merged]
+    cards_path = os.path.join(base, "cards.jsonl")
+    txt_path = os.path.join(base, "cards.txt")
+    with open(cards_path + ".tmp", "w", encoding="utf-8") as out_json, open(txt_path + ".tmp", "w", encoding="utf-8") as out_txt:
+        for c, doc in zip(merged, docs):
+            out_json.write(json.dumps(c, ensure_ascii=False) + "\n")
+            out_txt.write(doc + "\n")
+    os.replace(cards_path + ".tmp", cards_path)
+    os.replace(txt_path + ".tmp", txt_path)
+    gen = publish(base, docs, [str(c.get("id")) for c in merged], cards=merged)
+    return {"generation": gen, "cards": len(merged), "added": added, "replaced": replaced, "removed": len(drop)}
+
+
+def _load_generation(base: str, gen: str) -> Optional[Dict[str, Any]]:
+    import bm25s  # type: ignore
+    d = _cards_dir(base)
+    gdir = os.path.join(d, gen) if gen else d
+    retr = bm25s.BM25.load(gdir)
+    cards = _read_cards(gdir if os.path.exists(os.path.join(gdir, "cards.jsonl")) else base)
+    by_chunk_id = {str(c.get("id")): c for c in cards if c.get("id")}
+    ids_path = os.path.join(gdir, "chunk_ids.json")
+    if os.path.exists(ids_path):
+        with open(ids_path, "r", encoding="utf-8") as f:
+            ids = [str(x) for x in json.load(f)]
+    else:
+        ids = [str(c.get("id") or "") for c in cards]
+    return {
+        "generation": gen,
+        "retriever": retr,
+        "by_idx": {i: cid for i, cid in enumerate(ids) if cid},
+        "by_chunk_id": by_chunk_id,
+    }
+
+
+def load(repo: str) -> Optional[Dict[str, Any]]:
+    """Live cards index for a repo, cached until CURRENT points at a new generation."""
+    base = out_dir(repo)
+    gen = current_generation(base)
+    if gen is None:
+        return None
+    hit = _loaded.get(base)
+    if hit is not None and hit[0] == gen:
+        return hit[1]
+    with _lock:
+        hit = _loaded.get(base)
+        if hit is not None and hit[0] == gen:
+            return hit[1]
+        try:
+            idx = _load_generation(base, gen)
+        except Exception:
+            return None
+        _loaded[base] = (gen, idx)
+        return idx
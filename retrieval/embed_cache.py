@@ -1,41 +1,185 @@
-import os, json
-import tiktoken
+import os, json, glob, threading, uuid
+
+import numpy as np
+
+INDEX_NAME = "embed_cache.idx"
+LEGACY_NAME = "embed_cache.jsonl"
+
 
 class EmbeddingCache:
+    """hash -> float32 embedding, persisted as embed_cache.idx + embed_cache.<id>.f32.
+
+    The .f32 file holds raw float32 rows; embed_cache.idx is a JSON header
+    ({"dim", "vectors"}) followed by one hash per row. Only the hash -> row
+    index is kept in memory (~150 bytes per entry, loaded on first use); get()
+    reads its row through a memory map, so the cache never holds the corpus's
+    vectors. A legacy embed_cache.jsonl is converted on first use.
+    """
+
     def __init__(self, outdir: str):
         os.makedirs(outdir, exist_ok=True)
-        self.path = os.path.join(outdir, "embed_cache.jsonl")
-        self.cache = {}
+        self.outdir = outdir
+        self.path = os.path.join(outdir, INDEX_NAME)
+        self._legacy = os.path.join(outdir, LEGACY_NAME)
+        self._lock = threading.RLock()
+        self._rows = None  # hash -> row; None until loaded
+        self._n = 0        # rows on disk (a re-put hash leaves its old row behind)
+        self.dim = 0
+        self._vec_path = None
+        self._mm = None
+
+    def _load(self):
+        if self._rows is not None:
+            return
+        self._rows, self._n, self.dim, self._vec_path = {}, 0, 0, None
         if os.path.exists(self.path):
-            with open(self.path, "r", encoding="utf-8") as f:
+            try:
+                self._read_index()
+            except Exception:
+                self._rows, self._n, self.dim, self._vec_path = {}, 0, 0, None
+        # Vector files left behind by an interrupted rewrite
+        for p in glob.glob(os.path.join(self.outdir, "embed_cache.*.f32")):
+            if p != self._vec_path:
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+        if os.path.exists(self._legacy):
+            self._migrate()
+
+    def _read_index(self):
+        with open(self.path, "rb") as f:
+            head = f.readline()
+            meta = json.loads(head)
+            dim = int(meta["dim"])
+            vec = os.path.join(self.outdir, os.path.basename(meta["vectors"]))
+            stored = os.path.getsize(vec) // (4 * dim)
+            rows, n, end = {}, 0, len(head)
+            while n < stored:
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    break
+                rows[line[:-1].decode("utf-8")] = n
+                n += 1
+                end += len(line)
+        # Drop a torn tail (vectors are written before their hashes)
+        if os.path.getsize(self.path) > end:
+            os.truncate(self.path, end)
+        if os.path.getsize(vec) > n * dim * 4:
+            os.truncate(vec, n * dim * 4)
+        self._rows, self._n, self.dim, self._vec_path = rows, n, dim, vec
+
+    def _migrate(self):
+        try:
+            batch = []
+            with open(self._legacy, "r", encoding="utf-8") as f:
                 for line in f:
                     try:
                         o = json.loads(line)
-                        self.cache[o["hash"]] = o["vec"]
+                        batch.append((o["hash"], o["vec"]))
                     except Exception:
-                        pass
+                        continue
+                    if len(batch) >= 256:
+                        self.append(batch)
+                        batch = []
+            if batch:
+                self.append(batch)
+            os.remove(self._legacy)
+        except Exception:
+            pass
+
+    def _memmap(self):
+        if self._mm is None or len(self._mm) < self._n:
+            self._mm = np.memmap(self._vec_path, dtype=np.float32, mode="r", shape=(self._n, self.dim))
+        return self._mm
+
+    def _rewrite(self, dim: int, keep) -> None:
+        """Write `keep` (hashes, in row order) to a fresh vectors file and switch the index to it."""
+        name = f"embed_cache.{uuid.uuid4().hex[:12]}.f32"
+        vec = os.path.join(self.outdir, name)
+        with open(vec, "wb") as out:
+            for i in range(0, len(keep), 1024):
+                part = keep[i:i + 1024]
+                out.write(np.ascontiguousarray(self._memmap()[[self._rows[h] for h in part]]).tobytes())
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"dim": dim, "vectors": name}) + "\n")
+            f.writelines(h + "\n" for h in keep)
+        os.replace(tmp, self.path)
+        old = self._vec_path
+        self._mm = None
+        self._rows = {h: i for i, h in enumerate(keep)}
+        self._n, self.dim, self._vec_path = len(keep), dim, vec
+        if old and old != vec:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+    def _ordered(self):
+        return sorted(self._rows, key=self._rows.get)
 
     def get(self, h: str):
-        return self.cache.get(h)
+        with self._lock:
+            self._load()
+            row = self._rows.get(h)
+            if row is None:
+                return None
+            return np.array(self._memmap()[row])
 
     def put(self, h: str, v):
-        self.cache[h] = v
+        self.append([(h, v)])
 
     def save(self):
-        with open(self.path, "w", encoding="utf-8") as f:
-            for h, v in self.cache.items():
-                f.write(json.dumps({"hash": h, "vec": v}) + "\n")
+        """Compact rows superseded by a later put of the same hash (rows are written as they arrive)."""
+        with self._lock:
+            self._load()
+            if self._n > len(self._rows):
+                self._rewrite(self.dim, self._ordered())
 
     def prune(self, valid_hashes: set):
-        before = len(self.cache)
-        self.cache = {h: v for h, v in self.cache.items() if h in valid_hashes}
-        after = len(self.cache)
-        pruned = before - after
-        if pruned > 0:
-            self.save()
-        return pruned
-
-    def embed_texts(self, client, texts, hashes, model="text-embedding-3-large", batch=64):
+        with self._lock:
+            self._load()
+            keep = [h for h in self._ordered() if h in valid_hashes]
+            pruned = len(self._rows) - len(keep)
+            if pruned > 0:
+                self._rewrite(self.dim, keep)
+            return pruned
+
+    def append(self, items) -> None:
+        """Persist (hash, vec) pairs right away so an interrupted index run resumes from them.
+
+        A hash appended twice resolves to its last row; save() compacts the file.
+        Vectors of another dimension (a different model) start the cache over.
+        """
+        with self._lock:
+            self._load()
+            pairs = [(h, np.asarray(v, dtype=np.float32).ravel()) for h, v in items]
+            if not pairs:
+                return
+            dim = pairs[0][1].size
+            if dim != self.dim:
+                self._rewrite(dim, [])
+            pairs = [(h, v) for h, v in pairs if v.size == dim and "\n" not in h]
+            if not pairs:
+                return
+            with open(self._vec_path, "ab") as f:
+                f.write(np.stack([v for _, v in pairs]).tobytes())
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.writelines(h + "\n" for h, _ in pairs)
+            for h, _ in pairs:
+                self._rows[h] = self._n
+                self._n += 1
+
+    def embed_texts(self, client, texts, hashes, model="text-embedding-3-large", batch=None, on_batch=None):
+        """Embeddings for `texts`, calling the API only for hashes not in the cache.
+
+        Misses go through a concurrent, rate-limited EmbeddingExecutor; `batch`
+        caps texts per request (default: token-based packing). on_batch(indices,
+        vectors) sees cached hits first, then every API batch as it completes.
+        """
+        from common.embedding_executor import EmbeddingExecutor, clip_for_openai
+
         embs = [None] * len(texts)
         to_embed, idx_map = [], []
         for i, (t, h) in enumerate(zip(texts, hashes)):
@@ -45,21 +189,28 @@ class EmbeddingCache:
                 to_embed.append(t)
             else:
                 embs[i] = v
-        enc = tiktoken.get_encoding('cl100k_base')
-
-        def _clip_for_openai(text: str, max_tokens: int = 8000) -> str:
-            toks = enc.encode(text)
-            if len(toks) <= max_tokens:
-                return text
-            return enc.decode(toks[:max_tokens])
+        if on_batch is not None and len(idx_map) < len(texts):
+            hits = [i for i, v in enumerate(embs) if v is not None]
+            on_batch(hits, [embs[i] for i in hits])
+        if not to_embed:
+            return embs
 
-        for i in range(0, len(to_embed), batch):
-            sub = [_clip_for_openai(t) for t in to_embed[i:i + batch]]
+        def _embed(sub):
             r = client.embeddings.create(model=model, input=sub)
-            for j, d in enumerate(r.data):
-                orig = idx_map[i + j]
-                vec = d.embedding
-                embs[orig] = vec
-                self.put(hashes[orig], vec)
-        return embs
+            return [d.embedding for d in r.data]
 
+        def _done(idx, vecs):
+            orig = [idx_map[j] for j in idx]
+            for i, vec in zip(orig, vecs):
+                embs[i] = vec
+            try:
+                self.append([(hashes[i], vec) for i, vec in zip(orig, vecs)])
+            except Exception:
+                pass
+            if on_batch is not None:
+                on_batch(orig, vecs)
+
+        clipped, counts = clip_for_openai(to_embed)
+        ex = EmbeddingExecutor(_embed, provider="openai", max_batch_items=batch)
+        ex.map(clipped, counts, on_batch=_done)
+        return embs
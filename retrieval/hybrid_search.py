@@ -1,9 +1,12 @@
 import os
 import json
+import time
+import threading
 import collections
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 from typing import List, Dict
 from pathlib import Path
-from common.config_loader import choose_repo_from_query, get_default_repo, out_dir
+from common.config_loader import choose_repo_from_query, get_default_repo, out_dir, rank_repos_for_query
 from dotenv import load_dotenv, find_dotenv
 
 # Load any existing env ASAP so downstream imports (e.g., rerank backend) see them
@@ -36,7 +39,13 @@ import bm25s
 from bm25s.tokenization import Tokenizer
 from Stemmer import Stemmer
 from .rerank import rerank_results as ce_rerank
+from . import cards_index
+from . import result_cache
+from . import rewrite_cache
+from . import local_vectors
+from common import index_generations, qdrant_config
 from server.env_model import generate_text
+from server.metrics import pipeline_stage
 from .synonym_expander import expand_query_with_synonyms, get_synonym_variants
 
 
@@ -260,13 +269,13 @@ COLLECTION = os.getenv('COLLECTION_NAME', f'code_chunks_{REPO}')
 
 
 def _lazy_import_openai():
-    from openai import OpenAI
-    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    from common.provider_clients import openai_client
+    return openai_client()
 
 
 def _lazy_import_voyage():
-    import voyageai
-    return voyageai.Client(api_key=os.getenv("VOYAGE_API_KEY"))
+    from common.provider_clients import voyage_client
+    return voyage_client()
 
 
 _local_embed_model = None
@@ -343,8 +352,13 @@ def rrf(dense: list, sparse: list, k: int = 10, kdiv: int = 60) -> list:
     return [pid for pid, _ in ranked[:k]]
 
 
-def _load_chunks(repo: str) -> List[Dict]:
-    p = os.path.join(out_dir(repo), 'chunks.jsonl')
+def _index_dir(repo: str) -> str:
+    """Live index generation for a repo (flat out/<repo>/ for pre-generation indexes)."""
+    return index_generations.generation_dir(out_dir(repo))
+
+
+def _load_chunks(repo: str, base: str | None = None) -> List[Dict]:
+    p = os.path.join(base or _index_dir(repo), 'chunks.jsonl')
     chunks: List[Dict] = []
     if os.path.exists(p):
         with open(p, 'r', encoding='utf-8') as f:
@@ -373,31 +387,100 @@ def _load_bm25_map(idx_dir: str):
     return None
 
 
-def _load_cards_bm25(repo: str):
-    idx_dir = os.path.join(out_dir(repo), 'bm25_cards')
-    try:
-        import bm25s
-        retr = bm25s.BM25.load(idx_dir)
-        return retr
-    except Exception:
-        return None
+# ---------------- Resident per-repo indexes ----------------
+# Chunk metadata, the BM25 retriever and its id map stay in memory per repo and
+# are reloaded only when the files on disk change (re-index), instead of being
+# read on every query. All of them (and the dense collection) come from one
+# index generation, so a re-index never mixes old and new artifacts.
+_RESIDENT: Dict[str, Dict] = {}
+_RESIDENT_LOCK = threading.Lock()
 
 
-def _load_cards_map(repo: str) -> Dict:
-    cards_file = os.path.join(out_dir(repo), 'cards.jsonl')
-    cards_by_idx = {}
-    cards_by_chunk_id = {}
-    try:
-        with open(cards_file, 'r', encoding='utf-8') as f:
-            for idx, line in enumerate(f):
-                card = json.loads(line)
-                chunk_id = str(card.get('id', ''))
-                if chunk_id:
-                    cards_by_idx[idx] = chunk_id
-                    cards_by_chunk_id[chunk_id] = card
-        return {'by_idx': cards_by_idx, 'by_chunk_id': cards_by_chunk_id}
-    except Exception:
-        return {'by_idx': {}, 'by_chunk_id': {}}
+def _index_signature(repo: str) -> tuple:
+    base = _index_dir(repo)
+    sig = [('generation', base)]
+    for rel in ('chunks.jsonl', os.path.join('bm25_index', 'params.index.json'),
+                os.path.join('bm25_index', 'bm25_point_ids.json'), os.path.join('bm25_index', 'chunk_ids.txt')):
+        try:
+            st = os.stat(os.path.join(base, rel))
+            sig.append((rel, st.st_mtime_ns, st.st_size))
+        except OSError:
+            sig.append((rel, None, None))
+    return tuple(sig)
+
+
+def _resident_index(repo: str) -> Dict:
+    sig = _index_signature(repo)
+    ent = _RESIDENT.get(repo)
+    if ent is not None and ent['sig'] == sig:
+        return ent
+    with _RESIDENT_LOCK:
+        ent = _RESIDENT.get(repo)
+        if ent is not None and ent['sig'] == sig:
+            return ent
+        base = _index_dir(repo)
+        chunks = _load_chunks(repo, base)
+        idx_dir = os.path.join(base, 'bm25_index')
+        manifest = index_generations.read_manifest(out_dir(repo))
+        # Query this generation's own collection rather than the alias, unless
+        # COLLECTION_NAME points the repo somewhere else
+        own = manifest.get('alias') == _collection_for(repo)
+        coll = manifest.get('collection') if own else None
+        # A generation indexed without dense vectors must not fall back to the alias
+        # (an older generation's collection): BM25 only
+        dense = not (own and manifest.get('dense') == 'none')
+        # Two-stage (Matryoshka) collections store a coarse prefix vector too
+        coarse = int(manifest.get('coarse_dim') or 0) if coll else 0
+        try:
+            retriever = bm25s.BM25.load(idx_dir) if chunks else None
+        except Exception:
+            retriever = None
+        ent = {
+            'sig': sig,
+            'dir': base,
+            'collection': coll or _collection_for(repo),
+            'dense': dense,
+            # Incremental runs share the collection between generations; keep only
+            # points of this generation's chunks (stale ones wait for prune)
+            'own_collection': bool(coll),
+            'coarse_dim': coarse,
+            'chunks': chunks,
+            'by_chunk_id': {str(c['id']): c for c in chunks},
+            'bm25': retriever,
+            'id_map': _load_bm25_map(idx_dir) if chunks else None,
+            'loaded_at': time.time(),
+        }
+        _RESIDENT[repo] = ent
+        return ent
+
+
+def warm_indexes(repos: List[str]) -> None:
+    """Load resident indexes ahead of the first query (e.g., at server start)."""
+    for r in repos:
+        try:
+            _resident_index(r)
+        except Exception:
+            pass
+
+
+_QDRANT_CLIENT = None
+
+
+def _qdrant() -> QdrantClient:
+    global _QDRANT_CLIENT
+    if _QDRANT_CLIENT is None:
+        _QDRANT_CLIENT = QdrantClient(url=QDRANT_URL)
+    return _QDRANT_CLIENT
+
+
+def _collection_for(repo: str) -> str:
+    # COLLECTION_NAME overrides the collection of the configured REPO only (the
+    # indexer names it that way for REPO); searching any other repo, by override or
+    # federated, always hits that repo's own code_chunks_<repo> collection.
+    env_coll = os.getenv('COLLECTION_NAME')
+    if env_coll and repo == os.getenv('REPO', 'project'):
+        return env_coll
+    return f'code_chunks_{repo}'
 
 
 @with_langtrace_root_span()
@@ -405,7 +488,8 @@ def search(query: str, repo: str, topk_dense: int = 75, topk_sparse: int = 75, f
     return _search_impl(query, repo, topk_dense, topk_sparse, final_k, trace)
 
 def _search_impl(query: str, repo: str, topk_dense: int, topk_sparse: int, final_k: int, trace: object | None) -> List[Dict]:
-    chunks = _load_chunks(repo)
+    resident = _resident_index(repo)
+    chunks = resident['chunks']
     if not chunks:
         return []
     
@@ -413,89 +497,55 @@ def _search_impl(query: str, repo: str, topk_dense: int, topk_sparse: int, final
     use_synonyms = str(os.getenv('USE_SEMANTIC_SYNONYMS', '1')).strip().lower() in {'1', 'true', 'on'}
     expanded_query = expand_query_with_synonyms(query, repo, max_expansions=3) if use_synonyms else query
     
-    # SPAN: Vector Search (Qdrant)
+    # Each step is timed into agro_pipeline_stage_seconds{stage="search.*"} and,
+    # when LangTrace is active, also becomes an OpenTelemetry span.
+    # SPAN: Vector Search (Qdrant, or the in-process index for VECTOR_BACKEND=local|faiss)
     dense_pairs = []
-    if _tracer:
-        with _tracer.start_as_current_span("agro.vector_search", attributes={"query": expanded_query, "topk": topk_dense}) as span:
-            qc = QdrantClient(url=QDRANT_URL)
-            coll = os.getenv('COLLECTION_NAME', f'code_chunks_{repo}')
-            try:
-                e = _get_embedding(expanded_query, kind="query")
-                backend = (os.getenv('VECTOR_BACKEND','qdrant') or 'qdrant').lower()
-                if backend != 'faiss':
-                    dres = qc.query_points(
-                        collection_name=coll,
-                        query=e,
-                        using='dense',
-                        limit=topk_dense,
-                        with_payload=models.PayloadSelectorInclude(include=['file_path', 'start_line', 'end_line', 'language', 'layer', 'repo', 'hash', 'id'])
-                    )
-                    points = getattr(dres, 'points', dres)
-                    dense_pairs = [(str(p.id), dict(p.payload)) for p in points]
-                    span.set_attribute("results_count", len(dense_pairs))
-            except Exception as ex:
-                span.set_attribute("error", str(ex))
-                dense_pairs = []
-    else:
-        # No tracing
-        qc = QdrantClient(url=QDRANT_URL)
-        coll = os.getenv('COLLECTION_NAME', f'code_chunks_{repo}')
+    use_dense = resident.get('dense', True)
+    qc = None if local_vectors.enabled() or not use_dense else _qdrant()
+    coll = resident.get('collection') or _collection_for(repo)
+    with pipeline_stage("search.embed", tracer=_tracer, span_name="agro.query_embedding") as span:
         try:
-            e = _get_embedding(expanded_query, kind="query")
-        except Exception:
+            e = _get_embedding(expanded_query, kind="query") if use_dense else []
+        except Exception as ex:
+            span.set_attribute("error", str(ex))
             e = []
+    with pipeline_stage("search.dense", tracer=_tracer, span_name="agro.vector_search", query=expanded_query, topk=topk_dense) as span:
         try:
-            backend = (os.getenv('VECTOR_BACKEND','qdrant') or 'qdrant').lower()
-            if backend == 'faiss':
-                dense_pairs = []
-            else:
+            if local_vectors.enabled():
+                # In-process index (out/<repo>/vectors): no Qdrant round-trip
+                lvi = local_vectors.load(repo) if e else None
+                if lvi is not None:
+                    by_chunk_id = resident['by_chunk_id']
+                    dense_pairs = [(cid, by_chunk_id[cid]) for cid, _ in lvi.search(e, k=topk_dense) if cid in by_chunk_id]
+            elif e:
+                # Single-stage, or coarse-vector prefetch rescored at full dim
+                # (search params: QDRANT_HNSW_EF / QDRANT_OVERSAMPLING, DENSE_RESCORE_K)
                 dres = qc.query_points(
                     collection_name=coll,
-                    query=e,
-                    using='dense',
-                    limit=topk_dense,
-                    with_payload=models.PayloadSelectorInclude(include=['file_path', 'start_line', 'end_line', 'language', 'layer', 'repo', 'hash', 'id'])
+                    with_payload=models.PayloadSelectorInclude(include=['file_path', 'start_line', 'end_line', 'language', 'layer', 'repo', 'hash', 'id']),
+                    **qdrant_config.dense_query(e, topk_dense, resident.get('coarse_dim') or 0)
                 )
                 points = getattr(dres, 'points', dres)
                 dense_pairs = [(str(p.id), dict(p.payload)) for p in points]
-        except Exception:
+                if resident.get('own_collection'):
+                    by_chunk_id = resident['by_chunk_id']
+                    dense_pairs = [(pid, pl) for pid, pl in dense_pairs
+                                   if (by_chunk_id.get(str(pl.get('id'))) or {}).get('hash') == pl.get('hash')]
+            span.set_attribute("results_count", len(dense_pairs))
+        except Exception as ex:
+            span.set_attribute("error", str(ex))
             dense_pairs = []
 
     # SPAN: BM25 Sparse Retrieval
-    if _tracer:
-        with _tracer.start_as_current_span("agro.bm25_search", attributes={"query": expanded_query, "topk": topk_sparse}) as span:
-            idx_dir = os.path.join(out_dir(repo), 'bm25_index')
-            retriever = bm25s.BM25.load(idx_dir)
-            tokenizer = Tokenizer(stemmer=Stemmer('english'), stopwords='en')
-            tokens = tokenizer.tokenize([expanded_query])
-            ids, _ = retriever.retrieve(tokens, k=topk_sparse)
-            ids = ids.tolist()[0] if hasattr(ids, 'tolist') else list(ids[0])
-            id_map = _load_bm25_map(idx_dir)
-            by_chunk_id = {str(c['id']): c for c in chunks}
-            sparse_pairs = []
-            for i in ids:
-                if id_map is not None:
-                    if 0 <= i < len(id_map):
-                        pid_or_cid = id_map[i]
-                        key = str(pid_or_cid)
-                        if key in by_chunk_id:
-                            sparse_pairs.append((key, by_chunk_id[key]))
-                        else:
-                            if 0 <= i < len(chunks):
-                                sparse_pairs.append((str(chunks[i]['id']), chunks[i]))
-                else:
-                    if 0 <= i < len(chunks):
-                        sparse_pairs.append((str(chunks[i]['id']), chunks[i]))
-            span.set_attribute("results_count", len(sparse_pairs))
-    else:
-        idx_dir = os.path.join(out_dir(repo), 'bm25_index')
-        retriever = bm25s.BM25.load(idx_dir)
-        tokenizer = Tokenizer(stemmer=Stemmer('english'), stopwords='en')
+    tokenizer = Tokenizer(stemmer=Stemmer('english'), stopwords='en')
+    with pipeline_stage("search.bm25", tracer=_tracer, span_name="agro.bm25_search", query=expanded_query, topk=topk_sparse) as span:
+        retriever = resident['bm25']
         tokens = tokenizer.tokenize([expanded_query])
         ids, _ = retriever.retrieve(tokens, k=topk_sparse)
         ids = ids.tolist()[0] if hasattr(ids, 'tolist') else list(ids[0])
-        id_map = _load_bm25_map(idx_dir)
-        by_chunk_id = {str(c['id']): c for c in chunks}
+        id_map = resident['id_map']
+        by_chunk_id = resident['by_chunk_id']
         sparse_pairs = []
         for i in ids:
             if id_map is not None:
@@ -510,43 +560,42 @@ def _search_impl(query: str, repo: str, topk_dense: int, topk_sparse: int, final
             else:
                 if 0 <= i < len(chunks):
                     sparse_pairs.append((str(chunks[i]['id']), chunks[i]))
+        span.set_attribute("results_count", len(sparse_pairs))
 
     card_chunk_ids: set = set()
-    cards_retr = _load_cards_bm25(repo)
-    if cards_retr is not None:
-        try:
-            cards_map = _load_cards_map(repo)
-            # Use expanded query for card retrieval too
-            tokens = tokenizer.tokenize([expanded_query])
-            c_ids, _ = cards_retr.retrieve(tokens, k=min(topk_sparse, 30))
-            c_ids_flat = c_ids[0] if hasattr(c_ids, '__getitem__') else c_ids
-            for card_idx in c_ids_flat:
-                chunk_id = cards_map['by_idx'].get(int(card_idx))
-                if chunk_id:
-                    card_chunk_ids.add(str(chunk_id))
-        except Exception:
-            pass
+    # Live cards generation (cached until the indexer publishes a new one)
+    with pipeline_stage("search.cards", tracer=_tracer, span_name="agro.cards_search") as span:
+        cards_idx = cards_index.load(repo)
+        if cards_idx is not None:
+            try:
+                cards_retr = cards_idx['retriever']
+                # Use expanded query for card retrieval too
+                tokens = tokenizer.tokenize([expanded_query])
+                c_ids, _ = cards_retr.retrieve(tokens, k=min(topk_sparse, 30))
+                c_ids_flat = c_ids[0] if hasattr(c_ids, '__getitem__') else c_ids
+                for card_idx in c_ids_flat:
+                    chunk_id = cards_idx['by_idx'].get(int(card_idx))
+                    if chunk_id:
+                        card_chunk_ids.add(str(chunk_id))
+            except Exception:
+                pass
+        span.set_attribute("card_hits", len(card_chunk_ids))
 
     # SPAN: RRF Fusion
     dense_ids = [pid for pid, _ in dense_pairs]
     sparse_ids = [pid for pid, _ in sparse_pairs]
-    
-    if _tracer:
-        with _tracer.start_as_current_span("agro.rrf_fusion", attributes={
-            "dense_count": len(dense_ids),
-            "sparse_count": len(sparse_ids),
-            "final_k": final_k
-        }) as span:
-            fused = rrf(dense_ids, sparse_ids, k=max(final_k, 2 * final_k)) if dense_pairs else sparse_ids[:final_k]
-            span.set_attribute("fused_count", len(fused))
-    else:
+    with pipeline_stage("search.fusion", tracer=_tracer, span_name="agro.rrf_fusion",
+                        dense_count=len(dense_ids), sparse_count=len(sparse_ids), final_k=final_k) as span:
         fused = rrf(dense_ids, sparse_ids, k=max(final_k, 2 * final_k)) if dense_pairs else sparse_ids[:final_k]
-    
+        span.set_attribute("fused_count", len(fused))
+
     by_id = {pid: p for pid, p in (dense_pairs + sparse_pairs)}
-    docs = [by_id[pid] for pid in fused if pid in by_id]
+    # Copy: sparse hits are the resident chunk dicts, which hydration/scoring must not mutate
+    docs = [dict(by_id[pid]) for pid in fused if pid in by_id]
     HYDRATION_MODE = (os.getenv('HYDRATION_MODE', 'lazy') or 'lazy').lower()
     if HYDRATION_MODE != 'none':
-        _hydrate_docs_inplace(repo, docs)
+        with pipeline_stage("search.hydrate", tracer=_tracer, span_name="agro.hydrate", docs=len(docs)):
+            _hydrate_docs_inplace(repo, docs)
     # tracing: pre-rerank candidate snapshot
     try:
         if trace is not None and hasattr(trace, 'add'):
@@ -597,17 +646,20 @@ def _search_impl(query: str, repo: str, topk_dense: int, topk_sparse: int, final
     
     if not skip_local_rerank:
         # Apply local cross-encoder reranking
-        if _tracer:
-            with _tracer.start_as_current_span("agro.cross_encoder_rerank", attributes={
-                "candidates_count": len(docs),
-                "top_k": final_k
-            }) as span:
-                docs = ce_rerank(query, docs, top_k=final_k, trace=trace)
-                span.set_attribute("reranked_count", len(docs))
-        else:
+        with pipeline_stage("search.rerank", tracer=_tracer, span_name="agro.cross_encoder_rerank",
+                            candidates_count=len(docs), top_k=final_k) as span:
             docs = ce_rerank(query, docs, top_k=final_k, trace=trace)
+            span.set_attribute("reranked_count", len(docs))
 
     # Apply all scoring bonuses (CRITICAL: Must happen regardless of reranker backend)
+    with pipeline_stage("search.scoring"):
+        _apply_scoring_bonuses(query, repo, docs, card_chunk_ids, wants_code)
+
+    # NOW return top-k (bonuses have been applied)
+    return docs[:final_k]
+
+
+def _apply_scoring_bonuses(query: str, repo: str, docs: list[dict], card_chunk_ids: set, wants_code: bool) -> None:
     intent = _classify_query(query)
     
     for d in docs:
@@ -640,9 +692,6 @@ def _search_impl(query: str, repo: str, topk_dense: int, topk_sparse: int, final
     
     # Re-sort after applying all bonuses
     docs.sort(key=lambda x: x.get('rerank_score', 0.0), reverse=True)
-    
-    # NOW return top-k (bonuses have been applied)
-    return docs[:final_k]
 
 
 def _hydrate_docs_inplace(repo: str, docs: list[dict]) -> None:
@@ -659,7 +708,7 @@ def _hydrate_docs_inplace(repo: str, docs: list[dict]) -> None:
             needed_hashes.add(h)
     if not needed_ids and not needed_hashes:
         return
-    jl = os.path.join(out_dir(repo), 'chunks.jsonl')
+    jl = os.path.join(_resident_index(repo).get('dir') or _index_dir(repo), 'chunks.jsonl')
     max_chars = int(os.getenv('HYDRATION_MAX_CHARS', '2000') or '2000')
     found_by_id: dict[str, str] = {}
     found_by_hash: dict[str, str] = {}
@@ -742,27 +791,83 @@ def search_routed(query: str, repo_override: str | None = None, final_k: int = 1
     return search(query, repo=repo, final_k=final_k, trace=trace)
 
 
+_EXPAND_SYS = "Rewrite a developer query into multiple search-friendly variants without changing meaning."
+_EXPAND_USER = "Count: {m}\nQuery: {query}\nOutput one variant per line, no numbering."
+_REWRITE_SYS = "You rewrite developer questions into search-optimized queries without changing meaning."
+_REWRITE_USER = "Rewrite this for code search (expand CamelCase, include API nouns), one line.\n\n{query}"
+
+
 def expand_queries(query: str, m: int = 4) -> list[str]:
     if m <= 1:
         return [query]
-    try:
-        sys = "Rewrite a developer query into multiple search-friendly variants without changing meaning."
-        user = f"Count: {m}\nQuery: {query}\nOutput one variant per line, no numbering."
-        text, _ = generate_text(user_input=user, system_instructions=sys, reasoning_effort=None)
+
+    def compute() -> list[str]:
+        text, _ = generate_text(user_input=_EXPAND_USER.format(m=m, query=query), system_instructions=_EXPAND_SYS, reasoning_effort=None)
         lines = [ln.strip('- ').strip() for ln in (text or '').splitlines() if ln.strip()]
         uniq = []
         for ln in lines:
             if ln and ln not in uniq:
                 uniq.append(ln)
-        return (uniq or [query])[:m]
+        return uniq[:m]
+
+    try:
+        return rewrite_cache.cached_rewrites('expand', query, m, _EXPAND_SYS + _EXPAND_USER, compute) or [query]
     except Exception:
         return [query]
 
 
+def rewrite_for_search(query: str) -> str:
+    """Single search-optimized rewrite of a question (LangGraph low-confidence loop)."""
+    def compute() -> list[str]:
+        text, _ = generate_text(user_input=_REWRITE_USER.format(query=query), system_instructions=_REWRITE_SYS, reasoning_effort=None)
+        text = (text or '').strip()
+        return [text] if text else []
+
+    out = rewrite_cache.cached_rewrites('rewrite', query, 1, _REWRITE_SYS + _REWRITE_USER, compute)
+    return out[0] if out else ''
+
+
 @with_langtrace_root_span()
 def search_routed_multi(query: str, repo_override: str | None = None, m: int = 4, final_k: int = 10, trace: object | None = None):
     repo = (repo_override or route_repo(query) or os.getenv('REPO', 'project')).strip()
-    variants = expand_queries(query, m=m)
+    if not result_cache.enabled():
+        return _search_routed_multi_uncached(query, repo, m, final_k, trace)
+
+    cache = result_cache.get_cache()
+    generation = result_cache.index_generation(repo)
+    settings = result_cache.settings_fingerprint(m=int(m), final_k=int(final_k))
+    key = cache.make_key(query, repo, settings)
+    tier = 'exact'
+    qvec = None
+    hit = cache.get(key, generation)
+    result_cache.record('exact', hit is not None, hit[1] if hit else 0.0)
+    if hit is None and cache.semantic:
+        tier = 'semantic'
+        try:
+            qvec = _get_embedding(query, kind="query")
+        except Exception:
+            qvec = None
+        if qvec:
+            hit = cache.get_similar(qvec, repo, settings, generation)
+            result_cache.record('semantic', hit is not None, hit[1] if hit else 0.0)
+    if hit is not None:
+        try:
+            if trace is not None and hasattr(trace, 'add'):
+                trace.add('retriever.cache_hit', {'tier': tier, 'repo': repo, 'generation': generation,
+                                                  'saved_ms': int(hit[1] * 1000), 'count': len(hit[0])})
+        except Exception:
+            pass
+        return hit[0]
+
+    t0 = time.perf_counter()
+    docs = _search_routed_multi_uncached(query, repo, m, final_k, trace)
+    cache.put(key, repo, settings, generation, docs, time.perf_counter() - t0, vec=qvec)
+    return docs
+
+
+def _search_routed_multi_uncached(query: str, repo: str, m: int, final_k: int, trace: object | None):
+    with pipeline_stage("search.expand"):
+        variants = expand_queries(query, m=m)
     try:
         if trace is not None and hasattr(trace, 'add'):
             trace.add('router.decide', {
@@ -802,8 +907,147 @@ def search_routed_multi(query: str, repo_override: str | None = None, m: int = 4
     
     try:
         from .rerank import rerank_results as _rr
-        reranked = _rr(query, uniq, top_k=final_k)
-        _apply_filename_boosts(reranked, query)
+        with pipeline_stage("search.final_rerank"):
+            reranked = _rr(query, uniq, top_k=final_k)
+            _apply_filename_boosts(reranked, query)
         return reranked
     except Exception:
         return uniq[:final_k]
+
+
+# ---------------- Federated (multi-repo) search ----------------
+def _normalize_scores(docs: List[Dict]) -> None:
+    """Min-max normalize rerank_score over the merged list of all repos into fed_score (0..1).
+
+    Every repo's list was scored by the same reranker against the same query, so
+    raw scores compare across repos; normalizing per repo would give each repo's
+    best hit 1.0 however weak it is.
+    """
+    if not docs:
+        return
+    vals = [float(d.get('rerank_score', 0.0) or 0.0) for d in docs]
+    lo, hi = min(vals), max(vals)
+    span = hi - lo
+    for d, v in zip(docs, vals):
+        d['fed_score'] = (v - lo) / span if span > 0 else 1.0
+
+
+def federated_repos(query: str, repos: List[str] | None = None, max_repos: int | None = None) -> List[str]:
+    """Candidate repos for a federated query: explicit list, else keyword-ranked config order."""
+    if max_repos is None:
+        max_repos = int(os.getenv('FEDERATED_MAX_REPOS', '3') or 3)
+    if repos:
+        cands = [r.strip() for r in repos if r and r.strip()]
+    else:
+        try:
+            cands = rank_repos_for_query(query, default=get_default_repo())
+        except Exception:
+            cands = []
+        if not cands:
+            cands = [route_repo(query)]
+    # Only repos that have been indexed can answer
+    cands = [r for r in dict.fromkeys(cands) if os.path.exists(os.path.join(_index_dir(r), 'chunks.jsonl'))]
+    return cands[:max(1, max_repos)]
+
+
+_FED_POOL: ThreadPoolExecutor | None = None
+_FED_SLOTS: Dict[str, threading.BoundedSemaphore] = {}
+_FED_LOCK = threading.Lock()
+
+
+def _fed_pool() -> ThreadPoolExecutor:
+    global _FED_POOL
+    with _FED_LOCK:
+        if _FED_POOL is None:
+            workers = max(1, int(os.getenv('FEDERATED_WORKERS', '8') or 8))
+            _FED_POOL = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='agro-fed')
+        return _FED_POOL
+
+
+def _fed_slot(repo: str) -> threading.BoundedSemaphore:
+    with _FED_LOCK:
+        sem = _FED_SLOTS.get(repo)
+        if sem is None:
+            sem = _FED_SLOTS[repo] = threading.BoundedSemaphore(
+                max(1, int(os.getenv('FEDERATED_REPO_CONCURRENCY', '2') or 2)))
+        return sem
+
+
+def _fed_search(sem: threading.BoundedSemaphore, *args) -> List[Dict]:
+    try:
+        return _search_impl(*args)
+    finally:
+        sem.release()
+
+
+def search_federated(query: str, repos: List[str] | None = None, final_k: int = 10, trace: object | None = None,
+                     budget_ms: int | None = None, repo_timeout_ms: int | None = None) -> List[Dict]:
+    """Run _search_impl against several repos concurrently and merge normalized results.
+
+    Each repo gets at most FEDERATED_REPO_TIMEOUT_MS and the whole call at most
+    FEDERATED_BUDGET_MS; repos that miss their deadline are dropped from the merge
+    (their worker finishes in the background and warms the resident index).
+
+    Searches run on one shared pool (FEDERATED_WORKERS). A running search can't be
+    interrupted, so each repo may hold at most FEDERATED_REPO_CONCURRENCY workers:
+    while that many of its searches are still running (a slow or hung repo) it is
+    skipped as "busy" instead of tying up more threads and starving other repos.
+    """
+    budget_ms = int(budget_ms if budget_ms is not None else (os.getenv('FEDERATED_BUDGET_MS', '4000') or 4000))
+    repo_timeout_ms = int(repo_timeout_ms if repo_timeout_ms is not None else (os.getenv('FEDERATED_REPO_TIMEOUT_MS', '3000') or 3000))
+    topk_dense = int(os.getenv('TOPK_DENSE', '75') or 75)
+    topk_sparse = int(os.getenv('TOPK_SPARSE', '75') or 75)
+    cands = federated_repos(query, repos)
+    if not cands:
+        return []
+
+    start = time.time()
+    deadline = start + budget_ms / 1000.0
+    pool = _fed_pool()
+    per_repo: Dict[str, Dict] = {}
+    futures = {}
+    for r in cands:
+        sem = _fed_slot(r)
+        if not sem.acquire(blocking=False):
+            per_repo[r] = {'status': 'busy'}
+            continue
+        try:
+            futures[r] = pool.submit(_fed_search, sem, query, r, topk_dense, topk_sparse, final_k, None)
+        except Exception as e:
+            sem.release()
+            per_repo[r] = {'status': 'error', 'error': str(e)[:200]}
+    merged: List[Dict] = []
+    for r, fut in futures.items():
+        repo_deadline = min(start + repo_timeout_ms / 1000.0, deadline)
+        try:
+            # Stragglers keep their worker (and repo slot) until the search returns
+            docs = fut.result(timeout=max(0.0, repo_deadline - time.time()))
+            for d in docs:
+                d['repo'] = d.get('repo') or r
+            merged.extend(docs)
+            per_repo[r] = {'status': 'ok', 'count': len(docs)}
+        except FuturesTimeout:
+            per_repo[r] = {'status': 'timeout'}
+        except Exception as e:
+            per_repo[r] = {'status': 'error', 'error': str(e)[:200]}
+    _normalize_scores(merged)
+
+    seen = set()
+    uniq = []
+    for d in sorted(merged, key=lambda x: x.get('fed_score', 0.0), reverse=True):
+        key = (d.get('repo'), d.get('file_path'), d.get('start_line'), d.get('end_line'))
+        if key in seen:
+            continue
+        seen.add(key)
+        uniq.append(d)
+    try:
+        if trace is not None and hasattr(trace, 'add'):
+            trace.add('router.federated', {
+                'repos': per_repo,
+                'budget_ms': budget_ms,
+                'repo_timeout_ms': repo_timeout_ms,
+                'elapsed_ms': int((time.time() - start) * 1000),
+            })
+    except Exception:
+        pass
+    return uniq[:final_k]
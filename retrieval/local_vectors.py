@@ -0,0 +1,244 @@
+"""In-process dense vector index (VECTOR_BACKEND=local, alias: faiss).
+
+For single-node deployments the indexer writes the chunk embeddings next to the
+BM25 index and search reads them memory-mapped, so dense retrieval needs no
+Qdrant round-trip.
+
+Layout under <live index generation>/vectors/ (see common/index_generations.py):
+  vectors.npy    float32 [N, D], L2-normalised, rows grouped by IVF list
+  ids.json       row -> chunk id
+  centroids.npy  float32 [nlist, D]   (IVF only)
+  offsets.npy    int64 [nlist + 1]    rows of list i are offsets[i]:offsets[i+1]
+  meta.json      dim/count/kind/nlist/embedding info; written last, so a reader
+                 never sees a half-written index
+
+Small corpora use exact (flat) inner-product search. Above LOCAL_VECTORS_IVF_MIN
+rows the indexer trains an inverted-file index (k-means coarse quantiser) and
+queries scan only the LOCAL_VECTORS_NPROBE closest lists; because rows are
+stored grouped by list, each probe is one contiguous slice of the memmap.
+
+Env:
+  LOCAL_VECTORS_IVF_MIN  rows before IVF is used       (default 50000)
+  LOCAL_VECTORS_NLIST    IVF lists                     (default 4*sqrt(N))
+  LOCAL_VECTORS_NPROBE   lists scanned per query       (default 16)
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import time
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from common.config_loader import out_dir
+from common.index_generations import generation_dir
+
+VECTORS_DIRNAME = "vectors"
+LOCAL_BACKENDS = {"local", "faiss"}
+
+
+def enabled() -> bool:
+    return (os.getenv("VECTOR_BACKEND", "qdrant") or "qdrant").strip().lower() in LOCAL_BACKENDS
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)) or default)
+    except Exception:
+        return default
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+def _assign(vecs: np.ndarray, centroids: np.ndarray, batch: int = 8192) -> np.ndarray:
+    out = np.empty(len(vecs), dtype=np.int64)
+    for s in range(0, len(vecs), batch):
+        out[s:s + batch] = np.argmax(vecs[s:s + batch] @ centroids.T, axis=1)
+    return out
+
+
+def train_ivf(vecs: np.ndarray, nlist: int, iters: int = 12, sample: int = 100000, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on (a sample of) normalised vectors; returns centroids."""
+    rng = np.random.default_rng(seed)
+    n = len(vecs)
+    nlist = max(1, min(int(nlist), n))
+    train = vecs if n <= sample else vecs[np.sort(rng.choice(n, sample, replace=False))]
+    centroids = train[rng.choice(len(train), nlist, replace=False)].copy()
+    for _ in range(iters):
+        labels = _assign(train, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, train)
+        counts = np.bincount(labels, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty lists from random points
+            sums[empty] = train[rng.choice(len(train), int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+def build(dest: str, ids: Sequence[str], vectors: Sequence[Sequence[float]], meta: Optional[Dict[str, Any]] = None,
+          ivf_min: Optional[int] = None, nlist: Optional[int] = None) -> Dict[str, Any]:
+    """Write an index for `vectors` (row i belongs to chunk ids[i]) into `dest`."""
+    vecs = _normalize(np.asarray(vectors, dtype=np.float32))
+    if vecs.ndim != 2 or len(vecs) != len(ids):
+        raise ValueError(f"expected {len(ids)} vectors, got shape {vecs.shape}")
+    n, dim = vecs.shape
+    ivf_min = _env_int("LOCAL_VECTORS_IVF_MIN", 50000) if ivf_min is None else ivf_min
+    ids = [str(i) for i in ids]
+    os.makedirs(dest, exist_ok=True)
+
+    centroids = offsets = None
+    if n >= max(1, ivf_min):
+        nl = nlist or _env_int("LOCAL_VECTORS_NLIST", 0) or int(4 * np.sqrt(n))
+        centroids = train_ivf(vecs, nl)
+        labels = _assign(vecs, centroids)
+        order = np.argsort(labels, kind="stable")
+        vecs = vecs[order]
+        ids = [ids[i] for i in order]
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=len(centroids)))]).astype(np.int64)
+
+    def _save_npy(name: str, arr: np.ndarray) -> None:
+        tmp = os.path.join(dest, name + ".tmp.npy")
+        np.save(tmp, arr)
+        os.replace(tmp, os.path.join(dest, name))
+
+    # meta.json goes last and is removed first: readers key off it
+    try:
+        os.unlink(os.path.join(dest, "meta.json"))
+    except FileNotFoundError:
+        pass
+    _save_npy("vectors.npy", vecs)
+    with open(os.path.join(dest, "ids.json.tmp"), "w", encoding="utf-8") as f:
+        json.dump(ids, f)
+    os.replace(os.path.join(dest, "ids.json.tmp"), os.path.join(dest, "ids.json"))
+    if centroids is not None:
+        _save_npy("centroids.npy", centroids)
+        _save_npy("offsets.npy", offsets)
+    else:
+        for name in ("centroids.npy", "offsets.npy"):
+            try:
+                os.unlink(os.path.join(dest, name))
+            except FileNotFoundError:
+                pass
+    info = dict(meta or {})
+    info.update({
+        "dim": int(dim),
+        "count": int(n),
+        "kind": "ivf" if centroids is not None else "flat",
+        "nlist": int(len(centroids)) if centroids is not None else 0,
+        "metric": "cosine",
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    })
+    with open(os.path.join(dest, "meta.json.tmp"), "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+    os.replace(os.path.join(dest, "meta.json.tmp"), os.path.join(dest, "meta.json"))
+    return info
+
+
+class LocalVectorIndex:
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta: Dict[str, Any] = json.load(f)
+        with open(os.path.join(path, "ids.json"), "r", encoding="utf-8") as f:
+            self.ids: List[str] = json.load(f)
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        if self.vectors.shape[0] != len(self.ids):
+            raise ValueError("vectors/ids mismatch (index being rewritten?)")
+        self.centroids = self.offsets = None
+        if self.meta.get("kind") == "ivf":
+            self.centroids = np.load(os.path.join(path, "centroids.npy"))
+            self.offsets = np.load(os.path.join(path, "offsets.npy"))
+
+    @property
+    def dim(self) -> int:
+        return int(self.vectors.shape[1])
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _scan(self, q: np.ndarray, rows: Sequence[Tuple[int, int]], k: int) -> List[Tuple[int, float]]:
+        best_rows: List[np.ndarray] = []
+        best_scores: List[np.ndarray] = []
+        for s, e in rows:
+            if e <= s:
+                continue
+            scores = np.asarray(self.vectors[s:e] @ q)
+            if len(scores) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+            else:
+                top = np.arange(len(scores))
+            best_rows.append(top + s)
+            best_scores.append(scores[top])
+        if not best_rows:
+            return []
+        r = np.concatenate(best_rows)
+        sc = np.concatenate(best_scores)
+        order = np.argsort(-sc, kind="stable")[:k]
+        return [(int(r[i]), float(sc[i])) for i in order]
+
+    def search(self, query: Sequence[float], k: int = 10, nprobe: Optional[int] = None,
+               exact: bool = False) -> List[Tuple[str, float]]:
+        """Top-k (chunk id, cosine similarity) for a query embedding."""
+        if not len(self.ids) or k <= 0:
+            return []
+        q = _normalize(np.asarray(query, dtype=np.float32).reshape(-1))
+        if q.shape[0] != self.dim:
+            raise ValueError(f"query dim {q.shape[0]} != index dim {self.dim}")
+        if exact or self.centroids is None:
+            step = 65536
+            rows = [(s, min(s + step, len(self.ids))) for s in range(0, len(self.ids), step)]
+        else:
+            nprobe = nprobe or _env_int("LOCAL_VECTORS_NPROBE", 16)
+            nprobe = max(1, min(int(nprobe), len(self.centroids)))
+            cs = self.centroids @ q
+            probe = np.argpartition(-cs, nprobe - 1)[:nprobe]
+            rows = [(int(self.offsets[i]), int(self.offsets[i + 1])) for i in sorted(probe)]
+        return [(self.ids[r], s) for r, s in self._scan(q, rows, int(k))]
+
+
+# ---- per-process cache (one load per repo per index build) ----
+_lock = threading.Lock()
+_loaded: Dict[str, Tuple[Any, Optional[LocalVectorIndex]]] = {}
+
+
+def index_dir(repo: str) -> str:
+    return os.path.join(generation_dir(out_dir(repo)), VECTORS_DIRNAME)
+
+
+def _signature(path: str):
+    try:
+        st = os.stat(os.path.join(path, "meta.json"))
+        return (path, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+def load(repo: str) -> Optional[LocalVectorIndex]:
+    """The repo's local index (memory-mapped, cached until the indexer rewrites it)."""
+    path = index_dir(repo)
+    sig = _signature(path)
+    hit = _loaded.get(repo)
+    if hit is not None and hit[0] == sig:
+        return hit[1]
+    with _lock:
+        hit = _loaded.get(repo)
+        if hit is not None and hit[0] == sig:
+            return hit[1]
+        idx: Optional[LocalVectorIndex] = None
+        if sig is not None:
+            try:
+                idx = LocalVectorIndex(path)
+            except Exception:
+                idx = None
+        _loaded[repo] = (sig, idx)
+        return idx
@@ -86,14 +86,9 @@ def rerank_results(query: str, results: List[Dict], top_k: int = 10, trace: Any
     if backend == 'cohere':
         # DEBUG: print(f"  → Using Cohere API (no local processing)")
         try:
-            # DEBUG: print(f"  → Importing cohere...")
-            import cohere
-            # DEBUG: print(f"  → Getting API key...")
-            api_key = os.getenv('COHERE_API_KEY')
-            if not api_key:
-                raise RuntimeError('COHERE_API_KEY not set')
-            # DEBUG: print(f"  → Creating client...")
-            client = cohere.Client(api_key=api_key)
+            # Shared client (pooled connections); raises if COHERE_API_KEY is not set
+            from common.provider_clients import cohere_client
+            client = cohere_client()
             # DEBUG: print(f"  → Client created, building docs...")
             docs = []
             for r in results:
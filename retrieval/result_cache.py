@@ -0,0 +1,202 @@
+"""Two-tier cache for routed search results.
+
+Tier 1 (exact): normalized (query, repo, settings) -> results.
+Tier 2 (semantic, opt-in): nearest cached query of the same repo/settings by
+query-embedding cosine similarity, for trivially reworded questions.
+
+Every entry records the repo's index generation (a fingerprint of the index
+files on disk); a re-index changes it and stale entries are dropped on lookup.
+
+Env:
+  RESULT_CACHE_ENABLED   1|0        (default 1)
+  RESULT_CACHE_MAX       entries    (default 512)
+  RESULT_CACHE_TTL       seconds    (default 600)
+  RESULT_CACHE_SEMANTIC  1|0        (default 0)
+  RESULT_CACHE_SIM       cosine     (default 0.95)
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from common.config_loader import out_dir
+
+# Env knobs that change what a routed search returns
+_SETTINGS_ENV = (
+    "TOPK_DENSE", "TOPK_SPARSE", "EMBEDDING_TYPE", "RERANK_BACKEND", "RERANKER_MODEL",
+    "COHERE_RERANK_MODEL", "HYDRATION_MODE", "HYDRATION_MAX_CHARS", "VENDOR_MODE",
+    "USE_SEMANTIC_SYNONYMS", "GEN_MODEL", "VECTOR_BACKEND",
+    # query-time dense search params (common/qdrant_config.py, retrieval/local_vectors.py)
+    "QDRANT_HNSW_EF", "QDRANT_OVERSAMPLING", "QDRANT_RESCORE", "QDRANT_EXACT",
+    "DENSE_RESCORE_K", "LOCAL_VECTORS_NPROBE",
+)
+
+# Files whose change means the repo was re-indexed
+_GENERATION_FILES = (
+    "chunks.jsonl",
+    "last_index.json",
+    os.path.join("bm25_index", "params.index.json"),
+    os.path.join("bm25_cards", "CURRENT"),
+    os.path.join("generations", "CURRENT"),
+)
+
+
+def normalize_query(q: str) -> str:
+    q = (q or "").strip().lower()
+    q = re.sub(r"\s+", " ", q)
+    return q.strip(" ?!.")
+
+
+def settings_fingerprint(**extra: Any) -> str:
+    s = {k: os.getenv(k, "") for k in _SETTINGS_ENV}
+    s.update({k: v for k, v in extra.items()})
+    return hashlib.md5(json.dumps(s, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def index_generation(repo: str) -> str:
+    base = out_dir(repo)
+    parts = []
+    for rel in _GENERATION_FILES:
+        try:
+            st = os.stat(os.path.join(base, rel))
+            parts.append(f"{st.st_mtime_ns}:{st.st_size}")
+        except OSError:
+            parts.append("-")
+    return hashlib.md5("|".join(parts).encode()).hexdigest()[:12]
+
+
+def _copy(results: Sequence[Dict]) -> List[Dict]:
+    # Callers mutate scores/fields in place; never hand out the cached dicts.
+    return [dict(d) for d in results]
+
+
+class ResultCache:
+    def __init__(self, max_entries: int = 512, ttl_s: float = 600.0, semantic: bool = False, sim_threshold: float = 0.95):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_s = float(ttl_s)
+        self.semantic = bool(semantic)
+        self.sim_threshold = float(sim_threshold)
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts = {"exact_hit": 0, "exact_miss": 0, "semantic_hit": 0, "semantic_miss": 0}
+        self.saved_s = 0.0
+
+    @staticmethod
+    def make_key(query: str, repo: str, settings: str) -> str:
+        return f"{repo}|{settings}|{normalize_query(query)}"
+
+    def _live(self, e: Dict[str, Any], generation: str, now: float) -> bool:
+        return e["generation"] == generation and (self.ttl_s <= 0 or now - e["ts"] <= self.ttl_s)
+
+    def get(self, key: str, generation: str) -> Optional[Tuple[List[Dict], float]]:
+        """(results copy, seconds the original search took) or None."""
+        now = time.time()
+        with self._lock:
+            e = self._entries.get(key)
+            if e is not None and not self._live(e, generation, now):
+                self._entries.pop(key, None)
+                e = None
+            if e is None:
+                self.counts["exact_miss"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counts["exact_hit"] += 1
+            self.saved_s += e["cost_s"]
+            return _copy(e["results"]), e["cost_s"]
+
+    def get_similar(self, vec: Sequence[float], repo: str, settings: str, generation: str) -> Optional[Tuple[List[Dict], float]]:
+        import numpy as np
+        q = np.asarray(vec, dtype=np.float32)
+        qn = float(np.linalg.norm(q)) or 1.0
+        now = time.time()
+        best_key, best_sim = None, -1.0
+        with self._lock:
+            for k, e in self._entries.items():
+                if e.get("vec") is None or e["repo"] != repo or e["settings"] != settings:
+                    continue
+                if not self._live(e, generation, now):
+                    continue
+                sim = float(np.dot(q, e["vec"]) / (qn * e["vec_norm"]))
+                if sim > best_sim:
+                    best_key, best_sim = k, sim
+            if best_key is None or best_sim < self.sim_threshold:
+                self.counts["semantic_miss"] += 1
+                return None
+            e = self._entries[best_key]
+            self._entries.move_to_end(best_key)
+            self.counts["semantic_hit"] += 1
+            self.saved_s += e["cost_s"]
+            return _copy(e["results"]), e["cost_s"]
+
+    def put(self, key: str, repo: str, settings: str, generation: str, results: Sequence[Dict],
+            cost_s: float, vec: Optional[Sequence[float]] = None) -> None:
+        entry: Dict[str, Any] = {
+            "repo": repo,
+            "settings": settings,
+            "generation": generation,
+            "ts": time.time(),
+            "results": _copy(results),
+            "cost_s": float(cost_s),
+            "vec": None,
+        }
+        if vec is not None:
+            import numpy as np
+            v = np.asarray(vec, dtype=np.float32)
+            entry["vec"] = v
+            entry["vec_norm"] = float(np.linalg.norm(v)) or 1.0
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        c = self.counts
+        exact_total = c["exact_hit"] + c["exact_miss"]
+        hits = c["exact_hit"] + c["semantic_hit"]
+        return {
+            "entries": len(self._entries),
+            "semantic": self.semantic,
+            **c,
+            "hit_rate": round(hits / exact_total, 4) if exact_total else 0.0,
+            "saved_seconds": round(self.saved_s, 3),
+        }
+
+
+_CACHE: Optional[ResultCache] = None
+
+
+def enabled() -> bool:
+    return str(os.getenv("RESULT_CACHE_ENABLED", "1")).strip().lower() in {"1", "true", "on"}
+
+
+def get_cache() -> ResultCache:
+    global _CACHE
+    if _CACHE is None:
+        _CACHE = ResultCache(
+            max_entries=int(os.getenv("RESULT_CACHE_MAX", "512") or 512),
+            ttl_s=float(os.getenv("RESULT_CACHE_TTL", "600") or 600),
+            semantic=str(os.getenv("RESULT_CACHE_SEMANTIC", "0")).strip().lower() in {"1", "true", "on"},
+            sim_threshold=float(os.getenv("RESULT_CACHE_SIM", "0.95") or 0.95),
+        )
+    return _CACHE
+
+
+def record(tier: str, hit: bool, saved_s: float = 0.0) -> None:
+    """Best-effort Prometheus export (server.metrics may be unavailable in CLI use)."""
+    try:
+        from server.metrics import record_result_cache
+        record_result_cache(tier, hit, saved_s)
+    except Exception:
+        pass
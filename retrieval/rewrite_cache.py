@@ -0,0 +1,154 @@
+"""Persistent cache for LLM query rewrites.
+
+expand_queries() (multi-query variants) and the LangGraph rewrite step ask the
+generation model to rephrase the question; at temperature 0 the answer for a
+given (model, prompt, m, query) never changes, so it is computed once and
+reused across requests, eval runs and restarts.
+
+Entries live in one append-only JSONL file; the latest line per key wins and
+the file is compacted when it accumulates stale lines. Generations at
+temperature > 0 bypass the cache.
+
+Env:
+  REWRITE_CACHE_ENABLED  1|0       (default 1)
+  REWRITE_CACHE_PATH     file      (default <DATA_DIR>/cache/rewrites.jsonl)
+  REWRITE_CACHE_TTL      seconds   (default 604800 = 7 days, 0 = never expire)
+"""
+
+from __future__ import annotations
+
+import os
+import json
+import time
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from common.card_cache import enrich_model, prompt_version
+from common.paths import data_dir
+from retrieval.result_cache import normalize_query
+
+
+def _default_path() -> str:
+    return os.getenv("REWRITE_CACHE_PATH") or str(data_dir() / "cache" / "rewrites.jsonl")
+
+
+def enabled() -> bool:
+    if str(os.getenv("REWRITE_CACHE_ENABLED", "1")).strip().lower() not in {"1", "true", "on"}:
+        return False
+    try:
+        return float(os.getenv("GEN_TEMPERATURE", "0") or 0) <= 0
+    except Exception:
+        return False
+
+
+class RewriteCache:
+    def __init__(self, path: str, ttl_s: float = 604800.0):
+        self.path = path
+        self.ttl_s = float(ttl_s)
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lines = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    @staticmethod
+    def make_key(kind: str, model: str, prompt_ver: str, m: int, query: str) -> str:
+        return f"{kind}|{model}|{prompt_ver}|{int(m)}|{normalize_query(query)}"
+
+    def _live(self, e: Dict[str, Any], now: float) -> bool:
+        return self.ttl_s <= 0 or now - float(e.get("ts") or 0) <= self.ttl_s
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    o = json.loads(line)
+                    self._entries[o["key"]] = o
+                    self._lines += 1
+                except Exception:
+                    continue
+        now = time.time()
+        self._entries = {k: e for k, e in self._entries.items() if self._live(e, now)}
+        if self._lines > 2 * max(1, len(self._entries)):
+            self.compact()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        with self._lock:
+            e = self._entries.get(key)
+            if e is not None and not self._live(e, time.time()):
+                self._entries.pop(key, None)
+                e = None
+            if e is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return list(e["rewrites"])
+
+    def put(self, key: str, rewrites: List[str]) -> None:
+        e = {"key": key, "ts": time.time(), "rewrites": list(rewrites)}
+        with self._lock:
+            self._entries[key] = e
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(e, ensure_ascii=False) + "\n")
+                self._lines += 1
+            except Exception:
+                pass
+
+    def compact(self) -> None:
+        """Rewrite the file with one line per live entry."""
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                for e in self._entries.values():
+                    f.write(json.dumps(e, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.path)
+            self._lines = len(self._entries)
+        except Exception:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        looked_up = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / looked_up, 4) if looked_up else 0.0,
+            "path": self.path,
+        }
+
+
+_CACHE: Optional[RewriteCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache() -> RewriteCache:
+    global _CACHE
+    path = _default_path()
+    if _CACHE is None or _CACHE.path != path:
+        with _CACHE_LOCK:
+            if _CACHE is None or _CACHE.path != path:
+                _CACHE = RewriteCache(path, ttl_s=float(os.getenv("REWRITE_CACHE_TTL", "604800") or 604800))
+    return _CACHE
+
+
+def cached_rewrites(kind: str, query: str, m: int, prompt: str, compute: Callable[[], List[str]]) -> List[str]:
+    """Return cached rewrites for (model, prompt, m, query) or compute and store them.
+
+    compute() should raise (or return []) on failure; failures are not cached.
+    """
+    if not enabled():
+        return compute()
+    cache = get_cache()
+    key = cache.make_key(kind, enrich_model(), prompt_version(prompt), m, query)
+    hit = cache.get(key)
+    if hit:
+        return hit
+    out = compute()
+    if out:
+        cache.put(key, out)
+    return out
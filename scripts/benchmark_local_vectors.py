@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Recall@k and latency of the local vector index (VECTOR_BACKEND=local) vs exact search.
+
+Queries are either rows of the index itself (no API calls; the row's own hit is
+excluded) or golden questions embedded with the configured EMBEDDING_TYPE.
+
+Usage:
+  python scripts/benchmark_local_vectors.py --repo agro                     # 200 sampled rows, k=10
+  python scripts/benchmark_local_vectors.py --repo agro --nprobe 4,8,16,32
+  python scripts/benchmark_local_vectors.py --repo agro --queries golden
+  python scripts/benchmark_local_vectors.py --synthetic 200000 --dim 512   # no index needed
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from retrieval import local_vectors
+
+
+def _synthetic(n: int, dim: int, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    return centers[rng.integers(0, clusters, n)] + 0.35 * rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def _golden_queries(repo: str) -> list:
+    from retrieval.hybrid_search import _get_embedding
+    for p in (Path("data/golden.json"), Path("golden.json")):
+        if p.exists():
+            items = json.loads(p.read_text())
+            qs = [it["q"] for it in items if isinstance(it, dict) and it.get("q") and it.get("repo", repo) == repo]
+            return [_get_embedding(q, kind="query") for q in qs]
+    return []
+
+
+def _pct(xs, p):
+    return float(np.percentile(np.asarray(xs), p)) if xs else 0.0
+
+
+def run(idx: "local_vectors.LocalVectorIndex", queries, k: int, nprobes, skip_self: bool) -> dict:
+    exact, t_exact = [], []
+    for q, self_id in queries:
+        t = time.perf_counter()
+        hits = idx.search(q, k=k + (1 if skip_self else 0), exact=True)
+        t_exact.append((time.perf_counter() - t) * 1000)
+        exact.append({cid for cid, _ in hits if cid != self_id} if skip_self else {cid for cid, _ in hits})
+    report = {"index": dict(idx.meta), "queries": len(queries), "k": k,
+              "exact": {"p50_ms": round(_pct(t_exact, 50), 3), "p95_ms": round(_pct(t_exact, 95), 3)}, "ann": []}
+    if idx.centroids is None:
+        print("Index is flat (below LOCAL_VECTORS_IVF_MIN): local search is already exact.")
+        return report
+    for nprobe in nprobes:
+        recalls, lat = [], []
+        for (q, self_id), truth in zip(queries, exact):
+            t = time.perf_counter()
+            hits = idx.search(q, k=k + (1 if skip_self else 0), nprobe=nprobe)
+            lat.append((time.perf_counter() - t) * 1000)
+            got = [cid for cid, _ in hits if cid != self_id][:k] if skip_self else [cid for cid, _ in hits]
+            recalls.append(len(truth.intersection(got)) / max(1, len(truth)))
+        report["ann"].append({"nprobe": nprobe, f"recall@{k}": round(float(np.mean(recalls)), 4),
+                              "p50_ms": round(_pct(lat, 50), 3), "p95_ms": round(_pct(lat, 95), 3)})
+    return report
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--repo", default=os.getenv("REPO", "agro"))
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--nprobe", default="4,8,16,32", help="comma-separated nprobe values")
+    ap.add_argument("--queries", choices=["sample", "golden"], default="sample")
+    ap.add_argument("--n-queries", type=int, default=200)
+    ap.add_argument("--synthetic", type=int, default=0, help="benchmark N random clustered vectors instead of a repo index")
+    ap.add_argument("--dim", type=int, default=512)
+    args = ap.parse_args()
+    nprobes = [int(x) for x in args.nprobe.split(",") if x.strip()]
+
+    tmp = None
+    if args.synthetic:
+        tmp = tempfile.TemporaryDirectory()
+        vecs = _synthetic(args.synthetic, args.dim)
+        t = time.perf_counter()
+        local_vectors.build(tmp.name, [str(i) for i in range(len(vecs))], vecs, ivf_min=0)
+        print(f"Built synthetic index ({args.synthetic} x {args.dim}) in {time.perf_counter() - t:.1f}s")
+        idx = local_vectors.LocalVectorIndex(tmp.name)
+    else:
+        idx = local_vectors.load(args.repo)
+        if idx is None:
+            print(f"No local vector index for {args.repo!r} at {local_vectors.index_dir(args.repo)} "
+                  "(index with VECTOR_BACKEND=local first).")
+            return 1
+
+    if args.queries == "golden" and not args.synthetic:
+        queries = [(q, None) for q in _golden_queries(args.repo)]
+        skip_self = False
+    else:
+        rng = np.random.default_rng(1)
+        rows = rng.choice(len(idx), min(args.n_queries, len(idx)), replace=False)
+        queries = [(np.asarray(idx.vectors[r]), idx.ids[r]) for r in rows]
+        skip_self = True
+    if not queries:
+        print("No queries.")
+        return 1
+
+    print(json.dumps(run(idx, queries, args.k, nprobes, skip_self), indent=2))
+    if tmp is not None:
+        tmp.cleanup()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""Memory, p95 latency and recall@k of Qdrant collection configurations.
+
+Loads one set of vectors into a scratch collection per configuration (float,
+on-disk float, int8, binary, two-stage Matryoshka; see common/qdrant_config.py),
+then runs the same queries against each with several oversampling values.
+Recall is measured against exact cosine search in numpy; RAM is estimated from
+the configuration (vectors kept in RAM + quantized copy + HNSW links), since
+Qdrant does not report per-collection memory. The matryoshka config only means
+something for --repo vectors from a Matryoshka-trained model; random synthetic
+vectors lose most of their signal when truncated.
+
+Needs a Qdrant server (QDRANT_URL); the in-process ':memory:' client ignores
+quantization and HNSW settings.
+
+Usage:
+  python scripts/benchmark_qdrant_config.py --repo agro                    # vectors from the live collection
+  python scripts/benchmark_qdrant_config.py --synthetic 100000 --dim 3072
+  python scripts/benchmark_qdrant_config.py --repo agro --configs float,int8 --oversampling 1,2,4 --hnsw-ef 128
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from qdrant_client import QdrantClient, models
+
+from common import qdrant_config
+from common.qdrant_utils import recreate_collection
+from indexer.qdrant_uploader import QdrantUploader
+
+CONFIGS = {
+    "float": {"quantization": "none"},
+    "float_disk": {"quantization": "none", "on_disk": True},
+    "int8": {"quantization": "int8", "on_disk": True},
+    "binary": {"quantization": "binary", "on_disk": True},
+    # coarse 256-dim graph in RAM, full vectors on disk for rescoring (--coarse-dim)
+    "matryoshka": {"quantization": "none", "coarse_dim": 256},
+}
+
+
+def _synthetic(n: int, dim: int, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    return centers[rng.integers(0, clusters, n)] + 0.35 * rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def _repo_vectors(q: QdrantClient, repo: str, limit: int) -> np.ndarray:
+    from common.config_loader import out_dir
+    from common.index_generations import read_manifest
+    coll = read_manifest(out_dir(repo)).get("collection") or os.getenv("COLLECTION_NAME", f"code_chunks_{repo}")
+    vecs, offset = [], None
+    while len(vecs) < limit:
+        points, offset = q.scroll(coll, limit=min(1000, limit - len(vecs)), offset=offset,
+                                  with_vectors=["dense"], with_payload=False)
+        vecs.extend(p.vector["dense"] for p in points)
+        if offset is None:
+            break
+    return np.asarray(vecs, dtype=np.float32)
+
+
+def _settings(name: str, m: int, coarse: int) -> dict:
+    s = {"quant_always_ram": True, "hnsw_m": m, "hnsw_ef_construct": None, "hnsw_on_disk": False, "on_disk": False,
+         "payload_indexes": [], "coarse_dim": 0}
+    s.update(CONFIGS[name])
+    if s["coarse_dim"]:
+        s["coarse_dim"] = coarse
+    return s
+
+
+def estimate_ram_bytes(n: int, dim: int, settings: dict) -> int:
+    cd = qdrant_config.coarse_dim(dim, settings)
+    if cd:
+        # Full vectors are memory-mapped; the in-RAM coarse vectors carry the graph
+        ram, dim = n * cd * 4, cd
+    else:
+        ram = 0 if settings.get("on_disk") else n * dim * 4
+    quant = settings.get("quantization")
+    if quant == "int8":
+        ram += n * dim
+    elif quant == "binary":
+        ram += n * ((dim + 7) // 8)
+    ram += n * 2 * int(settings.get("hnsw_m") or 16) * 4  # level-0 links
+    return ram
+
+
+def _wait_indexed(q: QdrantClient, coll: str, n: int, timeout: float) -> float:
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < timeout:
+        info = q.get_collection(coll)
+        done = (info.indexed_vectors_count or 0) >= n or n < 10000  # below full_scan_threshold no graph is built
+        if info.status == models.CollectionStatus.GREEN and done:
+            break
+        time.sleep(1.0)
+    return time.perf_counter() - t0
+
+
+def _pct(xs, p):
+    return float(np.percentile(np.asarray(xs), p)) if xs else 0.0
+
+
+def run_config(q: QdrantClient, name: str, vecs: np.ndarray, queries: np.ndarray, truth, k: int,
+               oversampling, hnsw_ef, m: int, keep: bool, index_timeout: float, coarse: int = 256,
+               rescore_k: int = 256) -> dict:
+    settings = _settings(name, m, coarse)
+    coll = f"bench_{name}_{uuid.uuid4().hex[:6]}"
+    n, dim = vecs.shape
+    cd = qdrant_config.coarse_dim(dim, settings)
+    recreate_collection(q, coll, qdrant_config.vectors_config(dim, settings),
+                        **qdrant_config.collection_kwargs(settings))
+    try:
+        t0 = time.perf_counter()
+        with QdrantUploader(q, coll) as up:
+            for i, v in enumerate(vecs):
+                up.add(i, qdrant_config.point_vectors(v.tolist(), cd), None)
+        up.verify()
+        load_s = time.perf_counter() - t0
+        index_s = _wait_indexed(q, coll, n, index_timeout)
+        out = {"config": name, "settings": qdrant_config.describe(settings),
+               "est_ram_mb": round(estimate_ram_bytes(n, dim, settings) / 2**20, 1),
+               "load_s": round(load_s, 1), "index_s": round(index_s, 1), "runs": []}
+        for os_ in (oversampling if settings["quantization"] != "none" else [1.0]):
+            params = qdrant_config.search_params(hnsw_ef=hnsw_ef, oversampling=os_, rescore=True, exact=False)
+            lat, recalls = [], []
+            for qv, t in zip(queries, truth):
+                s = time.perf_counter()
+                res = q.query_points(coll, **qdrant_config.dense_query(qv.tolist(), k, cd, rescore_k, params))
+                lat.append((time.perf_counter() - s) * 1000)
+                recalls.append(len(t.intersection(int(p.id) for p in res.points)) / k)
+            out["runs"].append({"oversampling": os_, f"recall@{k}": round(float(np.mean(recalls)), 4),
+                                "p50_ms": round(_pct(lat, 50), 2), "p95_ms": round(_pct(lat, 95), 2)})
+        return out
+    finally:
+        if not keep:
+            try:
+                q.delete_collection(coll)
+            except Exception:
+                pass
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", default=os.getenv("QDRANT_URL", "http://127.0.0.1:6333"))
+    ap.add_argument("--repo", default=os.getenv("REPO", "agro"))
+    ap.add_argument("--synthetic", type=int, default=0, help="use N random clustered vectors instead of a repo collection")
+    ap.add_argument("--dim", type=int, default=3072)
+    ap.add_argument("--limit", type=int, default=50000, help="max vectors read from the repo collection")
+    ap.add_argument("--configs", default=",".join(CONFIGS), help=f"comma-separated subset of {','.join(CONFIGS)}")
+    ap.add_argument("--oversampling", default="1,2,4")
+    ap.add_argument("--hnsw-ef", type=int, default=None)
+    ap.add_argument("--hnsw-m", type=int, default=16)
+    ap.add_argument("--coarse-dim", type=int, default=256, help="coarse vector size for the matryoshka config")
+    ap.add_argument("--rescore-k", type=int, default=256, help="coarse candidates rescored at full dim")
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--n-queries", type=int, default=200)
+    ap.add_argument("--index-timeout", type=float, default=600.0)
+    ap.add_argument("--keep", action="store_true", help="keep the scratch collections")
+    args = ap.parse_args()
+
+    q = QdrantClient(url=args.url)
+    vecs = _synthetic(args.synthetic, args.dim) if args.synthetic else _repo_vectors(q, args.repo, args.limit)
+    if len(vecs) <= args.k:
+        print("Not enough vectors to benchmark.")
+        return 1
+    norm = vecs / np.maximum(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12)
+    rng = np.random.default_rng(1)
+    rows = rng.choice(len(vecs), min(args.n_queries, len(vecs)), replace=False)
+    # Perturbed rows as queries, so the answer is not just the row itself
+    queries = norm[rows] + 0.05 * rng.standard_normal((len(rows), norm.shape[1])).astype(np.float32)
+    truth = [set(np.argsort(-(norm @ qv))[:args.k].tolist()) for qv in queries]
+    oversampling = [float(x) for x in args.oversampling.split(",") if x.strip()]
+
+    report = {"vectors": int(len(vecs)), "dim": int(vecs.shape[1]), "queries": len(queries), "k": args.k, "configs": []}
+    for name in [c.strip() for c in args.configs.split(",") if c.strip()]:
+        if name not in CONFIGS:
+            print(f"Unknown config {name!r}; choose from {', '.join(CONFIGS)}")
+            return 1
+        print(f"Benchmarking {name} ...", file=sys.stderr)
+        report["configs"].append(run_config(q, name, vecs, queries, truth, args.k, oversampling, args.hnsw_ef,
+                                            args.hnsw_m, args.keep, args.index_timeout, args.coarse_dim,
+                                            args.rescore_k))
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,30 +9,36 @@ mkdir -p "$HOOKS_DIR"
 
 cat > "$HOOKS_DIR/post-checkout" << 'H'
 #!/usr/bin/env bash
-# Auto-index on branch changes when AUTO_INDEX=1
+# Auto-index on branch changes when AUTO_INDEX=1 (only files that differ are re-indexed)
 [ "${AUTO_INDEX:-0}" != "1" ] && exit 0
+[ "${3:-1}" != "1" ] && exit 0  # file checkouts don't move HEAD
 repo_root="$(git rev-parse --show-toplevel)"
 cd "$repo_root" || exit 0
 if [ -d .venv ]; then . .venv/bin/activate; fi
-export REPO=agro EMBEDDING_TYPE=local SKIP_DENSE=1
+# Dense mode and embedding type follow the live index generation
+export REPO=agro
 # Use shared profile by default
 export OUT_DIR_BASE="./out.noindex-shared"
-python -m indexer.index_repo >/dev/null 2>&1 || true
+nohup python -m indexer.incremental --live-mode >/dev/null 2>&1 &
 H
 
 cat > "$HOOKS_DIR/post-commit" << 'H'
 #!/usr/bin/env bash
-# Auto-index on commit when AUTO_INDEX=1
+# Auto-index on commit when AUTO_INDEX=1 (only files changed since the last indexed commit)
 [ "${AUTO_INDEX:-0}" != "1" ] && exit 0
 repo_root="$(git rev-parse --show-toplevel)"
 cd "$repo_root" || exit 0
 if [ -d .venv ]; then . .venv/bin/activate; fi
-export REPO=agro EMBEDDING_TYPE=local SKIP_DENSE=1
+# Dense mode and embedding type follow the live index generation
+export REPO=agro
 export OUT_DIR_BASE="./out.noindex-shared"
-python -m indexer.index_repo >/dev/null 2>&1 || true
+nohup python -m indexer.incremental --live-mode >/dev/null 2>&1 &
 H
 
-chmod +x "$HOOKS_DIR/post-checkout" "$HOOKS_DIR/post-commit"
+# Merges and pulls move HEAD without a commit hook
+sed 's/on commit/on merge\/pull/' "$HOOKS_DIR/post-commit" > "$HOOKS_DIR/post-merge"
+
+chmod +x "$HOOKS_DIR/post-checkout" "$HOOKS_DIR/post-commit" "$HOOKS_DIR/post-merge"
 echo "Installed git hooks. Enable with: export AUTO_INDEX=1"
 
 # Install pre-commit guard for root .py/.json hygiene
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Precompute LLM query rewrites for the golden set and frequent logged queries.
+
+Fills the rewrite cache (retrieval/rewrite_cache.py) so /search, /answer and
+eval runs do not pay a generation call for questions we already know about.
+
+Usage:
+  python scripts/warm_rewrite_cache.py                 # golden + top 200 log queries, m=4 and MQ_REWRITES
+  python scripts/warm_rewrite_cache.py --m 4,10 --top 500 --no-rewrite
+  python scripts/warm_rewrite_cache.py --dry-run       # list the queries only
+"""
+import os
+import sys
+import json
+import argparse
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from common.paths import repo_root
+
+
+def golden_questions() -> list:
+    for p in (repo_root() / "data" / "golden.json", repo_root() / "golden.json"):
+        if p.exists():
+            try:
+                items = json.loads(p.read_text())
+                return [str(it["q"]) for it in items if isinstance(it, dict) and it.get("q")]
+            except Exception:
+                return []
+    return []
+
+
+def frequent_log_queries(top: int) -> list:
+    try:
+        from server.telemetry import LOG_PATH
+    except Exception:
+        LOG_PATH = repo_root() / "data" / "logs" / "queries.jsonl"
+    counts: Counter = Counter()
+    if top <= 0 or not Path(LOG_PATH).exists():
+        return []
+    with open(LOG_PATH, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                evt = json.loads(line)
+            except Exception:
+                continue
+            if evt.get("type") == "query" and evt.get("query_raw"):
+                counts[str(evt["query_raw"]).strip()] += 1
+    return [q for q, _ in counts.most_common(top)]
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--m", default="", help="comma-separated multi-query counts (default: 4 and MQ_REWRITES)")
+    ap.add_argument("--top", type=int, default=200, help="most frequent logged queries to include")
+    ap.add_argument("--no-golden", action="store_true")
+    ap.add_argument("--no-rewrite", action="store_true", help="skip the single LangGraph-style rewrite")
+    ap.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args()
+
+    ms = sorted({int(x) for x in (args.m or f"4,{os.getenv('MQ_REWRITES', '2')}").split(",") if x.strip() and int(x) > 1})
+    queries = [] if args.no_golden else golden_questions()
+    for q in frequent_log_queries(args.top):
+        if q not in queries:
+            queries.append(q)
+    print(f"{len(queries)} queries, m={ms}, rewrite={'no' if args.no_rewrite else 'yes'}")
+    if args.dry_run:
+        for q in queries:
+            print(f"  {q}")
+        return 0
+
+    from retrieval import rewrite_cache
+    from retrieval.hybrid_search import expand_queries, rewrite_for_search
+    if not rewrite_cache.enabled():
+        print("Rewrite cache disabled (REWRITE_CACHE_ENABLED=0 or GEN_TEMPERATURE > 0); nothing to warm.")
+        return 1
+    cache = rewrite_cache.get_cache()
+    for i, q in enumerate(queries, 1):
+        for m in ms:
+            expand_queries(q, m=m)
+        if not args.no_rewrite:
+            try:
+                rewrite_for_search(q)
+            except Exception as e:
+                print(f"  rewrite failed for {q!r}: {e}")
+        if i % 20 == 0:
+            print(f"  {i}/{len(queries)} ({cache.stats()['misses']} generated)")
+    cache.compact()
+    print(json.dumps(cache.stats(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,25 @@
 # server/api_interceptor.py
 # Wrapper for requests library that automatically tracks all outbound API calls
-
+#
+# Tracking never sits on the caller's hot path:
+#   - Non-streamed responses are already buffered by requests, so their size is free.
+#   - Streamed responses (stream=True) are NOT buffered here; bytes are counted as
+#     the caller consumes iter_content()/iter_lines()/content, and the call is
+#     recorded when the body is exhausted or the response is closed. Time to first
+#     byte is recorded separately from total duration.
+#   - Records go to a bounded queue drained by a daemon thread (JSONL append +
+#     Prometheus), so a slow disk cannot add latency to a provider call.
+#
+# Env:
+#   API_TRACK_QUEUE_MAX   max pending records before new ones are dropped (default 10000)
+
+import os
 import time
+import queue
+import atexit
 import functools
-from typing import Any, Optional
+import threading
+from typing import Any, Dict, Optional
 import logging
 
 logger = logging.getLogger(__name__)
@@ -15,53 +31,185 @@ except ImportError:
     _requests = None
 
 
+# ---------------- background tracking ----------------
+
+_queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(
+    maxsize=int(os.getenv("API_TRACK_QUEUE_MAX", "10000") or 10000)
+)
+_worker: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+_dropped = 0
+
+
+def _drain():
+    while True:
+        item = _queue.get()
+        try:
+            if item is None:
+                return
+            from server.api_tracker import track_api_call, get_provider_from_url
+            url = item.pop("url")
+            track_api_call(provider=get_provider_from_url(url), endpoint=url, **item)
+        except Exception as e:
+            logger.debug(f"Failed to track API call: {e}")
+        finally:
+            _queue.task_done()
+
+
+def _ensure_worker():
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_drain, name="api-tracker", daemon=True)
+            _worker.start()
+
+
+def _enqueue(record: Dict[str, Any]) -> None:
+    global _dropped
+    _ensure_worker()
+    try:
+        _queue.put_nowait(record)
+    except queue.Full:
+        _dropped += 1
+
+
+def flush(timeout: float = 5.0) -> bool:
+    """Wait until queued records are written; returns False on timeout."""
+    deadline = time.time() + timeout
+    while _queue.unfinished_tasks:
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def queue_stats() -> Dict[str, int]:
+    return {"pending": _queue.qsize(), "dropped": _dropped}
+
+
+atexit.register(flush, 2.0)
+
+
+# ---------------- streamed bodies ----------------
+
+class _StreamTracker:
+    """Counts body bytes as a streamed response is consumed; records once."""
+
+    def __init__(self, response: Any, record: Dict[str, Any], start: float):
+        self.record = record
+        self.start = start
+        self.nbytes = 0
+        self.first_byte: Optional[float] = None
+        self.error: Optional[str] = None
+        self.done = False
+        self._orig_iter_content = response.iter_content
+        self._orig_close = response.close
+        # Instance attributes shadow the methods; iter_lines() and .content both
+        # go through self.iter_content, and `with` exits through self.close.
+        response.iter_content = self.iter_content
+        response.close = self.close
+
+    def iter_content(self, *args, **kwargs):
+        try:
+            for chunk in self._orig_iter_content(*args, **kwargs):
+                if self.first_byte is None:
+                    self.first_byte = time.time()
+                if chunk:
+                    self.nbytes += len(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+                yield chunk
+        except Exception as e:
+            self.error = str(e)
+            raise
+        finally:
+            # Also runs on GeneratorExit when a caller breaks out and drops the response
+            self.finish()
+
+    def close(self):
+        try:
+            self._orig_close()
+        finally:
+            self.finish()
+
+    def finish(self):
+        if self.done:
+            return
+        self.done = True
+        now = time.time()
+        rec = self.record
+        rec["duration_ms"] = (now - self.start) * 1000
+        rec["response_size_bytes"] = self.nbytes
+        if self.first_byte is not None:
+            rec["ttfb_ms"] = (self.first_byte - self.start) * 1000
+        if self.error and not rec.get("error"):
+            rec["error"] = self.error
+        _enqueue(rec)
+
+
+def _request_size(kwargs: Dict[str, Any]) -> int:
+    body = kwargs.get("data") or kwargs.get("json") or ""
+    if isinstance(body, bytes):
+        return len(body)
+    if isinstance(body, (dict, list)):
+        body = str(body)
+    return len(str(body).encode("utf-8")) if body else 0
+
+
+def _headers_ms(response: Any) -> Optional[float]:
+    # requests sets .elapsed when the response headers have been parsed
+    try:
+        return response.elapsed.total_seconds() * 1000
+    except Exception:
+        return None
+
+
 def _track_request(method: str, url: str, **kwargs) -> Any:
     """Wrapper around requests that tracks API calls."""
     if _requests is None:
         raise ImportError("requests library not available")
+    # Make the actual request using the original unwrapped method
+    return track_request(method, url, getattr(_requests, f"_original_{method.lower()}"), **kwargs)
+
 
+def track_request(method: str, url: str, send: Any, **kwargs) -> Any:
+    """Call send(url, **kwargs) (any requests-style callable) and track it.
+
+    Used by the patched module-level functions and by pooled sessions
+    (common.provider_clients.request).
+    """
     start_time = time.time()
-    status_code = None
-    error = None
-    response_size = 0
-    request_size = kwargs.get("data", "")
-    if isinstance(request_size, (dict, list)):
-        request_size = str(request_size)
-    request_size = len(str(request_size).encode("utf-8")) if request_size else 0
+    record: Dict[str, Any] = {
+        "url": url,
+        "method": method.upper(),
+        "status_code": None,
+        "error": None,
+        "request_size_bytes": _request_size(kwargs),
+        "response_size_bytes": 0,
+    }
 
     try:
-        # Make the actual request using the original unwrapped method
-        response = getattr(_requests, f"_original_{method.lower()}")(url, **kwargs)
-        status_code = response.status_code
-        response_size = len(response.content) if hasattr(response, "content") else 0
-        return response
-
+        response = send(url, **kwargs)
     except Exception as e:
-        error = str(e)
-        logger.error(f"API request failed ({method} {url}): {error}")
+        record["error"] = str(e)
+        record["duration_ms"] = (time.time() - start_time) * 1000
+        logger.error(f"API request failed ({method} {url}): {record['error']}")
+        _enqueue(record)
         raise
 
-    finally:
-        # Track the call regardless of success/failure
-        duration_ms = (time.time() - start_time) * 1000
-
-        # Import here to avoid circular dependency
-        try:
-            from server.api_tracker import track_api_call, get_provider_from_url
-            provider = get_provider_from_url(url)
-
-            track_api_call(
-                provider=provider,
-                endpoint=url,
-                method=method.upper(),
-                duration_ms=duration_ms,
-                status_code=status_code,
-                error=error,
-                request_size_bytes=request_size,
-                response_size_bytes=response_size,
-            )
-        except Exception as e:
-            logger.debug(f"Failed to track API call: {e}")
+    try:
+        record["status_code"] = response.status_code
+        if kwargs.get("stream"):
+            _StreamTracker(response, record, start_time)
+            return response
+        # Body already buffered by requests; reading its length costs nothing
+        record["response_size_bytes"] = len(response.content or b"")
+        record["ttfb_ms"] = _headers_ms(response)
+    except Exception as e:
+        logger.debug(f"Failed to inspect API response: {e}")
+    record["duration_ms"] = (time.time() - start_time) * 1000
+    _enqueue(record)
+    return response
 
 
 def setup_interceptor():
@@ -69,6 +217,8 @@ def setup_interceptor():
     if _requests is None:
         logger.warning("requests library not available, API interception disabled")
         return
+    if getattr(_requests, "_agro_intercepted", False):
+        return
 
     # Save original methods to avoid recursion
     _requests._original_post = _requests.post
@@ -98,5 +248,6 @@ def setup_interceptor():
     _requests.get = tracked_get
     _requests.put = tracked_put
     _requests.delete = tracked_delete
+    _requests._agro_intercepted = True
 
     logger.info("API request interceptor enabled - tracking all outbound API calls")
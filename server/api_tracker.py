@@ -5,11 +5,12 @@
 import logging
 import time
 import threading
-from typing import Dict, List, Any, Optional
-from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional, Tuple
+from datetime import datetime, timezone
 from dataclasses import dataclass, field
 from enum import Enum
-from collections import defaultdict
+from collections import deque
+import atexit
 import json
 from pathlib import Path
 
@@ -50,6 +51,7 @@ class APICall:
     cost_usd: float = 0.0
     request_size_bytes: int = 0
     response_size_bytes: int = 0
+    ttfb_ms: Optional[float] = None  # Time to first response byte (streamed calls)
 
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -64,43 +66,155 @@ class APICall:
             "cost_usd": self.cost_usd,
             "request_size_bytes": self.request_size_bytes,
             "response_size_bytes": self.response_size_bytes,
+            "ttfb_ms": self.ttfb_ms,
         }
 
 
-class APITracker:
-    """Track all outbound API calls with rate limiting and anomaly detection."""
+# Latency sketch: fixed log-spaced bucket upper bounds (ms); last bucket is open-ended
+LATENCY_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000, float("inf"))
+RETENTION_MINUTES = 60
+RECENT_CALLS = 5
+# Calls kept for recent_calls; filtered by the stats window, so older (late-recorded)
+# calls in the buffer don't crowd out the window's last RECENT_CALLS
+RECENT_BUFFER = RECENT_CALLS * 20
+
+
+class _MinuteBucket:
+    """Aggregates for one provider over one wall-clock minute."""
+
+    __slots__ = ("minute", "count", "errors", "duration_ms", "cost_usd", "tokens", "latency")
 
     def __init__(self):
-        self.calls: List[APICall] = []
+        self.reset(-1)
+
+    def reset(self, minute: int):
+        self.minute = minute
+        self.count = 0
+        self.errors = 0
+        self.duration_ms = 0.0
+        self.cost_usd = 0.0
+        self.tokens = 0
+        self.latency = [0] * len(LATENCY_BOUNDS_MS)
+
+
+def _latency_slot(ms: float) -> int:
+    for i, bound in enumerate(LATENCY_BOUNDS_MS):
+        if ms <= bound:
+            return i
+    return len(LATENCY_BOUNDS_MS) - 1
+
+
+def _percentile(hist: List[int], q: float) -> float:
+    """Approximate percentile from the latency sketch (linear within a bucket)."""
+    total = sum(hist)
+    if not total:
+        return 0.0
+    rank = q * total
+    seen = 0
+    for i, n in enumerate(hist):
+        if n and seen + n >= rank:
+            lo = LATENCY_BOUNDS_MS[i - 1] if i else 0.0
+            hi = LATENCY_BOUNDS_MS[i] if LATENCY_BOUNDS_MS[i] != float("inf") else lo * 2
+            return lo + (hi - lo) * ((rank - seen) / n)
+        seen += n
+    return LATENCY_BOUNDS_MS[-2]
+
+
+class _CallLogWriter:
+    """Buffers JSONL lines for API_CALLS_LOG and appends them from one daemon thread."""
+
+    def __init__(self, path: Path, max_lines: int = 200, interval_s: float = 1.0):
+        self.path = path
+        self.max_lines = max_lines
+        self.interval_s = interval_s
+        self._buf: List[str] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self.dropped = 0
+
+    def write(self, line: str):
+        with self._cond:
+            if len(self._buf) >= self.max_lines * 50:
+                self.dropped += 1
+                return
+            self._buf.append(line)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="api-call-log", daemon=True)
+                self._thread.start()
+            if len(self._buf) >= self.max_lines:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._buf) < self.max_lines:
+                    self._cond.wait(self.interval_s)
+            self.flush()
+
+    def flush(self):
+        with self._cond:
+            lines, self._buf = self._buf, []
+        if not lines:
+            return
+        try:
+            with open(self.path, "a") as f:
+                f.write("".join(lines))
+        except Exception as e:
+            logger.error(f"Failed to log API calls: {e}")
+
+
+class APITracker:
+    """Track all outbound API calls with rate limiting and anomaly detection.
+
+    Keeps per-provider rings of minute buckets (counts, errors, cost, tokens and
+    a latency sketch) for the last hour, so rate/anomaly queries cost the same
+    regardless of call volume. Individual calls only go to the JSONL log.
+    """
+
+    def __init__(self, log_path: Optional[Path] = None):
         self.lock = threading.Lock()
-        self._cleanup_thread()
-
-    def _cleanup_thread(self):
-        """Periodically clean old calls to prevent memory leak."""
-        def cleanup():
-            while True:
-                try:
-                    time.sleep(300)  # Every 5 minutes
-                    with self.lock:
-                        cutoff = datetime.utcnow() - timedelta(hours=1)
-                        self.calls = [c for c in self.calls if c.timestamp > cutoff]
-                except Exception as e:
-                    logger.error(f"Cleanup thread error: {e}")
-
-        t = threading.Thread(target=cleanup, daemon=True)
-        t.start()
+        self._buckets: Dict[APIProvider, List[_MinuteBucket]] = {
+            p: [_MinuteBucket() for _ in range(RETENTION_MINUTES)] for p in APIProvider
+        }
+        self._recent: Dict[APIProvider, "deque[Tuple[int, Dict[str, Any]]]"] = {
+            p: deque(maxlen=RECENT_BUFFER) for p in APIProvider
+        }
+        self._log = _CallLogWriter(log_path or API_CALLS_LOG)
+
+    def _bucket(self, provider: APIProvider, minute: int) -> Optional[_MinuteBucket]:
+        """Bucket for `minute`, or None when the call is too old to be counted.
+
+        A slot is only recycled for a newer minute; a late-recorded call must not
+        erase the counts of the minute that now owns its slot.
+        """
+        if minute <= int(time.time() // 60) - RETENTION_MINUTES:
+            return None
+        b = self._buckets[provider][minute % RETENTION_MINUTES]
+        if b.minute > minute:
+            return None
+        if b.minute != minute:
+            b.reset(minute)
+        return b
 
     def track_call(self, call: APICall):
         """Record an API call."""
+        record = call.to_dict()
+        is_error = bool(call.error or (call.status_code and call.status_code >= 400))
+        # APICall timestamps are naive UTC
+        minute = int(call.timestamp.replace(tzinfo=timezone.utc).timestamp() // 60) if call.timestamp else int(time.time() // 60)
         with self.lock:
-            self.calls.append(call)
-
-        # Log to JSONL for analysis
-        try:
-            with open(API_CALLS_LOG, "a") as f:
-                f.write(json.dumps(call.to_dict()) + "\n")
-        except Exception as e:
-            logger.error(f"Failed to log API call: {e}")
+            b = self._bucket(call.provider, minute)
+            if b is not None:
+                b.count += 1
+                b.errors += 1 if is_error else 0
+                b.duration_ms += float(call.duration_ms or 0.0)
+                b.cost_usd += float(call.cost_usd or 0.0)
+                b.tokens += int(call.tokens_estimated or 0)
+                b.latency[_latency_slot(float(call.duration_ms or 0.0))] += 1
+                self._recent[call.provider].append((minute, record))
+
+        # Log to JSONL for analysis (buffered, written off the caller's thread)
+        self._log.write(json.dumps(record) + "\n")
 
         # Update Prometheus metrics
         try:
@@ -111,19 +225,36 @@ class APITracker:
                 duration_seconds=call.duration_ms / 1000.0,
                 cost_usd=call.cost_usd,
                 tokens=call.tokens_estimated,
-                method=call.method
+                method=call.method,
+                ttfb_seconds=(call.ttfb_ms or 0.0) / 1000.0,
             )
         except Exception as e:
             logger.debug(f"Failed to record API call metric: {e}")
 
+    def flush(self):
+        """Write buffered call records to API_CALLS_LOG now."""
+        self._log.flush()
+
     def get_stats_for_provider(self, provider: APIProvider, minutes: int = 5) -> Dict[str, Any]:
         """Get rate statistics for a specific provider."""
-        cutoff = datetime.utcnow() - timedelta(minutes=minutes)
-
+        minutes = max(1, min(int(minutes), RETENTION_MINUTES))
+        now_min = int(time.time() // 60)
+        count = errors = tokens = 0
+        duration = cost = 0.0
+        hist = [0] * len(LATENCY_BOUNDS_MS)
         with self.lock:
-            calls = [c for c in self.calls if c.provider == provider and c.timestamp > cutoff]
-
-        if not calls:
+            for b in self._buckets[provider]:
+                if now_min - minutes < b.minute <= now_min:
+                    count += b.count
+                    errors += b.errors
+                    duration += b.duration_ms
+                    cost += b.cost_usd
+                    tokens += b.tokens
+                    for i, n in enumerate(b.latency):
+                        hist[i] += n
+            recent = [r for m, r in self._recent[provider] if now_min - minutes < m <= now_min][-RECENT_CALLS:]
+
+        if not count:
             return {
                 "provider": provider.value,
                 "period_minutes": minutes,
@@ -134,21 +265,23 @@ class APITracker:
                 "total_tokens": 0,
                 "error_count": 0,
                 "avg_duration_ms": 0.0,
+                "p50_duration_ms": 0.0,
+                "p95_duration_ms": 0.0,
             }
 
-        errors = [c for c in calls if c.error or c.status_code and c.status_code >= 400]
-
         return {
             "provider": provider.value,
             "period_minutes": minutes,
-            "call_count": len(calls),
-            "calls_per_minute": len(calls) / max(minutes, 1),
-            "total_duration_ms": sum(c.duration_ms for c in calls),
-            "total_cost_usd": sum(c.cost_usd for c in calls),
-            "total_tokens": sum(c.tokens_estimated for c in calls),
-            "error_count": len(errors),
-            "avg_duration_ms": sum(c.duration_ms for c in calls) / len(calls) if calls else 0,
-            "recent_calls": [c.to_dict() for c in calls[-5:]],  # Last 5
+            "call_count": count,
+            "calls_per_minute": count / max(minutes, 1),
+            "total_duration_ms": duration,
+            "total_cost_usd": cost,
+            "total_tokens": tokens,
+            "error_count": errors,
+            "avg_duration_ms": duration / count,
+            "p50_duration_ms": round(_percentile(hist, 0.50), 1),
+            "p95_duration_ms": round(_percentile(hist, 0.95), 1),
+            "recent_calls": recent,  # Last 5
         }
 
     def get_all_stats(self, minutes: int = 5) -> Dict[str, Any]:
@@ -212,6 +345,7 @@ class APITracker:
 
 # Global tracker instance
 _tracker = APITracker()
+atexit.register(_tracker.flush)
 
 
 def track_api_call(
@@ -225,6 +359,7 @@ def track_api_call(
     cost_usd: float = 0.0,
     request_size_bytes: int = 0,
     response_size_bytes: int = 0,
+    ttfb_ms: Optional[float] = None,
 ):
     """Record an API call - call this after making external API requests."""
     call = APICall(
@@ -238,6 +373,7 @@ def track_api_call(
         cost_usd=cost_usd,
         request_size_bytes=request_size_bytes,
         response_size_bytes=response_size_bytes,
+        ttfb_ms=ttfb_ms,
     )
     _tracker.track_call(call)
 
@@ -17,10 +17,10 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, Response
 from starlette.responses import StreamingResponse
 from server.langgraph_app import build_graph
-from server.tracing import start_trace, end_trace, Trace, latest_trace_path
-from retrieval.hybrid_search import search_routed_multi
+from server.tracing import start_trace, end_trace, Trace, recent_trace_paths, latest_trace as _latest_trace, latest_trace_with_path
+from retrieval.hybrid_search import search_routed_multi, search_federated
 from common.config_loader import load_repos, out_dir
-from server.index_stats import get_index_stats as _get_index_stats
+from server.index_stats import get_index_stats as _get_index_stats, invalidate as _invalidate_index_stats
 from typing import cast
 from server.feedback import router as feedback_router
 from server.reranker_info import router as reranker_info_router
@@ -29,6 +29,7 @@ from server.telemetry import log_query_event
 from server.reranker import rerank_candidates
 from server.frequency_limiter import FrequencyAnomalyMiddleware, get_frequency_stats
 from server.api_interceptor import setup_interceptor
+from server.profiler import router as profiler_router, ProfileRequestMiddleware
 from server.metrics import (
     init_metrics_fastapi, stage, record_tokens, record_cost,
     set_retrieval_quality, record_canary, ERRORS_TOTAL
@@ -56,11 +57,15 @@ init_metrics_fastapi(app)
 # Add frequency anomaly detection middleware (catches orphaned loops, bots)
 app.add_middleware(FrequencyAnomalyMiddleware)
 
+# Per-request sampling profile (X-Agro-Profile: 1 + admin token; see server/profiler.py)
+app.add_middleware(ProfileRequestMiddleware)
+
 # Mount routers
 app.include_router(feedback_router)
 app.include_router(reranker_info_router)
 app.include_router(alerts_router)
 app.include_router(monitoring_router)
+app.include_router(profiler_router)
 
 _graph = None
 def get_graph():
@@ -159,14 +164,9 @@ def api_langsmith_latest(
     """
     # 1) Try local trace snapshot
     try:
-        p = latest_trace_path(project or os.getenv('REPO','agro'))
-        if p:
-            try:
-                data = json.loads(Path(p).read_text())
-                if isinstance(data, dict) and data.get('langsmith_url'):
-                    return {'project': data.get('langsmith_project'), 'url': data.get('langsmith_url'), 'source': 'local'}
-            except Exception:
-                pass
+        data = _latest_trace(project or os.getenv('REPO','agro'))
+        if isinstance(data, dict) and data.get('langsmith_url'):
+            return {'project': data.get('langsmith_project'), 'url': data.get('langsmith_url'), 'source': 'local'}
     except Exception:
         pass
     # 2) Query LangSmith API
@@ -313,6 +313,42 @@ class ChatRequest(BaseModel):
     confidence: Optional[float] = None
     system_prompt: Optional[str] = None
 
+_CHAT_ENV_KEYS = (
+    'GEN_MODEL', 'GEN_TEMPERATURE', 'GEN_MAX_TOKENS', 'MQ_REWRITES', 'LANGGRAPH_FINAL_K',
+    'CONF_TOP1', 'CONF_AVG5', 'CONF_ANY', 'SYSTEM_PROMPT',
+)
+
+def _apply_chat_env(req: "ChatRequest") -> Dict[str, Optional[str]]:
+    """Apply chat settings to env; returns the previous values for _restore_env()."""
+    old_env = {k: os.environ.get(k) for k in _CHAT_ENV_KEYS}
+    if req.model:
+        os.environ['GEN_MODEL'] = req.model
+    if req.temperature is not None:
+        os.environ['GEN_TEMPERATURE'] = str(req.temperature)
+    if req.max_tokens is not None:
+        os.environ['GEN_MAX_TOKENS'] = str(req.max_tokens)
+    if req.multi_query is not None:
+        os.environ['MQ_REWRITES'] = str(req.multi_query)
+    if req.final_k is not None:
+        os.environ['LANGGRAPH_FINAL_K'] = str(req.final_k)
+    if req.confidence is not None:
+        # Scale confidence to thresholds
+        conf = req.confidence
+        os.environ['CONF_TOP1'] = str(conf + 0.05)  # Slightly higher for top-1
+        os.environ['CONF_AVG5'] = str(conf)
+        os.environ['CONF_ANY'] = str(conf - 0.05)  # Slightly lower for any
+    if req.system_prompt:
+        os.environ['SYSTEM_PROMPT'] = req.system_prompt
+    return old_env
+
+def _restore_env(old_env: Dict[str, Optional[str]]) -> None:
+    for k, v in old_env.items():
+        if v is None:
+            if k in os.environ:
+                del os.environ[k]
+        else:
+            os.environ[k] = v
+
 @app.post("/api/chat")
 def chat(req: ChatRequest, request: Request) -> Dict[str, Any]:
     """Chat endpoint with full settings control.
@@ -329,40 +365,10 @@ def chat(req: ChatRequest, request: Request) -> Dict[str, Any]:
     import time
     start_time = time.time()
     
-    # Save current env state
-    old_env = {
-        'GEN_MODEL': os.environ.get('GEN_MODEL'),
-        'GEN_TEMPERATURE': os.environ.get('GEN_TEMPERATURE'),
-        'GEN_MAX_TOKENS': os.environ.get('GEN_MAX_TOKENS'),
-        'MQ_REWRITES': os.environ.get('MQ_REWRITES'),
-        'LANGGRAPH_FINAL_K': os.environ.get('LANGGRAPH_FINAL_K'),
-        'CONF_TOP1': os.environ.get('CONF_TOP1'),
-        'CONF_AVG5': os.environ.get('CONF_AVG5'),
-        'CONF_ANY': os.environ.get('CONF_ANY'),
-        'SYSTEM_PROMPT': os.environ.get('SYSTEM_PROMPT'),
-    }
+    # Apply chat settings to env (restored in finally)
+    old_env = _apply_chat_env(req)
 
     try:
-        # Apply chat settings to env
-        if req.model:
-            os.environ['GEN_MODEL'] = req.model
-        if req.temperature is not None:
-            os.environ['GEN_TEMPERATURE'] = str(req.temperature)
-        if req.max_tokens is not None:
-            os.environ['GEN_MAX_TOKENS'] = str(req.max_tokens)
-        if req.multi_query is not None:
-            os.environ['MQ_REWRITES'] = str(req.multi_query)
-        if req.final_k is not None:
-            os.environ['LANGGRAPH_FINAL_K'] = str(req.final_k)
-        if req.confidence is not None:
-            # Scale confidence to thresholds
-            conf = req.confidence
-            os.environ['CONF_TOP1'] = str(conf + 0.05)  # Slightly higher for top-1
-            os.environ['CONF_AVG5'] = str(conf)
-            os.environ['CONF_ANY'] = str(conf - 0.05)  # Slightly lower for any
-        if req.system_prompt:
-            os.environ['SYSTEM_PROMPT'] = req.system_prompt
-
         # Run the RAG pipeline with overridden settings
         g = get_graph()
 
@@ -475,34 +481,147 @@ def chat(req: ChatRequest, request: Request) -> Dict[str, Any]:
         return response
 
     finally:
-        # Restore original env
-        for k, v in old_env.items():
-            if v is None:
-                if k in os.environ:
-                    del os.environ[k]
-            else:
-                os.environ[k] = v
+        _restore_env(old_env)
+
+
 
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def _stream_answer_sse(question: str, repo: Optional[str], route: str, request: Optional[Request],
+                       req: Optional["ChatRequest"] = None):
+    """SSE body for stream_answer(): retrieval results first, then tokens as they arrive.
+
+    The pipeline runs on its own thread so the trace context and env overrides
+    stay on one thread for the whole request; events are handed over a queue.
+    When the client goes away the worker closes the pipeline generator, which
+    stops generation at the next token.
+    """
+    import time, queue, threading, asyncio
+    from server.langgraph_app import stream_answer
+    q: "queue.Queue[Optional[str]]" = queue.Queue()
+    cancelled = threading.Event()
+    client_ip = getattr(getattr(request, 'client', None), 'host', None) if request else None
+    user_agent = request.headers.get('user-agent') if request else None
+
+    def run():
+        start_time = time.time()
+        old_env = _apply_chat_env(req) if req is not None else None
+        tr: Optional[Trace] = None
+        try:
+            try:
+                if Trace.enabled():
+                    tr = start_trace(repo=(repo or os.getenv('REPO','agro')), question=question)
+            except Exception:
+                tr = None
+            first_token = None
+            events = stream_answer(question, repo=repo)
+            for evt in events:
+                if cancelled.is_set():
+                    events.close()
+                    return
+                data = evt['data']
+                if evt['event'] == 'token' and first_token is None and not data.get('header'):
+                    first_token = time.time()
+                if evt['event'] == 'done':
+                    docs = data.pop('documents', None) or []
+                    try:
+                        data['event_id'] = log_query_event(
+                            query_raw=question,
+                            query_rewritten=None,
+                            retrieved=[{
+                                "doc_id": d.get("file_path", "") + f":{d.get('start_line', 0)}-{d.get('end_line', 0)}",
+                                "score": float(d.get("rerank_score", 0.0) or 0.0),
+                                "text": (d.get("code", "") or "")[:500],
+                                "clicked": False,
+                            } for d in docs[:10]],
+                            answer_text=data.get('answer', ''),
+                            latency_ms=int((time.time() - start_time) * 1000),
+                            cost_usd=_estimate_query_cost(question, data.get('answer', ''), len(docs)),
+                            route=route,
+                            client_ip=client_ip,
+                            user_agent=user_agent,
+                        )
+                    except Exception:
+                        data['event_id'] = None
+                    if first_token is not None:
+                        data['ttft_ms'] = int((first_token - start_time) * 1000)
+                q.put(_sse(evt['event'], data))
+        except Exception as e:
+            q.put(_sse('error', {'error': str(e)}))
+        finally:
+            try:
+                if tr is not None:
+                    end_trace()
+            except Exception:
+                pass
+            if old_env is not None:
+                _restore_env(old_env)
+            q.put(None)
+
+    threading.Thread(target=run, daemon=True).start()
+
+    async def gen():
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    item = await loop.run_in_executor(None, q.get, True, 0.5)
+                except queue.Empty:
+                    if request is not None and await request.is_disconnected():
+                        return
+                    continue
+                if item is None:
+                    return
+                yield item
+        finally:
+            # Client disconnected (or the response was torn down): stop the worker
+            cancelled.set()
 
+    return StreamingResponse(gen(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.post("/api/chat/stream")
+def chat_stream(req: ChatRequest, request: Request):
+    """Streaming variant of /api/chat (Server-Sent Events).
+
+    Emits `retrieval` (documents + citations) as soon as retrieval finishes,
+    then `token` events as the model generates, then `done` with the full answer.
+    """
+    return _stream_answer_sse(req.question, (req.repo.strip() if req.repo else None), "/api/chat/stream", request, req)
+
+@app.get("/answer/stream")
+def answer_stream(
+    q: str = Query(..., description="Question"),
+    repo: Optional[str] = Query(None, description="Repository override: agro|agro"),
+    request: Request = None,
+):
+    """Streaming variant of /answer (Server-Sent Events); see /api/chat/stream."""
+    return _stream_answer_sse(q, (repo.strip() if repo else None), "/answer/stream", request)
 
 @app.get("/search")
 def search(
     q: str = Query(..., description="Question"),
     repo: Optional[str] = Query(None, description="Repository override: agro|agro"),
     top_k: int = Query(10, description="Number of results to return"),
+    repos: Optional[str] = Query(None, description="Federated search: comma-separated repos, or 'auto' for keyword-ranked candidates"),
     response: Response = None,
     request: Request = None,
 ):
     """Search for relevant code locations without generation.
 
     Returns file paths, line ranges, and rerank scores for the most relevant code chunks.
+    With `repos`, searches several repos concurrently and merges normalized results.
     """
     import time
     start_time = time.time()
 
     # Track retrieval stage
     with stage("retrieve"):
-        docs = search_routed_multi(q, repo_override=repo, m=4, final_k=top_k)
+        if repos:
+            fed = None if repos.strip().lower() == "auto" else [r for r in repos.split(",") if r.strip()]
+            docs = search_federated(q, repos=fed, final_k=top_k)
+        else:
+            docs = search_routed_multi(q, repo_override=repo, m=4, final_k=top_k)
     
     # Apply reranker if enabled
     if os.getenv("AGRO_RERANKER_ENABLED", "0") == "1":
@@ -613,29 +732,28 @@ def api_mcp_rag_search(
 def list_traces(repo: Optional[str] = Query(None)) -> Dict[str, Any]:
     """List available trace files for a repo (defaults to current REPO)."""
     r = (repo or os.getenv('REPO','agro')).strip()
-    base = Path(out_dir(r)) / 'traces'
     files = []
-    if base.exists():
-        for p in sorted([x for x in base.glob('*.json') if x.is_file()], key=lambda x: x.stat().st_mtime, reverse=True)[:50]:
+    for sp in recent_trace_paths(r, limit=50):
+        try:
+            p = Path(sp)
             files.append({
                 'path': str(p),
                 'name': p.name,
                 'mtime': __import__('datetime').datetime.fromtimestamp(p.stat().st_mtime).isoformat()
             })
+        except OSError:
+            continue
     return {'repo': r, 'files': files}
 
 
 @app.get("/api/traces/latest")
 def latest_trace(repo: Optional[str] = Query(None)) -> Dict[str, Any]:
     r = (repo or os.getenv('REPO','agro')).strip()
-    p = latest_trace_path(r)
-    if not p:
+    data, path = latest_trace_with_path(r)
+    if data is None:
         return {'repo': r, 'trace': None}
-    try:
-        data = json.loads(Path(p).read_text())
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    return {'repo': r, 'trace': data, 'path': p}
+    # path is null until the exporter has written this trace
+    return {'repo': r, 'trace': data, 'path': path}
 
 # ---------------- Minimal GUI API stubs ----------------
 def _read_json(path: Path, default: Any) -> Any:
@@ -1563,6 +1681,7 @@ def index_start(payload: Dict[str, Any] = None) -> Dict[str, Any]:
 
             if result.returncode == 0:
                 _INDEX_STATUS.append("✓ Indexing completed successfully")
+                _invalidate_index_stats()
                 _INDEX_METADATA = _get_index_stats()
             else:
                 _INDEX_STATUS.append(f"✗ Indexing failed: {result.stderr[:200]}")
@@ -1575,6 +1694,45 @@ def index_start(payload: Dict[str, Any] = None) -> Dict[str, Any]:
 
     return {"ok": True, "success": True, "message": "Indexing started in background"}
 
+@app.post("/api/index/incremental")
+def index_incremental(payload: Dict[str, Any] = None) -> Dict[str, Any]:
+    """Re-index only files changed since the last indexed commit (full run as fallback)."""
+    global _INDEX_STATUS, _INDEX_METADATA
+    import subprocess
+    import threading
+
+    payload = payload or {}
+    repo = os.getenv("REPO", "agro")
+    cmd = [sys.executable, "-m", "indexer.incremental"]
+    if payload.get("dry_run"):
+        cmd.append("--dry-run")
+    if payload.get("no_full"):
+        cmd.append("--no-full")
+
+    _INDEX_STATUS = ["Incremental indexing started...", f"Indexing repository: {repo}"]
+    _INDEX_METADATA = {}
+
+    def run_incremental():
+        global _INDEX_STATUS, _INDEX_METADATA
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, cwd=repo_root(),
+                                    env={**os.environ, "REPO": repo})
+            lines = [ln for ln in (result.stdout or "").splitlines() if ln.strip()]
+            _INDEX_STATUS.extend(lines[-20:])
+            if result.returncode == 0:
+                _INDEX_STATUS.append("✓ Indexing completed successfully")
+                _invalidate_index_stats()
+                _INDEX_METADATA = _get_index_stats()
+            elif result.returncode == 2:
+                _INDEX_STATUS.append("✗ Indexing failed: a full index is needed")
+            else:
+                _INDEX_STATUS.append(f"✗ Indexing failed: {result.stderr[-200:]}")
+        except Exception as e:
+            _INDEX_STATUS.append(f"✗ Error: {str(e)}")
+
+    threading.Thread(target=run_incremental, daemon=True).start()
+    return {"ok": True, "success": True, "message": "Incremental indexing started in background"}
+
 @app.get("/api/index/stats")
 def index_stats() -> Dict[str, Any]:
     """Return index statistics"""
@@ -2363,36 +2521,44 @@ def _git_hooks_dir() -> Path:
     return root / ".git" / "hooks"
 
 _HOOK_POST_CHECKOUT = """#!/usr/bin/env bash
-# Auto-index on branch changes when AUTO_INDEX=1
+# Auto-index on branch changes when AUTO_INDEX=1 (only files that differ are re-indexed)
 [ "${AUTO_INDEX:-0}" != "1" ] && exit 0
+[ "${3:-1}" != "1" ] && exit 0  # file checkouts don't move HEAD
 repo_root="$(git rev-parse --show-toplevel)"
 cd "$repo_root" || exit 0
 if [ -d .venv ]; then . .venv/bin/activate; fi
-export REPO=agro EMBEDDING_TYPE=local SKIP_DENSE=1
+# Dense mode and embedding type follow the live index generation
+export REPO=agro
 export OUT_DIR_BASE="./out.noindex-shared"
-python index_repo.py >/dev/null 2>&1 || true
+nohup python -m indexer.incremental --live-mode >/dev/null 2>&1 &
 """
 
 _HOOK_POST_COMMIT = """#!/usr/bin/env bash
-# Auto-index on commit when AUTO_INDEX=1
+# Auto-index on commit when AUTO_INDEX=1 (only files changed since the last indexed commit)
 [ "${AUTO_INDEX:-0}" != "1" ] && exit 0
 repo_root="$(git rev-parse --show-toplevel)"
 cd "$repo_root" || exit 0
 if [ -d .venv ]; then . .venv/bin/activate; fi
-export REPO=agro EMBEDDING_TYPE=local SKIP_DENSE=1
+# Dense mode and embedding type follow the live index generation
+export REPO=agro
 export OUT_DIR_BASE="./out.noindex-shared"
-python index_repo.py >/dev/null 2>&1 || true
+nohup python -m indexer.incremental --live-mode >/dev/null 2>&1 &
 """
 
+# Merges and pulls move HEAD without a commit hook
+_HOOK_POST_MERGE = _HOOK_POST_COMMIT.replace("on commit", "on merge/pull")
+
 @app.get("/api/git/hooks/status")
 def git_hooks_status() -> Dict[str, Any]:
     d = _git_hooks_dir()
     pc = d / "post-checkout"
     pm = d / "post-commit"
+    pg = d / "post-merge"
     return {
         "dir": str(d),
         "post_checkout": pc.exists(),
         "post_commit": pm.exists(),
+        "post_merge": pg.exists(),
         "enabled_hint": "export AUTO_INDEX=1"
     }
 
@@ -2403,10 +2569,13 @@ def git_hooks_install() -> Dict[str, Any]:
         d.mkdir(parents=True, exist_ok=True)
         pc = d / "post-checkout"
         pm = d / "post-commit"
+        pg = d / "post-merge"
         pc.write_text(_HOOK_POST_CHECKOUT)
         pm.write_text(_HOOK_POST_COMMIT)
+        pg.write_text(_HOOK_POST_MERGE)
         os.chmod(pc, 0o755)
         os.chmod(pm, 0o755)
+        os.chmod(pg, 0o755)
         return {"ok": True, "message": "Installed git hooks. Enable with: export AUTO_INDEX=1"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -11,7 +11,10 @@ from pathlib import Path
 from typing import Dict, Any, Optional, Iterator, List
 
 from common.config_loader import out_dir
+from common.index_generations import generation_dir
+from common.card_cache import CardCache, chunk_hash, enrich_model, prompt_version, usage_tokens
 from server.env_model import generate_text
+from retrieval import cards_index
 
 
 QUICK_TIPS = [
@@ -22,6 +25,12 @@ QUICK_TIPS = [
     "Flip Enrich code chunks on for semantic cards; then Build, not Refresh.",
 ]
 
+CARD_PROMPT = (
+    "Summarize this code chunk for retrieval as a JSON object with keys: "
+    "symbols (array of names: functions/classes/components/routes), purpose (short sentence), routes (array of route paths if any). "
+    "Respond with only the JSON.\n\n"
+)
+
 
 def _progress_dir(repo: str) -> Path:
     base = Path(os.getenv("OUT_DIR_BASE") or Path(__file__).resolve().parents[1] / "out")
@@ -94,6 +103,7 @@ class CardsBuildJob:
     _queue: "queue.Queue[str]" = field(default_factory=lambda: queue.Queue(maxsize=1000))
     _cancel: threading.Event = field(default_factory=threading.Event)
     _thread: Optional[threading.Thread] = None
+    _cache: Optional[CardCache] = None
 
     def start(self) -> None:
         t = threading.Thread(target=self._run, daemon=True)
@@ -149,6 +159,8 @@ class CardsBuildJob:
             "eta_s": int(max(0, eta)),
             "throughput": thr,
         }
+        if self._cache is not None:
+            data["cache"] = self._cache.stats()
         # Persist snapshot
         try:
             prog_path = _progress_dir(self.repo) / "progress.json"
@@ -189,7 +201,7 @@ class CardsBuildJob:
         base.mkdir(parents=True, exist_ok=True)
         return {
             "base": base,
-            "chunks": base / "chunks.jsonl",
+            "chunks": Path(generation_dir(str(base))) / "chunks.jsonl",
             "cards": base / "cards.jsonl",
             "cards_txt": base / "cards.txt",
             "bm25_dir": base / "bm25_cards",
@@ -222,6 +234,8 @@ class CardsBuildJob:
             max_chunks = int(os.getenv("CARDS_MAX", "0") or "0")
             written = 0
             skipped = 0
+            if self.enrich:
+                self._cache = CardCache(str(paths["base"]), enrich_model(), prompt_version(CARD_PROMPT))
             with paths["cards"].open("w", encoding="utf-8") as out_json, paths["cards_txt"].open("w", encoding="utf-8") as out_txt:
                 for idx, ch in enumerate(_read_jsonl(chunks_path)):
                     if self._cancel.is_set():
@@ -237,25 +251,27 @@ class CardsBuildJob:
                     
                     code = (ch.get("code") or "")[:2000]
                     fp = ch.get("file_path", "")
-                    if self.enrich:
-                        prompt = (
-                            "Summarize this code chunk for retrieval as a JSON object with keys: "
-                            "symbols (array of names: functions/classes/components/routes), purpose (short sentence), routes (array of route paths if any). "
-                            "Respond with only the JSON.\n\n"
-                        )
-                        user = prompt + code
+                    cached = self._cache.get(chunk_hash(ch)) if self._cache is not None else None
+                    if cached is not None:
+                        card = cached
+                    elif self.enrich:
+                        user = CARD_PROMPT + code
                         try:
                             text, _meta = generate_text(user_input=user, system_instructions=None, reasoning_effort=None, response_format={"type": "json_object"})
                             content = (text or "").strip()
                             card: Dict[str, Any]
                             try:
                                 card = json.loads(content)
+                                if self._cache is not None:
+                                    self._cache.put(chunk_hash(ch), dict(card), usage_tokens(_meta, user, content))
                             except Exception:
                                 # Fuzzy parse: try to extract a JSON object substring; else treat as free-text purpose
                                 try:
                                     start = content.find('{'); end = content.rfind('}')
                                     if start != -1 and end != -1 and end > start:
                                         card = json.loads(content[start:end+1])
+                                        if self._cache is not None:
+                                            self._cache.put(chunk_hash(ch), dict(card), usage_tokens(_meta, user, content))
                                     else:
                                         raise ValueError('no json braces')
                                 except Exception:
@@ -290,6 +306,7 @@ class CardsBuildJob:
                         card = {"symbols": heur_syms, "purpose": purpose, "routes": heur_routes}
                     card["file_path"] = fp
                     card["id"] = ch.get("id")
+                    card["hash"] = chunk_hash(ch)
                     # Ensure minimal purpose is present
                     if not (card.get("purpose") or "").strip():
                         base = os.path.basename(fp)
@@ -307,6 +324,16 @@ class CardsBuildJob:
                     if max_chunks and written >= max_chunks:
                         break
 
+            if self._cache is not None:
+                try:
+                    # chunks.jsonl is the source of truth; drop entries for chunks that are gone
+                    self._cache.prune(chunk_hash(c) for c in _read_jsonl(chunks_path))
+                    self._cache.save()
+                    st = self._cache.stats()
+                    _log(f"cards-build cache repo={self.repo} hits={st['hits']} misses={st['misses']} saved_tokens={st['saved_tokens']}")
+                except Exception as e:
+                    _log(f"cards-build cache save failed: {e}")
+
             # Stage: write (already written incrementally)
             self.stage = "write"
             self._emit_progress(QUICK_TIPS[3])
@@ -314,24 +341,8 @@ class CardsBuildJob:
             # Stage: sparse (build BM25 index for cards)
             self.stage = "sparse"
             try:
-                import bm25s  # type: ignore
-                from bm25s.tokenization import Tokenizer  # type: ignore
-                from Stemmer import Stemmer  # type: ignore
-                stemmer = Stemmer("english")
-                tok = Tokenizer(stemmer=stemmer, stopwords="en")
-                docs = [ln.strip() for ln in paths["cards_txt"].read_text(encoding="utf-8").splitlines() if ln.strip()]
-                tokens = tok.tokenize(docs)
-                retriever = bm25s.BM25(method="lucene", k1=1.2, b=0.65)
-                retriever.index(tokens)
-                try:
-                    retriever.vocab_dict = {str(k): v for k, v in retriever.vocab_dict.items()}
-                except Exception:
-                    pass
-                paths["bm25_dir"].mkdir(parents=True, exist_ok=True)
-                retriever.save(str(paths["bm25_dir"]))
-                tok.save_vocab(save_dir=str(paths["bm25_dir"]))
-                tok.save_stopwords(save_dir=str(paths["bm25_dir"]))
-                _log(f"cards-build bm25 ok repo={self.repo} docs={len(docs)} dir={paths['bm25_dir']}")
+                ndocs = cards_index.rebuild(str(paths["base"]))
+                _log(f"cards-build bm25 ok repo={self.repo} docs={ndocs} generation={cards_index.current_generation(str(paths['base']))}")
             except Exception as e:
                 _log(f"cards-build bm25 failed: {e}")
 
@@ -344,6 +355,8 @@ class CardsBuildJob:
                 "chunks_skipped": skipped,
                 "duration_s": int(time.time() - self.started_at)
             }
+            if self._cache is not None:
+                snap["result"]["cache"] = self._cache.stats()
             try:
                 prog_path = _progress_dir(self.repo) / "progress.json"
                 prog_path.write_text(json.dumps(snap, indent=2))
@@ -1,6 +1,6 @@
 import os
 import json
-from typing import Optional, Dict, Any, Tuple
+from typing import Optional, Dict, Any, Tuple, Iterator
 
 try:
     from openai import OpenAI
@@ -10,7 +10,6 @@ except Exception as e:
 _DEFAULT_MODEL = os.getenv("GEN_MODEL", os.getenv("ENRICH_MODEL", "gpt-4o-mini"))
 _DEFAULT_TEMPERATURE = float(os.getenv("GEN_TEMPERATURE", "0.0") or 0.0)
 
-_client = None
 _mlx_model = None
 _mlx_tokenizer = None
 
@@ -23,10 +22,9 @@ def _get_mlx_model():
     return _mlx_model, _mlx_tokenizer
 
 def client() -> OpenAI:
-    global _client
-    if _client is None:
-        _client = OpenAI()
-    return _client
+    # Shared, pooled client (keep-alive/HTTP2); cached per OPENAI_API_KEY
+    from common.provider_clients import openai_client
+    return openai_client()
 
 def _extract_text(resp: Any) -> str:
     txt = ""
@@ -105,6 +103,7 @@ def generate_text(
     if prefer_ollama:
         try:
             import requests, json as _json, time
+            from common import provider_clients
             sys_text = (system_instructions or "").strip()
             prompt = (f"<system>{sys_text}</system>\n" if sys_text else "") + user_input
             url = OLLAMA_URL.rstrip("/") + "/generate"
@@ -114,7 +113,7 @@ def generate_text(
             for attempt in range(max_retries + 1):
                 start_time = time.time()
                 try:
-                    with requests.post(url, json={
+                    with provider_clients.request("POST", url, json={
                         "model": mdl,
                         "prompt": prompt,
                         "stream": True,
@@ -145,7 +144,7 @@ def generate_text(
                         text = ("".join(buf) or "").strip()
                         if text:
                             return text, (last or {"response": text})
-                    resp = requests.post(url, json={
+                    resp = provider_clients.request("POST", url, json={
                         "model": mdl,
                         "prompt": prompt,
                         "stream": False,
@@ -231,3 +230,170 @@ def generate_text(
             return text, cc
         except Exception as e:
             raise RuntimeError(f"Generation failed for model={mdl}: {e}")
+
+
+def _close_stream(stream) -> None:
+    """Close an SDK stream (drops the HTTP response, so the provider stops generating)."""
+    close = getattr(stream, "close", None)
+    if close is not None:
+        try:
+            close()
+        except Exception:
+            pass
+
+
+def generate_text_stream(
+    user_input: str,
+    *,
+    system_instructions: Optional[str] = None,
+    model: Optional[str] = None,
+    reasoning_effort: Optional[str] = None,
+    extra: Optional[Dict[str, Any]] = None,
+) -> Iterator[str]:
+    """Yield text deltas as the backend produces them (same backend choice as generate_text).
+
+    If a backend fails before emitting anything, the next one is tried; if none can
+    stream, the full generate_text() result is yielded as a single chunk. A failure
+    after text was emitted is raised (the answer would be truncated). Closing this
+    generator closes the upstream stream, which stops the provider's generation.
+    """
+    mdl = model or os.getenv("GEN_MODEL", _DEFAULT_MODEL) or _DEFAULT_MODEL
+    try:
+        temp = float(os.getenv("GEN_TEMPERATURE", str(_DEFAULT_TEMPERATURE)) or _DEFAULT_TEMPERATURE)
+    except Exception:
+        temp = _DEFAULT_TEMPERATURE
+    sys_text = (system_instructions or "").strip()
+    prompt = (f"<system>{sys_text}</system>\n" if sys_text else "") + user_input
+
+    ENRICH_BACKEND = os.getenv("ENRICH_BACKEND", "").lower()
+    if ENRICH_BACKEND == "mlx" or (mdl or "").startswith("mlx-community/"):
+        emitted = False
+        try:
+            from mlx_lm import stream_generate
+            mlx_model, tokenizer = _get_mlx_model()
+            for resp in stream_generate(mlx_model, tokenizer, prompt=prompt, max_tokens=2048):
+                seg = resp if isinstance(resp, str) else (getattr(resp, "text", "") or "")
+                if seg:
+                    emitted = True
+                    yield seg
+            return
+        except Exception:
+            if emitted:
+                raise
+
+    OLLAMA_URL = os.getenv("OLLAMA_URL")
+    if OLLAMA_URL:
+        emitted = False
+        try:
+            from common import provider_clients
+            url = OLLAMA_URL.rstrip("/") + "/generate"
+            with provider_clients.request("POST", url, json={
+                "model": mdl,
+                "prompt": prompt,
+                "stream": True,
+                "options": {"temperature": temp, "num_ctx": 8192},
+            }, timeout=60, stream=True) as r:
+                r.raise_for_status()
+                for line in r.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    try:
+                        obj = json.loads(line)
+                    except Exception:
+                        continue
+                    if not isinstance(obj, dict):
+                        continue
+                    seg = obj.get("response") or ""
+                    if seg:
+                        emitted = True
+                        yield seg
+                    if obj.get("done") is True:
+                        break
+            if emitted:
+                return
+        except Exception:
+            if emitted:
+                raise
+
+    import time as timer
+    from server.api_tracker import track_api_call, APIProvider
+
+    kwargs: Dict[str, Any] = {"model": mdl, "input": user_input, "store": False, "temperature": temp, "stream": True}
+    if system_instructions:
+        kwargs["instructions"] = system_instructions
+    if reasoning_effort:
+        kwargs["reasoning"] = {"effort": reasoning_effort}
+    if extra:
+        kwargs.update(extra)
+
+    emitted = False
+    start = timer.time()
+    first = None
+    try:
+        # OpenAI Responses API streaming events
+        tokens_used = 0
+        stream = client().responses.create(**kwargs)
+        try:
+            for event in stream:
+                etype = getattr(event, "type", "")
+                if etype == "response.output_text.delta":
+                    seg = getattr(event, "delta", "") or ""
+                    if seg:
+                        if first is None:
+                            first = timer.time()
+                        emitted = True
+                        yield seg
+                elif etype == "response.completed":
+                    usage = getattr(getattr(event, "response", None), "usage", None)
+                    tokens_used = getattr(usage, "total_tokens", 0) or 0
+        finally:
+            _close_stream(stream)
+        track_api_call(
+            provider=APIProvider.OPENAI,
+            endpoint="https://api.openai.com/v1/responses",
+            method="POST",
+            duration_ms=(timer.time() - start) * 1000,
+            status_code=200,
+            tokens_estimated=tokens_used,
+            ttfb_ms=((first - start) * 1000) if first else None,
+        )
+        return
+    except Exception:
+        if emitted:
+            raise
+
+    try:
+        messages = []
+        if system_instructions:
+            messages.append({"role": "system", "content": system_instructions})
+        messages.append({"role": "user", "content": user_input})
+        start = timer.time()
+        first = None
+        stream = client().chat.completions.create(model=mdl, messages=messages, temperature=temp, stream=True)
+        try:
+            for chunk in stream:
+                choices = getattr(chunk, "choices", None) or []
+                seg = (getattr(getattr(choices[0], "delta", None), "content", None) or "") if choices else ""
+                if seg:
+                    if first is None:
+                        first = timer.time()
+                    emitted = True
+                    yield seg
+        finally:
+            _close_stream(stream)
+        track_api_call(
+            provider=APIProvider.OPENAI,
+            endpoint="https://api.openai.com/v1/chat/completions",
+            method="POST",
+            duration_ms=(timer.time() - start) * 1000,
+            status_code=200,
+            ttfb_ms=((first - start) * 1000) if first else None,
+        )
+        return
+    except Exception:
+        if emitted:
+            raise
+
+    text, _ = generate_text(user_input, system_instructions=system_instructions, model=mdl, reasoning_effort=reasoning_effort, extra=extra)
+    if text:
+        yield text
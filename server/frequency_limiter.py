@@ -1,22 +1,30 @@
 # server/frequency_limiter.py
 # Track endpoint call frequency to detect anomalies (orphaned loops, bots, etc)
+#
+# Fixed memory: each (ip, endpoint) key holds a ring of per-bucket counters
+# (sliding-window counter, O(1) amortized per request) and keys are kept in an
+# LRU capped at FREQUENCY_MAX_KEYS. Optionally a per-key token bucket sheds load
+# with 429 before requests reach retrieval/generation.
+#
+# Env:
+#   FREQUENCY_MAX_KEYS     tracked (ip, endpoint) keys (default 10000)
+#   RATE_LIMIT_ENABLED     1|0   enable token-bucket shedding (default 0)
+#   RATE_LIMIT_RPS         tokens/second refill per key (default 5)
+#   RATE_LIMIT_BURST       bucket size per key (default 20)
+#   RATE_LIMIT_PATHS       comma-separated path prefixes to limit (default /search,/answer,/api/chat)
 
+import os
 import logging
+import threading
 import time
-from collections import defaultdict
-from typing import Dict, Tuple, Set
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
+from starlette.responses import JSONResponse
 
 logger = logging.getLogger(__name__)
 
-# Global tracking dictionaries
-# Format: {(ip, endpoint): [timestamp1, timestamp2, ...]}
-_call_history: Dict[Tuple[str, str], list] = defaultdict(list)
-
-# Format: {(ip, endpoint): (count, first_seen, last_seen, alert_fired)}
-_frequency_summary: Dict[Tuple[str, str], Tuple[int, float, float, bool]] = {}
-
 # Endpoints that are high-frequency and safe (exclude from anomaly detection)
 ALLOWED_HIGH_FREQUENCY = {
     "/health",
@@ -26,8 +34,152 @@ ALLOWED_HIGH_FREQUENCY = {
 
 # Thresholds for anomaly detection
 FREQUENCY_WINDOW_SECONDS = 300  # 5 min sliding window
+FREQUENCY_BUCKET_SECONDS = 10  # window resolution (30 buckets)
 ALERT_THRESHOLD_PER_MINUTE = 10  # Alert if > 10 calls/min from same client
-CLEANUP_THRESHOLD_CALLS = 1000  # Clean up old entries once we have 1000 (to prevent memory leak)
+SUSTAINED_SECONDS = 120  # Alert after 2 minutes of sustained high frequency
+MAX_TRACKED_KEYS = int(os.getenv("FREQUENCY_MAX_KEYS", "10000") or 10000)
+
+
+class SlidingWindowCounter:
+    """Call count over the last `window` seconds using a ring of bucket counters."""
+
+    __slots__ = ("bucket_s", "counts", "epochs", "total")
+
+    def __init__(self, window_s: float = FREQUENCY_WINDOW_SECONDS, bucket_s: float = FREQUENCY_BUCKET_SECONDS):
+        n = max(1, int(window_s // bucket_s))
+        self.bucket_s = float(bucket_s)
+        self.counts = [0] * n
+        self.epochs = [-1] * n
+        self.total = 0
+
+    def _slot(self, now: float) -> int:
+        epoch = int(now // self.bucket_s)
+        i = epoch % len(self.counts)
+        if self.epochs[i] != epoch:
+            # Bucket belongs to an older lap of the ring: expire it
+            self.total -= self.counts[i]
+            self.counts[i] = 0
+            self.epochs[i] = epoch
+        return i
+
+    def add(self, now: float) -> int:
+        i = self._slot(now)
+        self.counts[i] += 1
+        self.total += 1
+        return self.count(now)
+
+    def count(self, now: float) -> int:
+        # Drop buckets that fell out of the window since their last use
+        oldest = int(now // self.bucket_s) - len(self.counts) + 1
+        for i, e in enumerate(self.epochs):
+            if 0 <= e < oldest and self.counts[i]:
+                self.total -= self.counts[i]
+                self.counts[i] = 0
+        return self.total
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "ts")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.ts = now
+
+    def take(self, now: float) -> float:
+        """Consume one token; returns 0 if allowed, else seconds until one is available."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rate)
+        self.ts = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+
+class _KeyState:
+    __slots__ = ("window", "first_seen", "last_seen", "alert_fired", "bucket")
+
+    def __init__(self, now: float):
+        self.window = SlidingWindowCounter()
+        self.first_seen = now
+        self.last_seen = now
+        self.alert_fired = False
+        self.bucket: Optional[TokenBucket] = None
+
+
+_lock = threading.Lock()
+_keys: "OrderedDict[Tuple[str, str], _KeyState]" = OrderedDict()
+_evicted = 0
+_shed = 0
+
+
+def _rate_limit_config() -> Optional[Tuple[float, float, List[str]]]:
+    if (os.getenv("RATE_LIMIT_ENABLED", "0") or "0").strip().lower() not in {"1", "true", "on"}:
+        return None
+    try:
+        rps = float(os.getenv("RATE_LIMIT_RPS", "5") or 5)
+        burst = float(os.getenv("RATE_LIMIT_BURST", "20") or 20)
+    except Exception:
+        rps, burst = 5.0, 20.0
+    paths = [p.strip() for p in (os.getenv("RATE_LIMIT_PATHS", "/search,/answer,/api/chat") or "").split(",") if p.strip()]
+    return rps, burst, paths
+
+
+def _state(key: Tuple[str, str], now: float) -> _KeyState:
+    global _evicted
+    st = _keys.get(key)
+    if st is None:
+        st = _KeyState(now)
+        _keys[key] = st
+        while len(_keys) > MAX_TRACKED_KEYS:
+            _keys.popitem(last=False)
+            _evicted += 1
+    else:
+        _keys.move_to_end(key)
+    return st
+
+
+def _calls_per_minute(st: _KeyState, count: int, now: float) -> float:
+    span = min(float(FREQUENCY_WINDOW_SECONDS), now - st.first_seen)
+    return (count / span) * 60 if span > 0 else 0.0
+
+
+def record_call(client_ip: str, endpoint: str, now: Optional[float] = None) -> float:
+    """Record one call; returns seconds to wait if the token bucket rejects it, else 0."""
+    global _shed
+    now = time.time() if now is None else now
+    key = (client_ip, endpoint)
+    limit = _rate_limit_config()
+    with _lock:
+        st = _state(key, now)
+        if st.window.count(now) == 0:
+            # Quiet for a whole window: start a new episode
+            st.first_seen = now
+            st.alert_fired = False
+        count = st.window.add(now)
+        st.last_seen = now
+        rate = _calls_per_minute(st, count, now)
+        fire = rate > ALERT_THRESHOLD_PER_MINUTE and not st.alert_fired and now - st.first_seen > SUSTAINED_SECONDS
+        if fire:
+            # Mark alert as fired to avoid spam
+            st.alert_fired = True
+        wait = 0.0
+        if limit is not None and any(endpoint.startswith(p) for p in limit[2]):
+            if st.bucket is None or st.bucket.rate != limit[0] or st.bucket.capacity != limit[1]:
+                st.bucket = TokenBucket(limit[0], limit[1], now)
+            wait = st.bucket.take(now)
+            if wait > 0:
+                _shed += 1
+        sustained = now - st.first_seen
+    if fire:
+        logger.warning(
+            f"🔴 ANOMALY DETECTED: Client {client_ip} calling {endpoint} at "
+            f"{rate:.1f} calls/min (threshold: {ALERT_THRESHOLD_PER_MINUTE}/min). "
+            f"Sustained for {sustained:.0f}s. This pattern indicates: "
+            f"bot, infinite loop, or load test."
+        )
+    return wait
 
 
 class FrequencyAnomalyMiddleware(BaseHTTPMiddleware):
@@ -38,8 +190,8 @@ class FrequencyAnomalyMiddleware(BaseHTTPMiddleware):
     - Single client makes > 10 calls/min to same endpoint (orphaned loop pattern)
     - Pattern sustained for 2+ minutes
 
-    Metrics:
-    - agro_endpoint_calls_per_minute (gauge, per client/endpoint)
+    With RATE_LIMIT_ENABLED=1, rejects calls over the per-client token bucket
+    with 429 + Retry-After before they reach the handler.
     """
 
     async def dispatch(self, request: Request, call_next):
@@ -51,77 +203,53 @@ class FrequencyAnomalyMiddleware(BaseHTTPMiddleware):
         if endpoint in ALLOWED_HIGH_FREQUENCY:
             return await call_next(request)
 
-        # Record call
-        now = time.time()
-        key = (client_ip, endpoint)
-        _call_history[key].append(now)
-
-        # Clean up old calls outside window
-        _call_history[key] = [t for t in _call_history[key] if now - t < FREQUENCY_WINDOW_SECONDS]
+        wait = record_call(client_ip, endpoint)
+        if wait > 0:
+            try:
+                from server.metrics import ERRORS_TOTAL
+                ERRORS_TOTAL.labels(type="rate_limit").inc()
+            except Exception:
+                pass
+            return JSONResponse(
+                status_code=429,
+                content={"error": "rate_limited", "retry_after_seconds": round(wait, 2)},
+                headers={"Retry-After": str(max(1, int(wait + 0.999)))},
+            )
+        return await call_next(request)
 
-        # Check for anomaly
-        call_count = len(_call_history[key])
-        if call_count > 0:
-            window_start = _call_history[key][0]
-            window_duration = now - window_start
-            if window_duration > 0:
-                calls_per_minute = (call_count / window_duration) * 60
-
-                # Get previous state
-                prev_count, first_seen, last_seen, alert_fired = _frequency_summary.get(key, (0, now, now, False))
-
-                # Update summary
-                _frequency_summary[key] = (call_count, first_seen, now, alert_fired)
-
-                # Alert if threshold exceeded and alert not already fired
-                if calls_per_minute > ALERT_THRESHOLD_PER_MINUTE:
-                    time_since_first = now - first_seen
-
-                    if not alert_fired and time_since_first > 120:  # Alert after 2 minutes of sustained high frequency
-                        logger.warning(
-                            f"🔴 ANOMALY DETECTED: Client {client_ip} calling {endpoint} at "
-                            f"{calls_per_minute:.1f} calls/min (threshold: {ALERT_THRESHOLD_PER_MINUTE}/min). "
-                            f"Sustained for {time_since_first:.0f}s. This pattern indicates: "
-                            f"bot, infinite loop, or load test."
-                        )
-                        # Mark alert as fired to avoid spam
-                        _frequency_summary[key] = (call_count, first_seen, now, True)
 
-        # Cleanup old entries to prevent memory leak
-        if len(_call_history) > CLEANUP_THRESHOLD_CALLS:
-            # Remove entries older than 2x the window
-            cutoff_time = now - (2 * FREQUENCY_WINDOW_SECONDS)
-            _call_history.clear()  # Simple cleanup: clear all, will rebuild naturally
-            _frequency_summary.clear()
-
-        response = await call_next(request)
-        return response
-
-
-def get_frequency_stats() -> Dict:
-    """Get current frequency tracking statistics."""
+def get_frequency_stats(now: Optional[float] = None) -> Dict:
+    """Get current frequency tracking statistics (as of `now`, default the current time)."""
+    limit = _rate_limit_config()
     stats = {
-        "tracked_clients": len(_frequency_summary),
-        "tracked_endpoints": len({endpoint for _, endpoint in _frequency_summary}),
+        "tracked_clients": 0,
+        "tracked_endpoints": 0,
         "high_frequency_clients": [],
         "window_seconds": FREQUENCY_WINDOW_SECONDS,
         "alert_threshold": ALERT_THRESHOLD_PER_MINUTE,
+        "max_tracked_keys": MAX_TRACKED_KEYS,
+        "evicted_keys": _evicted,
+        "rate_limit": {"enabled": limit is not None, "rps": limit[0] if limit else None,
+                       "burst": limit[1] if limit else None, "paths": limit[2] if limit else [], "shed": _shed},
     }
 
     # Find high-frequency clients
-    current_time = time.time()
-    for (client_ip, endpoint), (count, first_seen, last_seen, alert_fired) in _frequency_summary.items():
+    now = time.time() if now is None else now
+    with _lock:
+        items = [(k, st, st.window.count(now)) for k, st in _keys.items()]
+    stats["tracked_clients"] = len(items)
+    stats["tracked_endpoints"] = len({endpoint for (_, endpoint), _, _ in items})
+    for (client_ip, endpoint), st, count in items:
         if count > ALERT_THRESHOLD_PER_MINUTE:
-            window_duration = last_seen - first_seen
+            window_duration = min(float(FREQUENCY_WINDOW_SECONDS), st.last_seen - st.first_seen)
             if window_duration > 0:
-                calls_per_minute = (count / window_duration) * 60
                 stats["high_frequency_clients"].append({
                     "client_ip": client_ip,
                     "endpoint": endpoint,
                     "calls_in_window": count,
-                    "calls_per_minute": round(calls_per_minute, 1),
+                    "calls_per_minute": round(_calls_per_minute(st, count, now), 1),
                     "duration_seconds": round(window_duration, 1),
-                    "alert_fired": alert_fired,
+                    "alert_fired": st.alert_fired,
                 })
 
     return stats
@@ -129,8 +257,9 @@ def get_frequency_stats() -> Dict:
 
 def reset_frequency_tracking():
     """Reset all frequency tracking (useful for cleanup)."""
-    global _call_history, _frequency_summary
-    _call_history.clear()
-    _frequency_summary.clear()
+    global _evicted, _shed
+    with _lock:
+        _keys.clear()
+        _evicted = 0
+        _shed = 0
     logger.info("Frequency tracking reset")
-
@@ -1,17 +1,26 @@
 import os
 import json
+import time
+import threading
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional, Tuple
 from path_config import repo_root, data_dir
+from common.index_meta import dir_size as _dir_size, gen_dir as _gen_dir, read_json as _read_json
+from common.index_meta import record_index_meta  # noqa: F401 (re-exported)
 
+# Index profiles to scan (default out, shared, gui, devclean)
+_BASE_PATHS = ["out", "out.noindex-shared", "out.noindex-gui", "out.noindex-devclean"]
 
-def _read_json(path: Path, default: Any) -> Any:
-    if path.exists():
-        try:
-            return json.loads(path.read_text())
-        except Exception:
-            return default
-    return default
+# Stats are served from memory. Per-repo entries are invalidated by file
+# mtimes; the assembled snapshot is additionally reused for INDEX_STATS_TTL
+# seconds so hot paths don't even stat().
+_lock = threading.Lock()
+_repo_cache: Dict[str, Tuple[tuple, Dict[str, Any], Optional[str]]] = {}
+_dir_cache: Dict[str, Tuple[float, List[str]]] = {}
+_branch_cache: Dict[str, Any] = {}
+_keywords_cache: Dict[str, Tuple[float, int]] = {}
+_snapshot: Dict[str, Any] = {"at": 0.0, "stats": None}
+_freshness: Dict[str, Tuple[float, Dict[str, Any]]] = {}
 
 
 def _last_index_timestamp_for_repo(base: Path, repo_name: str) -> str | None:
@@ -33,7 +42,8 @@ def _last_index_timestamp_for_repo(base: Path, repo_name: str) -> str | None:
         return ts
 
     # 2) chunks.jsonl mtime
-    chunks = repo_dir / "chunks.jsonl"
+    gen_dir = _gen_dir(repo_dir)
+    chunks = gen_dir / "chunks.jsonl"
     if chunks.exists():
         try:
             return __import__('datetime').datetime.fromtimestamp(chunks.stat().st_mtime).isoformat()
@@ -41,7 +51,7 @@ def _last_index_timestamp_for_repo(base: Path, repo_name: str) -> str | None:
             pass
 
     # 3) bm25_index dir mtime
-    bm25 = repo_dir / "bm25_index"
+    bm25 = gen_dir / "bm25_index"
     if bm25.exists():
         try:
             return __import__('datetime').datetime.fromtimestamp(bm25.stat().st_mtime).isoformat()
@@ -50,13 +60,150 @@ def _last_index_timestamp_for_repo(base: Path, repo_name: str) -> str | None:
     return None
 
 
+def _ttl() -> float:
+    try:
+        return float(os.getenv("INDEX_STATS_TTL", "2") or 2)
+    except Exception:
+        return 2.0
+
+
+def _mtime(p: Path) -> Optional[float]:
+    try:
+        return p.stat().st_mtime
+    except OSError:
+        return None
+
+
+
+def _current_branch() -> str:
+    """Branch from .git/HEAD (cached by mtime); falls back to `git branch` once."""
+    head = repo_root() / ".git" / "HEAD"
+    mt = _mtime(head)
+    if mt is not None and _branch_cache.get("mtime") == mt:
+        return _branch_cache["branch"]
+    branch = "unknown"
+    try:
+        txt = head.read_text().strip()
+        if txt.startswith("ref:"):
+            branch = txt.split("/", 2)[-1] if txt.startswith("ref: refs/heads/") else txt[4:].strip()
+        else:
+            branch = ""  # detached HEAD, same as `git branch --show-current`
+    except Exception:
+        try:
+            import subprocess
+            r = subprocess.run(["git", "branch", "--show-current"], capture_output=True, text=True, cwd=str(repo_root()))
+            branch = r.stdout.strip() if r.returncode == 0 else "unknown"
+        except Exception:
+            branch = "unknown"
+    _branch_cache.update({"mtime": mt, "branch": branch})
+    return branch
+
+
+def _repo_dirs(base_path: Path) -> List[str]:
+    mt = _mtime(base_path)
+    if mt is None:
+        return []
+    hit = _dir_cache.get(str(base_path))
+    if hit and hit[0] == mt:
+        return hit[1]
+    names = sorted(d.name for d in base_path.iterdir() if d.is_dir())
+    _dir_cache[str(base_path)] = (mt, names)
+    return names
+
+
+def _repo_entry(base_path: Path, profile_name: str, repo_name: str) -> Tuple[Dict[str, Any], Optional[str]]:
+    """Per-repo stats + last index timestamp, recomputed only when index files change."""
+    repo_dir = base_path / repo_name
+    gen_dir = _gen_dir(repo_dir)
+    chunks_file = gen_dir / "chunks.jsonl"
+    bm25_dir = gen_dir / "bm25_index"
+    cards_file = repo_dir / "cards.jsonl"
+    meta_file = repo_dir / "last_index.json"
+    sig = (_mtime(meta_file), _mtime(chunks_file), _mtime(bm25_dir), _mtime(cards_file))
+    key = str(repo_dir)
+    hit = _repo_cache.get(key)
+    if hit and hit[0] == sig:
+        return hit[1], hit[2]
+
+    meta = _read_json(meta_file, {})
+    if not isinstance(meta, dict):
+        meta = {}
+    repo_stats: Dict[str, Any] = {
+        "name": repo_name,
+        "profile": profile_name,
+        "paths": {
+            "chunks": str(chunks_file) if sig[1] is not None else None,
+            "bm25": str(bm25_dir) if sig[2] is not None else None,
+            "cards": str(cards_file) if sig[3] is not None else None,
+        },
+        "sizes": {},
+        "chunk_count": 0,
+        "has_cards": sig[3] is not None,
+    }
+    # Trust counters persisted by the indexer when they are at least as new as the artifacts
+    fresh_meta = sig[0] is not None and all(m is None or m <= sig[0] + 1 for m in (sig[1], sig[3]))
+    sizes = meta.get("sizes") if fresh_meta else None
+    if sig[1] is not None:
+        if fresh_meta and isinstance(meta.get("chunk_count"), int):
+            repo_stats["chunk_count"] = meta["chunk_count"]
+        else:
+            try:
+                with open(chunks_file, 'r') as f:
+                    repo_stats["chunk_count"] = sum(1 for _ in f)
+            except Exception:
+                pass
+        repo_stats["sizes"]["chunks"] = (sizes or {}).get("chunks") or chunks_file.stat().st_size
+    if sig[2] is not None:
+        repo_stats["sizes"]["bm25"] = (sizes or {}).get("bm25") or _dir_size(bm25_dir)
+    if sig[3] is not None:
+        repo_stats["sizes"]["cards"] = cards_file.stat().st_size
+
+    ts = _last_index_timestamp_for_repo(base_path, repo_name)
+    with _lock:
+        _repo_cache[key] = (sig, repo_stats, ts)
+    return repo_stats, ts
+
+
+def _keywords_count(repo: str) -> int:
+    keywords_file = data_dir() / f"keywords_{repo}.json"
+    mt = _mtime(keywords_file)
+    if mt is None:
+        return 0
+    hit = _keywords_cache.get(str(keywords_file))
+    if hit and hit[0] == mt:
+        return hit[1]
+    n = 0
+    try:
+        kw_data = json.loads(keywords_file.read_text())
+        n = len(kw_data) if isinstance(kw_data, list) else len(kw_data.get("keywords", []))
+    except Exception:
+        pass
+    _keywords_cache[str(keywords_file)] = (mt, n)
+    return n
+
+
+def invalidate() -> None:
+    """Drop the assembled snapshot (e.g., right after an index run)."""
+    _snapshot["at"] = 0.0
+    _freshness.clear()
+
+
 def get_index_stats() -> Dict[str, Any]:
     """Gather comprehensive indexing statistics with storage calculator integration.
 
     Prefers a persisted last_index.json timestamp if present, falling back to
-    file mtimes, then now().
+    file mtimes, then now(). Served from memory: see record_index_meta().
     """
-    import subprocess
+    now = time.time()
+    snap = _snapshot.get("stats")
+    if snap is not None and now - _snapshot["at"] < _ttl():
+        return json.loads(json.dumps(snap))
+    stats = _compute_index_stats()
+    _snapshot.update({"at": now, "stats": stats})
+    return json.loads(json.dumps(stats))
+
+
+def _compute_index_stats() -> Dict[str, Any]:
     from datetime import datetime
 
     # Get embedding configuration
@@ -90,76 +237,24 @@ def get_index_stats() -> Dict[str, Any]:
     }
 
     # Current repo + branch
-    try:
-        repo = os.getenv("REPO", "agro")
-        branch_result = subprocess.run(["git", "branch", "--show-current"], capture_output=True, text=True, cwd=str(repo_root()))
-        branch = branch_result.stdout.strip() if branch_result.returncode == 0 else "unknown"
-        stats["current_repo"] = repo
-        stats["current_branch"] = branch
-    except Exception:
-        stats["current_repo"] = os.getenv("REPO", "agro")
-        stats["current_branch"] = "unknown"
+    stats["current_repo"] = os.getenv("REPO", "agro")
+    stats["current_branch"] = _current_branch()
 
     total_chunks = 0
-
-    # Index profiles to scan (default out, shared, gui, devclean)
-    base_paths = ["out", "out.noindex-shared", "out.noindex-gui", "out.noindex-devclean"]
     discovered_ts: List[str] = []
-    for base in base_paths:
+    for base in _BASE_PATHS:
         base_path = repo_root() / base
-        if not base_path.exists():
-            continue
         profile_name = "default" if base == "out" else base.replace("out.noindex-", "")
-        repo_dirs = [d for d in base_path.iterdir() if d.is_dir()]
-        for repo_dir in repo_dirs:
-            repo_name = repo_dir.name
-            chunks_file = repo_dir / "chunks.jsonl"
-            bm25_dir = repo_dir / "bm25_index"
-            cards_file = repo_dir / "cards.jsonl"
-
-            repo_stats: Dict[str, Any] = {
-                "name": repo_name,
-                "profile": profile_name,
-                "paths": {
-                    "chunks": str(chunks_file) if chunks_file.exists() else None,
-                    "bm25": str(bm25_dir) if bm25_dir.exists() else None,
-                    "cards": str(cards_file) if cards_file.exists() else None,
-                },
-                "sizes": {},
-                "chunk_count": 0,
-                "has_cards": cards_file.exists() if cards_file else False,
-            }
-
-            # Aggregate sizes and counts
-            if chunks_file.exists():
-                size = chunks_file.stat().st_size
-                repo_stats["sizes"]["chunks"] = size
-                stats["total_storage"] += size
-                stats["storage_breakdown"]["chunks_json"] += size
-                try:
-                    with open(chunks_file, 'r') as f:
-                        cc = sum(1 for _ in f)
-                        repo_stats["chunk_count"] = cc
-                        total_chunks += cc
-                except Exception:
-                    pass
-
-            if bm25_dir.exists():
-                bm25_size = sum(f.stat().st_size for f in bm25_dir.rglob('*') if f.is_file())
-                repo_stats["sizes"]["bm25"] = bm25_size
-                stats["total_storage"] += bm25_size
-                stats["storage_breakdown"]["bm25_index"] += bm25_size
-
-            if cards_file.exists():
-                card_size = cards_file.stat().st_size
-                repo_stats["sizes"]["cards"] = card_size
-                stats["total_storage"] += card_size
-                stats["storage_breakdown"]["cards"] += card_size
-
+        for repo_name in _repo_dirs(base_path):
+            repo_stats, ts = _repo_entry(base_path, profile_name, repo_name)
+            repo_stats = json.loads(json.dumps(repo_stats))
+            sizes = repo_stats["sizes"]
+            total_chunks += int(repo_stats.get("chunk_count") or 0)
+            stats["storage_breakdown"]["chunks_json"] += sizes.get("chunks", 0)
+            stats["storage_breakdown"]["bm25_index"] += sizes.get("bm25", 0)
+            stats["storage_breakdown"]["cards"] += sizes.get("cards", 0)
+            stats["total_storage"] += sizes.get("chunks", 0) + sizes.get("bm25", 0) + sizes.get("cards", 0)
             stats["repos"].append(repo_stats)
-
-            # Try to resolve a last-index timestamp for this repo under this profile
-            ts = _last_index_timestamp_for_repo(base_path, repo_name)
             if ts:
                 discovered_ts.append(ts)
 
@@ -183,13 +278,7 @@ def get_index_stats() -> Dict[str, Any]:
             stats["costs"]["embedding_cost"] = round(embedding_cost, 4)
 
     # Try to get keywords count
-    keywords_file = data_dir() / f"keywords_{stats.get('current_repo','agro')}.json"
-    if keywords_file.exists():
-        try:
-            kw_data = json.loads(keywords_file.read_text())
-            stats["keywords_count"] = len(kw_data) if isinstance(kw_data, list) else len(kw_data.get("keywords", []))
-        except Exception:
-            pass
+    stats["keywords_count"] = _keywords_count(stats.get('current_repo', 'agro'))
 
     # Set a better global timestamp if any per-repo timestamp found
     if discovered_ts:
@@ -197,3 +286,42 @@ def get_index_stats() -> Dict[str, Any]:
 
     return stats
 
+
+def get_freshness_snapshot(repo: str) -> Dict[str, Any]:
+    """Cheap per-request freshness info for one repo (used for traces).
+
+    Reads only <out>/<repo>/last_index.json (cached, re-stat'ed at most every
+    INDEX_STATS_TTL seconds) instead of assembling full index stats.
+    """
+    now = time.time()
+    hit = _freshness.get(repo)
+    if hit is not None and now - hit[0] < _ttl():
+        return hit[1]
+    snap: Dict[str, Any] = {"repo": repo, "bm25_updated": None, "cards_updated": None,
+                            "dense_updated": None, "chunk_count": None}
+    try:
+        from common.config_loader import out_dir
+        repo_dir = Path(out_dir(repo))
+        key = str(repo_dir) + "#fresh"
+        sig = (_mtime(repo_dir / "last_index.json"), _mtime(_gen_dir(repo_dir) / "chunks.jsonl"))
+        prev = _repo_cache.get(key)
+        if prev and prev[0] == sig:
+            snap = prev[1]
+        else:
+            meta = _read_json(repo_dir / "last_index.json", {})
+            if not isinstance(meta, dict):
+                meta = {}
+            ts = _last_index_timestamp_for_repo(repo_dir.parent, repo_dir.name)
+            snap = {
+                "repo": repo,
+                "bm25_updated": meta.get("bm25_updated") or ts,
+                "cards_updated": meta.get("cards_updated"),
+                "dense_updated": meta.get("dense_updated") or (ts if meta.get("embedding_type") else None),
+                "chunk_count": meta.get("chunk_count"),
+            }
+            with _lock:
+                _repo_cache[key] = (sig, snap, ts)
+    except Exception:
+        pass
+    _freshness[repo] = (now, snap)
+    return snap
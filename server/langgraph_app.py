@@ -1,5 +1,5 @@
 import os, operator
-from typing import List, Dict, TypedDict, Annotated
+from typing import List, Dict, TypedDict, Annotated, Any, Iterator, Optional
 from pathlib import Path
 from dotenv import load_dotenv, find_dotenv
 
@@ -7,10 +7,11 @@ from dotenv import load_dotenv, find_dotenv
 
 from langgraph.graph import END, StateGraph
 from langgraph.checkpoint.redis import RedisSaver
-from retrieval.hybrid_search import search_routed_multi as hybrid_search_routed_multi
+from retrieval.hybrid_search import search_routed_multi as hybrid_search_routed_multi, rewrite_for_search
 from server.tracing import get_trace
-from server.env_model import generate_text
-from server.index_stats import get_index_stats
+from server.env_model import generate_text, generate_text_stream
+from server.index_stats import get_index_stats, get_freshness_snapshot
+from server.metrics import pipeline_stage, timed_stage
 
 # Load environment from repo root .env without hard-coded paths
 try:
@@ -44,6 +45,7 @@ def should_use_multi_query(question: str) -> bool:
             return True
     return False
 
+@timed_stage("graph.retrieve")
 def retrieve_node(state: RAGState) -> Dict:
     q = state['question']
     repo = state.get('repo') if isinstance(state, dict) else None
@@ -52,16 +54,15 @@ def retrieve_node(state: RAGState) -> Dict:
     docs = hybrid_search_routed_multi(q, repo_override=repo, m=mq, final_k=int(os.getenv('LANGGRAPH_FINAL_K','20') or 20), trace=tr)
     conf = float(sum(d.get('rerank_score',0.0) for d in docs)/max(1,len(docs)))
     repo_used = (repo or (docs[0].get('repo') if docs else os.getenv('REPO','project')))
-    # freshness snapshot (per-request)
+    # freshness snapshot (per-request; served from memory, no directory scan)
     try:
-        from server.index_stats import get_index_stats
-        stats = get_index_stats()
         if tr is not None:
+            fresh = get_freshness_snapshot(repo_used)
             tr.add('freshness.status', {
-                'bm25_updated': stats.get('timestamp'),
-                'cards_updated': None,
-                'dense_updated_min': stats.get('timestamp'),
-                'dense_updated_max': stats.get('timestamp'),
+                'bm25_updated': fresh.get('bm25_updated'),
+                'cards_updated': fresh.get('cards_updated'),
+                'dense_updated_min': fresh.get('dense_updated'),
+                'dense_updated_max': fresh.get('dense_updated'),
                 'dense_backlog': 0,
                 'vector_backend': (os.getenv('VECTOR_BACKEND','qdrant') or 'qdrant'),
             })
@@ -69,6 +70,7 @@ def retrieve_node(state: RAGState) -> Dict:
         pass
     return {'documents': docs, 'confidence': conf, 'iteration': state.get('iteration',0)+1, 'repo': repo_used}
 
+@timed_stage("graph.gate")
 def route_after_retrieval(state:RAGState)->str:
     conf = float(state.get("confidence", 0.0) or 0.0)
     it = int(state.get("iteration", 0) or 0)
@@ -107,65 +109,14 @@ def route_after_retrieval(state:RAGState)->str:
         pass
     return decision
 
+@timed_stage("graph.rewrite")
 def rewrite_query(state: RAGState) -> Dict:
     q = state['question']
-    sys = "You rewrite developer questions into search-optimized queries without changing meaning."
-    user = f"Rewrite this for code search (expand CamelCase, include API nouns), one line.\n\n{q}"
-    newq, _ = generate_text(user_input=user, system_instructions=sys, reasoning_effort=None)
-    newq = (newq or '').strip()
-    return {'question': newq}
+    # Cached per (model, prompt, question): repeated low-confidence loops skip the LLM
+    newq = rewrite_for_search(q)
+    return {'question': newq or q}
 
-def generate_node(state: RAGState) -> Dict:
-    q = state['question']; ctx = state['documents'][:5]
-    # packer summary for trace
-    try:
-        tr = get_trace()
-        if tr is not None:
-            budget = int(os.getenv('PACK_BUDGET_TOKENS', '4096') or 4096)
-            selected = []
-            for d in ctx:
-                sel = {
-                    'path': d.get('file_path'),
-                    'lines': f"L{d.get('start_line')}-L{d.get('end_line')}",
-                    'est_tokens': int(len((d.get('code') or ''))/4),
-                    'reason': ['high_rerank']
-                }
-                selected.append(sel)
-            tr.add('packer.pack', {
-                'budget_tokens': budget,
-                'diversity_penalty': 0.0,
-                'hydration_mode': (os.getenv('HYDRATION_MODE','lazy') or 'lazy'),
-                'selected': selected,
-                'final_tokens': sum(s['est_tokens'] for s in selected)
-            })
-    except Exception:
-        pass
-    ql = (q or '').lower()
-    if any(kw in ql for kw in ("last index", "last indexed", "when was this indexed", "when indexed", "index time")):
-        stats = get_index_stats()
-        repo_hdr = state.get('repo') or os.getenv('REPO','project')
-        paths = None
-        for r in stats.get('repos', []):
-            if str(r.get('name')) == str(repo_hdr):
-                paths = r.get('paths', {})
-                break
-        lines = []
-        lines.append(f"Most recent index: {stats.get('timestamp','unknown')}")
-        if paths and (paths.get('chunks') or paths.get('bm25')):
-            if paths.get('chunks'):
-                lines.append(f"chunks.jsonl: {paths['chunks']}")
-            if paths.get('bm25'):
-                lines.append(f"bm25_index: {paths['bm25']}")
-        content = "\n".join(lines)
-        header = f"[repo: {repo_hdr}]"
-        return {'generation': header + "\n" + content}
-    def _cite(d):
-        mark = " (card)" if d.get('card_hit') else ""
-        return f"- {d['file_path']}:{d['start_line']}-{d['end_line']}{mark}"
-    citations = "\n".join([_cite(d) for d in ctx])
-    context_text = "\n\n".join([d.get('code','') for d in ctx])
-    # Use custom system prompt if provided, otherwise use default
-    sys = os.getenv('SYSTEM_PROMPT') or '''You are an expert software engineer and smart home automation specialist with deep knowledge of both AGRO (Retrieval-Augmented Generation) systems and  plugin development.
+_DEFAULT_SYSTEM_PROMPT = '''You are an expert software engineer and smart home automation specialist with deep knowledge of both AGRO (Retrieval-Augmented Generation) systems and  plugin development.
 
 ## Your Expertise:
 
@@ -206,72 +157,165 @@ def generate_node(state: RAGState) -> Dict:
 - Always ground answers in the actual codebase when available
 
 You answer strictly from the provided code context. Always cite file paths and line ranges you used.'''
-    user = f"Question:\n{q}\n\nContext:\n{context_text}\n\nCitations (paths and line ranges):\n{citations}\n\nAnswer:"
-    content, _ = generate_text(user_input=user, system_instructions=sys, reasoning_effort=None)
+
+def _system_prompt() -> str:
+    # Custom system prompt if provided, otherwise the default
+    return os.getenv('SYSTEM_PROMPT') or _DEFAULT_SYSTEM_PROMPT
+
+def _trace_pack(ctx: List[Dict]) -> None:
+    # packer summary for trace
+    try:
+        tr = get_trace()
+        if tr is not None:
+            budget = int(os.getenv('PACK_BUDGET_TOKENS', '4096') or 4096)
+            selected = []
+            for d in ctx:
+                sel = {
+                    'path': d.get('file_path'),
+                    'lines': f"L{d.get('start_line')}-L{d.get('end_line')}",
+                    'est_tokens': int(len((d.get('code') or ''))/4),
+                    'reason': ['high_rerank']
+                }
+                selected.append(sel)
+            tr.add('packer.pack', {
+                'budget_tokens': budget,
+                'diversity_penalty': 0.0,
+                'hydration_mode': (os.getenv('HYDRATION_MODE','lazy') or 'lazy'),
+                'selected': selected,
+                'final_tokens': sum(s['est_tokens'] for s in selected)
+            })
+    except Exception:
+        pass
+
+def _index_time_answer(state: RAGState) -> Optional[str]:
+    """Answer 'when was this indexed' questions from index stats, without the LLM."""
+    ql = (state['question'] or '').lower()
+    if not any(kw in ql for kw in ("last index", "last indexed", "when was this indexed", "when indexed", "index time")):
+        return None
+    stats = get_index_stats()
+    repo_hdr = state.get('repo') or os.getenv('REPO','project')
+    paths = None
+    for r in stats.get('repos', []):
+        if str(r.get('name')) == str(repo_hdr):
+            paths = r.get('paths', {})
+            break
+    lines = []
+    lines.append(f"Most recent index: {stats.get('timestamp','unknown')}")
+    if paths and (paths.get('chunks') or paths.get('bm25')):
+        if paths.get('chunks'):
+            lines.append(f"chunks.jsonl: {paths['chunks']}")
+        if paths.get('bm25'):
+            lines.append(f"bm25_index: {paths['bm25']}")
+    header = f"[repo: {repo_hdr}]"
+    return header + "\n" + "\n".join(lines)
+
+def _cite(d: Dict) -> str:
+    mark = " (card)" if d.get('card_hit') else ""
+    return f"- {d['file_path']}:{d['start_line']}-{d['end_line']}{mark}"
+
+def _answer_prompt(q: str, ctx: List[Dict]) -> str:
+    citations = "\n".join([_cite(d) for d in ctx])
+    context_text = "\n\n".join([d.get('code','') for d in ctx])
+    return f"Question:\n{q}\n\nContext:\n{context_text}\n\nCitations (paths and line ranges):\n{citations}\n\nAnswer:"
+
+def _repo_header(state: RAGState, ctx: List[Dict]) -> str:
+    repo_hdr = state.get('repo') or (ctx[0].get('repo') if ctx else None) or os.getenv('REPO','project')
+    return f"[repo: {repo_hdr}]"
+
+@timed_stage("graph.generate")
+def generate_node(state: RAGState) -> Dict:
+    q = state['question']; ctx = state['documents'][:5]
+    _trace_pack(ctx)
+    canned = _index_time_answer(state)
+    if canned is not None:
+        return {'generation': canned}
+    content, _ = generate_text(user_input=_answer_prompt(q, ctx), system_instructions=_system_prompt(), reasoning_effort=None)
     content = content or ''
     conf = float(state.get('confidence', 0.0) or 0.0)
     if conf < 0.55:
         repo = state.get('repo') or os.getenv('REPO','project')
         alt_docs = hybrid_search_routed_multi(q, repo_override=repo, m=4, final_k=10)
         if alt_docs:
-            ctx2 = alt_docs[:5]
-            citations2 = "\n".join([f"- {d['file_path']}:{d['start_line']}-{d['end_line']}" + (" (card)" if d.get('card_hit') else "") for d in ctx2])
-            context_text2 = "\n\n".join([d.get('code','') for d in ctx2])
-            user2 = f"Question:\n{q}\n\nContext:\n{context_text2}\n\nCitations (paths and line ranges):\n{citations2}\n\nAnswer:"
             # Use same system prompt as first generation attempt
-            sys2 = os.getenv('SYSTEM_PROMPT') or '''You are an expert software engineer and smart home automation specialist with deep knowledge of both AGRO (Retrieval-Augmented Generation) systems and  plugin development.
-
-## Your Expertise:
-
-###  Plugin Development:
-- **Plugin Architecture**: Expert in creating device plugins, automation plugins, and integration plugins for the  smart home platform
-- **Device Interfaces**: Deep understanding of Interface types (Camera, MotionSensor, BinarySensor, Switch, Lock, Thermostat, etc.)
-- **Protocols & Communication**: 
-  - **WebRTC**: Real-time video streaming, peer connections, data channels
-  - **RTSP**: Real-Time Streaming Protocol for IP cameras
-  - **ONVIF**: Network video interface standard
-  - **HTTP/HTTPS**: REST APIs, webhooks, authentication
-  - **MQTT**: Message queuing for IoT devices
-  - **WebSockets**: Real-time bidirectional communication
-  - **FFmpeg**: Video processing, transcoding, streaming
-- **Smart Home Integration**: HomeKit, Alexa, Google Assistant, Home Assistant
-- **AI & Computer Vision**: Motion detection, object recognition, face detection
-- **Device Management**: Discovery, pairing, state management, event handling
-
-### AGRO RAG System:
-- **Hybrid Search**: BM25 + dense vector retrieval with reranking
-- **Vector Databases**: Qdrant, embeddings, semantic search
-- **Code Analysis**: AST chunking, semantic cards, keyword generation
-- **Multi-Repository**: Routing, indexing, evaluation systems
-- **MCP Integration**: Model Context Protocol for AI agents
-
-## Your Role:
-- Answer questions about both AGRO and  codebases with expert precision
-- Help developers create robust, efficient  plugins for any device type
-- Provide guidance on protocol implementation, interface design, and best practices
-- Always cite specific file paths and line ranges from the provided code context
-- Offer practical, production-ready solutions with error handling and edge cases
-
-## Response Style:
-- Be direct and technical, but accessible
-- Include relevant code examples when helpful
-- Explain the "why" behind recommendations
-- Consider performance, security, and maintainability
-- Always ground answers in the actual codebase when available
-
-You answer strictly from the provided code context. Always cite file paths and line ranges you used.'''
-            content2, _ = generate_text(user_input=user2, system_instructions=sys2, reasoning_effort=None)
+            content2, _ = generate_text(user_input=_answer_prompt(q, alt_docs[:5]), system_instructions=_system_prompt(), reasoning_effort=None)
             content = (content2 or content or '')
-    repo_hdr = state.get('repo') or (ctx[0].get('repo') if ctx else None) or os.getenv('REPO','project')
-    header = f"[repo: {repo_hdr}]"
-    return {'generation': header + "\n" + content}
+    return {'generation': _repo_header(state, ctx) + "\n" + content}
 
+@timed_stage("graph.fallback")
 def fallback_node(state: RAGState) -> Dict:
     repo_hdr = state.get('repo') or (state.get('documents', [])[0].get('repo') if state.get('documents') else None) or os.getenv('REPO','project')
     header = f"[repo: {repo_hdr}]"
     msg = "I don't have high confidence from local code. Try refining the question or expanding the context."
     return {'generation': header + "\n" + msg}
 
+def _retrieval_event(docs: List[Dict], state: RAGState, stage: str) -> Dict[str, Any]:
+    return {'event': 'retrieval', 'data': {
+        'stage': stage,
+        'repo': state.get('repo'),
+        'iteration': state.get('iteration', 0),
+        'confidence': state.get('confidence', 0.0),
+        'citations': [_cite(d) for d in docs[:5]],
+        'documents': [{
+            'file_path': d.get('file_path'),
+            'start_line': d.get('start_line'),
+            'end_line': d.get('end_line'),
+            'rerank_score': float(d.get('rerank_score', 0.0) or 0.0),
+            'card_hit': bool(d.get('card_hit')),
+        } for d in docs],
+    }}
+
+def stream_answer(question: str, repo: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Run the graph's flow step by step, yielding events as soon as each stage is done.
+
+    Events: 'retrieval' (documents + citations, after every retrieve), 'token'
+    (answer text deltas, starting with the repo header) and a final 'done'
+    carrying the full answer. Follows the same retrieve -> gate -> rewrite loop
+    as build_graph(); for low-confidence results the alternate retrieval runs
+    before generation instead of re-generating afterwards, since streamed
+    tokens cannot be taken back.
+    """
+    state: Dict[str, Any] = {'question': question, 'documents': [], 'generation': '', 'iteration': 0, 'confidence': 0.0, 'repo': repo}
+    while True:
+        upd = retrieve_node(state)
+        state['documents'] = state['documents'] + upd['documents']  # same reducer as RAGState
+        state.update({k: v for k, v in upd.items() if k != 'documents'})
+        yield _retrieval_event(upd['documents'], state, 'retrieve')
+        decision = route_after_retrieval(state)
+        if decision != 'rewrite_query':
+            break
+        state.update(rewrite_query(state))
+
+    if decision == 'fallback':
+        text = fallback_node(state)['generation']
+        yield {'event': 'token', 'data': {'text': text}}
+        yield {'event': 'done', 'data': {'answer': text, 'confidence': state['confidence'], 'repo': state['repo']}}
+        return
+
+    q = state['question']; ctx = state['documents'][:5]
+    _trace_pack(ctx)
+    canned = _index_time_answer(state)
+    if canned is not None:
+        yield {'event': 'token', 'data': {'text': canned}}
+        yield {'event': 'done', 'data': {'answer': canned, 'confidence': state['confidence'], 'repo': state['repo']}}
+        return
+    gen_ctx = ctx
+    if float(state.get('confidence', 0.0) or 0.0) < 0.55:
+        with pipeline_stage("graph.retrieve_alt"):
+            alt_docs = hybrid_search_routed_multi(q, repo_override=(state.get('repo') or os.getenv('REPO','project')), m=4, final_k=10)
+        if alt_docs:
+            gen_ctx = alt_docs[:5]
+            yield _retrieval_event(alt_docs, state, 'low_confidence')
+    parts = [_repo_header(state, ctx) + "\n"]
+    # Marked so time-to-first-token is measured to the first model delta, not the header
+    yield {'event': 'token', 'data': {'text': parts[0], 'header': True}}
+    # Timed as graph.generate (includes time the consumer spends between tokens)
+    with pipeline_stage("graph.generate"):
+        for seg in generate_text_stream(user_input=_answer_prompt(q, gen_ctx), system_instructions=_system_prompt(), reasoning_effort=None):
+            parts.append(seg)
+            yield {'event': 'token', 'data': {'text': seg}}
+    answer = "".join(parts)
+    yield {'event': 'done', 'data': {'answer': answer, 'confidence': state['confidence'], 'repo': state['repo'], 'documents': state['documents']}}
+
 def build_graph():
     builder = StateGraph(RAGState)
     builder.add_node('retrieve', retrieve_node)
@@ -3,6 +3,7 @@
 # Exposes /metrics and provides helpers for RAG/canary metrics you asked for.
 
 from contextlib import contextmanager
+from functools import wraps
 from typing import Optional
 import time
 
@@ -12,6 +13,8 @@ from prometheus_client import (
 
 # Latency buckets tuned for LLM/RAG (seconds)
 LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 21, 34, 60)
+# Finer buckets for individual pipeline steps (BM25/fusion/scoring run in ms)
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
 
 # ---- Core request & latency ----
 REQUESTS_TOTAL = Counter(
@@ -27,6 +30,13 @@ REQUEST_DURATION = Histogram(
     buckets=LATENCY_BUCKETS,
 )
 
+PIPELINE_STAGE_DURATION = Histogram(
+    "agro_pipeline_stage_seconds",
+    "Retrieval/graph pipeline step durations in seconds",
+    labelnames=("stage",),  # e.g. 'search.embed' | 'search.bm25' | 'search.rerank' | 'graph.generate'
+    buckets=STAGE_BUCKETS,
+)
+
 # ---- Tokens & cost ----
 TOKENS_TOTAL = Counter(
     "agro_tokens_total",
@@ -100,6 +110,13 @@ API_CALL_DURATION = Histogram(
     buckets=LATENCY_BUCKETS,
 )
 
+API_CALL_TTFB = Histogram(
+    "agro_api_call_ttfb_seconds",
+    "Outbound API call time to first response byte in seconds",
+    labelnames=("provider",),
+    buckets=LATENCY_BUCKETS,
+)
+
 API_CALL_COST_USD = Counter(
     "agro_api_call_cost_usd",
     "USD cost of outbound API calls by provider",
@@ -112,6 +129,18 @@ API_CALL_TOKENS = Counter(
     labelnames=("provider",),
 )
 
+# ---- Search result cache ----
+RESULT_CACHE_TOTAL = Counter(
+    "agro_result_cache_total",
+    "Search result cache lookups by tier and outcome",
+    labelnames=("tier", "outcome"),  # tier: exact|semantic, outcome: hit|miss
+)
+
+RESULT_CACHE_SAVED_SECONDS = Counter(
+    "agro_result_cache_saved_seconds_total",
+    "Retrieval latency avoided by result cache hits (seconds)",
+)
+
 def _classify_error(exc: BaseException) -> str:
     n = exc.__class__.__name__.lower()
     msg = str(exc).lower()
@@ -144,6 +173,49 @@ def stage(name: str, provider: str = "", model: str = "", route: str = ""):
     else:
         REQUEST_DURATION.labels(stage=name).observe(time.perf_counter() - start)
 
+class _NoSpan:
+    def set_attribute(self, key, value):
+        pass
+
+
+@contextmanager
+def pipeline_stage(name: str, tracer=None, span_name: str = "", **attributes):
+    """
+    with pipeline_stage("search.bm25", tracer=_tracer, span_name="agro.bm25_search", topk=k) as span:
+        ... one step of the retrieval/graph pipeline ...
+        span.set_attribute("results_count", n)
+
+    Observes agro_pipeline_stage_seconds{stage=name}. With an OpenTelemetry
+    tracer the step also becomes a span (span_name, default "agro.<name>");
+    without one a no-op span is yielded so callers have a single code path.
+    """
+    start = time.perf_counter()
+    try:
+        # X-Agro-Profile requests: sample the thread running this stage (traced or not)
+        from server.profiler import note_thread
+        note_thread()
+    except Exception:
+        pass
+    try:
+        if tracer is not None:
+            with tracer.start_as_current_span(span_name or f"agro.{name}", attributes=attributes or None) as span:
+                yield span
+        else:
+            yield _NoSpan()
+    finally:
+        PIPELINE_STAGE_DURATION.labels(stage=name).observe(time.perf_counter() - start)
+
+
+def timed_stage(name: str):
+    """Decorator form of pipeline_stage() (used for LangGraph nodes)."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with pipeline_stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
 # ---------- Simple helpers you can call from your pipeline ----------
 def record_tokens(role: str, provider: str, model: str, count: int):
     TOKENS_TOTAL.labels(role=role, provider=provider, model=model).inc(max(0, int(count)))
@@ -170,26 +242,57 @@ def record_canary(provider: str, model: str, passed: bool, margin: Optional[floa
         RERANKER_WINNER_TOTAL.labels(winner=winner).inc()
 
 def record_api_call(provider: str, status_code: int = 200, duration_seconds: float = 0.0,
-                    cost_usd: float = 0.0, tokens: int = 0, method: str = "POST"):
+                    cost_usd: float = 0.0, tokens: int = 0, method: str = "POST",
+                    ttfb_seconds: float = 0.0):
     """Record metrics for an outbound API call."""
     API_CALLS_TOTAL.labels(provider=provider, method=method, status_code=str(status_code)).inc()
     if duration_seconds > 0:
         API_CALL_DURATION.labels(provider=provider).observe(duration_seconds)
+    if ttfb_seconds > 0:
+        API_CALL_TTFB.labels(provider=provider).observe(ttfb_seconds)
     if cost_usd > 0:
         API_CALL_COST_USD.labels(provider=provider).inc(cost_usd)
     if tokens > 0:
         API_CALL_TOKENS.labels(provider=provider).inc(tokens)
 
+def record_result_cache(tier: str, hit: bool, saved_seconds: float = 0.0):
+    RESULT_CACHE_TOTAL.labels(tier=tier, outcome="hit" if hit else "miss").inc()
+    if hit and saved_seconds > 0:
+        RESULT_CACHE_SAVED_SECONDS.inc(saved_seconds)
+
 # ---------- FastAPI integration ----------
 # This middleware measures end-to-end request time and increments agro_requests_total.
 # It reads provider/model from response headers that your endpoint sets: X-Provider / X-Model.
+# The route label is the matched route template (/api/cards/build/status/{job_id}), never
+# the raw path, so ids in URLs don't create a new time series per request.
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
 from starlette.responses import Response
+from starlette.routing import Match
+
+UNMATCHED_ROUTE = "__unmatched__"
+
+def _route_template(request: Request, scope0: dict) -> str:
+    # FastAPI records the matched APIRoute in the (shared) scope during call_next
+    route = request.scope.get("route")
+    path = getattr(route, "path", None)
+    if path:
+        return path
+    # Mounts (/metrics, static files) and plain Starlette routes: match the
+    # pre-routing scope again (routing rewrites root_path for mounts)
+    router = getattr(getattr(request, "app", None), "router", None)
+    for r in getattr(router, "routes", None) or []:
+        try:
+            match, _ = r.matches(scope0)
+        except Exception:
+            continue
+        if match == Match.FULL:
+            return getattr(r, "path", None) or UNMATCHED_ROUTE
+    return UNMATCHED_ROUTE
 
 class MetricsMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
-        route_path = request.url.path
+        scope0 = dict(request.scope)
         start = time.perf_counter()
         success = "false"
         provider = ""
@@ -206,7 +309,7 @@ class MetricsMiddleware(BaseHTTPMiddleware):
             raise
         finally:
             REQUEST_DURATION.labels(stage="request").observe(time.perf_counter() - start)
-            REQUESTS_TOTAL.labels(route=route_path, provider=provider, model=model, success=success).inc()
+            REQUESTS_TOTAL.labels(route=_route_template(request, scope0), provider=provider, model=model, success=success).inc()
 
 def init_metrics_fastapi(app):
     # add middleware and mount /metrics
@@ -0,0 +1,312 @@
+# server/profiler.py
+# Low-overhead sampling profiler for live servers (admin only).
+#
+# A daemon thread snapshots every thread's Python stack via sys._current_frames()
+# at a fixed interval and counts identical stacks. Output is the "collapsed"
+# format understood by flamegraph.pl / speedscope / inferno:
+#
+#   MainThread;serve (server.py:12);handle (app.py:228) 17
+#
+# Nothing is instrumented and no tracing hook is installed, so the profiled code
+# runs at full speed; the cost is one stack walk per thread per sample on the
+# sampler thread. Only one profile runs at a time per process.
+#
+# Two ways to use it:
+#   GET /api/admin/profile?seconds=10        profile all threads for N seconds
+#   X-Agro-Profile: 1 header on any request  profile that request; the collapsed
+#                                            stacks are added to its Trace as a
+#                                            'profile.collapsed' event, or, when
+#                                            the request has no trace, kept under
+#                                            an id returned in the X-Agro-Profile
+#                                            header: GET /api/admin/profile/<id>
+# Both require the admin token (X-Admin-Token or Authorization: Bearer).
+#
+# Env:
+#   ADMIN_TOKEN             required; admin endpoints return 404 when unset
+#   PROFILER_MAX_SECONDS    upper bound for ?seconds (default 60)
+#   PROFILER_INTERVAL_MS    default sampling interval (default 10)
+#   PROFILER_KEEP           untraced request profiles kept for retrieval (default 16)
+
+import os
+import sys
+import hmac
+import time
+import asyncio
+import uuid
+import threading
+from collections import Counter, OrderedDict
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+router = APIRouter(prefix="/api/admin", tags=["admin"])
+
+PROFILE_HEADER = "x-agro-profile"
+MAX_STACK_DEPTH = 128
+
+# Leaf frames of threads that are parked (pool workers, event loop selector)
+_IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+}
+
+
+def _max_seconds() -> float:
+    try:
+        return max(1.0, float(os.getenv("PROFILER_MAX_SECONDS", "60") or 60))
+    except Exception:
+        return 60.0
+
+
+def _default_interval_ms() -> float:
+    try:
+        return float(os.getenv("PROFILER_INTERVAL_MS", "10") or 10)
+    except Exception:
+        return 10.0
+
+
+def _frame_label(code) -> str:
+    fn = code.co_filename
+    short = os.path.basename(fn)
+    parent = os.path.basename(os.path.dirname(fn))
+    if parent and parent not in ("site-packages", "lib"):
+        short = f"{parent}/{short}"
+    # ';' separates frames in the collapsed format
+    return f"{code.co_name} ({short}:{code.co_firstlineno})".replace(";", ":")
+
+
+class SamplingProfiler:
+    """Counts identical Python stacks across threads at a fixed interval."""
+
+    def __init__(self, interval_s: float = 0.01, include_idle: bool = False,
+                 thread_ids: Optional[set] = None):
+        self.interval_s = min(1.0, max(0.001, float(interval_s)))
+        self.include_idle = include_idle
+        self.thread_ids = thread_ids
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at = 0.0
+        self.stopped_at = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for tid, frame in sys._current_frames().items():
+            if tid == own or (self.thread_ids is not None and tid not in self.thread_ids):
+                continue
+            if not self.include_idle:
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+                    continue
+            labels: List[str] = []
+            f = frame
+            while f is not None and len(labels) < MAX_STACK_DEPTH:
+                labels.append(_frame_label(f.f_code))
+                f = f.f_back
+            labels.append(str(names.get(tid, tid)).replace(";", ":"))
+            labels.reverse()
+            self.stacks[";".join(labels)] += 1
+        self.samples += 1
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            try:
+                self._sample()
+            except Exception:
+                pass
+
+    def start(self) -> "SamplingProfiler":
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="agro-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> "SamplingProfiler":
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+        self.stopped_at = time.time()
+        return self
+
+    def collapsed(self, limit: Optional[int] = None) -> str:
+        """flamegraph.pl input: one 'frame;frame;frame count' line per stack."""
+        items = self.stacks.most_common(limit)
+        return "\n".join(f"{stack} {n}" for stack, n in items) + ("\n" if items else "")
+
+    def to_dict(self, limit: Optional[int] = None) -> Dict[str, Any]:
+        return {
+            "duration_s": round((self.stopped_at or time.time()) - self.started_at, 3),
+            "interval_ms": round(self.interval_s * 1000, 2),
+            "samples": self.samples,
+            "stacks": [{"stack": s, "count": n} for s, n in self.stacks.most_common(limit)],
+        }
+
+
+class _RequestProfile:
+    """Profile of one X-Agro-Profile request: sampled threads and whether a Trace took it."""
+
+    __slots__ = ("prof", "threads", "attached")
+
+    def __init__(self, prof: SamplingProfiler, threads: set):
+        self.prof = prof
+        self.threads = threads
+        self.attached = False
+
+
+# One profile at a time: profiling must never pile up on a struggling node
+_busy = threading.Lock()
+_REQUEST_PROFILE: ContextVar[Optional[_RequestProfile]] = ContextVar("agro_request_profile", default=None)
+# Request profiles no Trace picked up (tracing off), retrievable by id
+_kept: "OrderedDict[str, SamplingProfiler]" = OrderedDict()
+_kept_lock = threading.Lock()
+
+
+def _keep_limit() -> int:
+    try:
+        return max(1, int(os.getenv("PROFILER_KEEP", "16") or 16))
+    except Exception:
+        return 16
+
+
+def _keep(prof: SamplingProfiler) -> str:
+    pid = uuid.uuid4().hex[:12]
+    with _kept_lock:
+        _kept[pid] = prof
+        while len(_kept) > _keep_limit():
+            _kept.popitem(last=False)
+    return pid
+
+
+def _admin_token() -> str:
+    return (os.getenv("ADMIN_TOKEN") or "").strip()
+
+
+def is_admin(request: Request) -> bool:
+    token = _admin_token()
+    if not token:
+        return False
+    given = request.headers.get("x-admin-token") or ""
+    auth = request.headers.get("authorization") or ""
+    if not given and auth.lower().startswith("bearer "):
+        given = auth[7:].strip()
+    return bool(given) and hmac.compare_digest(given.encode(), token.encode())
+
+
+def require_admin(request: Request) -> None:
+    if not _admin_token():
+        # Admin surface does not exist unless a token is configured
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not is_admin(request):
+        raise HTTPException(status_code=403, detail="admin token required")
+
+
+@router.get("/profile")
+async def profile(
+    request: Request,
+    seconds: float = Query(10.0, gt=0, description="How long to sample"),
+    interval_ms: Optional[float] = Query(None, ge=1, le=1000, description="Sampling interval"),
+    format: str = Query("collapsed", pattern="^(collapsed|json)$"),
+    include_idle: bool = Query(False, description="Keep stacks of parked threads"),
+    limit: Optional[int] = Query(None, ge=1, description="Top N stacks only"),
+):
+    """Sample all threads for `seconds` and return collapsed stacks (or JSON)."""
+    require_admin(request)
+    if not _busy.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="a profile is already running")
+    try:
+        prof = SamplingProfiler((interval_ms or _default_interval_ms()) / 1000.0, include_idle=include_idle).start()
+        try:
+            # Sleep on the event loop: the handlers being profiled keep running
+            await asyncio.sleep(min(seconds, _max_seconds()))
+        finally:
+            prof.stop()
+    finally:
+        _busy.release()
+    if format == "json":
+        return JSONResponse(prof.to_dict(limit))
+    return PlainTextResponse(prof.collapsed(limit), headers={"X-Profile-Samples": str(prof.samples)})
+
+
+@router.get("/profile/{profile_id}")
+def kept_profile(
+    profile_id: str,
+    request: Request,
+    format: str = Query("collapsed", pattern="^(collapsed|json)$"),
+    limit: Optional[int] = Query(None, ge=1, description="Top N stacks only"),
+):
+    """Stacks of an X-Agro-Profile request that had no Trace to carry them."""
+    require_admin(request)
+    with _kept_lock:
+        prof = _kept.get(profile_id)
+    if prof is None:
+        raise HTTPException(status_code=404, detail="unknown or expired profile id")
+    if format == "json":
+        return JSONResponse(prof.to_dict(limit))
+    return PlainTextResponse(prof.collapsed(limit), headers={"X-Profile-Samples": str(prof.samples)})
+
+
+def note_thread() -> None:
+    """Add the calling thread to the active request profile (no-op otherwise)."""
+    cur = _REQUEST_PROFILE.get()
+    if cur is not None:
+        cur.threads.add(threading.get_ident())
+
+
+def attach_to_trace(tr) -> None:
+    """Add the active request profile's stacks so far to a Trace."""
+    cur = _REQUEST_PROFILE.get()
+    if cur is None or tr is None:
+        return
+    prof = cur.prof
+    try:
+        cur.attached = True
+        tr.add("profile.collapsed", {
+            "interval_ms": round(prof.interval_s * 1000, 2),
+            "samples": prof.samples,
+            "collapsed": prof.collapsed(),
+        })
+    except Exception:
+        pass
+
+
+class ProfileRequestMiddleware(BaseHTTPMiddleware):
+    """Profile a single request when it carries `X-Agro-Profile: 1` and the admin token.
+
+    Only threads that touch the request (see note_thread(), called from
+    start_trace and pipeline_stage) are sampled, so concurrent traffic does not
+    leak into the profile. Busy or unauthorised requests are served normally,
+    unprofiled. When no Trace took the stacks (tracing off) the profile is kept
+    and its id returned as `X-Agro-Profile: samples=N; id=<id>`.
+    """
+
+    async def dispatch(self, request: Request, call_next):
+        flag = (request.headers.get(PROFILE_HEADER) or "").strip().lower()
+        if flag not in {"1", "true", "on"} or not is_admin(request):
+            return await call_next(request)
+        if not _busy.acquire(blocking=False):
+            response = await call_next(request)
+            response.headers["X-Agro-Profile"] = "busy"
+            return response
+        threads: set = set()
+        prof = SamplingProfiler(_default_interval_ms() / 1000.0, thread_ids=threads).start()
+        cur = _RequestProfile(prof, threads)
+        token = _REQUEST_PROFILE.set(cur)
+        try:
+            response = await call_next(request)
+        finally:
+            _REQUEST_PROFILE.reset(token)
+            prof.stop()
+            _busy.release()
+        value = f"samples={prof.samples}"
+        if not cur.attached:
+            value += f"; id={_keep(prof)}"
+        response.headers["X-Agro-Profile"] = value
+        return response
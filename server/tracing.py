@@ -1,9 +1,14 @@
 import os
+import gzip
 import json
 import time
 import uuid
+import queue
+import atexit
+import threading
+from collections import deque
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Deque, Dict, List, Optional, Tuple
 from contextvars import ContextVar
 
 from common.config_loader import out_dir
@@ -16,11 +21,24 @@ def _now_iso() -> str:
     return __import__("datetime").datetime.now().isoformat()
 
 
+def _retention() -> int:
+    try:
+        return max(1, int(os.getenv('TRACE_RETENTION', '50') or '50'))
+    except Exception:
+        return 50
+
+
+def _compress() -> bool:
+    return (os.getenv('TRACE_COMPRESS', '0') or '0').strip().lower() in {'1', 'true', 'on'}
+
+
 class Trace:
     """Lightweight per-request trace recorder.
 
-    - Stores structured breadcrumb events in-memory
-    - Persists to out/<repo>/traces/<ts>_<id>.json on save()
+    - Stores structured breadcrumb events in-memory (add() is just a list append)
+    - On end_trace() the trace is handed to a background exporter that writes
+      out/<repo>/traces/<ts>_<id>.json[.gz] and, in LangSmith mode, sends the
+      run plus one child run per event in a batch
     - Enabled when LANGCHAIN_TRACING_V2 is truthy (1/true/on)
     """
 
@@ -29,30 +47,14 @@ class Trace:
         self.question = question
         self.id = uuid.uuid4().hex[:8]
         self.started_at = _now_iso()
+        self.finished_at: Optional[str] = None
         self.events: List[Dict[str, Any]] = []
         self.path: Optional[str] = None
+        self.written = False  # path is assigned on submit, the file exists once this is set
         self.mode = (os.getenv('TRACING_MODE', '').lower() or (
             'langsmith' if ((os.getenv('LANGCHAIN_TRACING_V2','0') or '0').strip().lower() in {'1','true','on'}) else 'local'))
-        # Optional LangSmith client (best effort)
-        self._ls_client = None
         self._ls_project = os.getenv('LANGCHAIN_PROJECT') or os.getenv('LANGSMITH_PROJECT') or 'agro'
-        self._ls_run_id: Optional[str] = None
         self._ls_url: Optional[str] = None
-        try:
-            if self.mode == 'langsmith':
-                from langsmith import Client  # type: ignore
-                from datetime import datetime, timezone
-                self._ls_client = Client()
-                run = self._ls_client.create_run(
-                    name="RAG.run",
-                    run_type="chain",
-                    inputs={"question": question},
-                    project_name=self._ls_project,
-                    start_time=datetime.now(timezone.utc)
-                )
-                self._ls_run_id = getattr(run, 'id', None) or getattr(run, 'run_id', None)
-        except Exception:
-            self._ls_client = None
 
     # ---- control ----
     @staticmethod
@@ -64,7 +66,7 @@ class Trace:
         return True
 
     def add(self, kind: str, payload: Dict[str, Any]) -> None:
-        # Always record locally; never let tracing break flow
+        # Record locally only; LangSmith export happens in the background exporter
         try:
             self.events.append({
                 "ts": _now_iso(),
@@ -73,25 +75,6 @@ class Trace:
             })
         except Exception:
             pass
-        # Best-effort: also emit child run to LangSmith
-        try:
-            if self._ls_client is not None and self._ls_run_id is not None:
-                from datetime import datetime, timezone
-                child = self._ls_client.create_run(
-                    name=str(kind),
-                    run_type="chain",
-                    inputs=payload or {},
-                    project_name=self._ls_project,
-                    parent_run_id=self._ls_run_id,
-                    start_time=datetime.now(timezone.utc)
-                )
-                rid = getattr(child, 'id', None) or getattr(child, 'run_id', None)
-                try:
-                    self._ls_client.update_run(rid, end_time=datetime.now(timezone.utc), outputs=payload or {})
-                except Exception:
-                    pass
-        except Exception:
-            pass
 
     def _dir(self) -> Path:
         base = Path(out_dir(self.repo))
@@ -99,44 +82,271 @@ class Trace:
         d.mkdir(parents=True, exist_ok=True)
         return d
 
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "repo": self.repo,
+            "id": self.id,
+            "question": self.question,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at or _now_iso(),
+            "events": self.events,
+            "tracing_mode": self.mode,
+            "langsmith_project": self._ls_project if self.mode == 'langsmith' else None,
+            "langsmith_url": self._ls_url if self.mode == 'langsmith' else None,
+        }
+
     def save(self) -> str:
+        """Write the trace synchronously (the exporter calls this off the request path)."""
+        try:
+            path = Path(self.path) if self.path else _new_trace_path(self)
+            data = json.dumps(self.to_dict(), separators=(",", ":"), default=str).encode("utf-8")
+            tmp = path.with_name(path.name + ".tmp")
+            if path.suffix == ".gz":
+                with gzip.open(tmp, "wb", compresslevel=5) as f:
+                    f.write(data)
+            else:
+                tmp.write_bytes(data)
+            os.replace(tmp, path)
+            self.path = str(path)
+            self.written = True
+            _ring_push(self.repo, self.path)
+            return self.path
+        except Exception:
+            return ""
+
+
+def _new_trace_path(tr: Trace) -> Path:
+    ts_short = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    return tr._dir() / (f"{ts_short}_{tr.id}.json" + (".gz" if _compress() else ""))
+
+
+def load_trace(path: str) -> Dict[str, Any]:
+    """Read a trace file written by save() (plain or gzip-compressed JSON)."""
+    p = Path(path)
+    raw = gzip.decompress(p.read_bytes()) if p.suffix == ".gz" else p.read_bytes()
+    return json.loads(raw)
+
+
+# ---- retention ring (per repo) ----
+# Seeded from one directory listing per repo per process; afterwards retention
+# only touches the file that falls off the ring.
+_ring_lock = threading.Lock()
+_rings: Dict[str, Deque[str]] = {}
+
+
+def _traces_dir(repo: str) -> Path:
+    return Path(out_dir(repo)) / "traces"
+
+
+def _scan(repo: str) -> List[str]:
+    d = _traces_dir(repo)
+    if not d.exists():
+        return []
+    files = [p for p in d.iterdir() if p.is_file() and (p.name.endswith(".json") or p.name.endswith(".json.gz"))]
+    files.sort(key=lambda p: p.stat().st_mtime)
+    return [str(p) for p in files]
+
+
+def _ring(repo: str) -> Deque[str]:
+    r = _rings.get(repo)
+    if r is None:
+        r = deque(_scan(repo))
+        _rings[repo] = r
+    return r
+
+
+def _ring_push(repo: str, path: str) -> None:
+    keep = _retention()
+    evicted: List[str] = []
+    with _ring_lock:
+        r = _ring(repo)
+        if path in r:
+            r.remove(path)
+        r.append(path)
+        while len(r) > keep:
+            evicted.append(r.popleft())
+    for p in evicted:
         try:
-            ts_short = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
-            out_path = self._dir() / f"{ts_short}_{self.id}.json"
-            data = {
-                "repo": self.repo,
-                "id": self.id,
-                "question": self.question,
-                "started_at": self.started_at,
-                "finished_at": _now_iso(),
-                "events": self.events,
-                "tracing_mode": self.mode,
-                "langsmith_project": self._ls_project if self.mode == 'langsmith' else None,
-                "langsmith_url": self._ls_url if self.mode == 'langsmith' else None,
-            }
-            out_path.write_text(json.dumps(data, indent=2))
-            self.path = str(out_path)
-            # Simple retention purge
+            os.unlink(p)
+        except Exception:
+            pass
+
+
+def recent_trace_paths(repo: str, limit: int = 50) -> List[str]:
+    """Newest-first trace files for a repo."""
+    with _ring_lock:
+        r = list(_ring(repo))
+    return [p for p in reversed(r) if os.path.exists(p)][:limit]
+
+
+# ---- background exporter ----
+_queue: "queue.Queue[Trace]" = queue.Queue(maxsize=int(os.getenv('TRACE_QUEUE_MAX', '1000') or 1000))
+_worker: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+_latest: Dict[str, Trace] = {}
+_dropped = 0
+_ls_client = None
+
+
+def _langsmith_client():
+    global _ls_client
+    if _ls_client is None:
+        from langsmith import Client  # type: ignore
+        _ls_client = Client()
+    return _ls_client
+
+
+def _parse_ts(s: Optional[str]):
+    from datetime import datetime, timezone
+    try:
+        return datetime.fromisoformat(str(s)).astimezone(timezone.utc)
+    except Exception:
+        return datetime.now(timezone.utc)
+
+
+def _dotted(ts, run_id: str) -> str:
+    return ts.strftime("%Y%m%dT%H%M%S%fZ") + run_id
+
+
+def _langsmith_runs(tr: Trace) -> List[Dict[str, Any]]:
+    """Parent run plus one child per breadcrumb, with client-side ids for batch ingest."""
+    start = _parse_ts(tr.started_at)
+    end = _parse_ts(tr.finished_at)
+    root_id = str(uuid.uuid4())
+    root_order = _dotted(start, root_id)
+    runs = [{
+        "id": root_id, "trace_id": root_id, "dotted_order": root_order,
+        "name": "RAG.run", "run_type": "chain", "session_name": tr._ls_project,
+        "inputs": {"question": tr.question}, "outputs": {"status": "ok"},
+        "start_time": start, "end_time": end,
+    }]
+    for ev in tr.events:
+        cid = str(uuid.uuid4())
+        ts = _parse_ts(ev.get("ts"))
+        runs.append({
+            "id": cid, "trace_id": root_id, "parent_run_id": root_id,
+            "dotted_order": root_order + "." + _dotted(ts, cid),
+            "name": ev.get("kind"), "run_type": "chain", "session_name": tr._ls_project,
+            "inputs": ev.get("data") or {}, "outputs": ev.get("data") or {},
+            "start_time": ts, "end_time": ts,
+        })
+    return runs
+
+
+def _export_langsmith(traces: List[Trace]) -> None:
+    ls = [t for t in traces if t.mode == 'langsmith']
+    if not ls:
+        return
+    try:
+        client = _langsmith_client()
+    except Exception:
+        return
+    roots: Dict[str, str] = {}
+    runs: List[Dict[str, Any]] = []
+    for t in ls:
+        tr_runs = _langsmith_runs(t)
+        roots[t.id] = tr_runs[0]["id"]
+        runs.extend(tr_runs)
+    try:
+        client.batch_ingest_runs(create=runs)
+    except Exception:
+        # Older SDKs: one call per run, still off the request path
+        for r in runs:
             try:
-                keep = int(os.getenv('TRACE_RETENTION','50') or '50')
+                r = dict(r)
+                r["project_name"] = r.pop("session_name", None)
+                client.create_run(**r)
             except Exception:
-                keep = 50
+                pass
+    if (os.getenv('TRACE_LANGSMITH_SHARE', '1') or '1').strip().lower() in {'1', 'true', 'on'}:
+        for t in ls:
             try:
-                files = sorted([p for p in self._dir().glob('*.json') if p.is_file()], key=lambda p: p.stat().st_mtime, reverse=True)
-                for p in files[keep:]:
-                    try: p.unlink()
-                    except Exception: pass
+                info = client.share_run(roots[t.id])
+                if isinstance(info, str):
+                    t._ls_url = info
+                elif isinstance(info, dict):
+                    t._ls_url = info.get('url') or info.get('share_url')
             except Exception:
-                pass
-            return self.path
+                t._ls_url = None
+
+
+def _drain() -> None:
+    batch_max = max(1, int(os.getenv('TRACE_EXPORT_BATCH', '20') or 20))
+    while True:
+        batch = [_queue.get()]
+        while len(batch) < batch_max:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            _export_langsmith(batch)
         except Exception:
-            return ""
+            pass
+        for tr in batch:
+            try:
+                tr.save()
+            except Exception:
+                pass
+            finally:
+                _queue.task_done()
+
+
+def _ensure_worker() -> None:
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_drain, name="trace-exporter", daemon=True)
+            _worker.start()
+
+
+def submit(tr: Trace) -> str:
+    """Queue a finished trace for export; returns the path it will be written to."""
+    global _dropped
+    tr.finished_at = tr.finished_at or _now_iso()
+    try:
+        tr.path = str(_new_trace_path(tr))
+    except Exception:
+        tr.path = None
+    _latest[tr.repo] = tr
+    _ensure_worker()
+    try:
+        _queue.put_nowait(tr)
+    except queue.Full:
+        _dropped += 1
+        return ""
+    return tr.path or ""
+
+
+def flush(timeout: float = 5.0) -> bool:
+    """Wait until queued traces are exported; returns False on timeout."""
+    deadline = time.time() + timeout
+    while _queue.unfinished_tasks:
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def exporter_stats() -> Dict[str, int]:
+    return {"pending": _queue.qsize(), "dropped": _dropped}
+
+
+atexit.register(flush, 2.0)
 
 
 # ---- context helpers ----
 def start_trace(repo: str, question: str) -> Trace:
     tr = Trace(repo=repo, question=question)
     _TRACE_VAR.set(tr)
+    try:
+        # X-Agro-Profile requests: sample the thread serving this trace
+        from server.profiler import note_thread
+        note_thread()
+    except Exception:
+        pass
     return tr
 
 
@@ -148,39 +358,41 @@ def end_trace() -> Optional[str]:
     tr = _TRACE_VAR.get()
     if tr is None:
         return None
+    _TRACE_VAR.set(None)
     try:
-        if getattr(tr, '_ls_client', None) is not None and getattr(tr, '_ls_run_id', None) is not None:
-            from datetime import datetime, timezone
-            try:
-                tr._ls_client.update_run(tr._ls_run_id, end_time=datetime.now(timezone.utc), outputs={"status": "ok"})
-            except Exception:
-                pass
-            try:
-                share = getattr(tr._ls_client, 'share_run', None)
-                if callable(share):
-                    info = share(tr._ls_run_id)
-                    if isinstance(info, str):
-                        tr._ls_url = info
-                    elif isinstance(info, dict):
-                        tr._ls_url = info.get('url') or info.get('share_url')
-                if not tr._ls_url:
-                    rr = tr._ls_client.read_run(tr._ls_run_id)
-                    tr._ls_url = getattr(rr, 'url', None) or getattr(rr, 'dashboard_url', None)
-            except Exception:
-                tr._ls_url = None
+        from server.profiler import attach_to_trace
+        attach_to_trace(tr)
     except Exception:
         pass
-    path = tr.save()
-    _TRACE_VAR.set(None)
-    return path
+    return submit(tr)
+
+
+def latest_trace_with_path(repo: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Most recent trace for a repo and the file holding it.
+
+    The trace comes from memory when this process produced it; its path is None
+    until the background exporter has written that trace.
+    """
+    hit = _latest.get(repo)
+    if hit is not None:
+        return hit.to_dict(), (hit.path if hit.written else None)
+    p = latest_trace_path(repo)
+    if not p:
+        return None, None
+    try:
+        return load_trace(p), p
+    except Exception:
+        return None, None
+
+
+def latest_trace(repo: str) -> Optional[Dict[str, Any]]:
+    """Most recent trace for a repo, from memory when this process produced it."""
+    return latest_trace_with_path(repo)[0]
 
 
 def latest_trace_path(repo: str) -> Optional[str]:
     try:
-        d = Path(out_dir(repo)) / "traces"
-        if not d.exists():
-            return None
-        files = sorted([p for p in d.glob("*.json") if p.is_file()], key=lambda p: p.stat().st_mtime, reverse=True)
-        return str(files[0]) if files else None
+        files = recent_trace_paths(repo, limit=1)
+        return files[0] if files else None
     except Exception:
         return None
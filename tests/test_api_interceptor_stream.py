@@ -0,0 +1,105 @@
+import gc
+import io
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import requests
+
+import server.api_tracker as api_tracker
+from server import api_interceptor
+
+
+def _response(body: bytes, delay: float = 0.0) -> requests.Response:
+    class SlowRaw(io.BytesIO):
+        def read(self, n=-1, *a, **k):
+            time.sleep(delay)
+            return super().read(n)
+
+        def stream(self, n, decode_content=True):
+            while True:
+                chunk = self.read(n)
+                if not chunk:
+                    return
+                yield chunk
+
+    r = requests.Response()
+    r.status_code = 200
+    r.raw = SlowRaw(body)
+    return r
+
+
+def _capture(monkeypatch):
+    calls = []
+    monkeypatch.setattr(api_tracker, "track_api_call", lambda **kw: calls.append(kw))
+    return calls
+
+
+def test_streamed_response_is_not_buffered_and_tracked_on_close(monkeypatch):
+    calls = _capture(monkeypatch)
+    body = b"\n".join(b'{"response": "tok%d"}' % i for i in range(20))
+    monkeypatch.setattr(requests, "_original_post", lambda url, **kw: _response(body, delay=0.005), raising=False)
+
+    with api_interceptor._track_request("POST", "http://localhost:11434/api/generate", json={"p": 1}, stream=True) as r:
+        # Nothing read yet: body must still be unconsumed and nothing recorded
+        assert r._content is False
+        api_interceptor.flush()
+        assert calls == []
+        lines = list(r.iter_lines(chunk_size=16))
+    assert len(lines) == 20
+
+    assert api_interceptor.flush()
+    assert len(calls) == 1
+    c = calls[0]
+    assert c["response_size_bytes"] == len(body)
+    assert c["ttfb_ms"] is not None and c["ttfb_ms"] < c["duration_ms"]
+    assert c["provider"] == api_tracker.APIProvider.OLLAMA
+    assert c["request_size_bytes"] > 0
+
+
+def test_partial_stream_recorded_once_on_close(monkeypatch):
+    calls = _capture(monkeypatch)
+    monkeypatch.setattr(requests, "_original_post", lambda url, **kw: _response(b"x" * 100), raising=False)
+
+    r = api_interceptor._track_request("POST", "http://localhost:11434/api/generate", stream=True)
+    it = r.iter_content(chunk_size=10)
+    next(it)
+    r.close()
+    r.close()
+    assert api_interceptor.flush()
+    assert len(calls) == 1
+    assert calls[0]["response_size_bytes"] == 10
+
+
+def test_stream_abandoned_mid_iteration_is_recorded(monkeypatch):
+    calls = _capture(monkeypatch)
+    monkeypatch.setattr(requests, "_original_post", lambda url, **kw: _response(b"x" * 100), raising=False)
+
+    def first_chunk():
+        r = api_interceptor._track_request("POST", "http://localhost:11434/api/generate", stream=True)
+        for chunk in r.iter_content(chunk_size=10):
+            return chunk  # breaks out; neither the iterator nor the response is closed
+
+    assert first_chunk() == b"x" * 10
+    gc.collect()
+    assert api_interceptor.flush()
+    assert len(calls) == 1
+    assert calls[0]["response_size_bytes"] == 10
+
+
+def test_non_streamed_response_tracked_in_background(monkeypatch):
+    calls = _capture(monkeypatch)
+
+    def fake_get(url, **kw):
+        r = _response(b"")
+        r._content = b"hello"
+        return r
+
+    monkeypatch.setattr(requests, "_original_get", fake_get, raising=False)
+    r = api_interceptor._track_request("GET", "https://api.openai.com/v1/models")
+    assert r.content == b"hello"
+    assert api_interceptor.flush()
+    assert calls and calls[0]["response_size_bytes"] == 5
+    assert calls[0]["provider"] == api_tracker.APIProvider.OPENAI
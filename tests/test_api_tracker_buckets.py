@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""APITracker: per-provider minute buckets, latency sketch, buffered call log."""
+import json
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from server.api_tracker import APICall, APIProvider, APITracker
+
+
+def _call(provider, ms, ago_min=0, status=200, cost=0.0):
+    return APICall(provider=provider, endpoint="x", duration_ms=ms, status_code=status, cost_usd=cost,
+                   timestamp=datetime.utcnow() - timedelta(minutes=ago_min))
+
+
+def test_stats_aggregate_by_window(tmp_path):
+    t = APITracker(log_path=tmp_path / "calls.jsonl")
+    for ms in range(1, 101):
+        t.track_call(_call(APIProvider.COHERE, ms * 10, cost=0.001))
+    t.track_call(_call(APIProvider.COHERE, 50, status=500))
+    t.track_call(_call(APIProvider.COHERE, 50, ago_min=10))
+    t.track_call(_call(APIProvider.COHERE, 50, ago_min=90))  # beyond retention
+
+    s = t.get_stats_for_provider(APIProvider.COHERE, minutes=5)
+    assert s["call_count"] == 101
+    assert s["error_count"] == 1
+    assert abs(s["total_cost_usd"] - 0.1) < 1e-9
+    assert 300 <= s["p50_duration_ms"] <= 700
+    assert 800 <= s["p95_duration_ms"] <= 1100
+    assert len(s["recent_calls"]) == 5
+
+    assert t.get_stats_for_provider(APIProvider.COHERE, minutes=15)["call_count"] == 102
+    assert t.get_stats_for_provider(APIProvider.OPENAI)["call_count"] == 0
+
+
+def test_anomalies_from_buckets(tmp_path):
+    t = APITracker(log_path=tmp_path / "calls.jsonl")
+    for _ in range(150):
+        t.track_call(_call(APIProvider.COHERE, 20))
+    issues = [a["issue"] for a in t.check_anomalies({"cohere_rerank_calls_per_minute": 20})]
+    assert any("High call frequency" in i for i in issues)
+
+
+def test_call_log_is_buffered(tmp_path):
+    log = tmp_path / "calls.jsonl"
+    t = APITracker(log_path=log)
+    t.track_call(_call(APIProvider.OPENAI, 12))
+    t.flush()
+    rows = [json.loads(l) for l in log.read_text().splitlines()]
+    assert rows[0]["provider"] == "openai" and rows[0]["duration_ms"] == 12
+
+
+def test_late_calls_never_erase_newer_minutes(tmp_path):
+    t = APITracker(log_path=tmp_path / "calls.jsonl")
+    for _ in range(3):
+        t.track_call(_call(APIProvider.OPENAI, 10))
+    # Recorded late: maps to the same ring slot as the current minute
+    t.track_call(_call(APIProvider.OPENAI, 10, ago_min=60))
+    t.track_call(_call(APIProvider.OPENAI, 10, ago_min=20))
+    s = t.get_stats_for_provider(APIProvider.OPENAI, minutes=5)
+    assert s["call_count"] == 3
+    # recent_calls only lists calls inside the window
+    assert len(s["recent_calls"]) == 3
+    assert t.get_stats_for_provider(APIProvider.OPENAI, minutes=30)["call_count"] == 4
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Batch enrichment end-to-end against the local file-based backend."""
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+def _write_chunks(base: Path):
+    base.mkdir(parents=True, exist_ok=True)
+    rows = [
+        {"id": "1", "file_path": "server/app.py", "hash": "h1", "code": "def answer():\n    return '/answer'\n"},
+        {"id": "2", "file_path": "retrieval/hybrid_search.py", "hash": "h2", "code": "class Retriever:\n    pass\n"},
+    ]
+    with open(base / "chunks.jsonl", "w") as f:
+        for r in rows:
+            f.write(json.dumps(r) + "\n")
+
+
+def test_local_batch_cards_roundtrip(tmp_path, monkeypatch):
+    monkeypatch.setenv("OUT_DIR_BASE", str(tmp_path))
+    from indexer import batch_enrich as be
+
+    _write_chunks(tmp_path / "demo")
+    backend = be.LocalBatchBackend(str(tmp_path / "demo" / "batch" / "local"))
+    state = be.submit("demo", "cards", backend)
+    assert len(state["batches"]) == 1 and state["batches"][0]["requests"] == 2
+
+    state = be.collect("demo", "cards", wait=True, backend=backend)
+    assert state["status"] == "merged"
+    cards = [json.loads(l) for l in open(tmp_path / "demo" / "cards.jsonl")]
+    assert [c["id"] for c in cards] == ["1", "2"]
+    assert cards[0]["symbols"] == ["answer"] and cards[1]["symbols"] == ["Retriever"]
+    assert len((tmp_path / "demo" / "cards.txt").read_text().splitlines()) == 2
+
+    # Second submit finds everything cached and submits nothing
+    again = be.submit("demo", "cards", backend)
+    assert again["batches"] == [] and again["status"] == "cached"
+
+
+def test_local_batch_metadata_goes_to_the_cache_not_the_live_chunks(tmp_path, monkeypatch):
+    monkeypatch.setenv("OUT_DIR_BASE", str(tmp_path))
+    from indexer import batch_enrich as be
+    from common.card_cache import CardCache, enrich_model, prompt_version
+    from common.metadata import METADATA_PROMPT
+
+    _write_chunks(tmp_path / "demo")
+    live = (tmp_path / "demo" / "chunks.jsonl").read_text()
+    backend = be.LocalBatchBackend(str(tmp_path / "demo" / "batch" / "local"))
+    be.submit("demo", "metadata", backend)
+    state = be.collect("demo", "metadata", wait=True, backend=backend)
+    assert state["result"]["chunks_cached"] == 2
+    # The published index is immutable; the next index run reads the cache
+    assert (tmp_path / "demo" / "chunks.jsonl").read_text() == live
+    cache = CardCache(str(tmp_path / "demo"), enrich_model(), prompt_version(METADATA_PROMPT),
+                      filename="metadata_cache.jsonl")
+    assert cache.get("h2")["keywords"] == ["Retriever"]
+
+
+def test_failed_batch_is_not_merged_and_existing_cards_survive(tmp_path, monkeypatch):
+    monkeypatch.setenv("OUT_DIR_BASE", str(tmp_path))
+    from indexer import batch_enrich as be
+
+    _write_chunks(tmp_path / "demo")
+    old = [{"id": "1", "hash": "stale", "symbols": ["answer"], "purpose": "old card"},
+           {"id": "2", "hash": "stale2", "symbols": ["Retriever"], "purpose": "kept"}]
+    (tmp_path / "demo" / "cards.jsonl").write_text("".join(json.dumps(c) + "\n" for c in old))
+    backend = be.LocalBatchBackend(str(tmp_path / "demo" / "batch" / "local"))
+    state = be.submit("demo", "cards", backend)
+    (tmp_path / "demo" / "batch" / "local" / state["batches"][0]["id"] / "status").write_text("expired")
+
+    state = be.collect("demo", "cards", wait=True, backend=backend)
+    assert state["status"] == "failed" and state["failed_batches"] == [state["batches"][0]["id"]]
+    assert (tmp_path / "demo" / "cards.jsonl").read_text() == "".join(json.dumps(c) + "\n" for c in old)
+
+    # A later merge without cached results keeps the old cards (and their stale hashes)
+    cache = be._cache_for("demo", "cards", "m")
+    be._merge_cards("demo", cache)
+    cards = [json.loads(l) for l in open(tmp_path / "demo" / "cards.jsonl")]
+    assert [c["purpose"] for c in cards] == ["old card", "kept"] and cards[0]["hash"] == "stale"
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""Card cache round-trip: hits survive a reload, model/prompt changes miss, prune drops stale chunks."""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from common.card_cache import CardCache, chunk_hash, prompt_version, usage_tokens
+
+
+def test_card_cache_roundtrip(tmp_path):
+    c = CardCache(str(tmp_path), "gpt-4o-mini", prompt_version("P1"))
+    h = chunk_hash({"code": "def foo():\n    return 1\n"})
+    assert c.get(h) is None
+    c.put(h, {"symbols": ["foo"], "purpose": "returns 1", "routes": []}, tokens=120)
+    c.save()
+
+    again = CardCache(str(tmp_path), "gpt-4o-mini", prompt_version("P1"))
+    card = again.get(h)
+    assert card and card["symbols"] == ["foo"]
+    card["file_path"] = "x.py"  # callers mutate; cache entry must not change
+    assert "file_path" not in again.get(h)
+    st = again.stats()
+    assert st["hits"] == 2 and st["saved_tokens"] == 240
+
+    assert CardCache(str(tmp_path), "other-model", prompt_version("P1")).get(h) is None
+    assert CardCache(str(tmp_path), "gpt-4o-mini", prompt_version("P2")).get(h) is None
+
+    assert again.prune({"deadbeef"}) == 1
+    assert again.get(h) is None
+
+
+def test_chunk_hash_prefers_indexer_hash():
+    assert chunk_hash({"hash": "abc", "code": "x"}) == "abc"
+    assert chunk_hash({"code": "x"}) == chunk_hash({"code": "x"})
+
+
+def test_usage_tokens_fallbacks():
+    assert usage_tokens({"usage": {"total_tokens": 42}}) == 42
+    assert usage_tokens({"prompt_eval_count": 10, "eval_count": 5}) == 15
+    assert usage_tokens(None, "a" * 40, "b" * 40) == 20
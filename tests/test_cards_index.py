@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Cards BM25 generations: incremental apply + atomic CURRENT swap."""
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+pytest.importorskip("bm25s")
+pytest.importorskip("Stemmer")
+
+
+def test_apply_changes_swaps_generation(tmp_path, monkeypatch):
+    monkeypatch.setenv("OUT_DIR_BASE", str(tmp_path))
+    from retrieval import cards_index
+
+    base = tmp_path / "demo"
+    base.mkdir()
+    cards = [
+        {"id": "a", "file_path": "server/app.py", "symbols": ["answer"], "purpose": "answer endpoint"},
+        {"id": "b", "file_path": "retrieval/rerank.py", "symbols": ["rerank"], "purpose": "cross encoder rerank"},
+    ]
+    with open(base / "cards.jsonl", "w") as f:
+        for c in cards:
+            f.write(json.dumps(c) + "\n")
+    with open(base / "cards.txt", "w") as f:
+        for c in cards:
+            f.write(cards_index.card_text(c, c["file_path"]) + "\n")
+    assert cards_index.rebuild(str(base)) == 2
+    first = cards_index.load("demo")
+    assert first and first["by_idx"] == {0: "a", 1: "b"}
+
+    res = cards_index.apply_changes(
+        str(base),
+        upserts=[{"id": "c", "file_path": "indexer/index_repo.py", "symbols": ["main"], "purpose": "indexer entry"}],
+        removes=["a"],
+    )
+    assert res["cards"] == 2 and res["added"] == 1
+    second = cards_index.load("demo")
+    assert second["generation"] != first["generation"]
+    assert sorted(second["by_idx"].values()) == ["b", "c"]
+    # Old generation stays on disk for readers that already loaded it
+    assert (base / "bm25_cards" / first["generation"]).exists()
+
+
+def test_rapid_publishes_prune_older_generations(tmp_path):
+    from retrieval import cards_index
+
+    base = tmp_path / "demo"
+    gens = [cards_index.publish(str(base), [f"doc {i}"], [str(i)], keep=1) for i in range(4)]
+    assert gens == sorted(gens)
+    assert cards_index.current_generation(str(base)) == gens[-1]
+    assert sorted(p.name for p in (base / "bm25_cards").glob("gen-*")) == [gens[-1]]
+
+
+def test_generation_reads_its_own_cards_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setenv("OUT_DIR_BASE", str(tmp_path))
+    from retrieval import cards_index
+
+    base = tmp_path / "demo"
+    base.mkdir()
+    cards_index.apply_changes(str(base), upserts=[{"id": "a", "file_path": "a.py", "purpose": "first"}])
+    gen = cards_index.current_generation(str(base))
+    assert json.loads((base / "bm25_cards" / gen / "cards.jsonl").read_text())["purpose"] == "first"
+
+    # A writer rewrites cards.jsonl before (or without) publishing a new generation
+    (base / "cards.jsonl").write_text(json.dumps({"id": "a", "file_path": "a.py", "purpose": "newer"}) + "\n")
+    monkeypatch.setattr(cards_index, "_loaded", {})
+    idx = cards_index.load("demo")
+    assert idx["generation"] == gen and idx["by_chunk_id"]["a"]["purpose"] == "first"
@@ -0,0 +1,73 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from indexer import discovery
+
+
+def _tree(root: Path, files):
+    for rel in files:
+        p = root / rel
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_text("x = 1\n")
+
+
+def _rels(root: Path, paths):
+    return sorted(Path(p).relative_to(root).as_posix() for p in paths)
+
+
+def test_scan_prunes_skip_dirs_globs_and_gitignore(tmp_path):
+    _tree(tmp_path, [
+        "app/main.py", "app/gen/out.py", "app/keep.log.py", "app/notes.md",
+        "node_modules/pkg/index.js", "dist/bundle.js", ".venv3/lib.py",
+        "logs/a.py", "build_tools/b.py", "src/debug.py", "src/x.py",
+    ])
+    (tmp_path / ".gitignore").write_text("# generated\n*.log.py\n/logs/\ndebug.py\n")
+    (tmp_path / "src" / ".gitignore").write_text("!debug.py\n")
+    files = discovery.discover([str(tmp_path)], patterns=["**/gen/**"], use_git=False)
+    assert _rels(tmp_path, files) == ["app/main.py", "build_tools/b.py", "src/debug.py", "src/x.py"]
+    # .gitignore can be switched off
+    files = discovery.discover([str(tmp_path)], patterns=[], use_git=False, gitignore=False, workers=1)
+    assert "logs/a.py" in _rels(tmp_path, files) and "app/keep.log.py" in _rels(tmp_path, files)
+
+
+def test_exclude_matcher_and_gitignore_patterns():
+    m = discovery.ExcludeMatcher(["**/vendor/**", "*.min.js", "docs/*"])
+    assert m.match("/r/lib/vendor/a.py") and m.match("/r/x.min.js") and m.match("/r/docs/a.py", "docs/a.py")
+    assert not m.match("/r/src/a.py", "src/a.py")
+    assert m.excludes_dir("/r/lib/vendor") and not m.excludes_dir("/r/src", "src")
+    gi = discovery.GitIgnore("/r", ["**/tmp/**", "a/**/z.py", "build/", "!keep.py", "*.py", "!keep.py"])
+    assert discovery.ignored([gi], "/r/x/tmp/y.py", False)
+    assert discovery.ignored([gi], "/r/a/b/c/z.py", False)
+    assert discovery.ignored([gi], "/r/build", True) and not discovery.ignored([gi], "/r/build", False)
+    assert not discovery.ignored([gi], "/r/sub/keep.py", False)
+
+
+def test_multiple_roots_and_git_ls_files(tmp_path):
+    a, b = tmp_path / "a", tmp_path / "b"
+    _tree(a, ["one.py", "ignored.py", "node_modules/m.js"])
+    _tree(b, ["two.py", "sub/three.ts"])
+    (a / ".gitignore").write_text("ignored.py\n")
+    files = discovery.discover([str(a), str(b), str(a)], patterns=[], use_git=False)
+    assert _rels(tmp_path, files) == ["a/one.py", "b/sub/three.ts", "b/two.py"]
+
+    try:
+        subprocess.run(["git", "init", "-q", str(a)], check=True, capture_output=True)
+    except Exception:
+        pytest.skip("git not available")
+    assert _rels(a, discovery.git_ls_files(str(a), discovery.ExcludeMatcher([]))) == ["one.py"]
+    assert discovery.git_ls_files(str(b), discovery.ExcludeMatcher([])) is None
+
+
+def test_included_agrees_with_scan(tmp_path):
+    _tree(tmp_path, ["app/main.py", "app/gen/out.py", "node_modules/m.js", "logs/a.py", "src/x.md", "src/y.py"])
+    (tmp_path / ".gitignore").write_text("/logs/\n")
+    m = discovery.ExcludeMatcher(["**/gen/**"])
+    listed = set(discovery.scan(str(tmp_path), m))
+    for p in tmp_path.rglob("*"):
+        if p.is_file():
+            assert discovery.included(str(tmp_path), str(p), m) == (str(p) in listed), p
@@ -0,0 +1,195 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from common import embedding_executor as ee
+
+
+def test_token_batches_pack_by_tokens_and_items():
+    assert ee.token_batches([10, 10, 10, 50, 5], max_tokens=30, max_items=10) == [[0, 1, 2], [3], [4]]
+    assert ee.token_batches([1] * 5, max_tokens=100, max_items=2) == [[0, 1], [2, 3], [4]]
+    # An oversize text still gets its own batch
+    assert ee.token_batches([500, 1], max_tokens=100, max_items=10) == [[0], [1]]
+
+
+class _Clock:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+    def sleep(self, s):
+        self.t += s
+
+
+def test_rate_limiter_enforces_rpm_and_tpm():
+    clk = _Clock()
+    lim = ee.RateLimiter(rpm=60, tpm=600, clock=clk, sleep=clk.sleep)
+    for _ in range(60):
+        assert lim.acquire(0) == 0.0  # full burst available
+    assert lim.acquire(0) == pytest.approx(1.0)  # then 1 request/second
+
+    clk = _Clock()
+    lim = ee.RateLimiter(rpm=1000, tpm=600, clock=clk, sleep=clk.sleep)
+    lim.acquire(600)
+    assert lim.acquire(300) == pytest.approx(30.0)  # 10 tokens/second refill
+    lim.pause(5)
+    assert lim.acquire(0) == pytest.approx(5.0)
+
+
+class _RateLimited(Exception):
+    status_code = 429
+
+    def __init__(self):
+        super().__init__("slow down")
+        self.response = type("R", (), {"headers": {"retry-after": "0.01"}})()
+
+
+class _BadRequest(Exception):
+    status_code = 400
+
+
+def _fast_limiter():
+    return ee.RateLimiter(rpm=1e9, tpm=1e12)
+
+
+def test_executor_runs_batches_concurrently_and_retries_429():
+    lock = threading.Lock()
+    state = {"active": 0, "peak": 0, "calls": 0}
+
+    def embed(sub):
+        with lock:
+            state["calls"] += 1
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+            fail = state["calls"] == 2
+        try:
+            time.sleep(0.02)
+            if fail:
+                raise _RateLimited()
+            return [[float(len(t))] for t in sub]
+        finally:
+            with lock:
+                state["active"] -= 1
+
+    texts = ["x" * (i + 1) for i in range(40)]
+    seen = []
+    ex = ee.EmbeddingExecutor(embed, provider="test", concurrency=4, max_batch_tokens=1000, max_batch_items=5,
+                              limiter=_fast_limiter())
+    out = ex.map(texts, [1] * len(texts), on_batch=lambda idx, vecs: seen.extend(idx))
+    assert out == [[float(i + 1)] for i in range(40)]
+    assert sorted(seen) == list(range(40))
+    assert state["peak"] > 1
+    assert ex.stats["batches"] == 8 and ex.stats["rate_limited"] == 1 and ex.stats["retries"] == 1
+
+
+def test_executor_does_not_retry_client_errors():
+    calls = []
+
+    def embed(sub):
+        calls.append(sub)
+        raise _BadRequest("bad input")
+
+    ex = ee.EmbeddingExecutor(embed, provider="test", concurrency=2, max_batch_items=1, limiter=_fast_limiter())
+    with pytest.raises(_BadRequest):
+        ex.map(["a", "b", "c", "d"])
+    assert len(calls) <= 2
+
+
+def test_retryable_classification():
+    assert ee.is_retryable(_RateLimited())
+    assert ee.is_retryable(ConnectionError("reset"))
+    assert not ee.is_retryable(_BadRequest())
+    err = Exception("server")
+    err.status_code = 503
+    assert ee.is_retryable(err)
+
+
+def test_embedding_cache_resumes_from_appended_batches(tmp_path, monkeypatch):
+    pytest.importorskip("tiktoken")
+    from retrieval.embed_cache import EmbeddingCache
+
+    class _Client:
+        def __init__(self, fail_after=None):
+            self.inputs = []
+            self.fail_after = fail_after
+            self.embeddings = self
+
+        def create(self, model, input):
+            if self.fail_after is not None and len(self.inputs) >= self.fail_after:
+                raise _BadRequest("quota")
+            self.inputs.append(list(input))
+            return type("R", (), {"data": [type("D", (), {"embedding": [float(len(t))]})() for t in input]})()
+
+    texts = [f"text {i}" for i in range(6)]
+    hashes = [f"h{i}" for i in range(6)]
+    monkeypatch.setenv("EMBED_CONCURRENCY", "1")
+    with pytest.raises(_BadRequest):
+        EmbeddingCache(str(tmp_path)).embed_texts(_Client(fail_after=1), texts, hashes, batch=2)
+    # The completed batch was persisted before the failure; a new run only embeds the rest
+    c2 = _Client()
+    out = EmbeddingCache(str(tmp_path)).embed_texts(c2, texts, hashes, batch=2)
+    assert out == [[6.0]] * 6
+    assert sum(len(b) for b in c2.inputs) == 4
+
+
+def test_embedding_cache_holds_float32_and_round_trips(tmp_path):
+    np = pytest.importorskip("numpy")
+    from retrieval.embed_cache import EmbeddingCache
+
+    c = EmbeddingCache(str(tmp_path))
+    c.put("a", [0.5, 0.25])
+    c.append([("b", np.array([1.0, 2.0], dtype=np.float32))])
+    c.put("b", [1.0, 2.0])
+    assert c.get("a").dtype == np.float32
+    c.save()
+    c2 = EmbeddingCache(str(tmp_path))
+    assert c2.get("a").tolist() == [0.5, 0.25] and c2.get("b").tolist() == [1.0, 2.0]
+    assert c2.prune({"a"}) == 1 and EmbeddingCache(str(tmp_path)).get("b") is None
+
+
+def test_embedding_cache_migrates_jsonl_and_survives_torn_writes(tmp_path):
+    np = pytest.importorskip("numpy")
+    import json
+    from retrieval.embed_cache import EmbeddingCache
+
+    with open(tmp_path / "embed_cache.jsonl", "w") as f:
+        f.write(json.dumps({"hash": "a", "vec": [1.0, 2.0]}) + "\n")
+        f.write(json.dumps({"hash": "b", "vec": [3.0, 4.0]}) + "\n")
+    c = EmbeddingCache(str(tmp_path))
+    assert c.get("b").tolist() == [3.0, 4.0]
+    assert not (tmp_path / "embed_cache.jsonl").exists()
+    # Only the hash -> row index lives in memory; vectors stay on disk
+    assert c._rows == {"a": 0, "b": 1}
+
+    # An interrupted append: half a vector row and a hash without its newline
+    with open(c._vec_path, "ab") as f:
+        f.write(np.float32([5.0]).tobytes())
+    with open(c.path, "a") as f:
+        f.write("c")
+    c2 = EmbeddingCache(str(tmp_path))
+    assert c2.get("c") is None and c2.get("a").tolist() == [1.0, 2.0]
+    c2.append([("d", [7.0, 8.0])])
+    assert EmbeddingCache(str(tmp_path)).get("d").tolist() == [7.0, 8.0]
+
+    # Another dimension (a different model) starts over; prune rewrites the vectors file
+    c2.append([("e", [1.0, 1.0, 1.0])])
+    assert c2.get("a") is None and c2.prune(set()) == 1
+    assert len(list(tmp_path.glob("embed_cache.*.f32"))) == 1
+
+
+def test_embedding_cache_lookup_reads_only_the_hash_index(tmp_path):
+    pytest.importorskip("numpy")
+    from retrieval.embed_cache import EmbeddingCache
+
+    EmbeddingCache(str(tmp_path)).append([(f"h{i}", [float(i), 1.0]) for i in range(100)])
+    c = EmbeddingCache(str(tmp_path))
+    assert c._rows is None  # nothing read until the first lookup
+    assert c.get("new") is None and c._mm is None  # a miss never touches the vectors
+    assert c.get("h42").tolist() == [42.0, 1.0]
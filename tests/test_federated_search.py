@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""Federated search: resident per-repo indexes, score normalization and per-repo timeouts.
+
+Runs against tiny on-disk BM25 indexes with dense retrieval unavailable and the
+reranker disabled, so no external services are needed.
+"""
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+bm25s = pytest.importorskip("bm25s")
+pytest.importorskip("qdrant_client")
+
+
+def _make_repo(base: Path, name: str, rows):
+    d = base / name
+    (d / "bm25_index").mkdir(parents=True)
+    with open(d / "chunks.jsonl", "w") as f:
+        for r in rows:
+            f.write(json.dumps(r) + "\n")
+    from bm25s.tokenization import Tokenizer
+    from Stemmer import Stemmer
+    tok = Tokenizer(stemmer=Stemmer("english"), stopwords="en")
+    retr = bm25s.BM25(method="lucene", k1=1.2, b=0.65)
+    retr.index(tok.tokenize([r["code"] for r in rows]))
+    retr.vocab_dict = {str(k): v for k, v in retr.vocab_dict.items()}
+    retr.save(str(d / "bm25_index"))
+    tok.save_vocab(save_dir=str(d / "bm25_index"))
+    (d / "bm25_index" / "chunk_ids.txt").write_text("\n".join(r["id"] for r in rows) + "\n")
+
+
+@pytest.fixture
+def hs(tmp_path, monkeypatch):
+    monkeypatch.setenv("OUT_DIR_BASE", str(tmp_path))
+    monkeypatch.setenv("RERANK_BACKEND", "none")
+    monkeypatch.setenv("USE_SEMANTIC_SYNONYMS", "0")
+    monkeypatch.setenv("TOPK_SPARSE", "2")  # bm25s refuses k > corpus size
+    monkeypatch.setenv("QDRANT_URL", "http://127.0.0.1:9")
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    from retrieval import hybrid_search
+    monkeypatch.setattr(hybrid_search, "QDRANT_URL", "http://127.0.0.1:9")
+    monkeypatch.setattr(hybrid_search, "_QDRANT_CLIENT", None)
+    hybrid_search._RESIDENT.clear()
+    _make_repo(tmp_path, "alpha", [
+        {"id": "a1", "file_path": "alpha/auth.py", "start_line": 1, "end_line": 5, "language": "python", "code": "def oauth_token(): refresh oauth token"},
+        {"id": "a2", "file_path": "alpha/db.py", "start_line": 1, "end_line": 5, "language": "python", "code": "def connect(): open database pool"},
+    ])
+    _make_repo(tmp_path, "beta", [
+        {"id": "b1", "file_path": "beta/login.py", "start_line": 1, "end_line": 5, "language": "python", "code": "def login(): validate oauth session"},
+        {"id": "b2", "file_path": "beta/ui.py", "start_line": 1, "end_line": 5, "language": "python", "code": "def render(): draw dashboard"},
+    ])
+    return hybrid_search
+
+
+def test_federated_merges_repos(hs):
+    docs = hs.search_federated("oauth", repos=["alpha", "beta"], final_k=4)
+    repos = {d["repo"] for d in docs}
+    assert repos == {"alpha", "beta"}
+    assert all(0.0 <= d["fed_score"] <= 1.0 for d in docs)
+    # Resident index reused across calls (no reload while files are unchanged)
+    loaded = hs._RESIDENT["alpha"]["loaded_at"]
+    hs.search_federated("oauth", repos=["alpha"], final_k=2)
+    assert hs._RESIDENT["alpha"]["loaded_at"] == loaded
+
+
+def test_federated_drops_slow_repo(hs, monkeypatch):
+    real = hs._search_impl
+
+    def slow(query, repo, *a, **kw):
+        if repo == "beta":
+            time.sleep(0.5)
+        return real(query, repo, *a, **kw)
+
+    monkeypatch.setattr(hs, "_search_impl", slow)
+    docs = hs.search_federated("oauth", repos=["alpha", "beta"], final_k=4, repo_timeout_ms=200)
+    assert docs and {d["repo"] for d in docs} == {"alpha"}
+
+
+def test_slow_repo_does_not_starve_later_requests(hs, monkeypatch):
+    real = hs._search_impl
+    release = threading.Event()
+
+    def stuck(query, repo, *a, **kw):
+        if repo == "beta":
+            release.wait(10)
+        return real(query, repo, *a, **kw)
+
+    monkeypatch.setattr(hs, "_search_impl", stuck)
+    hs.search_federated("oauth", repos=["alpha"], final_k=2)  # warm the resident index
+    try:
+        # More stuck searches than a shared pool would have workers
+        for _ in range(6):
+            docs = hs.search_federated("oauth", repos=["alpha", "beta"], final_k=4, repo_timeout_ms=300)
+            assert {d["repo"] for d in docs} == {"alpha"}
+    finally:
+        release.set()
+
+
+def test_hung_repo_holds_a_bounded_number_of_workers(hs, monkeypatch):
+    real = hs._search_impl
+    release = threading.Event()
+    started = []
+
+    def stuck(query, repo, *a, **kw):
+        if repo == "beta":
+            started.append(1)
+            release.wait(10)
+        return real(query, repo, *a, **kw)
+
+    class _Trace:
+        def __init__(self):
+            self.events = {}
+
+        def add(self, name, data):
+            self.events[name] = data
+
+    monkeypatch.setenv("FEDERATED_REPO_CONCURRENCY", "2")
+    monkeypatch.setattr(hs, "_FED_SLOTS", {})
+    monkeypatch.setattr(hs, "_search_impl", stuck)
+    try:
+        for _ in range(5):
+            t = _Trace()
+            docs = hs.search_federated("oauth", repos=["alpha", "beta"], final_k=4, repo_timeout_ms=100, trace=t)
+            assert {d["repo"] for d in docs} == {"alpha"}
+        assert len(started) == 2  # later calls skip beta instead of starting more threads
+        assert t.events["router.federated"]["repos"]["beta"] == {"status": "busy"}
+    finally:
+        release.set()
+
+
+def test_weak_repo_does_not_tie_a_strong_repos_best_hit(hs, monkeypatch):
+    scores = {"alpha": [9.0, 8.0], "beta": [0.2, 0.1]}
+
+    def fake(query, repo, *a, **kw):
+        return [{"file_path": f"{repo}/{i}.py", "start_line": 1, "end_line": 2, "rerank_score": s}
+                for i, s in enumerate(scores[repo])]
+
+    monkeypatch.setattr(hs, "_search_impl", fake)
+    docs = hs.search_federated("oauth", repos=["alpha", "beta"], final_k=4)
+    assert [d["repo"] for d in docs] == ["alpha", "alpha", "beta", "beta"]
+    assert docs[0]["fed_score"] == 1.0 and docs[2]["fed_score"] < 0.05
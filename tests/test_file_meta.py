@@ -0,0 +1,40 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from indexer import file_meta
+
+
+def test_describe_file_reads_once_and_derives_file_facts(tmp_path):
+    d = tmp_path / "retrieval"
+    d.mkdir()
+    f = d / "lic.py"
+    f.write_text("# Licensed under the MIT License\ndef f():\n    return 1\n")
+    text, meta = file_meta.describe_file(str(f), "python")
+    assert text.startswith("# Licensed")
+    assert meta.layer == "retrieval" and meta.origin == "vendor" and meta.license == "mit"
+    assert meta.lines == 3 and meta.size == f.stat().st_size and meta.sha1 and meta.skipped is None
+    assert meta.chunk_fields() == {"layer": "retrieval", "origin": "vendor", "license": "mit"}
+
+    plain = tmp_path / "a.py"
+    plain.write_text("x = 1\n")
+    # Short files (fewer lines than the header window) are still checked
+    assert file_meta.describe_file(str(plain))[1].chunk_fields() == {"layer": "server", "origin": "first_party"}
+    assert file_meta.detect_origin("/x/node_modules/y.js", head="") == "vendor"
+
+
+def test_size_heuristics_skip_and_table_round_trips(tmp_path):
+    mini = tmp_path / "app.min.js"
+    mini.write_text("a" * (file_meta.MAX_AVG_LINE + 1))
+    text, meta = file_meta.describe_file(str(mini), "javascript")
+    assert text is None and meta.skipped == "minified"
+    assert file_meta.describe_file(str(tmp_path / "missing.py"))[1].skipped == "unreadable"
+
+    _, ok = file_meta.describe_file(str(mini))
+    ok.chunk_ids = ["c1", "c2"]
+    table = tmp_path / "file_meta.jsonl"
+    table.write_text(ok.to_json() + "\n{broken\n")
+    loaded = file_meta.load_table(str(table))
+    assert list(loaded) == [str(mini)] and loaded[str(mini)].chunk_ids == ["c1", "c2"]
+    assert file_meta.load_table(str(tmp_path / "none.jsonl")) == {}
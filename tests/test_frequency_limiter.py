@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Frequency anomaly tracking: fixed-memory windows, LRU key cap, optional token bucket."""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from server import frequency_limiter as fl
+
+
+def test_sliding_window_expires_old_buckets():
+    w = fl.SlidingWindowCounter(window_s=60, bucket_s=10)
+    for t in range(0, 30):
+        w.add(1000.0 + t)
+    assert w.count(1029.0) == 30
+    # 60s later the first buckets have left the window
+    assert w.count(1075.0) == 10
+    assert w.count(2000.0) == 0
+    assert len(w.counts) == 6
+
+
+def test_key_cap_is_lru(monkeypatch):
+    fl.reset_frequency_tracking()
+    monkeypatch.setattr(fl, "MAX_TRACKED_KEYS", 3)
+    for i in range(5):
+        fl.record_call(f"10.0.0.{i}", "/search", now=100.0 + i)
+    fl.record_call("10.0.0.2", "/search", now=106.0)
+    fl.record_call("10.0.0.9", "/search", now=107.0)
+    assert list(k[0] for k in fl._keys) == ["10.0.0.4", "10.0.0.2", "10.0.0.9"]
+    assert fl.get_frequency_stats()["evicted_keys"] == 3
+
+
+def test_sustained_high_rate_alerts_once(caplog):
+    fl.reset_frequency_tracking()
+    with caplog.at_level("WARNING", logger="server.frequency_limiter"):
+        for t in range(0, 200, 2):  # 30 calls/min for 200s
+            fl.record_call("1.2.3.4", "/answer", now=5000.0 + t)
+    assert sum("ANOMALY DETECTED" in r.message for r in caplog.records) == 1
+    hf = fl.get_frequency_stats(now=5198.0)["high_frequency_clients"]
+    assert len(hf) == 1
+    assert hf[0]["alert_fired"] is True and hf[0]["calls_in_window"] == 100
+
+
+def test_token_bucket_sheds_with_429(monkeypatch):
+    fl.reset_frequency_tracking()
+    monkeypatch.setenv("RATE_LIMIT_ENABLED", "1")
+    monkeypatch.setenv("RATE_LIMIT_RPS", "0.001")
+    monkeypatch.setenv("RATE_LIMIT_BURST", "2")
+    app = FastAPI()
+    app.add_middleware(fl.FrequencyAnomalyMiddleware)
+    hits = []
+
+    @app.get("/search")
+    def search():
+        hits.append(1)
+        return {"ok": True}
+
+    @app.get("/other")
+    def other():
+        return {"ok": True}
+
+    c = TestClient(app)
+    codes = [c.get("/search").status_code for _ in range(4)]
+    assert codes == [200, 200, 429, 429]
+    assert len(hits) == 2
+    r = c.get("/search")
+    assert int(r.headers["Retry-After"]) >= 1
+    # paths outside RATE_LIMIT_PATHS are only counted
+    assert all(c.get("/other").status_code == 200 for _ in range(5))
+    assert fl.get_frequency_stats()["rate_limit"]["shed"] == 3
@@ -0,0 +1,99 @@
+import io
+import json
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest
+import requests
+
+from common import provider_clients
+from server import env_model
+
+
+def _ollama_response(parts):
+    body = b"".join(json.dumps({"response": p, "done": False}).encode() + b"\n" for p in parts)
+    body += json.dumps({"response": "", "done": True}).encode() + b"\n"
+    r = requests.Response()
+    r.status_code = 200
+    r.raw = io.BytesIO(body)
+    return r
+
+
+def test_ollama_tokens_are_yielded_incrementally(monkeypatch):
+    monkeypatch.setenv("OLLAMA_URL", "http://localhost:11434/api")
+    monkeypatch.delenv("ENRICH_BACKEND", raising=False)
+    seen = {}
+
+    def fake_request(method, url, **kw):
+        seen.update(kw)
+        seen["url"] = url
+        return _ollama_response(["Hel", "lo", " world"])
+
+    monkeypatch.setattr(provider_clients, "request", fake_request)
+    stream = env_model.generate_text_stream("q", system_instructions="be brief", model="qwen")
+    assert next(stream) == "Hel"
+    assert list(stream) == ["lo", " world"]
+    assert seen["stream"] is True and seen["url"].endswith("/generate")
+    assert seen["json"]["prompt"].startswith("<system>be brief</system>")
+
+
+def test_falls_back_to_full_generation_when_streaming_unavailable(monkeypatch):
+    monkeypatch.delenv("OLLAMA_URL", raising=False)
+    monkeypatch.delenv("ENRICH_BACKEND", raising=False)
+
+    def no_client():
+        raise RuntimeError("no api key")
+
+    monkeypatch.setattr(env_model, "client", no_client)
+    monkeypatch.setattr(env_model, "generate_text", lambda *a, **k: ("whole answer", {}))
+    assert list(env_model.generate_text_stream("q", model="gpt-4o-mini")) == ["whole answer"]
+
+
+class _FakeStream:
+    def __init__(self, events, fail=None):
+        self.events, self.fail, self.closed = events, fail, False
+
+    def __iter__(self):
+        for e in self.events:
+            yield e
+        if self.fail is not None:
+            raise self.fail
+
+    def close(self):
+        self.closed = True
+
+
+def _openai_with(stream):
+    from types import SimpleNamespace as NS
+    return lambda: NS(responses=NS(create=lambda **kw: stream))
+
+
+def _delta(text):
+    from types import SimpleNamespace as NS
+    return NS(type="response.output_text.delta", delta=text)
+
+
+def test_mid_stream_failure_is_raised_not_a_short_answer(monkeypatch):
+    monkeypatch.delenv("OLLAMA_URL", raising=False)
+    monkeypatch.delenv("ENRICH_BACKEND", raising=False)
+    stream = _FakeStream([_delta("Hel")], fail=ConnectionError("reset"))
+    monkeypatch.setattr(env_model, "client", _openai_with(stream))
+    monkeypatch.setattr(env_model, "generate_text", lambda *a, **k: ("whole answer", {}))
+    gen = env_model.generate_text_stream("q", model="gpt-4o-mini")
+    assert next(gen) == "Hel"
+    with pytest.raises(ConnectionError):
+        next(gen)
+    assert stream.closed
+
+
+def test_closing_the_generator_closes_the_upstream_stream(monkeypatch):
+    monkeypatch.delenv("OLLAMA_URL", raising=False)
+    monkeypatch.delenv("ENRICH_BACKEND", raising=False)
+    stream = _FakeStream([_delta("a"), _delta("b"), _delta("c")])
+    monkeypatch.setattr(env_model, "client", _openai_with(stream))
+    gen = env_model.generate_text_stream("q", model="gpt-4o-mini")
+    assert next(gen) == "a"
+    gen.close()  # client disconnected
+    assert stream.closed
@@ -0,0 +1,58 @@
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from indexer import git_state
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git not installed")
+
+
+def _git(root: Path, *args):
+    subprocess.run(["git", "-C", str(root), "-c", "user.email=t@t", "-c", "user.name=t", *args],
+                   check=True, capture_output=True)
+
+
+def test_changed_paths_cover_commits_dirty_files_and_previous_dirty_files(tmp_path):
+    repo = tmp_path / "repo"
+    (repo / "pkg").mkdir(parents=True)
+    for name in ("a.py", "b.py", "pkg/c.py"):
+        (repo / name).write_text("x = 1\n")
+    (repo / ".gitignore").write_text("*.log\n")
+    _git(repo, "init", "-q")
+    _git(repo, "add", ".")
+    _git(repo, "commit", "-qm", "init")
+
+    (repo / "b.py").write_text("x = 2\n")
+    since = git_state.snapshot([str(repo)])[str(repo)]
+    assert since["dirty"] == ["b.py"] and since["commit"] == git_state.head_commit(str(repo))
+    assert git_state.changed_paths(str(repo), since) == ["b.py"]
+
+    (repo / "b.py").write_text("x = 1\n")   # reverted: still differs from what was indexed
+    (repo / "pkg" / "c.py").unlink()
+    _git(repo, "commit", "-qam", "drop c")
+    (repo / "new.py").write_text("y = 1\n")
+    (repo / "debug.log").write_text("ignored\n")
+    assert git_state.changed_paths(str(repo), since) == ["b.py", "new.py", "pkg/c.py"]
+
+    # A subdirectory root only sees its own files, relative to itself
+    sub = git_state.snapshot([str(repo / "pkg")])[str(repo / "pkg")]
+    (repo / "pkg" / "d.py").write_text("z = 1\n")
+    assert git_state.changed_paths(str(repo / "pkg"), sub) == ["d.py"]
+
+
+def test_unknown_commit_or_non_repo_means_full_index(tmp_path):
+    assert git_state.snapshot([str(tmp_path), str(tmp_path / "missing")]) == {}
+    assert git_state.changed_paths(str(tmp_path), {"commit": "deadbeef"}) is None
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    (repo / "a.py").write_text("x = 1\n")
+    _git(repo, "init", "-q")
+    _git(repo, "add", ".")
+    _git(repo, "commit", "-qm", "init")
+    assert git_state.changed_paths(str(repo), {"commit": "0" * 40}) is None
+    assert git_state.changed_paths(str(repo), {}) is None
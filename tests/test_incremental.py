@@ -0,0 +1,153 @@
+"""Commit-driven incremental re-indexing against a temporary git repo (BM25 only)."""
+import json
+import os
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="git not installed")
+
+
+def _git(root: Path, *args):
+    subprocess.run(["git", "-C", str(root), "-c", "user.email=t@t", "-c", "user.name=t", *args],
+                   check=True, capture_output=True)
+
+
+def _fn(name: str, body: str) -> str:
+    return f"def {name}(x):\n    return {body}\n"
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    pytest.importorskip("tiktoken")  # indexer.index_repo imports it
+    pytest.importorskip("bm25s")
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "keep.py").write_text(_fn("keep", "x + 1"))
+    (src / "edit.py").write_text(_fn("edit", "x + 2"))
+    (src / "gone.py").write_text(_fn("gone", "x + 3"))
+    _git(src, "init", "-q")
+    _git(src, "add", ".")
+    _git(src, "commit", "-qm", "init")
+
+    monkeypatch.setenv("SKIP_DENSE", "1")
+    monkeypatch.setenv("OUT_DIR_BASE", str(tmp_path / "out"))
+    monkeypatch.setenv("QDRANT_URL", "http://127.0.0.1:9")
+    monkeypatch.setenv("INDEX_INCREMENTAL_CARDS", "0")
+    from indexer import index_repo as ir
+    from indexer.discovery import ExcludeMatcher, exclude_patterns
+    monkeypatch.setattr(ir, "REPO", "inc_demo")
+    monkeypatch.setattr(ir, "OUTDIR", str(tmp_path / "out" / "inc_demo"))
+    monkeypatch.setattr(ir, "BASES", [str(src)])
+    monkeypatch.setattr(ir, "QDRANT_URL", "http://127.0.0.1:9")
+    monkeypatch.setattr(ir, "_EXCLUDES", ExcludeMatcher(exclude_patterns([str(src)])))
+    return src
+
+
+def _chunks(gen_dir: str):
+    with open(os.path.join(gen_dir, "chunks.jsonl"), encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_apply_rechunks_touched_files_and_copies_the_rest(repo):
+    from common import index_generations as ig
+    from indexer import incremental as inc
+    from indexer import index_repo as ir
+
+    ir.main()
+    live = ig.current_generation(ir.OUTDIR)
+    before = {c["file_path"]: c for c in _chunks(ig.generation_dir(ir.OUTDIR, live))}
+    assert inc.plan()["changed"] == {}
+
+    (repo / "edit.py").write_text(_fn("edit", "x * 2"))
+    (repo / "gone.py").unlink()
+    (repo / "new.py").write_text(_fn("new", "x - 1"))
+    _git(repo, "add", "-A")
+    _git(repo, "commit", "-qm", "edit")
+    p = inc.plan()
+    assert sorted(os.path.basename(f) for f in p["changed"]) == ["edit.py", "gone.py", "new.py"]
+
+    res = inc.apply(p)
+    assert res["from"] == live and res["generation"] == ig.current_generation(ir.OUTDIR) != live
+    assert (res["added"], res["removed"]) == (2, 2)
+    gen_dir = ig.generation_dir(ir.OUTDIR, res["generation"])
+    chunks = _chunks(gen_dir)
+    after = {c["file_path"]: c for c in chunks}
+    assert after[str(repo / "keep.py")] == before[str(repo / "keep.py")]  # copied as is
+    assert str(repo / "gone.py") not in after
+    assert "x * 2" in after[str(repo / "edit.py")]["code"]
+    assert after[str(repo / "edit.py")]["id"] != before[str(repo / "edit.py")]["id"]
+    assert "x - 1" in after[str(repo / "new.py")]["code"]
+    # BM25 rows cover exactly the new generation's chunks
+    ids = Path(gen_dir, "bm25_index", "chunk_ids.txt").read_text().split()
+    assert ids == [str(c["id"]) for c in chunks]
+    assert ig.read_manifest(ir.OUTDIR)["dense"] == "none"
+
+    # Nothing indexable changed: the commit is recorded, no new generation
+    (repo / "README.md").write_text("docs\n")
+    _git(repo, "add", "-A")
+    _git(repo, "commit", "-qm", "docs")
+    res = inc.apply(inc.plan())
+    assert res["generation"] == res["from"] == ig.current_generation(ir.OUTDIR)
+    assert inc.plan()["changed"] == {}
+
+
+def test_full_fallback_runs_under_the_incremental_lock(repo):
+    from common import index_generations as ig
+    from indexer import incremental as inc
+    from indexer import index_repo as ir
+
+    assert inc.plan() == {"full": "no live index generation"}
+    # main() holds .index.lock and falls back to index_repo.main(), which takes it again
+    assert inc.main([]) == 0
+    assert ig.current_generation(ir.OUTDIR) is not None
+
+
+def _hook_env(script: str):
+    """Variables the post-commit hook exports (the REPO/OUT_DIR_BASE lines are test-specific)."""
+    hook = script.split('"$HOOKS_DIR/post-commit" << \'H\'\n', 1)[1].split("\nH\n", 1)[0]
+    env = {}
+    for line in hook.splitlines():
+        if line.startswith("export "):
+            for kv in line[len("export "):].split():
+                k, _, v = kv.partition("=")
+                env[k] = v.strip('"')
+    return hook, env
+
+
+def test_hooks_stay_incremental_on_a_qdrant_generation(repo, monkeypatch):
+    from common import index_generations as ig
+    from indexer import incremental as inc
+    from indexer import index_repo as ir
+
+    ir.main()
+    live = ig.current_generation(ir.OUTDIR)
+    # Pretend the live generation was built with Qdrant vectors
+    m = ig.read_manifest(ir.OUTDIR, live)
+    m.update({"dense": "qdrant", "collection": ig.collection_name("code_chunks_inc_demo", live),
+              "embedding_type": "local"})
+    Path(ig.generation_dir(ir.OUTDIR, live), "manifest.json").write_text(json.dumps(m))
+
+    root = Path(__file__).resolve().parents[1]
+    hook, env = _hook_env((root / "scripts" / "install_git_hooks.sh").read_text())
+    assert "indexer.incremental --live-mode" in hook
+    # The hooks the server installs (server/app.py) carry the same body
+    app_hook = (root / "server" / "app.py").read_text().split("_HOOK_POST_COMMIT = ", 1)[1].split('"""', 2)[1]
+    assert app_hook.strip() == hook.strip()
+    for k, v in env.items():
+        if k not in ("REPO", "OUT_DIR_BASE"):
+            monkeypatch.setenv(k, v)
+    monkeypatch.setenv("SKIP_DENSE", "1")  # e.g. left over in the user's shell
+    monkeypatch.setenv("EMBEDDING_TYPE", "openai")
+    assert "full" in inc.plan()
+    for k, v in inc.live_mode_env().items():
+        monkeypatch.setenv(k, v)
+    (repo / "edit.py").write_text(_fn("edit", "x * 2"))
+    p = inc.plan()
+    assert "full" not in p and p["mode"] == "qdrant"
+    assert [os.path.basename(f) for f in p["changed"]] == ["edit.py"]
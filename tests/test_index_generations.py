@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""Blue/green index generations: publish/prune/rollback, Qdrant alias swaps and
+searches reading one consistent generation."""
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from common import index_generations as ig
+
+bm25s = pytest.importorskip("bm25s")
+qdrant_client = pytest.importorskip("qdrant_client")
+
+
+def _write_index(d: Path, rows):
+    (d / "bm25_index").mkdir(parents=True, exist_ok=True)
+    with open(d / "chunks.jsonl", "w") as f:
+        for r in rows:
+            f.write(json.dumps(r) + "\n")
+    from bm25s.tokenization import Tokenizer
+    from Stemmer import Stemmer
+    tok = Tokenizer(stemmer=Stemmer("english"), stopwords="en")
+    retr = bm25s.BM25(method="lucene", k1=1.2, b=0.65)
+    retr.index(tok.tokenize([r["code"] for r in rows]))
+    retr.vocab_dict = {str(k): v for k, v in retr.vocab_dict.items()}
+    retr.save(str(d / "bm25_index"))
+    tok.save_vocab(save_dir=str(d / "bm25_index"))
+    (d / "bm25_index" / "chunk_ids.txt").write_text("\n".join(r["id"] for r in rows) + "\n")
+
+
+def _collections(q):
+    return sorted(c.name for c in q.get_collections().collections)
+
+
+def test_publish_prune_and_rollback_with_alias(tmp_path):
+    from qdrant_client import QdrantClient, models
+    from common.qdrant_utils import alias_target
+    q = QdrantClient(":memory:")
+    base = str(tmp_path)
+    assert ig.current_generation(base) is None
+    assert ig.generation_dir(base) == base  # legacy flat layout
+
+    gens = []
+    for _ in range(4):
+        g = ig.new_generation(base)
+        coll = ig.collection_name("code_chunks_demo", g)
+        q.create_collection(coll, vectors_config={"dense": models.VectorParams(size=4, distance=models.Distance.COSINE)})
+        m = ig.publish(base, g, {"alias": "code_chunks_demo", "collection": coll, "chunk_count": 1}, qdrant=q, keep=2)
+        assert m["previous"] == (gens[-1] if gens else None)
+        gens.append(g)
+        assert ig.current_generation(base) == g
+        assert alias_target(q, "code_chunks_demo") == coll
+    assert ig.generation_dir(base) == str(tmp_path / "generations" / gens[-1])
+
+    # Only the newest two generations (and their collections) survive
+    assert [g["generation"] for g in ig.list_generations(base)] == [gens[3], gens[2]]
+    assert _collections(q) == sorted(ig.collection_name("code_chunks_demo", g) for g in gens[2:])
+
+    out = ig.rollback(base, qdrant=q)
+    assert out == {"from": gens[3], "to": gens[2], "collection": ig.collection_name("code_chunks_demo", gens[2])}
+    assert ig.current_generation(base) == gens[2]
+    assert alias_target(q, "code_chunks_demo") == out["collection"]
+    with pytest.raises(ValueError):
+        ig.rollback(base, to="gen-does-not-exist")
+
+
+def test_prune_keeps_collection_shared_with_incremental_generations(tmp_path):
+    from qdrant_client import QdrantClient, models
+    q = QdrantClient(":memory:")
+    base = str(tmp_path)
+    g0 = ig.new_generation(base)
+    coll = ig.collection_name("code_chunks_demo", g0)
+    q.create_collection(coll, vectors_config={"dense": models.VectorParams(size=4, distance=models.Distance.COSINE)})
+    ig.publish(base, g0, {"alias": "code_chunks_demo", "collection": coll}, qdrant=q, keep=1)
+    # Incremental generations update the same collection in place
+    for _ in range(2):
+        ig.publish(base, ig.new_generation(base), {"alias": "code_chunks_demo", "collection": coll}, qdrant=q, keep=1)
+    assert len(ig.list_generations(base)) == 1
+    assert _collections(q) == [coll]
+
+
+def test_swap_alias_migrates_plain_collection():
+    from qdrant_client import QdrantClient, models
+    from common.qdrant_utils import swap_alias, alias_target
+    q = QdrantClient(":memory:")
+    vc = {"dense": models.VectorParams(size=4, distance=models.Distance.COSINE)}
+    q.create_collection("code_chunks_x", vectors_config=vc)  # pre-alias layout
+    q.create_collection("code_chunks_x__gen-1", vectors_config=vc)
+    swap_alias(q, "code_chunks_x", "code_chunks_x__gen-1")
+    assert alias_target(q, "code_chunks_x") == "code_chunks_x__gen-1"
+    assert _collections(q) == ["code_chunks_x__gen-1"]
+
+
+def test_search_reads_one_generation(tmp_path, monkeypatch):
+    monkeypatch.setenv("OUT_DIR_BASE", str(tmp_path))
+    monkeypatch.setenv("RERANK_BACKEND", "none")
+    monkeypatch.setenv("USE_SEMANTIC_SYNONYMS", "0")
+    monkeypatch.setenv("QDRANT_URL", "http://127.0.0.1:9")
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.delenv("COLLECTION_NAME", raising=False)
+    from retrieval import hybrid_search as hs
+    monkeypatch.setattr(hs, "QDRANT_URL", "http://127.0.0.1:9")
+    monkeypatch.setattr(hs, "_QDRANT_CLIENT", None)
+    hs._RESIDENT.clear()
+    base = str(tmp_path / "demo")
+
+    g1 = ig.new_generation(base)
+    _write_index(Path(ig.generation_dir(base, g1)), [
+        {"id": "old1", "file_path": "a.py", "start_line": 1, "end_line": 2, "language": "python", "code": "def oauth(): token refresh"},
+        {"id": "old2", "file_path": "b.py", "start_line": 1, "end_line": 2, "language": "python", "code": "def db(): pool"},
+    ])
+    ig.publish(base, g1, {"alias": "code_chunks_demo", "collection": ig.collection_name("code_chunks_demo", g1)})
+    ent = hs._resident_index("demo")
+    assert ent["dir"] == ig.generation_dir(base, g1)
+    assert ent["collection"] == ig.collection_name("code_chunks_demo", g1)
+    ids = [d["id"] for d in hs.search("oauth token", repo="demo", topk_dense=2, topk_sparse=2, final_k=2)]
+    assert ids[0] == "old1"
+
+    # A generation being built is invisible until published
+    g2 = ig.new_generation(base)
+    _write_index(Path(ig.generation_dir(base, g2)), [
+        {"id": "new1", "file_path": "a.py", "start_line": 1, "end_line": 2, "language": "python", "code": "def oauth(): token refresh v2"},
+        {"id": "new2", "file_path": "c.py", "start_line": 1, "end_line": 2, "language": "python", "code": "def cache(): lru"},
+    ])
+    assert hs.search("oauth token", repo="demo", topk_dense=2, topk_sparse=2, final_k=2)[0]["id"] == "old1"
+    ig.publish(base, g2, {"alias": "code_chunks_demo", "collection": None})
+    hit = hs.search("oauth token", repo="demo", topk_dense=2, topk_sparse=2, final_k=2)[0]
+    assert hit["id"] == "new1"
+    # No versioned collection for this generation: fall back to the alias
+    assert hs._resident_index("demo")["collection"] == "code_chunks_demo"
+
+    ig.rollback(base)
+    assert hs.search("oauth token", repo="demo", topk_dense=2, topk_sparse=2, final_k=2)[0]["id"] == "old1"
+
+
+def test_prune_without_client_keeps_generations_owning_collections(tmp_path):
+    base = str(tmp_path)
+    g0 = ig.new_generation(base)
+    ig.publish(base, g0, {"alias": "code_chunks_demo", "collection": ig.collection_name("code_chunks_demo", g0)}, keep=1)
+    g1 = ig.new_generation(base)
+    ig.publish(base, g1, {"alias": "code_chunks_demo", "collection": None, "dense": "none"}, keep=1)
+    # g0's collection can't be dropped without a client, so g0 stays listed
+    assert [g["generation"] for g in ig.list_generations(base)] == [g1, g0]
+    g2 = ig.new_generation(base)
+    ig.publish(base, g2, {"alias": "code_chunks_demo", "collection": None, "dense": "none"}, keep=1)
+    assert [g["generation"] for g in ig.list_generations(base)] == [g2, g0]
+
+
+def test_bm25_only_generation_skips_dense(tmp_path, monkeypatch):
+    monkeypatch.setenv("OUT_DIR_BASE", str(tmp_path))
+    monkeypatch.setenv("RERANK_BACKEND", "none")
+    monkeypatch.setenv("USE_SEMANTIC_SYNONYMS", "0")
+    monkeypatch.delenv("COLLECTION_NAME", raising=False)
+    monkeypatch.delenv("VECTOR_BACKEND", raising=False)
+    from retrieval import hybrid_search as hs
+    hs._RESIDENT.clear()
+    base = str(tmp_path / "demo")
+    g = ig.new_generation(base)
+    _write_index(Path(ig.generation_dir(base, g)), [
+        {"id": "n1", "file_path": "a.py", "start_line": 1, "end_line": 2, "language": "python", "code": "def oauth(): token refresh"},
+        {"id": "n2", "file_path": "b.py", "start_line": 1, "end_line": 2, "language": "python", "code": "def db(): pool"},
+    ])
+    ig.publish(base, g, {"alias": "code_chunks_demo", "collection": None, "dense": "none"})
+
+    calls = []
+    monkeypatch.setattr(hs, "_get_embedding", lambda *a, **kw: calls.append("embed") or [0.1] * 4)
+    monkeypatch.setattr(hs, "_qdrant", lambda: calls.append("qdrant"))
+    assert hs._resident_index("demo")["dense"] is False
+    assert hs.search("oauth token", repo="demo", topk_dense=2, topk_sparse=2, final_k=2)[0]["id"] == "n1"
+    assert calls == []
+
+
+def test_prune_deletes_points_no_kept_generation_lists(tmp_path):
+    import uuid
+    from qdrant_client import QdrantClient, models
+    q = QdrantClient(":memory:")
+    base = str(tmp_path)
+    coll = "code_chunks_demo__gen-base"
+    q.create_collection(coll, vectors_config=models.VectorParams(size=2, distance=models.Distance.COSINE))
+    a, b, c = (str(uuid.uuid4()) for _ in range(3))
+    q.upsert(coll, points=[models.PointStruct(id=p, vector=[1.0, 0.0]) for p in (a, b, c)])
+
+    def _publish(ids, qdrant):
+        g = ig.new_generation(base)
+        d = Path(ig.generation_dir(base, g)) / "bm25_index"
+        d.mkdir(parents=True)
+        (d / "bm25_point_ids.json").write_text(json.dumps({str(i): p for i, p in enumerate(ids)}))
+        ig.publish(base, g, {"alias": "code_chunks_demo", "collection": coll}, qdrant=qdrant, keep=2)
+
+    def _points():
+        return {str(p.id) for p in q.scroll(coll, limit=10)[0]}
+
+    _publish([a, b], q)
+    _publish([a, c], q)  # incremental run: chunk b replaced by c
+    assert _points() == {a, b, c}  # b stays for a rollback
+    _publish([a, c], None)
+    assert len(ig.list_generations(base)) == 3  # no client: the doomed generation waits
+    _publish([a, c], q)
+    assert len(ig.list_generations(base)) == 2
+    assert _points() == {a, c}
+
+
+def test_search_skips_points_of_other_generations_in_a_shared_collection(tmp_path, monkeypatch):
+    import types
+    monkeypatch.setenv("OUT_DIR_BASE", str(tmp_path))
+    monkeypatch.setenv("RERANK_BACKEND", "none")
+    monkeypatch.setenv("USE_SEMANTIC_SYNONYMS", "0")
+    monkeypatch.setenv("HYDRATION_MODE", "none")
+    monkeypatch.delenv("COLLECTION_NAME", raising=False)
+    monkeypatch.delenv("VECTOR_BACKEND", raising=False)
+    from retrieval import hybrid_search as hs
+    hs._RESIDENT.clear()
+    base = str(tmp_path / "demo")
+    g = ig.new_generation(base)
+    _write_index(Path(ig.generation_dir(base, g)), [
+        {"id": "n1", "hash": "h1", "file_path": "a.py", "start_line": 1, "end_line": 2, "language": "python", "code": "def oauth(): token refresh"},
+        {"id": "n2", "hash": "h2", "file_path": "b.py", "start_line": 1, "end_line": 2, "language": "python", "code": "def db(): pool"},
+    ])
+    ig.publish(base, g, {"alias": "code_chunks_demo", "collection": ig.collection_name("code_chunks_demo", g)})
+
+    def _pt(pid, cid, h):
+        return types.SimpleNamespace(id=pid, payload={"id": cid, "hash": h, "file_path": "a.py"})
+
+    # Older content of n1 and a chunk an incremental run removed are still in the collection
+    hits = [_pt("p-old", "n1", "h0"), _pt("p-gone", "gone", "hx"), _pt("p-2", "n2", "h2")]
+    monkeypatch.setattr(hs, "_get_embedding", lambda *a, **kw: [0.1] * 4)
+    monkeypatch.setattr(hs, "_qdrant", lambda: types.SimpleNamespace(
+        query_points=lambda **kw: types.SimpleNamespace(points=hits)))
+    docs = hs.search("oauth token", repo="demo", topk_dense=3, topk_sparse=2, final_k=5)
+    assert {(d["id"], d.get("hash")) for d in docs} == {("n1", "h1"), ("n2", "h2")}
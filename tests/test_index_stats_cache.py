@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""Index stats service: indexer-persisted counters, mtime invalidation, cheap freshness snapshot."""
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from server import index_stats
+
+
+def _repo(tmp_path, n):
+    d = tmp_path / "demo"
+    (d / "bm25_index").mkdir(parents=True, exist_ok=True)
+    (d / "bm25_index" / "params.index.json").write_text("{}")
+    with open(d / "chunks.jsonl", "w") as f:
+        for i in range(n):
+            f.write(json.dumps({"id": str(i)}) + "\n")
+    return d
+
+
+def test_record_meta_and_freshness(tmp_path, monkeypatch):
+    monkeypatch.setenv("OUT_DIR_BASE", str(tmp_path))
+    monkeypatch.setenv("INDEX_STATS_TTL", "0")
+    d = _repo(tmp_path, 3)
+    meta = index_stats.record_index_meta(str(d), chunk_count=3, bm25_updated="2026-01-01T00:00:00Z")
+    assert meta["sizes"]["chunks"] == (d / "chunks.jsonl").stat().st_size
+    assert meta["sizes"]["bm25"] == 2
+
+    snap = index_stats.get_freshness_snapshot("demo")
+    assert snap["bm25_updated"] == "2026-01-01T00:00:00Z" and snap["chunk_count"] == 3
+
+    # Re-index: the snapshot follows last_index.json
+    time.sleep(0.01)
+    index_stats.record_index_meta(str(d), chunk_count=5, bm25_updated="2026-01-02T00:00:00Z")
+    os.utime(d / "last_index.json", (time.time() + 5, time.time() + 5))
+    assert index_stats.get_freshness_snapshot("demo")["chunk_count"] == 5
+
+
+def test_repo_entry_uses_persisted_counts(tmp_path):
+    d = _repo(tmp_path, 4)
+    index_stats.record_index_meta(str(d), chunk_count=4)
+    stats, _ts = index_stats._repo_entry(tmp_path, "default", "demo")
+    assert stats["chunk_count"] == 4 and stats["sizes"]["bm25"] == 2
+    # Cached: same object until an index file changes
+    again, _ = index_stats._repo_entry(tmp_path, "default", "demo")
+    assert again is stats
+    with open(d / "chunks.jsonl", "a") as f:
+        f.write("{}\n")
+    os.utime(d / "chunks.jsonl", (time.time() + 10, time.time() + 10))
+    fresh, _ = index_stats._repo_entry(tmp_path, "default", "demo")
+    assert fresh["chunk_count"] == 5  # meta is older than chunks.jsonl -> recount
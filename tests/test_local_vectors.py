@@ -0,0 +1,82 @@
+import sys
+import json
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import numpy as np
+
+from retrieval import local_vectors
+
+
+def _clustered(n, dim, clusters=32, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    return centers[rng.integers(0, clusters, n)] + 0.3 * rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def _brute(vecs, q, k):
+    v = vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+    qn = q / np.linalg.norm(q)
+    return [str(i) for i in np.argsort(-(v @ qn))[:k]]
+
+
+def test_flat_index_matches_brute_force(tmp_path):
+    vecs = _clustered(500, 16)
+    info = local_vectors.build(str(tmp_path), [str(i) for i in range(len(vecs))], vecs, ivf_min=10_000)
+    assert info["kind"] == "flat" and info["count"] == 500 and info["dim"] == 16
+    idx = local_vectors.LocalVectorIndex(str(tmp_path))
+    assert isinstance(idx.vectors, np.memmap)
+    q = vecs[7] + 0.01
+    hits = idx.search(q, k=10)
+    assert [cid for cid, _ in hits] == _brute(vecs, q, 10)
+    assert hits[0][1] >= hits[-1][1]
+
+
+def test_ivf_recall_against_exact(tmp_path):
+    vecs = _clustered(4000, 32)
+    ids = [f"c{i}" for i in range(len(vecs))]
+    info = local_vectors.build(str(tmp_path), ids, vecs, ivf_min=0, nlist=64)
+    assert info["kind"] == "ivf" and info["nlist"] == 64
+    idx = local_vectors.LocalVectorIndex(str(tmp_path))
+    # Rows are regrouped by list; ids must follow their vectors
+    assert sorted(idx.ids) == sorted(ids)
+    assert idx.offsets[-1] == len(vecs)
+
+    rng = np.random.default_rng(3)
+    recalls = []
+    for r in rng.choice(len(vecs), 50, replace=False):
+        q = vecs[r]
+        truth = {cid for cid, _ in idx.search(q, k=10, exact=True)}
+        got = {cid for cid, _ in idx.search(q, k=10, nprobe=8)}
+        recalls.append(len(truth & got) / 10)
+    assert np.mean(recalls) >= 0.9
+    # Probing every list is exact
+    q = vecs[11]
+    assert idx.search(q, k=10, nprobe=64) == idx.search(q, k=10, exact=True)
+
+
+def test_load_caches_per_repo_and_reloads_after_rebuild(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_vectors, "out_dir", lambda repo: str(tmp_path / repo))
+    monkeypatch.setattr(local_vectors, "_loaded", {})
+    assert local_vectors.load("r1") is None
+
+    vecs = _clustered(50, 8)
+    local_vectors.build(local_vectors.index_dir("r1"), [str(i) for i in range(50)], vecs, meta={"repo": "r1"})
+    a = local_vectors.load("r1")
+    assert a is not None and len(a) == 50 and a.meta["repo"] == "r1"
+    assert local_vectors.load("r1") is a
+
+    local_vectors.build(local_vectors.index_dir("r1"), [str(i) for i in range(20)], vecs[:20])
+    meta = Path(local_vectors.index_dir("r1")) / "meta.json"
+    m = json.loads(meta.read_text())
+    m["rebuilt"] = True  # guarantee a new signature on coarse-mtime filesystems
+    meta.write_text(json.dumps(m))
+    b = local_vectors.load("r1")
+    assert b is not a and len(b) == 20
+
+
+def test_backend_selection(monkeypatch):
+    for val, expected in (("qdrant", False), ("local", True), ("FAISS", True), ("", False)):
+        monkeypatch.setenv("VECTOR_BACKEND", val)
+        assert local_vectors.enabled() is expected
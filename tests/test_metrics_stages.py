@@ -0,0 +1,68 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from server.metrics import init_metrics, pipeline_stage, timed_stage
+
+
+def _count(name, labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def _requests(route, success):
+    return _count("agro_requests_total", {"route": route, "provider": "", "model": "", "success": success})
+
+
+def test_requests_are_labelled_with_route_template():
+    app = FastAPI()
+
+    @app.get("/api/cards/build/status/{job_id}")
+    def status(job_id: str):
+        return {"job_id": job_id}
+
+    init_metrics(app)
+    client = TestClient(app)
+    route = "/api/cards/build/status/{job_id}"
+    before = _requests(route, "true")
+    for job in ("a1", "b2", "c3"):
+        assert client.get(f"/api/cards/build/status/{job}").status_code == 200
+    assert _requests(route, "true") == before + 3
+    assert _requests("/api/cards/build/status/a1", "true") == 0
+
+    before_404 = _requests("__unmatched__", "false")
+    client.get("/no/such/path/123")
+    assert _requests("__unmatched__", "false") == before_404 + 1
+
+    before_mount = _requests("/metrics", "true")
+    assert client.get("/metrics/").status_code == 200
+    assert _requests("/metrics", "true") == before_mount + 1
+
+
+def test_pipeline_stage_observes_histogram_and_yields_span():
+    labels = {"stage": "test.stage"}
+    before = _count("agro_pipeline_stage_seconds_count", labels)
+    with pipeline_stage("test.stage") as span:
+        span.set_attribute("results_count", 3)  # no-op without a tracer
+    try:
+        with pipeline_stage("test.stage"):
+            raise ValueError("boom")
+    except ValueError:
+        pass
+    assert _count("agro_pipeline_stage_seconds_count", labels) == before + 2
+
+
+def test_timed_stage_decorator():
+    @timed_stage("test.node")
+    def node(state):
+        return {"x": state["x"] + 1}
+
+    labels = {"stage": "test.node"}
+    before = _count("agro_pipeline_stage_seconds_count", labels)
+    assert node({"x": 1}) == {"x": 2}
+    assert node.__name__ == "node"
+    assert _count("agro_pipeline_stage_seconds_count", labels) == before + 1
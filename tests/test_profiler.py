@@ -0,0 +1,117 @@
+import sys
+import time
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from server import profiler
+from server import tracing
+from server.metrics import pipeline_stage
+
+
+def _busy_loop(stop):
+    while not stop.is_set():
+        sum(i * i for i in range(1000))
+
+
+def _app():
+    app = FastAPI()
+    app.add_middleware(profiler.ProfileRequestMiddleware)
+    app.include_router(profiler.router)
+
+    @app.get("/work")
+    def work():
+        tr = tracing.start_trace(repo="agro", question="q")
+        deadline = time.time() + 0.2
+        while time.time() < deadline:
+            sum(i * i for i in range(1000))
+        profiler.attach_to_trace(tr)
+        return {"events": [e["kind"] for e in tr.events],
+                "collapsed": next((e["data"]["collapsed"] for e in tr.events if e["kind"] == "profile.collapsed"), "")}
+
+    @app.get("/untraced")
+    def untraced():
+        with pipeline_stage("test.untraced"):
+            deadline = time.time() + 0.2
+            while time.time() < deadline:
+                sum(i * i for i in range(1000))
+        return {"ok": True}
+
+    return app
+
+
+def test_collapsed_output_counts_stacks():
+    stop = threading.Event()
+    t = threading.Thread(target=_busy_loop, args=(stop,), name="busy-worker", daemon=True)
+    t.start()
+    prof = profiler.SamplingProfiler(0.002).start()
+    time.sleep(0.2)
+    prof.stop()
+    stop.set()
+    t.join()
+    assert prof.samples > 10
+    lines = prof.collapsed().strip().splitlines()
+    busy = [ln for ln in lines if ln.startswith("busy-worker;")]
+    assert busy and any("_busy_loop (tests/test_profiler.py:" in ln for ln in busy)
+    stack, count = busy[0].rsplit(" ", 1)
+    assert int(count) > 0 and ";" in stack
+    assert not any(ln.startswith("agro-profiler;") for ln in lines)
+
+
+def test_endpoint_requires_admin_token(monkeypatch):
+    client = TestClient(_app())
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    assert client.get("/api/admin/profile?seconds=0.1").status_code == 404
+    monkeypatch.setenv("ADMIN_TOKEN", "s3cret")
+    assert client.get("/api/admin/profile?seconds=0.1").status_code == 403
+    assert client.get("/api/admin/profile?seconds=0.1", headers={"X-Admin-Token": "nope"}).status_code == 403
+    r = client.get("/api/admin/profile?seconds=0.2&interval_ms=5&format=json",
+                   headers={"Authorization": "Bearer s3cret"})
+    assert r.status_code == 200
+    body = r.json()
+    assert body["samples"] > 0 and body["interval_ms"] == 5.0
+
+
+def test_endpoint_rejects_concurrent_profiles(monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "s3cret")
+    client = TestClient(_app())
+    assert profiler._busy.acquire(blocking=False)
+    try:
+        r = client.get("/api/admin/profile?seconds=0.1", headers={"X-Admin-Token": "s3cret"})
+        assert r.status_code == 409
+    finally:
+        profiler._busy.release()
+
+
+def test_profile_header_attaches_to_trace(monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "s3cret")
+    client = TestClient(_app())
+    plain = client.get("/work").json()
+    assert "profile.collapsed" not in plain["events"]
+    # Without the admin token the header is ignored
+    assert "profile.collapsed" not in client.get("/work", headers={"X-Agro-Profile": "1"}).json()["events"]
+
+    r = client.get("/work", headers={"X-Agro-Profile": "1", "X-Admin-Token": "s3cret"})
+    assert r.headers["X-Agro-Profile"].startswith("samples=")
+    body = r.json()
+    assert "profile.collapsed" in body["events"]
+    assert "work (tests/test_profiler.py:" in body["collapsed"]
+
+
+def test_untraced_request_profile_is_retrievable_by_id(monkeypatch):
+    monkeypatch.setenv("ADMIN_TOKEN", "s3cret")
+    client = TestClient(_app())
+    r = client.get("/untraced", headers={"X-Agro-Profile": "1", "X-Admin-Token": "s3cret"})
+    samples, pid = r.headers["X-Agro-Profile"].split("; id=")
+    assert samples.startswith("samples=")
+    stacks = client.get(f"/api/admin/profile/{pid}", headers={"X-Admin-Token": "s3cret"})
+    assert stacks.status_code == 200 and "untraced (tests/test_profiler.py:" in stacks.text
+    assert client.get(f"/api/admin/profile/{pid}").status_code == 403
+    assert client.get("/api/admin/profile/nope", headers={"X-Admin-Token": "s3cret"}).status_code == 404
+    # Traced requests hand their stacks to the Trace and keep no id
+    r = client.get("/work", headers={"X-Agro-Profile": "1", "X-Admin-Token": "s3cret"})
+    assert "id=" not in r.headers["X-Agro-Profile"]
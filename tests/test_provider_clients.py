@@ -0,0 +1,62 @@
+import io
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import requests
+
+from common import provider_clients
+from server import api_interceptor
+import server.api_tracker as api_tracker
+
+
+def test_openai_client_is_shared_per_key(monkeypatch):
+    provider_clients.reset()
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-one")
+    a = provider_clients.openai_client()
+    assert provider_clients.openai_client() is a
+    # SDK client rides on the shared pooled httpx client
+    assert a._client is provider_clients.http_client()
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-two")
+    b = provider_clients.openai_client()
+    assert b is not a
+    provider_clients.reset()
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-two")
+    assert provider_clients.openai_client() is not b
+
+
+def test_request_uses_pooled_session_and_is_tracked(monkeypatch):
+    provider_clients.reset()
+    calls = []
+    monkeypatch.setattr(api_tracker, "track_api_call", lambda **kw: calls.append(kw))
+    session = provider_clients.requests_session()
+    assert provider_clients.requests_session() is session
+    adapter = session.get_adapter("http://localhost:11434/")
+    assert adapter.max_retries.connect == provider_clients.max_retries()
+
+    def fake_request(method, url, **kw):
+        assert kw["timeout"] == provider_clients.timeout_s()
+        r = requests.Response()
+        r.status_code = 200
+        r.raw = io.BytesIO(b"ok")
+        r._content = b"ok"
+        return r
+
+    monkeypatch.setattr(session, "request", fake_request)
+    r = provider_clients.request("POST", "http://localhost:11434/api/generate", json={"x": 1})
+    assert r.content == b"ok"
+    assert api_interceptor.flush()
+    assert len(calls) == 1 and calls[0]["provider"] == api_tracker.APIProvider.OLLAMA
+    provider_clients.reset()
+
+
+def test_openai_client_keeps_a_long_read_timeout(monkeypatch):
+    provider_clients.reset()
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-one")
+    monkeypatch.setenv("PROVIDER_TIMEOUT", "30")
+    monkeypatch.delenv("PROVIDER_READ_TIMEOUT", raising=False)
+    c = provider_clients.openai_client()
+    # Long non-streaming generations must not inherit the short embedding/rerank timeout
+    assert c.timeout.read == 600.0 and c.timeout.connect == provider_clients._env_float("PROVIDER_CONNECT_TIMEOUT", 5.0)
+    provider_clients.reset()
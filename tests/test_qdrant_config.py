@@ -0,0 +1,94 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+pytest.importorskip("qdrant_client")
+from qdrant_client import models
+
+from common import qdrant_config
+from common.qdrant_utils import recreate_collection
+
+
+def test_defaults_leave_collections_untuned(monkeypatch):
+    for k in ("QDRANT_QUANTIZATION", "QDRANT_ON_DISK", "QDRANT_HNSW_M", "QDRANT_HNSW_EF_CONSTRUCT", "QDRANT_PAYLOAD_INDEXES"):
+        monkeypatch.delenv(k, raising=False)
+    s = qdrant_config.index_settings()
+    assert s["quantization"] == "none" and s["payload_indexes"] == ["repo", "layer", "language"]
+    assert qdrant_config.collection_kwargs(s) == {}
+    assert qdrant_config.vector_params(8, s).on_disk is None
+
+
+def test_env_selects_quantization_on_disk_and_hnsw(monkeypatch):
+    monkeypatch.setenv("QDRANT_QUANTIZATION", "scalar")
+    monkeypatch.setenv("QDRANT_ON_DISK", "1")
+    monkeypatch.setenv("QDRANT_HNSW_M", "32")
+    s = qdrant_config.index_settings()
+    kw = qdrant_config.collection_kwargs(s)
+    assert kw["quantization_config"].scalar.type == models.ScalarType.INT8
+    assert kw["hnsw_config"].m == 32 and kw["hnsw_config"].ef_construct is None
+    assert qdrant_config.vector_params(3072, s).on_disk is True
+    assert qdrant_config.describe(s)["quantization"] == "int8"
+
+    monkeypatch.setenv("QDRANT_QUANTIZATION", "binary")
+    assert isinstance(qdrant_config.collection_kwargs()["quantization_config"], models.BinaryQuantization)
+    monkeypatch.setenv("QDRANT_QUANTIZATION", "bogus")
+    assert "quantization_config" not in qdrant_config.collection_kwargs()
+
+
+def test_search_params_env_and_overrides(monkeypatch):
+    monkeypatch.setenv("QDRANT_HNSW_EF", "256")
+    monkeypatch.setenv("QDRANT_OVERSAMPLING", "3")
+    p = qdrant_config.search_params()
+    assert p.hnsw_ef == 256 and p.quantization.oversampling == 3.0 and p.quantization.rescore is True
+    p = qdrant_config.search_params(hnsw_ef=64, oversampling=1.5, rescore=False)
+    assert p.hnsw_ef == 64 and p.quantization.oversampling == 1.5 and p.quantization.rescore is False
+
+
+def test_recreate_collection_passes_tuning_through():
+    calls = {}
+
+    class _Client:
+        def get_collection(self, name):
+            raise KeyError(name)
+
+        def create_collection(self, **kw):
+            calls.update(kw)
+
+    recreate_collection(_Client(), "c", {"dense": qdrant_config.vector_params(4, {})},
+                        quantization_config=qdrant_config.quantization_config({"quantization": "int8"}))
+    assert calls["collection_name"] == "c"
+    assert isinstance(calls["quantization_config"], models.ScalarQuantization)
+
+
+def test_two_stage_matryoshka_collection_and_query():
+    import numpy as np
+    from qdrant_client import QdrantClient
+
+    s = {"coarse_dim": 8}
+    assert qdrant_config.coarse_dim(32, s) == 8
+    assert qdrant_config.coarse_dim(8, s) == 0  # not smaller than the full vector: single stage
+    cfg = qdrant_config.vectors_config(32, s)
+    assert cfg["dense"].on_disk is True and cfg["dense"].hnsw_config.m == 0
+    assert cfg["dense_coarse"].size == 8
+    v = qdrant_config.truncate([3.0, 4.0, 12.0], 2)
+    assert v == pytest.approx([0.6, 0.8])
+
+    rng = np.random.default_rng(0)
+    vecs = rng.standard_normal((200, 32))
+    q = QdrantClient(":memory:")
+    q.create_collection("m", vectors_config=cfg)
+    q.upsert("m", points=[models.PointStruct(id=i, vector=qdrant_config.point_vectors(v.tolist(), 8))
+                          for i, v in enumerate(vecs)])
+    norm = vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+    qv = norm[5]
+    exact = np.argsort(-(norm @ qv))[:5].tolist()
+    # Rescoring every coarse candidate at full dim gives the exact full-dim ranking
+    kw = qdrant_config.dense_query(qv.tolist(), 5, cd=8, rescore_k=200)
+    assert kw["prefetch"].using == "dense_coarse" and kw["using"] == "dense"
+    assert [p.id for p in q.query_points("m", **kw).points] == exact
+    # Single-stage kwargs are unchanged
+    kw = qdrant_config.dense_query(qv.tolist(), 5)
+    assert "prefetch" not in kw and kw["using"] == "dense"
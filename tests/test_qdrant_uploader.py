@@ -0,0 +1,95 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+qdrant_client = pytest.importorskip("qdrant_client")
+from qdrant_client import QdrantClient, models
+
+from indexer.qdrant_uploader import QdrantUploader
+
+
+def _client(dim=4):
+    q = QdrantClient(":memory:")
+    q.create_collection("c", vectors_config={"dense": models.VectorParams(size=dim, distance=models.Distance.COSINE)})
+    return q
+
+
+def test_uploads_every_point_in_batches_and_verifies():
+    q = _client()
+    with QdrantUploader(q, "c", batch_size=16, workers=3, queue_size=2) as up:
+        for i in range(203):
+            up.add(f"00000000-0000-0000-0000-{i:012d}", [1.0, float(i), 0.0, 0.5], {"id": f"chunk{i}"})
+        # Re-adding an id overwrites it; the expected count stays distinct
+        up.add("00000000-0000-0000-0000-000000000000", [0.0, 1.0, 0.0, 0.0], {"id": "chunk0"})
+    assert up.expected == 203
+    assert up.stats.points == 204 and up.stats.batches == 13
+    assert up.verify(timeout=5) == 203
+    p = q.retrieve("c", ["00000000-0000-0000-0000-000000000007"], with_payload=True)[0]
+    assert p.payload == {"id": "chunk7"}
+    assert up.workers == 1  # in-process client: uploads are serialized
+
+
+class _SlowFlaky:
+    """Counts concurrent upserts and fails the first call of one batch."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.active = self.peak = 0
+        self.waits = set()
+        self.failed_once = False
+        self.lock = threading.Lock()
+
+    def upsert(self, collection, points, wait=True):
+        with self.lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            self.waits.add(wait)
+            fail = not self.failed_once and points[0].payload.get("i") == 40
+            self.failed_once = self.failed_once or fail
+        try:
+            time.sleep(0.02)
+            if fail:
+                raise ConnectionError("transient")
+            with self.lock:  # the in-process client is not thread-safe
+                return self.inner.upsert(collection, points=points, wait=True)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def count(self, collection, exact=True):
+        return self.inner.count(collection, exact=exact)
+
+
+def test_concurrent_workers_retry_transient_failures():
+    fake = _SlowFlaky(_client())
+    with QdrantUploader(fake, "c", batch_size=10, workers=4) as up:
+        for i in range(100):
+            up.add(f"00000000-0000-0000-0000-{i:012d}", [1.0, 0.0, 0.0, float(i)], {"i": i})
+    assert fake.waits == {False}
+    assert fake.peak > 1
+    assert up.stats.retries == 1
+    assert up.verify(timeout=5) == 100
+
+
+def test_permanent_failure_surfaces_and_count_mismatch_is_detected():
+    class _Broken:
+        def upsert(self, *a, **kw):
+            raise ConnectionError("down")
+
+    with pytest.raises(RuntimeError, match="down"):
+        with QdrantUploader(_Broken(), "c", batch_size=2, workers=2, retries=1) as up:
+            for i in range(1000):
+                up.add(f"00000000-0000-0000-0000-{i:012d}", [1.0, 0.0, 0.0, 0.0], None)
+    assert not any(t.is_alive() for t in up._threads)
+
+    q = _client()
+    up = QdrantUploader(q, "c", batch_size=4, workers=1)
+    up.add("00000000-0000-0000-0000-000000000001", [1.0, 0.0, 0.0, 0.0], None)
+    up.close()
+    with pytest.raises(RuntimeError, match="expected 2"):
+        up.verify(expected=2, timeout=0.2)
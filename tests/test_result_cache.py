@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""Search result cache: exact + semantic tiers, generation invalidation, LRU bound."""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from retrieval.result_cache import ResultCache, normalize_query
+
+
+def test_exact_tier_normalizes_and_copies():
+    c = ResultCache(max_entries=4, ttl_s=60)
+    k = c.make_key("Where is  OAuth handled?", "agro", "s1")
+    assert k == c.make_key("where is oauth handled", "agro", "s1")
+    c.put(k, "agro", "s1", "g1", [{"file_path": "a.py", "rerank_score": 1.0}], cost_s=0.8)
+    res, cost = c.get(k, "g1")
+    assert cost == 0.8 and res[0]["file_path"] == "a.py"
+    res[0]["rerank_score"] = 99  # callers mutate results
+    assert c.get(k, "g1")[0][0]["rerank_score"] == 1.0
+    assert c.stats()["exact_hit"] == 2 and c.stats()["saved_seconds"] == 1.6
+
+
+def test_generation_change_invalidates():
+    c = ResultCache()
+    k = c.make_key("q", "agro", "s1")
+    c.put(k, "agro", "s1", "g1", [{"x": 1}], cost_s=0.1)
+    assert c.get(k, "g2") is None
+    assert c.get(k, "g1") is None  # stale entry was dropped
+
+
+def test_semantic_tier_threshold():
+    c = ResultCache(semantic=True, sim_threshold=0.95)
+    c.put(c.make_key("how does rerank work", "agro", "s1"), "agro", "s1", "g1", [{"x": 1}], 0.5, vec=[1.0, 0.0, 0.1])
+    assert c.get_similar([1.0, 0.0, 0.12], "agro", "s1", "g1") is not None
+    assert c.get_similar([0.0, 1.0, 0.0], "agro", "s1", "g1") is None
+    assert c.get_similar([1.0, 0.0, 0.12], "other", "s1", "g1") is None
+
+
+def test_lru_bound():
+    c = ResultCache(max_entries=2)
+    for q in ("a", "b", "c"):
+        c.put(c.make_key(q, "r", "s"), "r", "s", "g", [], 0.0)
+    assert c.get(c.make_key("a", "r", "s"), "g") is None
+    assert c.stats()["entries"] == 2
+    assert normalize_query("  Foo   BAR? ") == "foo bar"
+
+
+def test_query_time_search_params_are_part_of_the_key(monkeypatch):
+    from retrieval.result_cache import settings_fingerprint
+    for name in ("QDRANT_HNSW_EF", "QDRANT_OVERSAMPLING", "QDRANT_RESCORE", "QDRANT_EXACT",
+                 "DENSE_RESCORE_K", "LOCAL_VECTORS_NPROBE"):
+        monkeypatch.delenv(name, raising=False)
+        before = settings_fingerprint()
+        monkeypatch.setenv(name, "7")
+        assert settings_fingerprint() != before, name
@@ -0,0 +1,74 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from retrieval import rewrite_cache
+import retrieval.hybrid_search as hs
+
+
+def _fresh(monkeypatch, tmp_path):
+    monkeypatch.setenv("REWRITE_CACHE_PATH", str(tmp_path / "rewrites.jsonl"))
+    monkeypatch.setenv("GEN_TEMPERATURE", "0")
+    monkeypatch.setenv("GEN_MODEL", "gpt-4o-mini")
+    monkeypatch.setattr(rewrite_cache, "_CACHE", None)
+
+
+def test_expand_queries_reuses_cached_rewrites_across_restarts(monkeypatch, tmp_path):
+    _fresh(monkeypatch, tmp_path)
+    calls = []
+
+    def fake_generate(user_input, **kw):
+        calls.append(user_input)
+        return "auth token check\n- oauth validate\nauth token check", {}
+
+    monkeypatch.setattr(hs, "generate_text", fake_generate)
+    first = hs.expand_queries("Where is OAuth validated?", m=3)
+    assert first == ["auth token check", "oauth validate"]
+    # normalized query hits the same entry
+    assert hs.expand_queries("  where is oauth validated ", m=3) == first
+    assert len(calls) == 1
+    # m is part of the key
+    hs.expand_queries("Where is OAuth validated?", m=4)
+    assert len(calls) == 2
+
+    # a new process (fresh in-memory cache) reads the file
+    monkeypatch.setattr(rewrite_cache, "_CACHE", None)
+    assert hs.expand_queries("Where is OAuth validated?", m=3) == first
+    assert len(calls) == 2
+    # model change misses
+    monkeypatch.setenv("GEN_MODEL", "other-model")
+    hs.expand_queries("Where is OAuth validated?", m=3)
+    assert len(calls) == 3
+
+
+def test_failures_and_nonzero_temperature_are_not_cached(monkeypatch, tmp_path):
+    _fresh(monkeypatch, tmp_path)
+    calls = []
+
+    def boom(user_input, **kw):
+        calls.append(1)
+        raise RuntimeError("no key")
+
+    monkeypatch.setattr(hs, "generate_text", boom)
+    assert hs.expand_queries("q one", m=2) == ["q one"]
+    assert hs.expand_queries("q one", m=2) == ["q one"]
+    assert len(calls) == 2
+
+    monkeypatch.setattr(hs, "generate_text", lambda user_input, **kw: ("better query", {}))
+    monkeypatch.setenv("GEN_TEMPERATURE", "0.7")
+    assert hs.rewrite_for_search("q two") == "better query"
+    assert rewrite_cache.get_cache().stats()["entries"] == 0
+
+
+def test_ttl_expiry_and_compaction(tmp_path):
+    path = str(tmp_path / "rw.jsonl")
+    c = rewrite_cache.RewriteCache(path, ttl_s=100)
+    c.put("k", ["a"])
+    c.put("k", ["b"])
+    c._entries["k"]["ts"] -= 1000
+    assert c.get("k") is None
+    c.put("k2", ["c"])
+    c.compact()
+    assert len(Path(path).read_text().splitlines()) == 1
+    assert rewrite_cache.RewriteCache(path, ttl_s=100).get("k2") == ["c"]
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Trace export: hot path only appends; files, retention and LangSmith batching happen in the background."""
+import sys
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from server import tracing
+
+
+def _fresh(monkeypatch, tmp_path, **env):
+    monkeypatch.setenv("OUT_DIR_BASE", str(tmp_path))
+    monkeypatch.setenv("TRACING_MODE", env.pop("mode", "local"))
+    for k, v in env.items():
+        monkeypatch.setenv(k, v)
+    monkeypatch.setattr(tracing, "_rings", {})
+    monkeypatch.setattr(tracing, "_latest", {})
+
+
+def test_traces_written_compressed_with_ring_retention(monkeypatch, tmp_path):
+    _fresh(monkeypatch, tmp_path, TRACE_RETENTION="3", TRACE_COMPRESS="1")
+    paths = []
+    for i in range(5):
+        tr = tracing.start_trace("demo", f"q{i}")
+        tracing.get_trace().add("retriever.retrieve", {"i": i})
+        paths.append(tracing.end_trace())
+        # latest is served from memory before the file exists
+        assert tracing.latest_trace("demo")["question"] == f"q{i}"
+    assert tracing.flush()
+
+    kept = tracing.recent_trace_paths("demo")
+    assert kept == list(reversed(paths[-3:]))
+    assert all(p.endswith(".json.gz") for p in kept)
+    assert not any(Path(p).exists() for p in paths[:2])
+    data = tracing.load_trace(kept[0])
+    assert data["question"] == "q4" and data["events"][0]["data"] == {"i": 4}
+
+    # a new process seeds its ring from one listing of the directory
+    monkeypatch.setattr(tracing, "_rings", {})
+    monkeypatch.setattr(tracing, "_latest", {})
+    assert tracing.latest_trace_path("demo") == kept[0]
+    assert tracing.latest_trace("demo")["question"] == "q4"
+
+
+def test_latest_path_belongs_to_the_latest_trace(monkeypatch, tmp_path):
+    _fresh(monkeypatch, tmp_path)
+    tracing.start_trace("demo", "old")
+    old = tracing.end_trace()
+    assert tracing.flush()
+
+    # hold the exporter so the next trace is only in memory
+    gate = threading.Event()
+    save = tracing.Trace.save
+
+    def slow_save(self):
+        gate.wait(5)
+        return save(self)
+
+    monkeypatch.setattr(tracing.Trace, "save", slow_save)
+    tracing.start_trace("demo", "new")
+    new = tracing.end_trace()
+    data, path = tracing.latest_trace_with_path("demo")
+    assert data["question"] == "new" and path is None
+    assert tracing.latest_trace_path("demo") == old  # the file on disk is a different trace
+
+    gate.set()
+    assert tracing.flush()
+    data, path = tracing.latest_trace_with_path("demo")
+    assert data["question"] == "new" and path == new
+
+
+def test_langsmith_runs_are_batched_off_the_request_path(monkeypatch, tmp_path):
+    _fresh(monkeypatch, tmp_path, mode="langsmith")
+
+    class FakeClient:
+        def __init__(self):
+            self.batches = []
+
+        def batch_ingest_runs(self, create):
+            self.batches.append(create)
+
+        def share_run(self, run_id):
+            return f"https://smith.example/{run_id}"
+
+    client = FakeClient()
+    monkeypatch.setattr(tracing, "_ls_client", client)
+    tracing.start_trace("demo", "why")
+    tracing.get_trace().add("gating.outcome", {"outcome": "generate"})
+    tracing.get_trace().add("packer.pack", {"selected": []})
+    # nothing is sent while the request is running
+    assert client.batches == []
+    path = tracing.end_trace()
+    assert tracing.flush()
+
+    runs = [r for b in client.batches for r in b]
+    assert len(runs) == 3
+    root = runs[0]
+    assert all(r["trace_id"] == root["id"] for r in runs)
+    assert all(r["dotted_order"].startswith(root["dotted_order"] + ".") for r in runs[1:])
+    data = tracing.load_trace(path)
+    assert data["langsmith_url"] == f"https://smith.example/{root['id']}"